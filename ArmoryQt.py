@@ -135,6 +135,9 @@ class ArmoryMainWindow(QMainWindow):
       self.lockboxIDMap = {}
       self.cppLockboxWltMap = {}
 
+      # Which wallet/lockbox owns each scrAddr, for labelling ledger entries
+      self.scrAddrOwners = ScrAddrOwnerIndex()
+
       # Full list of notifications, and notify IDs that should trigger popups
       # when sending or receiving.
       self.lastAnnounceUpdate = {}
@@ -2602,7 +2605,8 @@ class ArmoryMainWindow(QMainWindow):
       wltOffline = self.settings.get('Offline_WalletIDs', expectList=True)
       for fpath in wltPaths:
          try:
-            wltLoad = PyBtcWallet().readWalletFile(fpath)
+            wltLoad = PyBtcWallet().readWalletFile(fpath, \
+                                      lazyLoad=CLI_OPTIONS.lazyWallets)
             wltID = wltLoad.uniqueIDB58
             if fpath in wltExclude or wltID in wltExclude:
                continue
@@ -2650,6 +2654,7 @@ class ArmoryMainWindow(QMainWindow):
          # Register all wallets with TheBDM
          TheBDM.registerWallet( wlt.cppWallet )
          TheBDM.bdm.registerWallet(wlt.cppWallet)
+      self.scrAddrOwners.syncWallets(self.walletMap)
 
 
       # Create one wallet per lockbox to make sure we can query individual
@@ -2759,6 +2764,7 @@ class ArmoryMainWindow(QMainWindow):
    def loadLockboxesFromFile(self, fn):
       self.allLockboxes = []
       self.cppLockboxWltMap = {}
+      self.scrAddrOwners.syncLockboxes(self.allLockboxes)
       if not os.path.exists(fn):
          return
 
@@ -2797,6 +2803,7 @@ class ArmoryMainWindow(QMainWindow):
             # Replace the original
             self.allLockboxes[index] = lbObj
 
+         self.scrAddrOwners.syncLockboxes(self.allLockboxes)
          writeLockboxesFile(self.allLockboxes, MULTISIG_FILE)
       except:
          LOGEXCEPT('Failed to add/update lockbox')
@@ -2811,6 +2818,7 @@ class ArmoryMainWindow(QMainWindow):
       else:
          del self.allLockboxes[index]
          self.reconstructLockboxMaps()
+         self.scrAddrOwners.syncLockboxes(self.allLockboxes)
          writeLockboxesFile(self.allLockboxes, MULTISIG_FILE)
 
 
@@ -2911,10 +2919,8 @@ class ArmoryMainWindow(QMainWindow):
 
    #############################################################################
    def getWalletForScrAddr(self, scrAddr):
-      for wltID, wlt in self.walletMap.iteritems():
-         if wlt.hasScrAddr(scrAddr):
-            return wltID
-      return ''
+      wltID = self.scrAddrOwners.getWalletIDForScrAddr(scrAddr)
+      return '' if wltID is None else wltID
 
    #############################################################################
    def getSettingOrSetDefault(self, settingName, defaultVal):
@@ -3310,6 +3316,7 @@ class ArmoryMainWindow(QMainWindow):
    #############################################################################
    @TimeThisFunction
    def walletListChanged(self):
+      self.scrAddrOwners.syncWallets(self.walletMap)
       self.walletModel.reset()
       self.populateLedgerComboBox()
       self.createCombinedLedger()
@@ -4415,10 +4422,13 @@ class ArmoryMainWindow(QMainWindow):
                                   defaultFilename=defaultFN)
 
       if len(unicode(saveFile)) > 0:
-         fout = open(saveFile, 'wb')
-         fout.write(getLastBytesOfFile(ARMORY_LOG_FILE, 256*1024))
-         fout.write(getLastBytesOfFile(ARMCPP_LOG_FILE, 256*1024))
-         fout.close()
+         # Make sure everything logged so far is in the file
+         for handler in logging.getLogger('').handlers:
+            handler.flush()
+
+         with open(saveFile, 'wb') as fout:
+            copyLastBytesOfFile(ARMORY_LOG_FILE, fout, 256*1024)
+            copyLastBytesOfFile(ARMCPP_LOG_FILE, fout, 256*1024)
 
          LOGINFO('Log saved to %s', saveFile)
 
@@ -6285,7 +6295,8 @@ class ArmoryMainWindow(QMainWindow):
                                  lblTrunc=12, lastTrunc=12):
       return getDisplayStringForScript(binScript, self.walletMap, 
                                        self.allLockboxes, maxChars, doBold,
-                                       prefIDOverAddr, lblTrunc, lastTrunc) 
+                                       prefIDOverAddr, lblTrunc, lastTrunc,
+                                       self.scrAddrOwners)
 
 
    #############################################################################
@@ -6517,6 +6528,7 @@ class ArmoryMainWindow(QMainWindow):
                for wltID in self.walletMap.keys():
                   wlt = self.walletMap[wltID]
                   TheBDM.rescanWalletZeroConf(wlt.cppWallet, wait=True)
+                  wlt.applyZeroConfTxList(self.newZeroConfSinceLastUpdate)
 
                for lbID,cppWlt in self.cppLockboxWltMap.iteritems():
                   TheBDM.rescanWalletZeroConf(cppWlt, wait=True)
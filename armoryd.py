@@ -239,7 +239,8 @@ def addMultWallets(inWltPaths, inWltMap, inWltIDSet):
    for aWlt in inWltPaths:
       # Logic basically taken from loadWalletsAndSettings()
       try:
-         wltLoad = PyBtcWallet().readWalletFile(aWlt)
+         wltLoad = PyBtcWallet().readWalletFile(aWlt, \
+                                      lazyLoad=CLI_OPTIONS.lazyWallets)
          wltID = wltLoad.uniqueIDB58
 
          # For now, no wallets are excluded. If this changes....
@@ -303,11 +304,144 @@ def addMultLockboxes(inLBPaths, inLboxMap, inLBIDSet):
    return newLBList
 
 
+# Rows are small, but a busy wallet has a lot of them
+LEDGER_CACHE_MAX_ROWS = 20000
+
+################################################################################
+class ArmoryLedgerCache(object):
+   """
+   Holds the ledger rows that getledger, getledgersimple and listtransactions
+   have already built, so that paging through a large wallet doesn't rebuild
+   every row (with a dozen BDM calls each) on every request.
+
+   Each wallet's ledger entry list is fetched once per top block hash, and
+   again after markStale(), which should be called whenever new zero-conf tx
+   may have changed the ledger.  Rows are kept per tx hash, up to maxRows of
+   them, and are only rebuilt if the tx ends up in a different block.
+   Confirmations are filled in when a row is served.  A reorg throws all the
+   rows away, and so does any change to the wallets' addresses (see
+   checkWallets), since every row says which wallet each address belongs to.
+   """
+   def __init__(self, maxRows=LEDGER_CACHE_MAX_ROWS):
+      self.topHash    = None
+      self.topHeight  = 0
+      self.generation = 0
+      self.ledgers    = {}  # (wltID, ledgerType) -> [generation, topHash, ledger]
+      self.rows       = LRUCache(maxRows)  # (wltID, rowType, txHash) -> 
+                                           #              [blockNum, rowList]
+      self.wltVersions = {} # wltID -> (wallet, addrMapVersion) rows were built with
+      self.lboxIDs     = set()
+
+
+   #############################################################################
+   def markStale(self):
+      self.generation += 1
+
+
+   #############################################################################
+   def clear(self):
+      self.ledgers.clear()
+      self.rows.clear()
+
+
+   #############################################################################
+   def checkWallets(self, wltMap, lboxMap):
+      """
+      Call before getPage.  Drops every row if a wallet or lockbox was added
+      or removed, or a wallet gained or lost addresses (address pool growth,
+      imports, deleted imports) since the rows were built.
+      """
+      wltVersions = dict([(wltID, (wlt, wlt.addrMapVersion)) \
+                          for wltID,wlt in wltMap.iteritems()])
+      lboxIDs = set(lboxMap.keys())
+      if not wltVersions==self.wltVersions or not lboxIDs==self.lboxIDs:
+         self.rows.clear()
+         self.markStale()
+         self.wltVersions = wltVersions
+         self.lboxIDs     = lboxIDs
+
+
+   #############################################################################
+   def checkTopBlock(self):
+      topHeader = TheBDM.getTopBlockHeader()
+      if topHeader is None:
+         raise BlockchainUnavailableError('BDM did not return the top block')
+      topHash = topHeader.getThisHash()
+      if topHash == self.topHash:
+         return
+
+      # If the block we had on top isn't on the main chain anymore, the
+      # blockhash of any cached row could be wrong
+      if self.topHash is not None:
+         oldHeader = TheBDM.getHeaderByHeight(self.topHeight)
+         if not oldHeader or not oldHeader.getThisHash()==self.topHash:
+            LOGINFO('Top block was reorganized, clearing ledger cache')
+            self.rows.clear()
+
+      self.topHash   = topHash
+      self.topHeight = topHeader.getBlockHeight()
+
+
+   #############################################################################
+   def getPage(self, wltID, wlt, rowType, fromIdx, count, buildRows, \
+                                                         ledgerType=None):
+      """
+      Returns [(ledgerEntry, rowList), ...] for wlt.getTxLedger() entries 
+      fromIdx through fromIdx+count-1.  buildRows(leList) is called once, 
+      for just the entries that have no cached rows, and must return one 
+      rowList per entry, in the same order.
+      """
+      self.checkTopBlock()
+
+      ledgerKey = (wltID, ledgerType)
+      cached = self.ledgers.get(ledgerKey)
+      if not cached or not cached[0]==self.generation or \
+                       not cached[1]==self.topHash:
+         if ledgerType is None:
+            ledger = wlt.getTxLedger()
+         else:
+            ledger = wlt.getTxLedger(ledgerType)
+         cached = [self.generation, self.topHash, ledger]
+         self.ledgers[ledgerKey] = cached
+
+      ledger = cached[2]
+      sz = len(ledger)
+      pageEntries = ledger[min(sz, fromIdx):min(sz, fromIdx+count)]
+
+      # Rows are held on to here, a big page can push its own rows out of
+      # the cache before it is served
+      pageRows = []
+      toBuild  = []
+      for le in pageEntries:
+         rowInfo = self.rows.get((wltID, rowType, le.getTxHash()))
+         if not rowInfo or not rowInfo[0]==le.getBlockNum():
+            rowInfo = None
+            toBuild.append(le)
+         pageRows.append(rowInfo)
+
+      if len(toBuild) > 0:
+         builtRows = iter(buildRows(toBuild))
+         for i,le in enumerate(pageEntries):
+            if pageRows[i] is None:
+               pageRows[i] = [le.getBlockNum(), builtRows.next()]
+               self.rows.put((wltID, rowType, le.getTxHash()), pageRows[i])
+
+      page = []
+      for le,(blockNum,rowList) in zip(pageEntries, pageRows):
+         nconf = self.topHeight - blockNum + 1
+         page.append((le, [dict(row, confirmations=nconf) for row in rowList]))
+
+      return page
+
+
+
+################################################################################
 class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
    #############################################################################
    def __init__(self, wallet, lockbox=None, inWltMap=None, inLBMap=None, \
                 inWltIDSet=None, inLBIDSet=None, inLBCppWalletMap=None, \
-                armoryHomeDir=ARMORY_HOME_DIR, addrByte=ADDRBYTE):
+                armoryHomeDir=ARMORY_HOME_DIR, addrByte=ADDRBYTE, \
+                ledgerCache=None):
       # Save the incoming info. If the user didn't pass in a wallet set, put the
       # wallet in the set (actually a dictionary w/ the wallet ID as the key).
       self.addressMetaData = {}
@@ -344,6 +478,15 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
       # we'll set everything up here.
       self.addrByte = addrByte
 
+      # Ledger rows already built for getledger & listtransactions.  The
+      # daemon passes in its own, so it can mark it stale on new tx
+      if ledgerCache == None:
+         ledgerCache = ArmoryLedgerCache()
+      self.ledgerCache = ledgerCache
+
+      # Which wallet/lockbox owns each scrAddr, for labelling ledger rows
+      self.scrAddrOwners = ScrAddrOwnerIndex()
+
 
    #############################################################################
    @catchErrsForJSON
@@ -677,6 +820,7 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
 
       if privKeyValid:
          self.thePubKey = self.curWlt.importExternalAddressData(self.binPrivKey)
+         self.scrAddrOwners.invalidateWallet(self.curWlt.uniqueIDB58)
          if self.thePubKey != None:
             retDict['PubKey'] = binary_to_hex(self.thePubKey)
          else:
@@ -1206,154 +1350,205 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
          else:
             b58Type = 'lockbox'
 
-         # Do some setup to determine how many ledger entries we'll get and
-         # which entries we'll get.
-         tx_count = int(tx_count)
-         from_tx = int(from_tx)
-         ledgerEntries = ledgerWlt.getTxLedger()
-         sz = len(ledgerEntries)
-         lower = min(sz, from_tx)
-         upper = min(sz, from_tx+tx_count)
-         txSet = set([])
-
-         # Loop through all the potential ledger entries and create what we can.
-         for i in range(lower,upper):
-            # Get the exact Tx we're looking for.
-            le = ledgerEntries[i]
-            txHashBin = le.getTxHash()
-            txHashHex = binary_to_hex(txHashBin, BIGENDIAN)
-
-            # If the BDM doesn't have the C++ Tx & header, log errors.
-            cppTx = TheBDM.getTxByHash(txHashBin)
-            if not cppTx.isInitialized():
-               LOGERROR('Tx hash not recognized by TheBDM: %s' % txHashHex)
-
-            cppHead = TheBDM.getHeaderPtrForTx(cppTx)
-            if not cppHead.isInitialized():
-               LOGERROR('Header pointer is not available!')
-               headHashBin = ''
-               headHashHex = ''
-               headtime    = 0
-            else:
-               headHashBin = cppHead.getThisHash()
-               headHashHex = binary_to_hex(headHashBin, BIGENDIAN)
-               headtime    = cppHead.getTimestamp()
-
-            # Get some more data.
-            # amtCoins: amt of BTC transacted, always positive (how big are
-            #           outputs minus change?)
-            # netCoins: net effect on wallet (positive or negative)
-            # feeCoins: how much fee was paid for this tx 
-            nconf = (TheBDM.getTopBlockHeader().getBlockHeight() - \
-                     le.getBlockNum()) + 1
-            isToSelf = le.isSentToSelf()
-            amtCoins = 0.0
-            netCoins = le.getValue()
-            feeCoins = getFeeForTx(txHashBin)
-            scrAddrs = [cppTx.getTxOutCopy(i).getScrAddressStr() for i in \
-                       range(cppTx.getNumTxOut())]
-
-            # Find the first recipient and the change recipient.
-            firstScrAddr = ''
-            changeScrAddr = ''
-            if cppTx.getNumTxOut()==1:
-               firstScrAddr = scrAddrs[0]
-            elif isToSelf:
-               # Sent-to-Self tx
-               amtCoins,changeIdx = determineSentToSelfAmt(le, ledgerWlt)
-               changeScrAddr = scrAddrs[changeIdx]
-               for iout,recipScrAddr in enumerate(scrAddrs):
-                  if not iout==changeIdx:
-                     firstScrAddr = recipScrAddr
-                     break
-            elif netCoins<0:
-               # Outgoing transaction (process in reverse order so get first)
-               amtCoins = -1*(netCoins+feeCoins)
-               for recipScrAddr in scrAddrs[::-1]:
-                  if ledgerWlt.hasScrAddress(recipScrAddr):
-                     changeScrAddr = recipScrAddr
-                  else:
-                     firstScrAddr = recipScrAddr
-            else:
-               # Incoming transaction (process in reverse order so get first)
-               amtCoins = netCoins
-               for recipScrAddr in scrAddrs[::-1]:
-                  if ledgerWlt.hasScrAddress(recipScrAddr):
-                     firstScrAddr = recipScrAddr
-                  else:
-                     changeScrAddr = recipScrAddr
+         # Rows are built once per tx, and then served out of the ledger
+         # cache.  The simple ledger is the full one minus the TxIn/TxOut lists
+         self.ledgerCache.checkWallets(self.serverWltMap, self.serverLBMap)
+         page = self.ledgerCache.getPage(self.b58ID, ledgerWlt, 'ledger', \
+                                         int(from_tx), int(tx_count), \
+                                         lambda leList: self.build_ledger_rows( \
+                                            leList, ledgerWlt, b58Type, inB58ID))
+         for le,rows in page:
+            for tx_info in rows:
+               if simple:
+                  for key in ('senderme', 'senderother', 'recipme', 'recipother'):
+                     del tx_info[key]
+               final_le_list.append(tx_info)
 
-            # Determine the direction of the Tx based on the coin setup.
-            if netCoins < -feeCoins:
-               txDir = 'send'
-            elif netCoins > -feeCoins:
-               txDir = 'receive'
-            else:
-               txDir = 'toself'
-
-            # Convert the scrAddrs to display strings.
-            firstAddr = scrAddr_to_displayStr(firstScrAddr, self.serverWltMap, \
-                                              self.serverLBMap.values())
-            changeAddr = '' if len(changeScrAddr)==0 else \
-                         scrAddr_to_displayStr(changeScrAddr, \
-                                               self.serverWltMap, \
-                                               self.serverLBMap.values())
-
-            # Get the address & amount from each TxIn.
-            myinputs, otherinputs = [], []
-            for iin in range(cppTx.getNumTxIn()):
-               sender = TheBDM.getSenderScrAddr(cppTx.getTxInCopy(iin))
-               val    = TheBDM.getSentValue(cppTx.getTxInCopy(iin))
-               addTo  = (myinputs if ledgerWlt.hasScrAddress(sender) else \
-                         otherinputs)
-               addTo.append( {'address': scrAddr_to_displayStr(sender, \
-                                                            self.serverWltMap, \
-                                                   self.serverLBMap.values()), \
-                              'amount':  AmountToJSON(val)} )
-
-            # Get the address & amount from each TxOut.
-            myoutputs, otheroutputs = [], []
-            for iout in range(cppTx.getNumTxOut()):
-               recip = cppTx.getTxOutCopy(iout).getScrAddressStr()
-               val   = cppTx.getTxOutCopy(iout).getValue();
-               addTo = (myoutputs if ledgerWlt.hasScrAddress(recip) else \
-                        otheroutputs)
-               addTo.append( {'address': scrAddr_to_displayStr(recip, \
-                                                            self.serverWltMap, \
-                                                   self.serverLBMap.values()), \
-                              'amount':  AmountToJSON(val)} )
-
-            # Create the ledger entry. (NB: "comment" isn't doable with C++
-            # wallets. Once the 2.0 wallets are ready, it should be restored.)
-            tx_info = {
-                        'direction' :    txDir,
-                        b58Type :        inB58ID,
-                        'amount' :       AmountToJSON(amtCoins),
-                        'netdiff' :      AmountToJSON(netCoins),
-                        'fee' :          AmountToJSON(feeCoins),
-                        'txid' :         txHashHex,
-                        'blockhash' :    headHashHex,
-                        'confirmations': nconf,
-                        'txtime' :       le.getTxTime(),
-                        'txsize' :       len(cppTx.serialize()),
-                        'blocktime' :    headtime,
-                        #'comment' :      ledgerWlt.getComment(txHashBin),
-                        'firstrecip':    firstAddr,
-                        'changerecip':   changeAddr
-                      }
-
-            # Add more info if it's not a simple ledger.
-            if not simple:
-               tx_info['senderme']     = myinputs
-               tx_info['senderother']  = otherinputs
-               tx_info['recipme']      = myoutputs
-               tx_info['recipother']   = otheroutputs
-
-            # Add the ledger entry to the ledger list.
-            final_le_list.append(tx_info)
+      return final_le_list
 
 
-      return final_le_list
+   #############################################################################
+   def build_ledger_rows(self, leList, ledgerWlt, b58Type, b58ID):
+      """
+      Builds the full getledger row for each LedgerEntry in leList, returned
+      as one single-row list per entry (the format ArmoryLedgerCache wants).
+      Confirmations are left out, the cache adds them when serving the row.
+      """
+      rowLists = []
+
+      # The maps are shared with Armory_Daemon, which may have changed them
+      self.scrAddrOwners.syncWallets(self.serverWltMap)
+      self.scrAddrOwners.syncLockboxes(self.serverLBMap.values())
+
+      # Get all the Tx in one trip through the BDM queue
+      cppTxList = TheBDM.batchWithFallback( \
+                        [('getTxByHash', le.getTxHash()) for le in leList])
+      for le,cppTx in zip(leList, cppTxList):
+         txHashBin = le.getTxHash()
+         txHashHex = binary_to_hex(txHashBin, BIGENDIAN)
+
+         # No answer at all means the BDM is busy, and nothing gets cached
+         if cppTx is None:
+            raise BlockchainUnavailableError('BDM did not return tx %s' % txHashHex)
+
+         # If the BDM doesn't have the C++ Tx & header, log errors.
+         if not cppTx.isInitialized():
+            LOGERROR('Tx hash not recognized by TheBDM: %s' % txHashHex)
+
+         # The header and the sender/value of every TxIn come back in one
+         # batch, as [header] + [senders] + [values]
+         cppTxIns = [cppTx.getTxInCopy(iin) for iin in range(cppTx.getNumTxIn())]
+         nIn = len(cppTxIns)
+         bdmOut = TheBDM.batchWithFallback( \
+                               [('getHeaderPtrForTx', cppTx)] + \
+                               [('getSenderScrAddr', txin) for txin in cppTxIns] + \
+                               [('getSentValue', txin) for txin in cppTxIns])
+         cppHead = bdmOut[0]
+         inSenders = bdmOut[1:1+nIn]
+         inValues  = bdmOut[1+nIn:]
+         if cppHead is None:
+            raise BlockchainUnavailableError('BDM did not return the header ' \
+                                             'for tx %s' % txHashHex)
+
+         # Anything the batch didn't answer is asked for on its own, and a row
+         # is never built (or cached) with a missing sender or value
+         for iin,txin in enumerate(cppTxIns):
+            if inSenders[iin] is None or isBDMRequestError(inSenders[iin]):
+               inSenders[iin] = TheBDM.getSenderScrAddr(txin)
+            if inValues[iin] is None or isBDMRequestError(inValues[iin]):
+               inValues[iin] = TheBDM.getSentValue(txin)
+            if inSenders[iin] is None or isBDMRequestError(inSenders[iin]) or \
+               inValues[iin] is None or isBDMRequestError(inValues[iin]):
+               raise BlockchainUnavailableError('BDM did not return TxIn %d ' \
+                                                'of tx %s' % (iin, txHashHex))
+         if not cppHead.isInitialized():
+            LOGERROR('Header pointer is not available!')
+            headHashBin = ''
+            headHashHex = ''
+            headtime    = 0
+         else:
+            headHashBin = cppHead.getThisHash()
+            headHashHex = binary_to_hex(headHashBin, BIGENDIAN)
+            headtime    = cppHead.getTimestamp()
+
+         # Get some more data.
+         # amtCoins: amt of BTC transacted, always positive (how big are
+         #           outputs minus change?)
+         # netCoins: net effect on wallet (positive or negative)
+         # feeCoins: how much fee was paid for this tx 
+         isToSelf = le.isSentToSelf()
+         amtCoins = 0.0
+         netCoins = le.getValue()
+         scrAddrs = [cppTx.getTxOutCopy(i).getScrAddressStr() for i in \
+                    range(cppTx.getNumTxOut())]
+
+         # We already have every input value, so no need for getFeeForTx()
+         feeCoins = 0
+         if cppTx.isInitialized():
+            feeCoins = sum(inValues) - sum([cppTx.getTxOutCopy(i).getValue() \
+                                       for i in range(cppTx.getNumTxOut())])
+
+         # Find the first recipient and the change recipient.
+         firstScrAddr = ''
+         changeScrAddr = ''
+         if cppTx.getNumTxOut()==1:
+            firstScrAddr = scrAddrs[0]
+         elif isToSelf:
+            # Sent-to-Self tx
+            amtCoins,changeIdx = determineSentToSelfAmt(le, ledgerWlt)
+            changeScrAddr = scrAddrs[changeIdx]
+            for iout,recipScrAddr in enumerate(scrAddrs):
+               if not iout==changeIdx:
+                  firstScrAddr = recipScrAddr
+                  break
+         elif netCoins<0:
+            # Outgoing transaction (process in reverse order so get first)
+            amtCoins = -1*(netCoins+feeCoins)
+            for recipScrAddr in scrAddrs[::-1]:
+               if ledgerWlt.hasScrAddress(recipScrAddr):
+                  changeScrAddr = recipScrAddr
+               else:
+                  firstScrAddr = recipScrAddr
+         else:
+            # Incoming transaction (process in reverse order so get first)
+            amtCoins = netCoins
+            for recipScrAddr in scrAddrs[::-1]:
+               if ledgerWlt.hasScrAddress(recipScrAddr):
+                  firstScrAddr = recipScrAddr
+               else:
+                  changeScrAddr = recipScrAddr
+
+         # Determine the direction of the Tx based on the coin setup.
+         if netCoins < -feeCoins:
+            txDir = 'send'
+         elif netCoins > -feeCoins:
+            txDir = 'receive'
+         else:
+            txDir = 'toself'
+
+         # Convert the scrAddrs to display strings.
+         firstAddr = scrAddr_to_displayStr(firstScrAddr, self.serverWltMap, \
+                                           self.serverLBMap.values(), \
+                                           self.scrAddrOwners)
+         changeAddr = '' if len(changeScrAddr)==0 else \
+                      scrAddr_to_displayStr(changeScrAddr, \
+                                            self.serverWltMap, \
+                                            self.serverLBMap.values(), \
+                                            self.scrAddrOwners)
+
+         # Get the address & amount from each TxIn.
+         myinputs, otherinputs = [], []
+         for iin in range(nIn):
+            sender = inSenders[iin]
+            val    = inValues[iin]
+            addTo  = (myinputs if ledgerWlt.hasScrAddress(sender) else \
+                      otherinputs)
+            addTo.append( {'address': scrAddr_to_displayStr(sender, \
+                                                         self.serverWltMap, \
+                                                self.serverLBMap.values(), \
+                                                self.scrAddrOwners), \
+                           'amount':  AmountToJSON(val)} )
+
+         # Get the address & amount from each TxOut.
+         myoutputs, otheroutputs = [], []
+         for iout in range(cppTx.getNumTxOut()):
+            recip = cppTx.getTxOutCopy(iout).getScrAddressStr()
+            val   = cppTx.getTxOutCopy(iout).getValue();
+            addTo = (myoutputs if ledgerWlt.hasScrAddress(recip) else \
+                     otheroutputs)
+            addTo.append( {'address': scrAddr_to_displayStr(recip, \
+                                                         self.serverWltMap, \
+                                                self.serverLBMap.values(), \
+                                                self.scrAddrOwners), \
+                           'amount':  AmountToJSON(val)} )
+
+         # Create the ledger entry. (NB: "comment" isn't doable with C++
+         # wallets. Once the 2.0 wallets are ready, it should be restored.)
+         tx_info = {
+                     'direction' :    txDir,
+                     b58Type :        b58ID,
+                     'amount' :       AmountToJSON(amtCoins),
+                     'netdiff' :      AmountToJSON(netCoins),
+                     'fee' :          AmountToJSON(feeCoins),
+                     'txid' :         txHashHex,
+                     'blockhash' :    headHashHex,
+                     'txtime' :       le.getTxTime(),
+                     'txsize' :       len(cppTx.serialize()),
+                     'blocktime' :    headtime,
+                     #'comment' :      ledgerWlt.getComment(txHashBin),
+                     'firstrecip':    firstAddr,
+                     'changerecip':   changeAddr
+                   }
+
+         # The simple ledger leaves these out when it's served
+         tx_info['senderme']     = myinputs
+         tx_info['senderother']  = otherinputs
+         tx_info['recipme']      = myoutputs
+         tx_info['recipother']   = otheroutputs
+
+         rowLists.append([tx_info])
+
+      return rowLists
 
 
    #############################################################################
@@ -1373,30 +1568,53 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
       # This does not use 'account's like in the Satoshi client
 
       final_tx_list = []
-      ledgerEntries = self.curWlt.getTxLedger('blk')
-
-      sz = len(ledgerEntries)
-      lower = min(sz, from_tx)
-      upper = min(sz, from_tx+tx_count)
+      wltID = self.curWlt.uniqueIDB58
+      self.ledgerCache.checkWallets(self.serverWltMap, self.serverLBMap)
+      page = self.ledgerCache.getPage(wltID, self.curWlt, 'listtransactions', \
+                                      from_tx, tx_count, \
+                                      lambda leList: self.build_txlist_rows( \
+                                                           leList, self.curWlt), \
+                                      'blk')
 
       txSet = set([])
-
-      for i in range(lower,upper):
-
-         le = ledgerEntries[i]
+      for le,rows in page:
          txHashBin = le.getTxHash()
          if txHashBin in txSet:
             continue
 
          txSet.add(txHashBin)
+         final_tx_list.extend(rows)
+
+      return final_tx_list
+
+
+   #############################################################################
+   def build_txlist_rows(self, leList, wlt):
+      """
+      Builds the listtransactions rows for each LedgerEntry in leList, and
+      returns one list of rows per entry (the format ArmoryLedgerCache wants).
+      Confirmations are left out, the cache adds them when serving the rows.
+      """
+      rowLists = []
+
+      # Get all the Tx, and then all their headers, in two BDM requests
+      cppTxList = TheBDM.batchWithFallback( \
+                        [('getTxByHash', le.getTxHash()) for le in leList])
+      if any([cppTx is None for cppTx in cppTxList]):
+         raise BlockchainUnavailableError('BDM did not return every tx')
+      cppHeadList = TheBDM.batchWithFallback( \
+                        [('getHeaderPtrForTx', cppTx) for cppTx in cppTxList])
+      if any([cppHead is None for cppHead in cppHeadList]):
+         raise BlockchainUnavailableError('BDM did not return every header')
+      for le,cppTx,cppHead in zip(leList, cppTxList, cppHeadList):
+         txHashBin = le.getTxHash()
          txHashHex = binary_to_hex(txHashBin, BIGENDIAN)
+         tx_list = []
 
-         cppTx = TheBDM.getTxByHash(txHashBin)
          if not cppTx.isInitialized():
             LOGERROR('Tx hash not recognized by TheBDM: %s' % txHashHex)
 
          #cppHead = cppTx.getHeaderPtr()
-         cppHead = TheBDM.getHeaderPtrForTx(cppTx)
          if not cppHead.isInitialized:
             LOGERROR('Header pointer is not available!')
 
@@ -1406,7 +1624,6 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
          isToSelf   = le.isSentToSelf()
          feeCoin   = getFeeForTx(txHashBin)
          totalBalDiff = le.getValue()
-         nconf = TheBDM.getTopBlockHeader().getBlockHeight()-le.getBlockNum()+1
 
 
          # We have potentially change outputs on any outgoing transactions.
@@ -1422,7 +1639,7 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
             changeAddr160 = ""
             targAddr160 = CheckHash160(cppTx.getTxOutCopy(0).getScrAddressStr())
          elif isToSelf:
-            selfamt,changeIdx = determineSentToSelfAmt(le, self.curWlt)
+            selfamt,changeIdx = determineSentToSelfAmt(le, wlt)
             if changeIdx==-1:
                changeAddr160 = ""
             else:
@@ -1432,7 +1649,7 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
          elif totalBalDiff < 0:
             # This was ultimately an outgoing transaction
             for iout,rv in enumerate(recipVals):
-               if self.curWlt.hasAddr(rv[0]):
+               if wlt.hasAddr(rv[0]):
                   changeAddr160 = rv[0]
                   del recipVals[iout]
                   break
@@ -1440,7 +1657,7 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
          else:
             # Receiving transaction
             for recip,val in recipVals:
-               if self.curWlt.hasAddr(recip):
+               if wlt.hasAddr(recip):
                   targAddr160 = recip
                   break
             targAddr160 = recipVals[0][0]
@@ -1457,7 +1674,6 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
                         "category" :       category,
                         "amount" :         amt,
                         "fee" :            fee,
-                        "confirmations" :  nconf,
                         "blockhash" :      blockHash,
                         "blockindex" :     blockIndex,
                         "blocktime" :      blockTime,
@@ -1465,11 +1681,11 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
                         "time" :           blockTime,
                         "timereceived" :   blockTime 
                      }
-            final_tx_list.append(tx_info)
+            tx_list.append(tx_info)
 
          for a160,val in recipVals:
             # Change outputs have already been removed
-            if totalBalDiff>0 and not self.curWlt.hasAddr(a160):
+            if totalBalDiff>0 and not wlt.hasAddr(a160):
                # This is a receiving tx and this is other addr sending to other
                # addr
                continue
@@ -1479,7 +1695,7 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
             else:
                address = hash160_to_addrStr(a160)
 
-            if not self.curWlt.hasAddr(a160):
+            if not wlt.hasAddr(a160):
                category = 'send'
                amt = -AmountToJSON(val)
                fee = -AmountToJSON(feeCoin)
@@ -1489,7 +1705,6 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
                            "category" :       category,
                            "amount" :         amt,
                            "fee" :            fee,
-                           "confirmations" :  nconf,
                            "blockhash" :      blockHash,
                            "blockindex" :     blockIndex,
                            "blocktime" :      blockTime,
@@ -1505,7 +1720,6 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
                            "address" : address,
                            "category" : category,
                            "amount" : amt,
-                           "confirmations" : nconf,
                            "blockhash" : blockHash,
                            "blockindex" : blockIndex,
                            "blocktime" : blockTime,
@@ -1514,9 +1728,11 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
                            "timereceived" : blockTime
                         }
 
-            final_tx_list.append(tx_info)
+            tx_list.append(tx_info)
 
-      return final_tx_list
+         rowLists.append(tx_list)
+
+      return rowLists
 
 
    #############################################################################
@@ -1954,6 +2170,10 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
                writeLockboxesFile([lockbox], lbFilePath, False)
                self.serverLBMap[lbID] = lockbox
 
+               # Cached ledger rows may show this lockbox's addresses as
+               # plain addresses
+               self.ledgerCache.clear()
+
                result = lockbox.toJSONMap()
 
       return result
@@ -2465,7 +2685,8 @@ class Armory_Json_Rpc_Server(jsonrpc.JSONRPC):
                                   'not be unlocked. Signed transaction will ' \
                                   'not be created.'
             else:
-               self.curWlt.unlock(securePassphrase=passwd)
+               # signUnsignedTx decrypts the keys it needs
+               self.curWlt.unlock(securePassphrase=passwd, onDemand=True)
                decrypted = True
          finally:
             passwd.destroy()
@@ -2663,6 +2884,7 @@ class Armory_Daemon(object):
       self.curLB = None
 
       self.newZeroConfSinceLastUpdate = []
+      self.ledgerCache = ArmoryLedgerCache()
 
       # Check if armoryd is already running. If so, just execute the command,
       # otherwise prepare to act as the server.
@@ -2794,7 +3016,8 @@ class Armory_Daemon(object):
             resource = Armory_Json_Rpc_Server(self.curWlt, self.curLB, \
                                               self.WltMap, self.lboxMap, \
                                               self.wltIDSet, self.lbIDSet, \
-                                              self.lboxCppWalletMap)
+                                              self.lboxCppWalletMap, \
+                                              ledgerCache=self.ledgerCache)
             secured_resource = self.set_auth(resource)
 
             # This is LISTEN call for armory RPC server
@@ -2986,6 +3209,7 @@ class Armory_Daemon(object):
       # Execute on every new Tx.
       TheBDM.addNewZeroConfTx(pytxObj.serialize(), long(RightNow()), True)
       self.newZeroConfSinceLastUpdate.append(pytxObj.serialize())
+      self.ledgerCache.markStale()
       #TheBDM.rescanWalletZeroConf(self.curWlt.cppWallet)
 
       # Add anything else you'd like to do on a new transaction.
@@ -3011,7 +3235,10 @@ class Armory_Daemon(object):
 
       # Therefore, if you put anything here, it should operate on the header
       # or tx data in a vacuum (without any reliance on TheBDM)
-      pass
+
+      # The ledger cache notices the new top block by itself, this just makes
+      # sure zero-conf tx confirmed by this block are re-read along with it
+      self.ledgerCache.markStale()
 
 
    #############################################################################
@@ -3077,9 +3304,13 @@ class Armory_Daemon(object):
                for wltID in self.WltMap.keys():
                   wlt = self.WltMap[wltID]
                   TheBDM.rescanWalletZeroConf(wlt.cppWallet, wait=True)
+                  wlt.applyZeroConfTxList(self.newZeroConfSinceLastUpdate)
    
                for lbID,cppWlt in self.lboxCppWalletMap.iteritems():
                   TheBDM.rescanWalletZeroConf(cppWlt, wait=True)
+
+               # The ledgers only show the new tx after the rescan
+               self.ledgerCache.markStale()
                      
             # We had a notification thing going in ArmoryQt using checkNewZeroConf()
             # but we didn't need it here (yet), so I simply remove it and clear the
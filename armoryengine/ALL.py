@@ -8,6 +8,8 @@ from armoryengine.Script import *
 from SDM import *
 from armoryengine.Timer import *
 from armoryengine.Transaction import *
+from armoryengine.UtxoIndex import *
+from armoryengine.ChainedKeyCache import *
 from armoryengine.MultiSigUtils import *
 from armoryengine.UserAddressUtils import *
 
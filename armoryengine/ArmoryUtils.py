@@ -28,11 +28,13 @@ import multiprocessing
 import optparse
 import os
 import platform
+import Queue
 import random
 import signal
 import smtplib
 from struct import pack, unpack
 from itertools import izip
+from collections import OrderedDict
 #from subprocess import PIPE
 import sys
 import threading
@@ -86,7 +88,9 @@ parser.add_option("--debug",           dest="doDebug",     default=False,     ac
 parser.add_option("--nologging",       dest="logDisable",  default=False,     action="store_true", help="Disable all logging")
 parser.add_option("--netlog",          dest="netlog",      default=False,     action="store_true", help="Log networking messages sent and received by Armory")
 parser.add_option("--logfile",         dest="logFile",     default='DEFAULT', type='str',          help="Specify a non-default location to send logging information")
+parser.add_option("--async-logging",   dest="asyncLogging",default=False,     action="store_true", help="Write the log file from a background thread")
 parser.add_option("--mtdebug",         dest="mtdebug",     default=False,     action="store_true", help="Log multi-threaded call sequences")
+parser.add_option("--bdm-readers",     dest="bdmReaders",  default=0,         type="int",          help="Number of threads taking read-only BDM lookups outside the BDM queue, answering from the snapshot during scans (0 = off)")
 parser.add_option("--skip-online-check", dest="forceOnline", default=False,   action="store_true", help="Go into online mode, even if internet connection isn't detected")
 parser.add_option("--skip-version-check", dest="skipVerCheck", default=False, action="store_true", help="Do not contact bitcoinarmory.com to check for new versions")
 parser.add_option("--skip-announce-check", dest="skipAnnounceCheck", default=False, action="store_true", help="Do not query for Armory announcements")
@@ -101,6 +105,7 @@ parser.add_option("--test-announce", dest="testAnnounceCode", default=False,
 parser.add_option("--nospendzeroconfchange",dest="ignoreAllZC",default=False, action="store_true", help="All zero-conf funds will be unspendable, including sent-to-self coins")
 parser.add_option("--multisigfile",  dest="multisigFile",  default='DEFAULT', type='str',          help="File to store information about multi-signature transactions")
 parser.add_option("--force-wallet-check", dest="forceWalletCheck", default=False, action="store_true", help="Force the wallet sanity check on startup")
+parser.add_option("--lazy-wallets",    dest="lazyWallets", default=False,     action="store_true", help="Only read wallet address entries when they are used, through a side-car index next to each wallet file")
 parser.add_option("--disable-modules", dest="disableModules", default=False, action="store_true", help="Disable looking for modules in the execution directory")
 parser.add_option("--disable-conf-permis", dest="disableConfPermis", default=False, action="store_true", help="Disable forcing permissions on bitcoin.conf")
 
@@ -673,18 +678,32 @@ def execAndWait(cli_str, timeout=0, useStartInfo=True):
 # Want to get the line in which an error was triggered, but by wrapping
 # the logger function (as I will below), the displayed "file:linenum"
 # references the logger function, not the function that called it.
-# So I use traceback to find the file and line number two up in the
-# stack trace, and return that to be displayed instead of default
-# [Is this a hack?  Yes and no.  I see no other way to do this]
-def getCallerLine():
-   stkTwoUp = traceback.extract_stack()[-3]
-   filename,method = stkTwoUp[0], stkTwoUp[1]
-   return '%s:%d' % (os.path.basename(filename),method)
+# So I look at the frame two up in the stack (the caller of the LOG*
+# function), and return that to be displayed instead of default.
+# traceback.extract_stack() would also do it, but it builds the whole
+# stack and reads source lines from disk, on every single log call
+def getCallerLine(depth=2):
+   frame = sys._getframe(depth)
+   return '%s:%d' % (os.path.basename(frame.f_code.co_filename), frame.f_lineno)
+
+# Lowest level any handler writes:  LOG* calls below it return before doing
+# any formatting or stack inspection.  Call updateLogThreshold() after
+# changing handler levels
+LOG_THRESHOLD = logging.NOTSET
+def updateLogThreshold():
+   global LOG_THRESHOLD
+   handlers = logging.getLogger('').handlers
+   if len(handlers)==0:
+      LOG_THRESHOLD = logging.NOTSET
+   else:
+      LOG_THRESHOLD = min([h.level for h in handlers])
 
 # When there's an error in the logging function, it's impossible to find!
 # These wrappers will print the full stack so that it's possible to find
 # which line triggered the error
 def LOGDEBUG(msg, *a):
+   if logging.DEBUG < LOG_THRESHOLD:
+      return
    try:
       logstr = msg if len(a)==0 else (msg%a)
       callerStr = getCallerLine() + ' - '
@@ -694,6 +713,8 @@ def LOGDEBUG(msg, *a):
       raise
 
 def LOGINFO(msg, *a):
+   if logging.INFO < LOG_THRESHOLD:
+      return
    try:
       logstr = msg if len(a)==0 else (msg%a)
       callerStr = getCallerLine() + ' - '
@@ -702,6 +723,8 @@ def LOGINFO(msg, *a):
       traceback.print_stack()
       raise
 def LOGWARN(msg, *a):
+   if logging.WARNING < LOG_THRESHOLD:
+      return
    try:
       logstr = msg if len(a)==0 else (msg%a)
       callerStr = getCallerLine() + ' - '
@@ -710,6 +733,8 @@ def LOGWARN(msg, *a):
       traceback.print_stack()
       raise
 def LOGERROR(msg, *a):
+   if logging.ERROR < LOG_THRESHOLD:
+      return
    try:
       logstr = msg if len(a)==0 else (msg%a)
       callerStr = getCallerLine() + ' - '
@@ -718,6 +743,8 @@ def LOGERROR(msg, *a):
       traceback.print_stack()
       raise
 def LOGCRIT(msg, *a):
+   if logging.CRITICAL < LOG_THRESHOLD:
+      return
    try:
       logstr = msg if len(a)==0 else (msg%a)
       callerStr = getCallerLine() + ' - '
@@ -726,6 +753,8 @@ def LOGCRIT(msg, *a):
       traceback.print_stack()
       raise
 def LOGEXCEPT(msg, *a):
+   if logging.ERROR < LOG_THRESHOLD:
+      return
    try:
       logstr = msg if len(a)==0 else (msg%a)
       callerStr = getCallerLine() + ' - '
@@ -735,27 +764,132 @@ def LOGEXCEPT(msg, *a):
       raise
 
 
+################################################################################
+class AsyncLogHandler(logging.Handler):
+   """
+   Wraps another handler (the log file), and hands it records through a
+   queue serviced by a background thread, so the thread doing the logging
+   (the Twisted reactor, the BDM thread) never waits on the disk.  Records
+   are dropped, not waited on, if the queue is full.
+   """
+   def __init__(self, target, maxQueue=10000):
+      logging.Handler.__init__(self, target.level)
+      self.target   = target
+      self.queue    = Queue.Queue(maxQueue)
+      self.nDropped = 0
+      self.thread   = threading.Thread(target=self.writeRecords, \
+                                       name='AsyncLogHandler')
+      self.thread.daemon = True
+      self.thread.start()
+
+   def setLevel(self, level):
+      logging.Handler.setLevel(self, level)
+      self.target.setLevel(level)
+
+   def setFormatter(self, fmt):
+      self.target.setFormatter(fmt)
+
+   def emit(self, record):
+      # Like QueueHandler.prepare in Python 3:  resolve the message and the
+      # traceback now, the args and exc_info may be gone by the time the
+      # writer thread gets to them
+      try:
+         record.msg = record.getMessage()
+         record.args = None
+         if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+         self.queue.put_nowait(record)
+      except Queue.Full:
+         self.nDropped += 1
+      except Exception:
+         self.handleError(record)
+
+   def writeRecords(self):
+      while True:
+         record = self.queue.get()
+         try:
+            if record is None:
+               return
+            if self.nDropped > 0:
+               nDropped,self.nDropped = self.nDropped,0
+               self.target.handle(logging.makeLogRecord({ \
+                  'levelno': logging.WARNING, 'levelname': 'WARNING', \
+                  'msg': 'Log queue full, dropped %d records' % nDropped}))
+            self.target.handle(record)
+         finally:
+            self.queue.task_done()
+
+   def flush(self):
+      if self.thread.is_alive():
+         self.queue.join()
+      self.target.flush()
+
+   def close(self):
+      if self.thread.is_alive():
+         self.queue.put(None)
+         self.thread.join(5)
+      self.target.close()
+      logging.Handler.close(self)
+
+
+
+LOGFILE_CHUNK_SIZE = 64*1024
+
+def copyLastBytesOfFile(filename, fout, nBytes, alignToLine=False):
+   """
+   Write the last nBytes of filename to the open file fout, one chunk at a
+   time, so memory use doesn't depend on the size of either.  With
+   alignToLine, the partial line at the start is skipped.  Returns the
+   number of bytes written.
+   """
+   if not os.path.exists(filename):
+      return 0
+
+   sz = os.path.getsize(filename)
+   nWritten = 0
+   with open(filename, 'rb') as fin:
+      if sz > nBytes:
+         fin.seek(sz - nBytes)
+         if alignToLine:
+            partial = fin.readline(LOGFILE_CHUNK_SIZE)
+            if not partial.endswith('\n'):
+               # No line break anywhere near, just cut at the byte
+               fin.seek(sz - nBytes)
+
+      while True:
+         chunk = fin.read(LOGFILE_CHUNK_SIZE)
+         if not chunk:
+            break
+         fout.write(chunk)
+         nWritten += len(chunk)
+   return nWritten
+
 
 def chopLogFile(filename, size):
+   """
+   If the log is bigger than size, cut it down to its last size bytes
+   (starting on a full line).  The tail is streamed to a temporary file
+   which then replaces the log, so a huge --netlog log costs one seek and
+   a size-byte copy, not a read of the whole file.
+   """
    if not os.path.exists(filename):
       print 'Log file doesn\'t exist [yet]'
       return
 
-   logfile = open(filename, 'r')
-   allLines = logfile.readlines()
-   logfile.close()
-
-   nBytes,nLines = 0,0;
-   for line in allLines[::-1]:
-      nBytes += len(line)
-      nLines += 1
-      if nBytes>size:
-         break
+   if os.path.getsize(filename) <= size:
+      return
 
-   logfile = open(filename, 'w')
-   for line in allLines[-nLines:]:
-      logfile.write(line)
-   logfile.close()
+   tempFile = filename + '.tmp'
+   try:
+      with open(tempFile, 'wb') as fout:
+         copyLastBytesOfFile(filename, fout, size, alignToLine=True)
+      if OS_WINDOWS:
+         # os.rename won't replace an existing file on Windows
+         os.remove(filename)
+      os.rename(tempFile, filename)
+   except (IOError, OSError) as e:
+      print 'Could not chop log file %s: %s' % (filename, str(e))
 
 
 # Cut down the log file to just the most recent 1 MB
@@ -787,6 +921,8 @@ fileFormatter  = logging.Formatter('%(asctime)s (%(levelname)s) -- %(message)s',
 fileHandler = logging.FileHandler(ARMORY_LOG_FILE)
 fileHandler.setLevel(DEFAULT_FILE_LOGTHRESH)
 fileHandler.setFormatter(fileFormatter)
+if CLI_OPTIONS.asyncLogging:
+   fileHandler = AsyncLogHandler(fileHandler)
 logging.getLogger('').addHandler(fileHandler)
 
 consoleFormatter = logging.Formatter('(%(levelname)s) %(message)s')
@@ -794,6 +930,7 @@ consoleHandler = logging.StreamHandler()
 consoleHandler.setLevel(DEFAULT_CONSOLE_LOGTHRESH)
 consoleHandler.setFormatter( consoleFormatter )
 logging.getLogger('').addHandler(consoleHandler)
+updateLogThreshold()
 
 
 
@@ -811,21 +948,23 @@ class stringAggregator(object):
 # Do this by swapping out sys.stdout temporarily, execute theObj.pprint()
 # then set sys.stdout back to the original.
 def LOGPPRINT(theObj, loglevel=DEFAULT_PPRINT_LOGLEVEL):
+   if loglevel < LOG_THRESHOLD:
+      return
    sys.stdout = stringAggregator()
    theObj.pprint()
    printedStr = sys.stdout.getStr()
    sys.stdout = sys.__stdout__
-   stkOneUp = traceback.extract_stack()[-2]
-   filename,method = stkOneUp[0], stkOneUp[1]
-   methodStr  = '(PPRINT from %s:%d)\n' % (filename,method)
+   frame = sys._getframe(1)
+   methodStr  = '(PPRINT from %s:%d)\n' % (frame.f_code.co_filename, frame.f_lineno)
    logging.log(loglevel, methodStr + printedStr)
 
 # For super-debug mode, we'll write out raw data
 def LOGRAWDATA(rawStr, loglevel=DEFAULT_RAWDATA_LOGLEVEL):
+   if loglevel < LOG_THRESHOLD:
+      return
    dtype = isLikelyDataType(rawStr)
-   stkOneUp = traceback.extract_stack()[-2]
-   filename,method = stkOneUp[0], stkOneUp[1]
-   methodStr  = '(PPRINT from %s:%d)\n' % (filename,method)
+   frame = sys._getframe(1)
+   methodStr  = '(PPRINT from %s:%d)\n' % (frame.f_code.co_filename, frame.f_lineno)
    pstr = rawStr[:]
    if dtype==DATATYPE.Binary:
       pstr = binary_to_hex(rawStr)
@@ -1909,8 +2048,64 @@ def bitset_to_int(bitset):
 EmptyHash = hex_to_binary('00'*32)
 
 
+################################################################################
+class LRUCache(object):
+   """
+   Holds at most maxSize entries, dropping the least-recently used one to
+   make room for a new one.  Lookups come from the GUI, the BDM thread and
+   armoryd's RPC handlers, so every access takes the lock.
+   """
+   def __init__(self, maxSize):
+      self.maxSize = maxSize
+      self.data    = OrderedDict()
+      self.lock    = threading.Lock()
+      self.nHits   = 0
+      self.nMisses = 0
+
+   def get(self, key, default=None):
+      with self.lock:
+         try:
+            val = self.data.pop(key)
+         except KeyError:
+            self.nMisses += 1
+            return default
+         # Re-insert to mark it most recently used
+         self.data[key] = val
+         self.nHits += 1
+         return val
+
+   def put(self, key, val):
+      with self.lock:
+         self.data.pop(key, None)
+         self.data[key] = val
+         if len(self.data) > self.maxSize:
+            self.data.popitem(last=False)
+
+   def clear(self):
+      with self.lock:
+         self.data.clear()
+
+   def __len__(self):
+      return len(self.data)
+
+   def __contains__(self, key):
+      return key in self.data
+
+
+
 ################################################################################
 # BINARY/BASE58 CONVERSIONS
+#
+# Both directions convert BASE58_CHUNK_DIGITS characters per big-integer
+# multiply/divide (58**10 < 2**63), and do the per-character work on small
+# ints.  Characters are looked up in BASE58INDEX instead of searched for, and
+# encoding produces two characters at a time from BASE58PAIRS.
+BASE58INDEX         = dict([(c,i) for i,c in enumerate(BASE58CHARS)])
+BASE58PAIRS         = [a+b for a in BASE58CHARS for b in BASE58CHARS]
+BASE58_CHUNK_DIGITS = 10
+BASE58_POWERS       = [58**i for i in range(BASE58_CHUNK_DIGITS+1)]
+BASE58_CHUNK_BASE   = BASE58_POWERS[BASE58_CHUNK_DIGITS]
+
 def binary_to_base58(binstr):
    """
    This method applies the Bitcoin-specific conversion from binary to Base58
@@ -1921,23 +2116,22 @@ def binary_to_base58(binstr):
    special kind of Base58 converter, which makes it usable for encoding other
    data, such as ECDSA keys or scripts.
    """
-   padding = 0;
-   for b in binstr:
-      if b=='\x00':
-         padding+=1
-      else:
-         break
+   stripped = binstr.lstrip('\x00')
+   padding  = len(binstr) - len(stripped)
 
-   n = 0
-   for ch in binstr:
-      n *= 256
-      n += ord(ch)
+   n = int(binary_to_hex(stripped), 16) if len(stripped)>0 else 0
 
-   b58 = ''
+   # Digit pairs come out least-significant first
+   pairs = []
    while n > 0:
-      n, r = divmod (n, 58)
-      b58 = BASE58CHARS[r] + b58
-   return '1'*padding + b58
+      n, chunk = divmod(n, BASE58_CHUNK_BASE)
+      for i in range(BASE58_CHUNK_DIGITS/2):
+         chunk, r = divmod(chunk, 58*58)
+         pairs.append(BASE58PAIRS[r])
+   pairs.reverse()
+
+   # The last chunk is padded with zero digits ('1'), which are leading zeros
+   return '1'*padding + ''.join(pairs).lstrip('1')
 
 
 ################################################################################
@@ -1952,27 +2146,38 @@ def base58_to_binary(addr):
    data, such as ECDSA keys or scripts.
    """
    # Count the zeros ('1' characters) at the beginning
-   padding = 0;
-   for c in addr:
-      if c=='1':
-         padding+=1
-      else:
-         break
+   padding = len(addr) - len(addr.lstrip('1'))
+
+   try:
+      vals = [BASE58INDEX[ch] for ch in addr]
+   except KeyError:
+      # Don't put the string in the error, it may be a private key
+      raise ValueError('Invalid character in Base58 string')
 
    n = 0
-   for ch in addr:
-      n *= 58
-      n += BASE58CHARS.index(ch)
+   for i in range(0, len(vals), BASE58_CHUNK_DIGITS):
+      piece = vals[i:i+BASE58_CHUNK_DIGITS]
+      chunk = 0
+      for v in piece:
+         chunk = chunk*58 + v
+      n = n*BASE58_POWERS[len(piece)] + chunk
 
    binOut = ''
-   while n>0:
-      d,m = divmod(n,256)
-      binOut = chr(m) + binOut
-      n = d
+   if n > 0:
+      h = '%x' % n
+      binOut = hex_to_binary(('0' if len(h)%2 else '') + h)
    return '\x00'*padding + binOut
 
 
 
+################################################################################
+# Ledgers, address books and RPC calls convert the same few addresses over
+# and over.  Only successful conversions are cached, so every error is still
+# raised from the code below.
+ADDRSTR_CACHE_SIZE = 20000
+addrStrEncodeCache = LRUCache(ADDRSTR_CACHE_SIZE)
+addrStrDecodeCache = LRUCache(ADDRSTR_CACHE_SIZE)
+
 ################################################################################
 def hash160_to_addrStr(binStr, netbyte=ADDRBYTE):
    """
@@ -1984,17 +2189,16 @@ def hash160_to_addrStr(binStr, netbyte=ADDRBYTE):
       raise InvalidHashError('Input string is %d bytes' % len(binStr))
 
    addr21 = netbyte + binStr
-   addr25 = addr21 + hash256(addr21)[:4]
-   return binary_to_base58(addr25);
+   addrStr = addrStrEncodeCache.get(addr21)
+   if addrStr is None:
+      addr25 = addr21 + hash256(addr21)[:4]
+      addrStr = binary_to_base58(addr25)
+      addrStrEncodeCache.put(addr21, addrStr)
+   return addrStr
 
 ################################################################################
 def hash160_to_p2shAddrStr(binStr):
-   if not len(binStr) == 20:
-      raise InvalidHashError('Input string is %d bytes' % len(binStr))
-
-   addr21 = P2SHBYTE + binStr
-   addr25 = addr21 + hash256(addr21)[:4]
-   return binary_to_base58(addr25);
+   return hash160_to_addrStr(binStr, P2SHBYTE)
 
 ################################################################################
 def binScript_to_p2shAddrStr(binScript):
@@ -2022,6 +2226,12 @@ def addrStr_is_p2sh(b58Str):
 # because we need to handle/distinguish regular addresses from P2SH.  All code
 # using this method must be updated to expect 2 outputs and check the prefix.
 def addrStr_to_hash160(b58Str, p2shAllowed=True):
+   cached = addrStrDecodeCache.get(b58Str)
+   if cached is not None:
+      if not p2shAllowed and cached[0]==P2SHBYTE:
+         raise P2SHNotSupportedError
+      return cached
+
    binStr = base58_to_binary(b58Str)
    if not p2shAllowed and binStr[0]==P2SHBYTE:
          raise P2SHNotSupportedError
@@ -2034,7 +2244,24 @@ def addrStr_to_hash160(b58Str, p2shAllowed=True):
    if not binStr[0] in (ADDRBYTE, P2SHBYTE):
       raise BadAddressError('Unknown addr prefix: %s' % binary_to_hex(binStr[0]))
 
-   return (binStr[0], binStr[1:-4])
+   result = (binStr[0], binStr[1:-4])
+   addrStrDecodeCache.put(b58Str, result)
+   return result
+
+
+################################################################################
+def hash160List_to_addrStrList(hash160List, netbyte=ADDRBYTE):
+   """ Convert many hash160s at once, such as every address of a wallet """
+   return [hash160_to_addrStr(a160, netbyte) for a160 in hash160List]
+
+
+################################################################################
+def addrStrList_to_hash160List(addrStrList, p2shAllowed=True):
+   """
+   Returns a list of (prefix, hash160) pairs.  Raises on the first bad
+   address, just like addrStr_to_hash160.
+   """
+   return [addrStr_to_hash160(addrStr, p2shAllowed) for addrStr in addrStrList]
 
 
 ###### Typing-friendly Base16 #####
@@ -2383,12 +2610,7 @@ class FiniteField(object):
       return (a*b) % self.prime
 
    def power(self,a,b):
-      result = 1
-      while(b>0):
-         b,x = divmod(b,2)
-         result = (result * (a if x else 1)) % self.prime
-         a = a*a % self.prime
-      return result
+      return pow(a, b, self.prime)
 
    def powinv(self,a):
       """ USE ONLY PRIME MODULUS """
@@ -2399,6 +2621,13 @@ class FiniteField(object):
       baddinv = self.powinv(b)
       return self.mult(a,baddinv)
 
+   def polyeval(self,coeffs,x):
+      """ Horner's rule, coefficients are highest-order first """
+      result = 0
+      for c in coeffs:
+         result = (result*x + c) % self.prime
+      return result
+
    def mtrxrmrowcol(self,mtrx,r,c):
       if not len(mtrx) == len(mtrx[0]):
          LOGERROR('Must be a square matrix!')
@@ -2475,9 +2704,12 @@ def SplitSecret(secret, needed, pieces, nbytes=None, use_random_x=False):
       LOGERROR('You must create more pieces than needed to reconstruct!')
       raise FiniteFieldError
 
-   if needed==1 or needed>8:
-      LOGERROR('Can split secrets into parts *requiring* at most 8 fragments')
-      LOGERROR('You can break it into as many optional fragments as you want')
+   if needed<2:
+      LOGERROR('Splitting a secret into 1-of-N fragments is just copying it!')
+      raise FiniteFieldError
+
+   if not pieces<ff.prime:
+      LOGERROR('Can create at most %d fragments of %d bytes', ff.prime-1, nbytes)
       raise FiniteFieldError
 
 
@@ -2489,16 +2721,11 @@ def SplitSecret(secret, needed, pieces, nbytes=None, use_random_x=False):
       lasthmac = HMAC512(lasthmac, 'splitsecrets')[:nbytes]
       othernum.append(binary_to_int(lasthmac))
 
-   def poly(x):
-      polyout = ff.mult(a, ff.power(x,needed-1))
-      for i,e in enumerate(range(needed-2,-1,-1)):
-         term = ff.mult(othernum[i], ff.power(x,e))
-         polyout = ff.add(polyout, term)
-      return polyout
-
+   # The secret is the highest-order coefficient
+   coeffs = [a] + othernum[:needed-1]
    for i in range(pieces):
       x = othernum[i+2] if use_random_x else i+1
-      fragments.append( [x, poly(x)] )
+      fragments.append( [x, ff.polyeval(coeffs, x)] )
 
    secret,a = None,None
    fragments = [ [int_to_binary(p, nbytes, BIGENDIAN) for p in frag] for frag in fragments]
@@ -2507,22 +2734,52 @@ def SplitSecret(secret, needed, pieces, nbytes=None, use_random_x=False):
 
 ################################################################################
 def ReconstructSecret(fragments, needed, nbytes):
+   return ReconstructSecretSubsets(fragments, [range(needed)], nbytes)[0]
 
-   ff = FiniteField(nbytes)
-   pairs = fragments[:needed]
-   m = []
-   v = []
-   for x,y in pairs:
-      x = binary_to_int(x, BIGENDIAN)
-      y = binary_to_int(y, BIGENDIAN)
-      m.append([])
-      for i,e in enumerate(range(needed-1,-1,-1)):
-         m[-1].append( ff.power(x,e) )
-      v.append(y)
 
-   minv = ff.mtrxinv(m)
-   outvect = ff.mtrxmultvect(minv,v)
-   return int_to_binary(outvect[0], nbytes, BIGENDIAN)
+################################################################################
+def ReconstructSecretSubsets(fragments, subsets, nbytes):
+   """
+   Reconstruct the secret from each subset of fragments (a list of indices
+   into fragments), returning one secret per subset.
+
+   The secret is the highest-order coefficient of the polynomial through the
+   points of a subset, which by Lagrange interpolation is:
+
+      sum_i  y_i / prod_{j!=i} (x_i - x_j)
+
+   Every subset is drawn from the same few fragments, so the inverse of each
+   (x_i - x_j) is computed once, and each subset then costs O(M^2) mults.
+   """
+   ff = FiniteField(nbytes)
+   xs = [binary_to_int(x, BIGENDIAN) for x,y in fragments]
+   ys = [binary_to_int(y, BIGENDIAN) for x,y in fragments]
+
+   invDiffs = {}
+   def getInvDiff(i, j):
+      if not (i,j) in invDiffs:
+         diff = ff.subtract(xs[i], xs[j])
+         if diff==0:
+            LOGERROR('Two fragments have the same x-value, cannot reconstruct')
+            raise FiniteFieldError
+         inv = ff.powinv(diff)
+         invDiffs[(i,j)] = inv
+         invDiffs[(j,i)] = ff.prime - inv
+      return invDiffs[(i,j)]
+
+   secrets = []
+   for subset in subsets:
+      secret = 0
+      for i in subset:
+         term = ys[i]
+         for j in subset:
+            if not j==i:
+               term = term * getInvDiff(i,j) % ff.prime
+         secret += term
+      secrets.append(int_to_binary(secret % ff.prime, nbytes, BIGENDIAN))
+
+   xs,ys,invDiffs = None,None,None
+   return secrets
 
 
 ################################################################################
@@ -2581,13 +2838,13 @@ def testReconstructSecrets(fragMap, M, maxTestCount=20):
    nBytes = len(fragMap[fragKeys[0]][1])
    LOGINFO('Testing %d-byte fragments' % nBytes)
 
-   testResults = []
-   for subset in subs:
-      fragSubset = [fragMap[i][:] for i in subset]
-
-      recon = ReconstructSecret(fragSubset, M, nBytes)
-      testResults.append((subset, recon))
+   # All subsets are reconstructed in one pass over the same fragment list
+   keyToPos = dict([(k,i) for i,k in enumerate(fragKeys)])
+   fragList = [fragMap[k][:] for k in fragKeys]
+   posSubs  = [[keyToPos[k] for k in subset] for subset in subs]
+   recons   = ReconstructSecretSubsets(fragList, posSubs, nBytes)
 
+   testResults = zip(subs, recons)
    return isRandom, testResults
 
 
@@ -40,9 +40,11 @@ BLOCKCHAINMODE  = enum('Offline', \
                        'Lite')
 
 BDMINPUTTYPE  = enum('RegisterAddr', \
+                     'RegisterAddrList', \
                      'ZeroConfTxToInsert', \
                      'HeaderRequested', \
                      'TxRequested', \
+                     'UnknownHashesRequested', \
                      'BlockRequested', \
                      'AddrBookRequested', \
                      'BlockAtHeightRequested', \
@@ -55,14 +57,233 @@ BDMINPUTTYPE  = enum('RegisterAddr', \
                      'GoOnlineRequested', \
                      'GoOfflineRequested', \
                      'Passthrough', \
+                     'BatchRequested', \
                      'Reset', \
                      'Shutdown')
 
+# Requests that never modify the BDM.  When concurrent readers are enabled,
+# these skip the main input queue and are run by the reader threads, in 
+# parallel with each other (but never while the BDM thread is modifying it)
+READONLY_BDMINPUTS = set([BDMINPUTTYPE.HeaderRequested, \
+                          BDMINPUTTYPE.TxRequested, \
+                          BDMINPUTTYPE.UnknownHashesRequested, \
+                          BDMINPUTTYPE.HeaderAtHeightRequested, \
+                          BDMINPUTTYPE.AddrBookRequested])
+
+# Passthrough methods that are safe to run on a reader thread
+READONLY_BDM_METHODS = set(['getTopBlockHeight', \
+                            'getTopBlockHeader', \
+                            'getHeaderByHeight', \
+                            'getHeaderByHash', \
+                            'getHeaderPtrForTx', \
+                            'getTxByHash', \
+                            'getPrevTx', \
+                            'getSenderScrAddr', \
+                            'getSentValue', \
+                            'getMainBlockFromDB', \
+                            'hasTxWithHash', \
+                            'hasHeaderWithHash', \
+                            'scrAddrIsRegistered', \
+                            'numBlocksToRescan', \
+                            'missingBlockHashes', \
+                            'isDirty'])
+
+# Requests that can keep the BDM thread busy for minutes.  While one of these
+# runs, the reader threads answer what they can from the read snapshot
+LONG_RUNNING_BDMINPUTS = set([BDMINPUTTYPE.RescanRequested, \
+                              BDMINPUTTYPE.WalletRecoveryScan, \
+                              BDMINPUTTYPE.UpdateWallets, \
+                              BDMINPUTTYPE.GoOnlineRequested, \
+                              BDMINPUTTYPE.ForceRebuild])
+
+BDM_READ_SNAPSHOT_SIZE = 10000
+
+def isReadOnlyBDMRequest(cmd, args):
+   if cmd in READONLY_BDMINPUTS:
+      return True
+   elif cmd == BDMINPUTTYPE.Passthrough:
+      return args[0] in READONLY_BDM_METHODS
+   elif cmd == BDMINPUTTYPE.BatchRequested:
+      return all([call[0] in READONLY_BDM_METHODS for call in args[0]])
+   return False
+
+# The output a caller gets (or a batch slot holds) when its request raised
+# an error on the BDM thread
+BDM_REQUEST_ERROR = 'BDM_REQUEST_ERROR'
+
+def isBDMRequestError(output):
+   return isinstance(output, str) and output==BDM_REQUEST_ERROR
+
 def newTheBDM(isOffline=False, blocking=False):
    global TheBDM
    TheBDM = BlockDataManagerThread(isOffline=isOffline, blocking=blocking)
    
 
+################################################################################
+class BDMRequest(object):
+   """
+   The caller's handle on one request sitting in the BDM input queue.  The
+   BDM thread hands the output to the BDMRequest with the same ID, so any
+   number of threads can have requests in flight without picking up each
+   other's results, and a caller that gives up waiting doesn't leave a
+   stray entry behind for the next caller to find.
+   """
+   def __init__(self, rndID, expectOutput=True):
+      self.rndID        = rndID
+      self.expectOutput = expectOutput
+      self.output       = None
+      self.finished     = threading.Event()
+
+   #############################################################################
+   def setOutput(self, output):
+      self.output = output
+      self.finished.set()
+
+   #############################################################################
+   def isFinished(self):
+      return self.finished.isSet()
+
+   #############################################################################
+   def getOutput(self, timeout=None):
+      """
+      Blocks until the BDM thread has processed the request, and raises 
+      Queue.Empty if that doesn't happen within timeout seconds (same as 
+      the Queue.get() call this replaces)
+      """
+      if not self.finished.wait(timeout):
+         raise Queue.Empty
+      return self.output
+
+
+################################################################################
+class BDMReadSnapshot(object):
+   """
+   The outputs of read-only requests made since the BDM last changed.  The
+   C++ BDM can't be read while it is scanning, so while the BDM thread runs
+   one of the LONG_RUNNING_BDMINPUTS, reader threads answer from here: the
+   same answer they would have gotten just before the scan started.  Reads
+   that aren't in the snapshot still wait for the scan.
+
+   Batches are stored call by call, and only requests whose arguments are
+   plain values are kept.  Outputs that are borrowed SWIG pointers (thisown
+   is False) point into the BDM's own memory, which the scan changes, so
+   those aren't kept either.  Anything that modifies the BDM clears it.
+   """
+   NOT_FOUND = object()
+
+   def __init__(self, maxEntries=BDM_READ_SNAPSHOT_SIZE):
+      self.results = LRUCache(maxEntries)
+      self.serving = False
+
+   #############################################################################
+   def getKeys(self, cmd, args):
+      if cmd == BDMINPUTTYPE.BatchRequested:
+         keys = [(BDMINPUTTYPE.Passthrough, name) + tuple(funcArgs) \
+                                             for name,funcArgs in args[0]]
+      elif cmd == BDMINPUTTYPE.AddrBookRequested:
+         return None
+      else:
+         keys = [(cmd,) + tuple(args)]
+
+      for key in keys:
+         for arg in key:
+            if not isinstance(arg, (str, int, long, bool)):
+               return None
+      return keys
+
+   #############################################################################
+   def contains(self, cmd, args):
+      if not self.serving:
+         return False
+      keys = self.getKeys(cmd, args)
+      return keys is not None and all([key in self.results for key in keys])
+
+   #############################################################################
+   def lookup(self, cmd, args):
+      """
+      Returns (True, output) if the request can be answered from the snapshot
+      right now, and (False, None) otherwise
+      """
+      keys = self.getKeys(cmd, args) if self.serving else None
+      if keys is None:
+         return (False, None)
+
+      outputs = []
+      for key in keys:
+         output = self.results.get(key, self.NOT_FOUND)
+         if output is self.NOT_FOUND:
+            return (False, None)
+         outputs.append(output)
+
+      if cmd == BDMINPUTTYPE.BatchRequested:
+         return (True, outputs)
+      return (True, outputs[0])
+
+   #############################################################################
+   def record(self, cmd, args, output):
+      """ Must be called while still holding the cppLock """
+      keys = self.getKeys(cmd, args)
+      if keys is None or isBDMRequestError(output):
+         return
+
+      outputs = output if cmd == BDMINPUTTYPE.BatchRequested else [output]
+      for key,out in zip(keys, outputs):
+         if isBDMRequestError(out) or not getattr(out, 'thisown', True):
+            continue
+         self.results.put(key, out)
+
+   #############################################################################
+   def clear(self):
+      self.results.clear()
+
+
+################################################################################
+class BDMAccessLock(object):
+   """
+   Only one thread at a time may call into the C++ BDM.  The SWIG wrappers
+   release the GIL, and not even lookups are safe to run in parallel:
+   InterfaceToLDB::getValue* keeps what it read in a shared member.  So the
+   reader threads take turns with each other and with the BDM thread, and
+   only answers from the read snapshot happen concurrently.  A waiting BDM
+   thread goes next, so a steady stream of lookups can't hold off a scan.
+   """
+   def __init__(self):
+      self.cond = threading.Condition(threading.Lock())
+      self.locked           = False
+      self.bdmThreadWaiting = False
+
+   #############################################################################
+   def acquireForReader(self, giveUpIf=None):
+      """
+      If giveUpIf is given, it is checked whenever we would have to wait, and
+      if it returns True we stop waiting and return False without the lock
+      """
+      with self.cond:
+         while self.locked or self.bdmThreadWaiting:
+            if giveUpIf and giveUpIf():
+               return False
+            self.cond.wait()
+         self.locked = True
+         return True
+
+   #############################################################################
+   def acquireForBDMThread(self):
+      with self.cond:
+         self.bdmThreadWaiting = True
+         # Waiting readers check giveUpIf again, now that a request started
+         self.cond.notifyAll()
+         while self.locked:
+            self.cond.wait()
+         self.bdmThreadWaiting = False
+         self.locked = True
+
+   #############################################################################
+   def release(self):
+      with self.cond:
+         self.locked = False
+         self.cond.notifyAll()
+
+
 # Make TheBDM act like it's a singleton. Always use the global singleton TheBDM
 # instance that exists in this module regardless of the instance that passed as self
 def ActLikeASingletonBDM(func):
@@ -186,15 +407,29 @@ class BlockDataManagerThread(threading.Thread):
 
       self.bdm = Cpp.BlockDataManager().getBDM()
 
-      # These are for communicating with the master (GUI) thread
-      self.inputQueue  = Queue.Queue()
-      self.outputQueue = Queue.Queue()
+      # These are for communicating with the master (GUI) thread.  Output
+      # goes to the BDMRequest object registered under the request's ID
+      self.inputQueue      = Queue.Queue()
+      self.pendingRequests = {}
+      self.requestLock     = threading.Lock()
+      self.lastRequestID   = 0
+
+      # Read-only requests go here instead, if setConcurrentReaders() was
+      # called.  Every call into the C++ BDM, from any of these threads,
+      # holds cppLock
+      self.readQueue     = None
+      self.readerThreads = []
+      self.cppLock       = BDMAccessLock()
+      self.readSnapshot  = BDMReadSnapshot()
+
+      # Time each request spent queued vs. executing, by request name
+      self.queuedTimes  = {}
+      self.requestStats = {}  # name -> [nCalls, waitSeconds, execSeconds]
 
       # Flags
       self.startBDM      = False
       self.doShutdown    = False
       self.aboutToRescan = False
-      self.errorOut      = 0
 
       self.setBlocking(blocking)
 
@@ -249,13 +484,12 @@ class BlockDataManagerThread(threading.Thread):
       '''
 
       
-      rndID = int(random.uniform(0,100000000)) 
       if not hasattr(self.bdm, name):
          LOGERROR('No BDM method: %s', name)
          raise AttributeError
       else:
          def passthruFunc(*args, **kwargs):
-            #LOGDEBUG('External thread requesting: %s (%d)', name, rndID)
+            #LOGDEBUG('External thread requesting: %s', name)
             waitForReturn = True
             if len(kwargs)>0 and \
                kwargs.has_key('wait') and \
@@ -270,53 +504,348 @@ class BlockDataManagerThread(threading.Thread):
                kwargs['calledFromBDM']:
                   return getattr(self.bdm, name)(*args)
 
-            self.inputQueue.put([BDMINPUTTYPE.Passthrough, rndID, waitForReturn, name] + list(args))
-            
+            request = self.queueRequest(BDMINPUTTYPE.Passthrough, waitForReturn, \
+                                                                  name, *args)
 
             if waitForReturn:
                try:
-                  out = self.outputQueue.get(True, self.mtWaitSec)
+                  out = request.getOutput(self.mtWaitSec)
                   return out
                except Queue.Empty:
                   LOGERROR('BDM was not ready for your request!  Waited %d sec.' % self.mtWaitSec)
                   LOGERROR('  getattr   name: %s', name)
                   LOGERROR('BDM currently doing: %s (%d)', self.currentActivity,self.currentID )
-                  LOGERROR('Waiting for completion: ID= %d', rndID)
+                  LOGERROR('Waiting for completion: ID= %d', request.rndID)
                   LOGERROR('Direct traceback')
                   traceback.print_stack()
-                  self.errorOut += 1
                   LOGEXCEPT('Traceback:')
+                  with self.requestLock:
+                     self.pendingRequests.pop(request.rndID, None)
          return passthruFunc
 
 
    
    #############################################################################
    @ActLikeASingletonBDM
-   def waitForOutputIfNecessary(self, expectOutput, rndID=0):
-      # The get() command will block until the thread puts something there.
+   def queueRequest(self, cmd, expectOutput, *args):
+      """
+      Puts [cmd, rndID, expectOutput, args...] on the input queue, and returns
+      the BDMRequest that the output will be delivered to.  If expectOutput
+      is False, the BDM thread won't report back, and the returned request
+      will never finish.
+      """
+      with self.requestLock:
+         self.lastRequestID += 1
+         request = BDMRequest(self.lastRequestID, expectOutput)
+         if expectOutput:
+            self.pendingRequests[request.rndID] = request
+         self.queuedTimes[request.rndID] = RightNow()
+
+      inputTuple = [cmd, request.rndID, expectOutput] + list(args)
+      if self.readQueue and isReadOnlyBDMRequest(cmd, args):
+         self.readQueue.put(inputTuple)
+      else:
+         self.inputQueue.put(inputTuple)
+      return request
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def setConcurrentReaders(self, nReaders=4):
+      """
+      Starts nReaders threads that take read-only requests (tx and header 
+      lookups, and the passthroughs in READONLY_BDM_METHODS) as soon as they
+      are queued, instead of behind everything else in the BDM queue.  They
+      still call into the C++ BDM one at a time, taking turns with the BDM
+      thread.  During a scan, reads the read snapshot can answer are
+      answered right away, in parallel.  Should be called once, before
+      anything is queued.
+      """
+      if self.readQueue or nReaders<=0:
+         return
+
+      LOGINFO('Starting %d concurrent BDM reader threads', nReaders)
+      self.readQueue = Queue.Queue()
+      for i in range(nReaders):
+         reader = threading.Thread(target=self.__readerLoop, \
+                                   name='BDMReader-%d' % i)
+         reader.setDaemon(True)
+         reader.start()
+         self.readerThreads.append(reader)
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def getRequestStats(self):
+      """
+      Returns {requestName: [nCalls, queueWaitSec, executeSec]} for every
+      request processed so far.  Passthroughs are listed by method name.
+      """
+      with self.requestLock:
+         return dict([(name, list(st)) for name,st in self.requestStats.iteritems()])
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def logRequestStats(self):
+      LOGINFO('BDM request stats (queue wait vs. execution):')
+      for name,(nCall,tWait,tExec) in sorted(self.getRequestStats().iteritems()):
+         LOGINFO('   %-28s %8d calls %10.3f sec waiting %10.3f sec executing', \
+                                                      name, nCall, tWait, tExec)
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def __startRequestTimer(self, rndID):
+      # Called as soon as the request comes off its queue, which is the last
+      # we need of its queuedTimes entry
+      tStart = RightNow()
+      with self.requestLock:
+         tQueued = self.queuedTimes.pop(rndID, tStart)
+      return (tStart - tQueued, tStart)
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def __stopRequestTimer(self, inputTuple, timer):
+      waitSec,tStart = timer
+      execSec = RightNow() - tStart
+
+      cmd = inputTuple[0]
+      if cmd == BDMINPUTTYPE.Passthrough:
+         name = inputTuple[3]
+      else:
+         name = self.getBDMInputName(cmd)
+
+      with self.requestLock:
+         stats = self.requestStats.setdefault(name, [0, 0.0, 0.0])
+         stats[0] += 1
+         stats[1] += waitSec
+         stats[2] += execSec
+
+      if CLI_OPTIONS.mtdebug:
+         LOGDEBUG('BDM request %s (%d): waited %0.3fs, executed in %0.3fs', \
+                                       name, inputTuple[1], waitSec, execSec)
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def __executeReadRequest(self, cmd, args):
+      """
+      Runs the requests that only look things up in the BDM.  This is used by
+      both the reader threads and the BDM thread (which also runs any other
+      passthrough through here)
+      """
+      if cmd == BDMINPUTTYPE.HeaderRequested:
+         rawHeader = self.bdm.getHeaderByHash(args[0])
+         return rawHeader if rawHeader else None
+
+      elif cmd == BDMINPUTTYPE.TxRequested:
+         rawTx = self.bdm.getTxByHash(args[0])
+         return rawTx if rawTx else None
+
+      elif cmd == BDMINPUTTYPE.UnknownHashesRequested:
+         headHashList,txHashList = args[:2]
+         return ([h for h in headHashList if not self.bdm.hasHeaderWithHash(h)], \
+                 [h for h in txHashList   if not self.bdm.hasTxWithHash(h)])
+
+      elif cmd == BDMINPUTTYPE.HeaderAtHeightRequested:
+         rawHeader = self.bdm.getHeaderByHeight(args[0])
+         if not rawHeader:
+            LOGERROR('Requested header does not exist:\nHeight=%s', args[0])
+            return None
+         return rawHeader
+
+      elif cmd == BDMINPUTTYPE.AddrBookRequested:
+         return self.createAddressBook(args[0])
+
+      elif cmd == BDMINPUTTYPE.Passthrough:
+         # If the caller is waiting, then it is notified by output
+         return getattr(self.bdm, args[0])(*args[1:])
+
+      elif cmd == BDMINPUTTYPE.BatchRequested:
+         # One failed call shouldn't cost the caller the whole batch
+         output = []
+         for funcName,funcArgs in args[0]:
+            try:
+               output.append(getattr(self.bdm, funcName)(*funcArgs))
+            except:
+               LOGEXCEPT('Error in batched BDM call: %s', funcName)
+               output.append(BDM_REQUEST_ERROR)
+         return output
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def __readerLoop(self):
+      while True:
+         inputTuple = self.readQueue.get()
+         if inputTuple is None:
+            break
+
+         cmd,rndID,expectOutput = inputTuple[:3]
+         args = inputTuple[3:]
+         timer = self.__startRequestTimer(rndID)
+         try:
+            output = self.__readOrWaitForBDM(cmd, args)
+         except:
+            LOGERROR('Error processing BDM read request')
+            LOGERROR('Received inputTuple: %s %s', self.getBDMInputName(cmd), \
+                                                           str(inputTuple))
+            LOGEXCEPT('ERROR:')
+            output = BDM_REQUEST_ERROR
+         finally:
+            self.__stopRequestTimer(inputTuple, timer)
+
+         if expectOutput:
+            self.__setRequestOutput(rndID, output)
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def __readOrWaitForBDM(self, cmd, args):
+      """
+      Answers from the read snapshot if the BDM thread is in the middle of a
+      long-running request and the snapshot has it.  Otherwise waits for its
+      turn at the C++ BDM and asks it.
+      """
+      snapshot = self.readSnapshot
+      while True:
+         found,output = snapshot.lookup(cmd, args)
+         if found:
+            return output
+
+         # Stop waiting if a scan starts and the snapshot can answer this
+         if self.cppLock.acquireForReader(lambda: snapshot.contains(cmd, args)):
+            try:
+               output = self.__executeReadRequest(cmd, args)
+               snapshot.record(cmd, args, output)
+               return output
+            finally:
+               self.cppLock.release()
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def __setRequestOutput(self, rndID, output):
+      # If the caller already gave up on this one, the output is dropped
+      with self.requestLock:
+         request = self.pendingRequests.pop(rndID, None)
+
+      if request:
+         request.setOutput(output)
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def waitForOutputIfNecessary(self, request):
+      # The get() command will block until the thread processes the request.
       # We don't always expect output, but we use this method to 
       # replace inputQueue.join().  The reason for doing it is so 
       # that we can guarantee that BDM thread knows whether we are waiting
       # for output or not, and any additional requests put on the inputQueue
       # won't extend our wait time for this request
-      if expectOutput:
+      if request and request.expectOutput:
          try:
-            return self.outputQueue.get(True, self.mtWaitSec)
+            return request.getOutput(self.mtWaitSec)
          except Queue.Empty:
             stkOneUp = traceback.extract_stack()[-2]
             filename,method = stkOneUp[0], stkOneUp[1]
             LOGERROR('Waiting for BDM output that didn\'t come after %ds.' % self.mtWaitSec)
             LOGERROR('BDM state is currently: %s', self.getBDMState())
-            LOGERROR('Called from: %s:%d (%d)', os.path.basename(filename), method, rndID)
+            LOGERROR('Called from: %s:%d (%d)', os.path.basename(filename), method, request.rndID)
             LOGERROR('BDM currently doing: %s (%d)', self.currentActivity, self.currentID)
             LOGERROR('Direct traceback')
             traceback.print_stack()
             LOGEXCEPT('Traceback:')
-            self.errorOut += 1
+            with self.requestLock:
+               self.pendingRequests.pop(request.rndID, None)
       else:
          return None
       
       
+   #############################################################################
+   @ActLikeASingletonBDM
+   def batch(self, callList, wait=True):
+      """
+      Runs a whole list of passthrough calls as a single request on the BDM
+      queue, and returns all their outputs in a list, in the same order.
+      Each entry of callList is a tuple (methodName, arg1, arg2, ...):
+
+         cppTx,topHead = TheBDM.batch([('getTxByHash', txHash), 
+                                       ('getTopBlockHeader',)])
+
+      Any call in the batch that raises an error gets 'BDM_REQUEST_ERROR' in
+      its slot.  Returns None if the BDM didn't get to it in time.  With 
+      wait=False, this returns the BDMRequest immediately, and the caller
+      can collect the outputs with request.getOutput(timeout) later.
+      """
+      calls = []
+      for call in callList:
+         if isinstance(call, basestring):
+            call = (call,)
+         if not hasattr(self.bdm, call[0]):
+            LOGERROR('No BDM method: %s', call[0])
+            raise AttributeError
+         calls.append((call[0], tuple(call[1:])))
+
+      request = self.queueRequest(BDMINPUTTYPE.BatchRequested, True, calls)
+      if not wait:
+         return request
+
+      try:
+         return request.getOutput(self.mtWaitSec)
+      except Queue.Empty:
+         LOGERROR('Waited %ds for batch of %d BDM calls.  Abort', \
+                                             self.mtWaitSec, len(calls))
+         LOGERROR('BDM currently doing: %s (%d)', self.currentActivity, \
+                                                          self.currentID)
+         with self.requestLock:
+            self.pendingRequests.pop(request.rndID, None)
+
+      return None
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def batchWithFallback(self, callList):
+      """
+      Same as batch(), but if the batch times out, or some calls in it came
+      back as BDM_REQUEST_ERROR, those calls are retried one at a time as
+      regular passthroughs.  Always returns a list with one entry per call.
+      An entry is None only if its own retry failed too.  Once a retry times
+      out, the BDM is clearly busy, so the rest are set to None without
+      waiting for each of them again.
+      """
+      calls = [(call,) if isinstance(call, basestring) else tuple(call) \
+                                                      for call in callList]
+      output = self.batch(calls)
+      if output is None:
+         output = [BDM_REQUEST_ERROR]*len(calls)
+
+      timedOut = False
+      for i,call in enumerate(calls):
+         if not isBDMRequestError(output[i]):
+            continue
+
+         output[i] = None
+         if timedOut:
+            continue
+
+         request = self.queueRequest(BDMINPUTTYPE.Passthrough, True, *call)
+         try:
+            singleOut = request.getOutput(self.mtWaitSec)
+            if not isBDMRequestError(singleOut):
+               output[i] = singleOut
+         except Queue.Empty:
+            LOGERROR('Waited %ds for BDM call %s.  Abort', self.mtWaitSec, call[0])
+            with self.requestLock:
+               self.pendingRequests.pop(request.rndID, None)
+            timedOut = True
+
+      return output
+
+
    #############################################################################
    @ActLikeASingletonBDM
    def setBlocking(self, doblock=True, newTimeout=MT_WAIT_TIMEOUT_SEC):
@@ -343,9 +872,8 @@ class BlockDataManagerThread(threading.Thread):
       if not wait==False and (self.alwaysBlock or wait==True):
          expectOutput = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.Reset, rndID, expectOutput] )
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      request = self.queueRequest(BDMINPUTTYPE.Reset, expectOutput)
+      return self.waitForOutputIfNecessary(request)
 
    #############################################################################
    @ActLikeASingletonBDM
@@ -433,9 +961,8 @@ class BlockDataManagerThread(threading.Thread):
       if not wait==False and (self.alwaysBlock or wait==True):
          expectOutput = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.Shutdown, rndID, expectOutput])
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      request = self.queueRequest(BDMINPUTTYPE.Shutdown, expectOutput)
+      return self.waitForOutputIfNecessary(request)
 
    #############################################################################
    @ActLikeASingletonBDM
@@ -473,16 +1000,15 @@ class BlockDataManagerThread(threading.Thread):
       if not wait==False and (self.alwaysBlock or wait==True):
          expectOutput = True
 
-      rndID = int(random.uniform(0,100000000)) 
-
+      request = None
       if goOnline:
          if TheBDM.getBDMState() in ('Offline','Uninitialized'):
-            self.inputQueue.put([BDMINPUTTYPE.GoOnlineRequested, rndID, expectOutput])
+            request = self.queueRequest(BDMINPUTTYPE.GoOnlineRequested, expectOutput)
       else:
          if TheBDM.getBDMState() in ('Scanning','BlockchainReady'):
-            self.inputQueue.put([BDMINPUTTYPE.GoOfflineRequested, rndID, expectOutput])
+            request = self.queueRequest(BDMINPUTTYPE.GoOfflineRequested, expectOutput)
 
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      return self.waitForOutputIfNecessary(request)
    
    #############################################################################
    @ActLikeASingletonBDM
@@ -505,9 +1031,8 @@ class BlockDataManagerThread(threading.Thread):
       if not wait==False and (self.alwaysBlock or wait==True):
          expectOutput = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.ReadBlkUpdate, rndID, expectOutput])
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      request = self.queueRequest(BDMINPUTTYPE.ReadBlkUpdate, expectOutput)
+      return self.waitForOutputIfNecessary(request)
       
 
    #############################################################################
@@ -532,10 +1057,9 @@ class BlockDataManagerThread(threading.Thread):
 
       self.aboutToRescan = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.RescanRequested, rndID, expectOutput, scanType])
+      request = self.queueRequest(BDMINPUTTYPE.RescanRequested, expectOutput, scanType)
       LOGINFO('Blockchain rescan requested')
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      return self.waitForOutputIfNecessary(request)
 
 
    #############################################################################
@@ -560,9 +1084,8 @@ class BlockDataManagerThread(threading.Thread):
       if not wait==False and (self.alwaysBlock or wait==True):
          expectOutput = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.UpdateWallets, rndID, expectOutput])
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      request = self.queueRequest(BDMINPUTTYPE.UpdateWallets, expectOutput)
+      return self.waitForOutputIfNecessary(request)
 
 
    #############################################################################
@@ -586,10 +1109,9 @@ class BlockDataManagerThread(threading.Thread):
 
       self.aboutToRescan = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.WalletRecoveryScan, rndID, expectOutput, pywlt])
+      request = self.queueRequest(BDMINPUTTYPE.WalletRecoveryScan, expectOutput, pywlt)
       LOGINFO('Wallet recovery scan requested')
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      return self.waitForOutputIfNecessary(request)
 
 
 
@@ -625,17 +1147,16 @@ class BlockDataManagerThread(threading.Thread):
       #if not self.__checkBDMReadyToServeData():
          #return None
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.TxRequested, rndID, True, txHash])
+      request = self.queueRequest(BDMINPUTTYPE.TxRequested, True, txHash)
 
       try:
-         result = self.outputQueue.get(True, 10)
+         result = request.getOutput(10)
          if result==None:
             LOGERROR('Requested tx does not exist:\n%s', binary_to_hex(txHash))
          return result
       except Queue.Empty:
          LOGERROR('Waited 10s for tx to be returned.  Abort')
-         LOGERROR('ID: getTxByHash (%d)', rndID)
+         LOGERROR('ID: getTxByHash (%d)', request.rndID)
          return None
          #LOGERROR('Going to block until we get something...')
          #return self.outputQueue.get(True)
@@ -653,24 +1174,47 @@ class BlockDataManagerThread(threading.Thread):
       #if not self.__checkBDMReadyToServeData():
          #return None
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.HeaderRequested, rndID, True, headHash])
+      request = self.queueRequest(BDMINPUTTYPE.HeaderRequested, True, headHash)
 
       try:
-         result = self.outputQueue.get(True, 10)
+         result = request.getOutput(10)
          if result==None:
             LOGERROR('Requested header does not exist:\n%s', \
                                           binary_to_hex(headHash))
          return result
       except Queue.Empty:
          LOGERROR('Waited 10s for header to be returned.  Abort')
-         LOGERROR('ID: getTxByHash (%d)', rndID)
+         LOGERROR('ID: getTxByHash (%d)', request.rndID)
          #LOGERROR('Going to block until we get something...')
          #return self.outputQueue.get(True)
 
       return None
 
 
+   ############################################################################
+   @ActLikeASingletonBDM
+   def getUnknownHashes(self, headHashList, txHashList):
+      """
+      Checks a whole batch of header and tx hashes in one trip through the
+      BDM queue.  Returns (unknownHeaderHashes, unknownTxHashes), or None if
+      the BDM didn't answer in time.  The networking code uses this to
+      filter inv messages, which can have hundreds of entries.
+      """
+      request = self.queueRequest(BDMINPUTTYPE.UnknownHashesRequested, True, \
+                                  list(headHashList), list(txHashList))
+
+      try:
+         result = request.getOutput(10)
+         if isBDMRequestError(result):
+            return None
+         return result
+      except Queue.Empty:
+         LOGERROR('Waited 10s for unknown hashes to be returned.  Abort')
+         LOGERROR('ID: getUnknownHashes (%d)', request.rndID)
+
+      return None
+
+
    #############################################################################
    @ActLikeASingletonBDM
    def getBlockByHash(self,headHash):
@@ -685,18 +1229,17 @@ class BlockDataManagerThread(threading.Thread):
       #if not self.__checkBDMReadyToServeData():
          #return None
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.BlockRequested, rndID, True, headHash])
+      request = self.queueRequest(BDMINPUTTYPE.BlockRequested, True, headHash)
 
       try:
-         result = self.outputQueue.get(True, 10)
+         result = request.getOutput(10)
          if result==None:
             LOGERROR('Requested block does not exist:\n%s', \
                                           binary_to_hex(headHash))
          return result
       except Queue.Empty:
          LOGERROR('Waited 10s for block to be returned.  Abort')
-         LOGERROR('ID: getTxByHash (%d)', rndID)
+         LOGERROR('ID: getTxByHash (%d)', request.rndID)
          #LOGERROR('Going to block until we get something...')
          #return self.outputQueue.get(True)
 
@@ -710,18 +1253,19 @@ class BlockDataManagerThread(threading.Thread):
       Address books are constructed from Blockchain data, which means this 
       must be a blocking method.  
       """
-      rndID = int(random.uniform(0,100000000)) 
       if isinstance(wlt, PyBtcWallet):
-         self.inputQueue.put([BDMINPUTTYPE.AddrBookRequested, rndID, True, wlt.cppWallet])
+         request = self.queueRequest(BDMINPUTTYPE.AddrBookRequested, True, wlt.cppWallet)
       elif isinstance(wlt, Cpp.BtcWallet):
-         self.inputQueue.put([BDMINPUTTYPE.AddrBookRequested, rndID, True, wlt])
+         request = self.queueRequest(BDMINPUTTYPE.AddrBookRequested, True, wlt)
+      else:
+         return None
 
       try:
-         result = self.outputQueue.get(True, self.mtWaitSec)
+         result = request.getOutput(self.mtWaitSec)
          return result
       except Queue.Empty:
          LOGERROR('Waited %ds for addrbook to be returned.  Abort' % self.mtWaitSec)
-         LOGERROR('ID: getTxByHash (%d)', rndID)
+         LOGERROR('ID: getTxByHash (%d)', request.rndID)
          #LOGERROR('Going to block until we get something...')
          #return self.outputQueue.get(True)
 
@@ -734,9 +1278,8 @@ class BlockDataManagerThread(threading.Thread):
       if not wait==False and (self.alwaysBlock or wait==True):
          expectOutput = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.ZeroConfTxToInsert, rndID, expectOutput, rawTx, timeRecv])
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      request = self.queueRequest(BDMINPUTTYPE.ZeroConfTxToInsert, expectOutput, rawTx, timeRecv)
+      return self.waitForOutputIfNecessary(request)
       
    #############################################################################
    @ActLikeASingletonBDM
@@ -763,10 +1306,9 @@ class BlockDataManagerThread(threading.Thread):
       if not wait==False and (self.alwaysBlock or wait==True):
          expectOutput = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.RegisterAddr, rndID, expectOutput, scrAddr, True])
+      request = self.queueRequest(BDMINPUTTYPE.RegisterAddr, expectOutput, scrAddr, True)
 
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      return self.waitForOutputIfNecessary(request)
 
 
 
@@ -786,11 +1328,29 @@ class BlockDataManagerThread(threading.Thread):
       if not wait==False and (self.alwaysBlock or wait==True):
          expectOutput = True
 
-      rndID = int(random.uniform(0,100000000)) 
-      self.inputQueue.put([BDMINPUTTYPE.RegisterAddr, rndID, expectOutput, \
-                           scrAddr, [firstTime, firstBlk, lastTime, lastBlk]])
+      request = self.queueRequest(BDMINPUTTYPE.RegisterAddr, expectOutput, \
+                           scrAddr, [firstTime, firstBlk, lastTime, lastBlk])
+
+      return self.waitForOutputIfNecessary(request)
+
+
+   #############################################################################
+   @ActLikeASingletonBDM
+   def registerScrAddrList(self, scrAddrList, isFresh=False, wait=None):
+      """
+      Same as calling registerScrAddr for each scrAddr, but it only costs one
+      trip through the BDM queue.  Use it when creating addresses in bulk
+      """
+      expectOutput = False
+      if not wait==False and (self.alwaysBlock or wait==True):
+         expectOutput = True
+
+      # Same time info registerNewScrAddr/registerImportedScrAddr would use
+      timeInfo = True if isFresh else [UINT32_MAX, UINT32_MAX, 0, 0]
+      request = self.queueRequest(BDMINPUTTYPE.RegisterAddrList, expectOutput, \
+                                                  list(scrAddrList), timeInfo)
 
-      return self.waitForOutputIfNecessary(expectOutput, rndID)
+      return self.waitForOutputIfNecessary(request)
 
          
    #############################################################################
@@ -853,6 +1413,17 @@ class BlockDataManagerThread(threading.Thread):
       self.__registerScrAddrNow(scrAddr, timeInfo)
 
 
+   #############################################################################
+   @ActLikeASingletonBDM
+   def registerScrAddrList_bdm_direct(self, scrAddrList, timeInfo):
+      """ 
+      THIS METHOD IS UNSAFE UNLESS CALLED FROM A METHOD RUNNING IN THE BDM THREAD
+      See registerScrAddr_bdm_direct
+      """
+      for scrAddr in scrAddrList:
+         self.__registerScrAddrNow(scrAddr, timeInfo)
+
+
    #############################################################################
    @ActLikeASingletonBDM
    def scanBlockchainForTx_bdm_direct(self, cppWlt, startBlk=0, endBlk=UINT32_MAX):
@@ -873,6 +1444,15 @@ class BlockDataManagerThread(threading.Thread):
       """
       self.bdm.scanRegisteredTxForWallet(cppWlt, startBlk, endBlk)
 
+   #############################################################################
+   @ActLikeASingletonBDM
+   def getTxByHash_bdm_direct(self, txHash):
+      """ 
+      THIS METHOD IS UNSAFE UNLESS CALLED FROM A METHOD RUNNING IN THE BDM THREAD
+      See getTopBlockHeight_bdm_direct
+      """
+      return self.bdm.getTxByHash(txHash)
+
    #############################################################################
    @ActLikeASingletonBDM
    def getTopBlockHeight_bdm_direct(self):
@@ -1216,6 +1796,14 @@ class BlockDataManagerThread(threading.Thread):
       self.blkMode = BLOCKCHAINMODE.Offline
       self.doShutdown = True
 
+      # Requests still queued now will never be dequeued
+      with self.requestLock:
+         self.queuedTimes.clear()
+
+      if self.readQueue:
+         for reader in self.readerThreads:
+            self.readQueue.put(None)
+
    #############################################################################
    @ActLikeASingletonBDM
    def __fullRebuild(self):
@@ -1358,19 +1946,6 @@ class BlockDataManagerThread(threading.Thread):
       """
 
       while not self.doShutdown:
-         # If there were any errors, we will have that many extra output
-         # entries on the outputQueue.  We clear them off so that this 
-         # thread can be re-sync'd with the main thread
-         try:
-            while self.errorOut>0:
-               self.outputQueue.get_nowait()
-               self.errorOut -= 1
-         except Queue.Empty:
-            LOGERROR('ErrorOut var over-represented number of errors!')
-            self.errorOut = 0
-               
-
-         # Now start the main 
          try:
             try:
                inputTuple = self.inputQueue.get_nowait()
@@ -1410,122 +1985,115 @@ class BlockDataManagerThread(threading.Thread):
             self.currentActivity = self.getBDMInputName(inputTuple[0])
             self.currentID = rndID
 
-            if cmd == BDMINPUTTYPE.RegisterAddr:
-               scrAddr,timeInfo = inputTuple[3:]
-               self.__registerScrAddrNow(scrAddr, timeInfo)
-
-            elif cmd == BDMINPUTTYPE.ZeroConfTxToInsert:
-               rawTx  = inputTuple[3]
-               timeIn = inputTuple[4]
-               if isinstance(rawTx, PyTx):
-                  rawTx = rawTx.serialize()
-               self.bdm.addNewZeroConfTx(rawTx, timeIn, True)
+            # Nobody else calls into the BDM while we do.  During a
+            # long-running request, readers use the snapshot of the state
+            # before it started
+            timer = self.__startRequestTimer(rndID)
+            isReadOnly = isReadOnlyBDMRequest(cmd, inputTuple[3:])
+            if cmd in LONG_RUNNING_BDMINPUTS:
+               self.readSnapshot.serving = True
+            self.cppLock.acquireForBDMThread()
+            try:
+               if cmd == BDMINPUTTYPE.RegisterAddr:
+                  scrAddr,timeInfo = inputTuple[3:]
+                  self.__registerScrAddrNow(scrAddr, timeInfo)
+
+               elif cmd == BDMINPUTTYPE.RegisterAddrList:
+                  scrAddrList,timeInfo = inputTuple[3:]
+                  for scrAddr in scrAddrList:
+                     self.__registerScrAddrNow(scrAddr, timeInfo)
+
+               elif cmd == BDMINPUTTYPE.ZeroConfTxToInsert:
+                  rawTx  = inputTuple[3]
+                  timeIn = inputTuple[4]
+                  if isinstance(rawTx, PyTx):
+                     rawTx = rawTx.serialize()
+                  self.bdm.addNewZeroConfTx(rawTx, timeIn, True)
                
-            elif cmd == BDMINPUTTYPE.HeaderRequested:
-               headHash = inputTuple[3]
-               rawHeader = self.bdm.getHeaderByHash(headHash)
-               if rawHeader:
-                  output = rawHeader
-               else:
-                  output = None
-
-            elif cmd == BDMINPUTTYPE.TxRequested:
-               txHash = inputTuple[3] 
-               rawTx = self.bdm.getTxByHash(txHash)
-               if rawTx:
-                  output = rawTx
-               else:
-                  output = None
+               elif cmd in READONLY_BDMINPUTS:
+                  output = self.__executeReadRequest(cmd, inputTuple[3:])
                   
-            elif cmd == BDMINPUTTYPE.BlockRequested:
-               headHash = inputTuple[3] 
-               rawBlock = self.__getFullBlock(headHash)
-               if rawBlock:
-                  output = rawBlock
-               else:
-                  output = None
-                  LOGERROR('Requested header does not exist:\n%s', \
-                                             binary_to_hex(headHash))
-
-            elif cmd == BDMINPUTTYPE.HeaderAtHeightRequested:
-               height = inputTuple[3] 
-               rawHeader = self.bdm.getHeaderByHeight(height)
-               if rawHeader:
-                  output = rawHeader
-               else:
-                  output = None
-                  LOGERROR('Requested header does not exist:\nHeight=%s', height)
-         
-            elif cmd == BDMINPUTTYPE.BlockAtHeightRequested:
-               height = inputTuple[3] 
-               rawBlock = self.__getFullBlock(height)
-               if rawBlock:
-                  output = rawBlock
-               else:
-                  output = None
-                  LOGERROR('Requested header does not exist:\nHeight=%s', height)
-
-            elif cmd == BDMINPUTTYPE.AddrBookRequested:
-               cppWlt = inputTuple[3] 
-               output = self.createAddressBook(cppWlt)
-                                             
-            elif cmd == BDMINPUTTYPE.UpdateWallets:
-               self.__updateWalletsAfterScan()
-
-            elif cmd == BDMINPUTTYPE.RescanRequested:
-               scanType = inputTuple[3]
-               if not scanType in ('AsNeeded', 'ForceRescan', 'ForceRebuild'):
-                  LOGERROR('Invalid scan type for rescanning: ' + scanType)
-                  scanType = 'AsNeeded'
-               self.__startRescanBlockchain(scanType)
-
-            elif cmd == BDMINPUTTYPE.WalletRecoveryScan:
-               LOGINFO('Wallet Recovery Scan Requested')
-               pywlt = inputTuple[3]
-               self.__startRecoveryRescan(pywlt)
-               
-            elif cmd == BDMINPUTTYPE.ReadBlkUpdate:
-               output = self.__readBlockfileUpdates()
-
-            elif cmd == BDMINPUTTYPE.Passthrough:
-               # If the caller is waiting, then it is notified by output
-               funcName = inputTuple[3]
-               funcArgs = inputTuple[4:]
-               output = getattr(self.bdm, funcName)(*funcArgs)
-
-            elif cmd == BDMINPUTTYPE.Shutdown:
-               LOGINFO('Shutdown Requested')
-               self.__shutdown()
-
-            elif cmd == BDMINPUTTYPE.ForceRebuild:
-               LOGINFO('Rebuild databases requested')
-               self.__fullRebuild()
-
-            elif cmd == BDMINPUTTYPE.Reset:
-               LOGINFO('Reset Requested')
-               self.__reset()
+               elif cmd == BDMINPUTTYPE.BlockRequested:
+                  headHash = inputTuple[3] 
+                  rawBlock = self.__getFullBlock(headHash)
+                  if rawBlock:
+                     output = rawBlock
+                  else:
+                     output = None
+                     LOGERROR('Requested header does not exist:\n%s', \
+                                                binary_to_hex(headHash))
+
+               elif cmd == BDMINPUTTYPE.BlockAtHeightRequested:
+                  height = inputTuple[3] 
+                  rawBlock = self.__getFullBlock(height)
+                  if rawBlock:
+                     output = rawBlock
+                  else:
+                     output = None
+                     LOGERROR('Requested header does not exist:\nHeight=%s', height)
+
+               elif cmd == BDMINPUTTYPE.UpdateWallets:
+                  self.__updateWalletsAfterScan()
+
+               elif cmd == BDMINPUTTYPE.RescanRequested:
+                  scanType = inputTuple[3]
+                  if not scanType in ('AsNeeded', 'ForceRescan', 'ForceRebuild'):
+                     LOGERROR('Invalid scan type for rescanning: ' + scanType)
+                     scanType = 'AsNeeded'
+                  self.__startRescanBlockchain(scanType)
+
+               elif cmd == BDMINPUTTYPE.WalletRecoveryScan:
+                  LOGINFO('Wallet Recovery Scan Requested')
+                  pywlt = inputTuple[3]
+                  self.__startRecoveryRescan(pywlt)
                
-            elif cmd == BDMINPUTTYPE.GoOnlineRequested:
-               LOGINFO('Go online requested')
-               # This only sets the blkMode to what will later be
-               # recognized as online-requested, or offline
-               self.prefMode = BLOCKCHAINMODE.Full
-               if self.bdm.isInitialized():
-                  # The BDM was started and stopped at one point, without
-                  # being reset.  It can safely pick up from where it 
-                  # left off
-                  self.__readBlockfileUpdates()
-               else:
-                  self.blkMode = BLOCKCHAINMODE.Uninitialized
-                  self.__startLoadBlockchain()
+               elif cmd == BDMINPUTTYPE.ReadBlkUpdate:
+                  output = self.__readBlockfileUpdates()
+
+               elif cmd in (BDMINPUTTYPE.Passthrough, BDMINPUTTYPE.BatchRequested):
+                  # Same as the reader threads, except these may modify the BDM
+                  output = self.__executeReadRequest(cmd, inputTuple[3:])
 
-            elif cmd == BDMINPUTTYPE.GoOfflineRequested:
-               LOGINFO('Go offline requested')
-               self.prefMode = BLOCKCHAINMODE.Offline
+               elif cmd == BDMINPUTTYPE.Shutdown:
+                  LOGINFO('Shutdown Requested')
+                  self.__shutdown()
+
+               elif cmd == BDMINPUTTYPE.ForceRebuild:
+                  LOGINFO('Rebuild databases requested')
+                  self.__fullRebuild()
+
+               elif cmd == BDMINPUTTYPE.Reset:
+                  LOGINFO('Reset Requested')
+                  self.__reset()
+               
+               elif cmd == BDMINPUTTYPE.GoOnlineRequested:
+                  LOGINFO('Go online requested')
+                  # This only sets the blkMode to what will later be
+                  # recognized as online-requested, or offline
+                  self.prefMode = BLOCKCHAINMODE.Full
+                  if self.bdm.isInitialized():
+                     # The BDM was started and stopped at one point, without
+                     # being reset.  It can safely pick up from where it 
+                     # left off
+                     self.__readBlockfileUpdates()
+                  else:
+                     self.blkMode = BLOCKCHAINMODE.Uninitialized
+                     self.__startLoadBlockchain()
+
+               elif cmd == BDMINPUTTYPE.GoOfflineRequested:
+                  LOGINFO('Go offline requested')
+                  self.prefMode = BLOCKCHAINMODE.Offline
+            finally:
+               # The snapshot is out of date once the BDM has changed
+               if not isReadOnly:
+                  self.readSnapshot.clear()
+               self.readSnapshot.serving = False
+               self.cppLock.release()
+               self.__stopRequestTimer(inputTuple, timer)
 
             self.inputQueue.task_done()
             if expectOutput:
-               self.outputQueue.put(output)
+               self.__setRequestOutput(rndID, output)
 
          except Queue.Empty:
             continue
@@ -1537,7 +2105,7 @@ class BlockDataManagerThread(threading.Thread):
             LOGERROR('Error processing ID (%d)', rndID)
             LOGEXCEPT('ERROR:')
             if expectOutput:
-               self.outputQueue.put('BDM_REQUEST_ERROR')
+               self.__setRequestOutput(rndID, BDM_REQUEST_ERROR)
             self.inputQueue.task_done()
             continue
            
@@ -1572,6 +2140,7 @@ else:
    LOGINFO('inclusion after the current scan is completed.')
    TheBDM = BlockDataManagerThread(isOffline=False, blocking=False)
    TheBDM.setDaemon(True)
+   TheBDM.setConcurrentReaders(CLI_OPTIONS.bdmReaders)
    TheBDM.start()
 
    #if CLI_OPTIONS.doDebug or CLI_OPTIONS.netlog or CLI_OPTIONS.mtdebug:
@@ -14,10 +14,83 @@
 ################################################################################
 from armoryengine.ArmoryUtils import LITTLEENDIAN, int_to_binary, packVarInt
 UINT8, UINT16, UINT32, UINT64, INT8, INT16, INT32, INT64, VAR_INT, VAR_STR, FLOAT, BINARY_CHUNK = range(12)
-from struct import pack, unpack
+from struct import pack, unpack, Struct
 
 class PackerError(Exception): pass
 
+# Struct format characters for every fixed-width type.  VAR_INT, VAR_STR and
+# BINARY_CHUNK are variable-width and are handled separately by the
+# packer/unpacker.
+FIXED_WIDTH_FORMATS = { UINT8:  'B', UINT16: 'H', UINT32: 'I', UINT64: 'Q',
+                        INT8:   'b', INT16:  'h', INT32:  'i', INT64:  'q',
+                        FLOAT:  'f' }
+
+# Compiling a format string is far more expensive than using it, so we keep
+# one Struct object per (endianness, varType) and reuse it forever.
+PRECOMPILED_STRUCTS = {}
+
+def getPrecompiledStruct(varType, endianness=LITTLEENDIAN):
+   """
+   Returns the cached struct.Struct for a fixed-width type, or None if the
+   type is variable-width (or not a known type at all).
+   """
+   key = (endianness, varType)
+   st = PRECOMPILED_STRUCTS.get(key)
+   if st is None:
+      fmtChar = FIXED_WIDTH_FORMATS.get(varType)
+      if fmtChar is None:
+         return None
+      st = Struct(endianness + fmtChar)
+      PRECOMPILED_STRUCTS[key] = st
+   return st
+
+################################################################################
+# A put_many() schema is a sequence of entries, each either a bare varType or
+# a (varType, width) pair.  Runs of fixed-width entries -- the numeric types,
+# plus BINARY_CHUNKs given an explicit width -- are merged into a single Struct
+# so that the whole run is written with one pack_into() call.
+COMPILED_SCHEMAS = {}
+
+def compileSchema(schema, endianness=LITTLEENDIAN):
+   """
+   Returns a list of (firstIndex, nEntries, st, extra) segments.  For a run of
+   fixed-width entries st is the merged Struct and extra lists the
+   (index, width) of each fixed-width BINARY_CHUNK in the run, so that
+   oversized data can still be rejected.  For a variable-width entry st is
+   None and extra is its (varType, width).
+   """
+   key = (endianness, schema)
+   segments = COMPILED_SCHEMAS.get(key)
+   if segments is not None:
+      return segments
+
+   segments = []
+   run = {'first': 0, 'fmt': [], 'chunks': []}
+
+   def closeRun():
+      if run['fmt']:
+         st = Struct(endianness + ''.join(run['fmt']))
+         segments.append((run['first'], len(run['fmt']), st, run['chunks']))
+      run['fmt'], run['chunks'] = [], []
+
+   for i,entry in enumerate(schema):
+      varType, width = entry if isinstance(entry, tuple) else (entry, None)
+      if not run['fmt']:
+         run['first'] = i
+      if varType in FIXED_WIDTH_FORMATS:
+         run['fmt'].append(FIXED_WIDTH_FORMATS[varType])
+      elif varType == BINARY_CHUNK and width is not None:
+         run['fmt'].append('%ds' % width)
+         run['chunks'].append((i, width))
+      else:
+         closeRun()
+         segments.append((i, 1, None, (varType, width)))
+   closeRun()
+
+   COMPILED_SCHEMAS[key] = segments
+   return segments
+
+
 class BinaryPacker(object):
 
    """
@@ -28,20 +101,51 @@ class BinaryPacker(object):
       >> bup.put(BINARY_CHUNK, '\x9f'*10)
       >> ...etc...
       >> result = bup.getBinaryString()
+
+   Data is written in place into a preallocated bytearray that doubles when it
+   runs out of room, so the size is always known and nothing is re-joined
+   until getBinaryString() is called.  If you know roughly how big the output
+   will be, pass it as sizeHint to avoid the reallocations entirely.
+   Fixed-width fields that always appear together can be written in one
+   shot with put_many().
    """
-   def __init__(self):
-      self.binaryConcat = []
+   def __init__(self, sizeHint=64):
+      self.binaryConcat = bytearray(max(sizeHint, 1))
+      self.size = 0
 
    def getSize(self):
-      return sum([len(a) for a in self.binaryConcat])
+      return self.size
 
    def getBinaryString(self):
-      return ''.join(self.binaryConcat)
+      return str(buffer(self.binaryConcat, 0, self.size))
 
    def __str__(self):
       return self.getBinaryString()
 
+   #############################################################################
+   def reserve(self, nBytes):
+      """ Make sure there is room for nBytes more without reallocating """
+      needed = self.size + nBytes
+      capacity = len(self.binaryConcat)
+      if needed > capacity:
+         while capacity < needed:
+            capacity *= 2
+         self.binaryConcat.extend('\x00' * (capacity - len(self.binaryConcat)))
+
+   #############################################################################
+   def putBinary(self, theData):
+      n = len(theData)
+      self.reserve(n)
+      self.binaryConcat[self.size:self.size+n] = theData
+      self.size += n
+
+   #############################################################################
+   def putStruct(self, st, *values):
+      self.reserve(st.size)
+      st.pack_into(self.binaryConcat, self.size, *values)
+      self.size += st.size
 
+   #############################################################################
    def put(self, varType, theData, width=None, endianness=LITTLEENDIAN):
       """
       Need to supply the argument type you are put'ing into the stream.
@@ -49,38 +153,49 @@ class BinaryPacker(object):
 
       Use width=X to include padding of BINARY_CHUNKs w/ 0x00 bytes
       """
-      E = endianness
-      if   varType == UINT8:
-         self.binaryConcat += int_to_binary(theData, 1, endianness)
-      elif varType == UINT16:
-         self.binaryConcat += int_to_binary(theData, 2, endianness)
-      elif varType == UINT32:
-         self.binaryConcat += int_to_binary(theData, 4, endianness)
-      elif varType == UINT64:
-         self.binaryConcat += int_to_binary(theData, 8, endianness)
-      elif varType == INT8:
-         self.binaryConcat += pack(E+'b', theData)
-      elif varType == INT16:
-         self.binaryConcat += pack(E+'h', theData)
-      elif varType == INT32:
-         self.binaryConcat += pack(E+'i', theData)
-      elif varType == INT64:
-         self.binaryConcat += pack(E+'q', theData)
+      st = getPrecompiledStruct(varType, endianness)
+      if st is not None:
+         self.putStruct(st, theData)
       elif varType == VAR_INT:
-         self.binaryConcat += packVarInt(theData)[0]
+         self.putBinary(packVarInt(theData)[0])
       elif varType == VAR_STR:
-         self.binaryConcat += packVarInt(len(theData))[0]
-         self.binaryConcat += theData
-      elif varType == FLOAT:
-         self.binaryConcat += pack(E+'f', theData)
+         self.putBinary(packVarInt(len(theData))[0])
+         self.putBinary(theData)
       elif varType == BINARY_CHUNK:
          if width==None:
-            self.binaryConcat += theData
+            self.putBinary(theData)
          else:
             if len(theData)>width:
                raise PackerError, 'Too much data to fit into fixed width field'
-            self.binaryConcat += theData.ljust(width, '\x00')
+            self.putBinary(theData.ljust(width, '\x00'))
       else:
          raise PackerError, "Var type not recognized!  VarType="+str(varType)
 
+   #############################################################################
+   def put_many(self, schema, values, endianness=LITTLEENDIAN):
+      """
+      Batch version of put().  The schema is a sequence of varTypes (or
+      (varType, width) pairs for fixed-width BINARY_CHUNKs), and values is
+      the matching sequence of data:
+
+         >> bp.put_many([UINT32, (BINARY_CHUNK,32), VAR_STR, UINT64],
+                        [version, txHash, script, value])
+
+      Consecutive fixed-width entries are packed with a single precompiled
+      struct, which is where nearly all the savings come from.
+      """
+      schema = tuple(schema)
+      if not len(schema)==len(values):
+         raise PackerError, 'Schema has %d entries but %d values were given' % \
+                            (len(schema), len(values))
+
+      for first,nEntries,st,extra in compileSchema(schema, endianness):
+         if st is None:
+            varType, width = extra
+            self.put(varType, values[first], width, endianness)
+         else:
+            for i,width in extra:
+               if len(values[i])>width:
+                  raise PackerError, 'Too much data to fit into fixed width field'
+            self.putStruct(st, *values[first:first+nEntries])
 
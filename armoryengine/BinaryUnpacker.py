@@ -22,11 +22,19 @@
 ################################################################################
 ################################################################################
 from struct import pack, unpack
-from BinaryPacker import UINT8, UINT16, UINT32, UINT64, INT8, INT16, INT32, INT64, VAR_INT, VAR_STR, FLOAT, BINARY_CHUNK
+from BinaryPacker import UINT8, UINT16, UINT32, UINT64, INT8, INT16, INT32, INT64, VAR_INT, VAR_STR, FLOAT, BINARY_CHUNK, \
+                         getPrecompiledStruct
 from armoryengine.ArmoryUtils import LITTLEENDIAN, unpackVarInt, LOGERROR
 
 class UnpackerError(Exception): pass
 
+# Readers for the varint prefix.  These are always little-endian regardless
+# of the endianness requested for the surrounding fields.
+VARINT_PREFIX = getPrecompiledStruct(UINT8)
+VARINT_READERS = { 0xfd: getPrecompiledStruct(UINT16),
+                   0xfe: getPrecompiledStruct(UINT32),
+                   0xff: getPrecompiledStruct(UINT64) }
+
 # Seed this object with binary data, then read in its pieces sequentially
 class BinaryUnpacker(object):
    """
@@ -36,95 +44,110 @@ class BinaryUnpacker(object):
       >> int64   = bup.get(VAR_INT)
       >> bytes10 = bup.get(BINARY_CHUNK, 10)
       >> ...etc...
+
+   The data can be a str, buffer, bytearray or memoryview.  Nothing is
+   copied on construction:  fixed-width fields are read in place with
+   precompiled struct objects (unpack_from at the current offset), and only
+   BINARY_CHUNK/VAR_STR fields produce new strings, since that is what the
+   callers hold on to.
    """
    def __init__(self, binaryStr):
       self.binaryStr = binaryStr
+      self.size = len(binaryStr)
       self.pos = 0
 
-   def getSize(self): return len(self.binaryStr)
-   def getRemainingSize(self): return len(self.binaryStr) - self.pos
-   def getBinaryString(self): return self.binaryStr
-   def getRemainingString(self): return self.binaryStr[self.pos:]
-   def append(self, binaryStr): self.binaryStr += binaryStr
+   def getSize(self): return self.size
+   def getRemainingSize(self): return self.size - self.pos
+   def getBinaryString(self): return self.getSlice(0, self.size)
+   def getRemainingString(self): return self.getSlice(self.pos, self.size)
    def advance(self, bytesToAdvance): self.pos += bytesToAdvance
    def rewind(self, bytesToRewind): self.pos -= bytesToRewind
    def resetPosition(self, toPos=0): self.pos = toPos
    def getPosition(self): return self.pos
 
+   #############################################################################
+   def append(self, binaryStr):
+      self.binaryStr = self.getBinaryString() + str(binaryStr)
+      self.size = len(self.binaryStr)
+
+   #############################################################################
+   def getSlice(self, startPos, endPos):
+      """ Always returns a str, whatever the underlying data type is """
+      piece = self.binaryStr[startPos:endPos]
+      if isinstance(piece, str):
+         return piece
+      elif isinstance(piece, memoryview):
+         return piece.tobytes()
+      return str(piece)
+
+   #############################################################################
+   def getRemainingBuffer(self):
+      """
+      Zero-copy view of the unread data.  Use this instead of
+      getRemainingString() when the result is only going to be handed to
+      another parser or hash function.
+      """
+      if isinstance(self.binaryStr, memoryview):
+         return self.binaryStr[self.pos:]
+      return buffer(self.binaryStr, self.pos)
+
+   #############################################################################
+   def sizeCheck(self, sz):
+      if self.size - self.pos < sz:
+         raise UnpackerError
+
+   #############################################################################
+   def getVarInt(self, sz=0, endianness=LITTLEENDIAN):
+      self.sizeCheck(1)
+      pos = self.pos
+      code = VARINT_PREFIX.unpack_from(self.binaryStr, pos)[0]
+      if code < 0xfd:
+         self.pos = pos + 1
+         return code
+      reader = VARINT_READERS[code]
+      self.sizeCheck(1 + reader.size)
+      value = reader.unpack_from(self.binaryStr, pos+1)[0]
+      self.pos = pos + 1 + reader.size
+      return value
+
+   #############################################################################
+   def getVarStr(self, sz=0, endianness=LITTLEENDIAN):
+      strLen = self.getVarInt()
+      pos = self.pos
+      self.pos = pos + strLen
+      return self.getSlice(pos, pos + strLen)
+
+   #############################################################################
+   def getBinaryChunk(self, sz=0, endianness=LITTLEENDIAN):
+      self.sizeCheck(sz)
+      pos = self.pos
+      self.pos = pos + sz
+      return self.getSlice(pos, pos + sz)
+
+   #############################################################################
    def get(self, varType, sz=0, endianness=LITTLEENDIAN):
       """
       First argument is the data-type:  UINT32, VAR_INT, etc.
       If BINARY_CHUNK, need to supply a number of bytes to read, as well
       """
-      def sizeCheck(sz):
-         if self.getRemainingSize()<sz:
+      st = getPrecompiledStruct(varType, endianness)
+      if st is not None:
+         pos = self.pos
+         if self.size - pos < st.size:
             raise UnpackerError
+         self.pos = pos + st.size
+         return st.unpack_from(self.binaryStr, pos)[0]
 
-      E = endianness
-      pos = self.pos
-      if varType == UINT32:
-         sizeCheck(4)
-         value = unpack(E+'I', self.binaryStr[pos:pos+4])[0]
-         self.advance(4)
-         return value
-      elif varType == UINT64:
-         sizeCheck(8)
-         value = unpack(E+'Q', self.binaryStr[pos:pos+8])[0]
-         self.advance(8)
-         return value
-      elif varType == UINT8:
-         sizeCheck(1)
-         value = unpack(E+'B', self.binaryStr[pos:pos+1])[0]
-         self.advance(1)
-         return value
-      elif varType == UINT16:
-         sizeCheck(2)
-         value = unpack(E+'H', self.binaryStr[pos:pos+2])[0]
-         self.advance(2)
-         return value
-      elif varType == INT32:
-         sizeCheck(4)
-         value = unpack(E+'i', self.binaryStr[pos:pos+4])[0]
-         self.advance(4)
-         return value
-      elif varType == INT64:
-         sizeCheck(8)
-         value = unpack(E+'q', self.binaryStr[pos:pos+8])[0]
-         self.advance(8)
-         return value
-      elif varType == INT8:
-         sizeCheck(1)
-         value = unpack(E+'b', self.binaryStr[pos:pos+1])[0]
-         self.advance(1)
-         return value
-      elif varType == INT16:
-         sizeCheck(2)
-         value = unpack(E+'h', self.binaryStr[pos:pos+2])[0]
-         self.advance(2)
-         return value
-      elif varType == VAR_INT:
-         sizeCheck(1)
-         [value, nBytes] = unpackVarInt(self.binaryStr[pos:pos+9])
-         self.advance(nBytes)
-         return value
-      elif varType == VAR_STR:
-         sizeCheck(1)
-         [value, nBytes] = unpackVarInt(self.binaryStr[pos:pos+9])
-         binOut = self.binaryStr[pos+nBytes:pos+nBytes+value]
-         self.advance(nBytes+value)
-         return binOut
-      elif varType == FLOAT:
-         sizeCheck(4)
-         value = unpack(E+'f', self.binaryStr[pos:pos+4])[0]
-         self.advance(4)
-         return value
-      elif varType == BINARY_CHUNK:
-         sizeCheck(sz)
-         binOut = self.binaryStr[pos:pos+sz]
-         self.advance(sz)
-         return binOut
+      getter = VARIABLE_WIDTH_GETTERS.get(varType)
+      if getter is not None:
+         return getter(self, sz, endianness)
 
       LOGERROR('Var Type not recognized!  VarType = %d', varType)
       raise UnpackerError, "Var type not recognized!  VarType="+str(varType)
 
-################################################################################
+
+# Dispatch table for the types that getPrecompiledStruct can't handle
+VARIABLE_WIDTH_GETTERS = { VAR_INT:      BinaryUnpacker.getVarInt.im_func,
+                           VAR_STR:      BinaryUnpacker.getVarStr.im_func,
+                           BINARY_CHUNK: BinaryUnpacker.getBinaryChunk.im_func }
+
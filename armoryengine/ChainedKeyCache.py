@@ -0,0 +1,431 @@
+################################################################################
+#                                                                              #
+# Copyright (C) 2011-2014, Armory Technologies, Inc.                           #
+# Distributed under the GNU Affero General Public License (AGPL v3)            #
+# See LICENSE or http://www.gnu.org/licenses/agpl.html                         #
+#                                                                              #
+################################################################################
+################################################################################
+#
+# ChainedKeyCache
+#
+#   Precomputed public-key chains for watching-only wallets, locked wallets
+#   and wallet recovery.  Armory key chaining is strictly sequential: key N+1
+#   is key N multiplied by hash256(key N) XOR chaincode, so a single chain can
+#   never be split across CPUs.  What can be split is the paranoia:
+#   safeExtendPublicKey computes every link twice and compares the results.
+#   Here each chunk is derived once, and the second computation of every link
+#   (which only needs the two keys it connects) is farmed out to a thread
+#   pool while the next chunk is being derived.  The CryptoECDSA calls
+#   release the GIL, so threads use every core, and nothing has to start a
+#   new process from inside ArmoryQt or armoryd.
+#
+#   Verified keys are appended to a cache file next to the wallet, so wallet
+#   restores and repeated freshImportFindHighestIndex scans only ever derive
+#   each key once.  The file contains nothing but public keys -- the same
+#   information a watching-only copy of the wallet holds.  The checksums only
+#   catch damaged records, so keys read back from the file are recomputed
+#   link by link (in parallel, links are independent) before they are used.
+#   Each link is only recomputed once per cache object.
+#
+#   File format, one record per chained key after the anchor:
+#
+#      PubKey65 | Checksum4 (hash256)
+#
+################################################################################
+import multiprocessing
+import os
+from multiprocessing.pool import ThreadPool
+
+from armoryengine.ArmoryUtils import LOGINFO, LOGWARN, LOGCRIT, LOGEXCEPT, \
+   MULT_LOG_FILE, KeyDataError, RightNow, binary_to_hex, hash256, \
+   computeChecksum, emptyFunc
+from armoryengine.PyBtcAddress import PyBtcAddress
+from CppBlockUtils import SecureBinaryData, CryptoECDSA
+
+
+CHAINCACHE_CHUNK   = 500
+CHAINCACHE_RECSIZE = 65 + 4
+
+# Below this many links, starting worker threads costs more than it saves
+CHAINCACHE_MIN_PARALLEL = 64
+
+
+################################################################################
+def getDefaultNumThreads():
+   # Leave one core for the thread deriving the chain
+   try:
+      return max(multiprocessing.cpu_count()-1, 1)
+   except NotImplementedError:
+      return 1
+
+
+################################################################################
+def getChainCachePath(cacheDir, anchorPub, chaincode):
+   anchorPub = SecureBinaryData(anchorPub).toBinStr()
+   chaincode = SecureBinaryData(chaincode).toBinStr()
+   chainID = binary_to_hex(hash256(anchorPub + chaincode)[:8])
+   return os.path.join(cacheDir, 'chain_%s.bin' % chainID)
+
+
+################################################################################
+def verifyChainLinks(linkList):
+   """
+   Recompute each link and compare it to the expected key.  This runs in the
+   worker threads, and only takes and returns plain strings:
+
+      linkList = [(fromPub65, chaincode32, depth, toPub65), ...]
+
+   Returns one bool per link.
+   """
+   out = []
+   for fromPub,chaincode,depth,toPub in linkList:
+      chn = SecureBinaryData(chaincode)
+      pub = SecureBinaryData(fromPub)
+      for i in range(depth):
+         pub = CryptoECDSA().ComputeChainedPublicKey(pub, chn)
+      out.append(pub.toBinStr()==toPub)
+   return out
+
+
+################################################################################
+def splitLinkList(linkList, numSlices):
+   sliceSize = max((len(linkList) + numSlices - 1) / numSlices, 1)
+   return [linkList[i:i+sliceSize] for i in range(0, len(linkList), sliceSize)]
+
+
+################################################################################
+def openWorkerPool(numThreads):
+   """
+   Returns None if a pool is not worth it or can't be started, in which
+   case callers verify in the calling thread.
+   """
+   if numThreads < 2:
+      return None
+   try:
+      return ThreadPool(numThreads)
+   except:
+      LOGEXCEPT('Could not start key-chain worker threads')
+      return None
+
+
+################################################################################
+def PyVerifyChainLinks(linkList, numThreads=None):
+   """
+   Parallel version of verifyChainLinks, for checking many independent links
+   at once (such as every address entry of a wallet being recovered).
+   """
+   if numThreads is None:
+      numThreads = getDefaultNumThreads()
+
+   pool = None
+   if len(linkList) >= CHAINCACHE_MIN_PARALLEL:
+      pool = openWorkerPool(numThreads)
+
+   if pool is None:
+      return verifyChainLinks(linkList)
+
+   try:
+      results = pool.map(verifyChainLinks, splitLinkList(linkList, numThreads*4))
+   finally:
+      pool.close()
+      pool.join()
+
+   return [ok for sliceResult in results for ok in sliceResult]
+
+
+
+################################################################################
+class ChainedKeyCache(object):
+   """
+   The public-key chain starting at anchorPub, with anchorPub at anchorIndex.
+   For a wallet the anchor is the root address, so getPubKey(i) is the key
+   of chainIndex i.  Keys derived here pass the double computation before
+   they are handed out or written to disk.  Keys read from the cache file
+   have only been checksummed:  isVerified[i] says whether the link into
+   pubKeys[i] has been recomputed, and getPubKey and getPubKeyRange recompute
+   every link they rely on before handing out a key.  Every link up to
+   verifiedTop has been recomputed, so those are never looked at again.
+   """
+
+   #############################################################################
+   def __init__(self, anchorPub, chaincode, anchorIndex=-1, cacheDir=None,
+                                                           numThreads=None):
+      self.anchorPub   = SecureBinaryData(anchorPub).toBinStr()
+      self.chaincode   = SecureBinaryData(chaincode).toBinStr()
+      self.anchorIndex = anchorIndex
+      self.numThreads  = getDefaultNumThreads() if numThreads is None                                                 else numThreads
+      self.chunkSize   = CHAINCACHE_CHUNK
+      self.pubKeys     = []
+      self.isVerified  = []
+      self.verifiedTop = anchorIndex
+
+      self.cachePath = None
+      if cacheDir:
+         self.cachePath = getChainCachePath(cacheDir, self.anchorPub,
+                                                      self.chaincode)
+         self.readCacheFile()
+
+
+   #############################################################################
+   def getTopIndex(self):
+      return self.anchorIndex + len(self.pubKeys)
+
+
+   #############################################################################
+   def getPubKeyStr(self, chainIndex):
+      """ No extending and no checks, chainIndex must be in the chain """
+      if chainIndex==self.anchorIndex:
+         return self.anchorPub
+      return self.pubKeys[chainIndex - self.anchorIndex - 1]
+
+
+   #############################################################################
+   def getPubKey(self, chainIndex):
+      """ Returns the chained key as SecureBinaryData, extending if needed """
+      self.verifyCachedLinks(self.anchorIndex, chainIndex)
+      self.extendTo(chainIndex)
+      return SecureBinaryData(self.getPubKeyStr(chainIndex))
+
+
+   #############################################################################
+   def getPubKeyRange(self, firstIndex, count, prevPub=None):
+      """
+      Keys firstIndex through firstIndex+count-1.  Cached keys are checked
+      from the anchor, unless the caller already has key firstIndex-1 (the
+      last address of a wallet, say) and passes it as prevPub:  then they are
+      only checked from there.  With prevPub, returns None if the chain
+      doesn't reach firstIndex-1 yet or has a different key there, rather
+      than derive the whole chain up to it.
+      """
+      fromIndex = self.anchorIndex
+      if prevPub is not None:
+         fromIndex = firstIndex - 1
+         if fromIndex > self.getTopIndex() or not \
+            self.getPubKeyStr(fromIndex)==SecureBinaryData(prevPub).toBinStr():
+            return None
+
+      lastIndex = firstIndex + count - 1
+      self.verifyCachedLinks(fromIndex, lastIndex)
+      self.extendTo(lastIndex)
+      start = firstIndex - self.anchorIndex - 1
+      return [SecureBinaryData(p) for p in self.pubKeys[start:start+count]]
+
+
+   #############################################################################
+   def verifyCachedLinks(self, fromIndex, toIndex):
+      """
+      Recompute each link from key fromIndex, which the caller trusts, to key
+      toIndex that came from the cache file and hasn't been checked yet.  At
+      the first bad link the chain is cut, and extendTo derives it again.
+      """
+      links, linkIndices = [], []
+      fromIndex = max(fromIndex, self.verifiedTop)
+      for i in range(fromIndex+1, min(toIndex, self.getTopIndex())+1):
+         if not self.isVerified[i - self.anchorIndex - 1]:
+            links.append((self.getPubKeyStr(i-1), self.chaincode, 1, \
+                          self.getPubKeyStr(i)))
+            linkIndices.append(i)
+
+      if len(links)==0:
+         return
+
+      for i,ok in zip(linkIndices, PyVerifyChainLinks(links, self.numThreads)):
+         if not ok:
+            LOGWARN('Bad link to chain index %d in key-chain cache %s, ' \
+                    'truncating', i, self.cachePath)
+            self.truncate(i)
+            break
+         self.isVerified[i - self.anchorIndex - 1] = True
+
+      self.advanceVerifiedTop()
+
+
+   #############################################################################
+   def advanceVerifiedTop(self):
+      while self.verifiedTop < self.getTopIndex() and \
+            self.isVerified[self.verifiedTop - self.anchorIndex]:
+         self.verifiedTop += 1
+
+
+   #############################################################################
+   def truncate(self, chainIndex):
+      """ Drop keys from chainIndex on, in memory and in the cache file """
+      keep = max(chainIndex - self.anchorIndex - 1, 0)
+      self.pubKeys = self.pubKeys[:keep]
+      self.isVerified = self.isVerified[:keep]
+      self.verifiedTop = min(self.verifiedTop, self.getTopIndex())
+      if self.cachePath:
+         self.rewriteCacheFile()
+
+
+   #############################################################################
+   def readCacheFile(self):
+      if not os.path.exists(self.cachePath):
+         return
+
+      with open(self.cachePath, 'rb') as f:
+         data = f.read()
+
+      pubKeys = []
+      for pos in range(0, len(data) - CHAINCACHE_RECSIZE + 1, CHAINCACHE_RECSIZE):
+         pub = data[pos:pos+65]
+         if not computeChecksum(pub)==data[pos+65:pos+CHAINCACHE_RECSIZE]:
+            LOGWARN('Bad record %d in key-chain cache %s, truncating', \
+                                          len(pubKeys), self.cachePath)
+            break
+         pubKeys.append(pub)
+
+      self.pubKeys = pubKeys
+      self.isVerified = [False]*len(pubKeys)
+      if not len(data)==len(pubKeys)*CHAINCACHE_RECSIZE:
+         self.rewriteCacheFile()
+
+
+   #############################################################################
+   def rewriteCacheFile(self):
+      try:
+         with open(self.cachePath, 'wb') as f:
+            f.write(''.join([p + computeChecksum(p) for p in self.pubKeys]))
+      except IOError:
+         LOGEXCEPT('Could not rewrite key-chain cache %s', self.cachePath)
+
+
+   #############################################################################
+   def appendToCacheFile(self, pubList):
+      # The cache can always be regenerated, no need to fsync
+      if not self.cachePath:
+         return
+      try:
+         cacheDir = os.path.dirname(self.cachePath)
+         if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+         with open(self.cachePath, 'ab') as f:
+            f.write(''.join([p + computeChecksum(p) for p in pubList]))
+      except (IOError, OSError):
+         LOGEXCEPT('Could not write key-chain cache %s', self.cachePath)
+         self.cachePath = None
+
+
+   #############################################################################
+   def deriveChunk(self, fromPub, count):
+      """
+      Single-computation derivation, the second computation happens in
+      verifyChainLinks.  Returns the new keys and their multipliers.
+      """
+      chn = SecureBinaryData(self.chaincode)
+      pub = SecureBinaryData(fromPub)
+      pubList, multList = [], []
+      for i in range(count):
+         logMult = SecureBinaryData()
+         pub = CryptoECDSA().ComputeChainedPublicKey(pub, chn, logMult)
+         pubList.append(pub.toBinStr())
+         multList.append(logMult.toHexStr())
+      return pubList, multList
+
+
+   #############################################################################
+   def verifyLinksAsync(self, pool, links):
+      """
+      Start verifying a chunk, returns a function that blocks until the
+      results are in.  Without a pool the work is done right away.
+      """
+      if pool is None:
+         verified = verifyChainLinks(links)
+         return lambda: verified
+
+      results = [pool.apply_async(verifyChainLinks, [linkSlice]) \
+                  for linkSlice in splitLinkList(links, self.numThreads)]
+      return lambda: [ok for r in results for ok in r.get()]
+
+
+   #############################################################################
+   def commitChunk(self, fromPub, pubList, multList, getVerified):
+      verified = getVerified()
+      if not all(verified):
+         LOGCRIT('Chaining failed!  Computed keys are different!')
+         LOGCRIT('   First bad link at chain index %d', \
+                  self.getTopIndex() + 1 + verified.index(False))
+         return False
+
+      # Same multiplier log safeExtendPublicKey writes, one open per chunk
+      prevList = [fromPub] + pubList[:-1]
+      with open(MULT_LOG_FILE, 'a') as f:
+         f.write(''.join(['PubChain (pkh, mult): %s,%s\n' % \
+                  (binary_to_hex(SecureBinaryData(prev).getHash160()), mult) \
+                  for prev,mult in zip(prevList, multList)]))
+
+      self.pubKeys.extend(pubList)
+      self.isVerified.extend([True]*len(pubList))
+      self.advanceVerifiedTop()
+      self.appendToCacheFile(pubList)
+      return True
+
+
+   #############################################################################
+   def extendSafely(self, chainIndex):
+      """ The old one-key-at-a-time path, used if a chunk fails to verify """
+      chn = SecureBinaryData(self.chaincode)
+      extender = PyBtcAddress()
+      while self.getTopIndex() < chainIndex:
+         lastPub = SecureBinaryData(self.pubKeys[-1] if self.pubKeys \
+                                                     else self.anchorPub)
+         newPub = extender.safeExtendPublicKey(lastPub, chn)
+         if newPub.getSize()==0:
+            raise KeyDataError('Could not extend public key chain')
+         self.pubKeys.append(newPub.toBinStr())
+         self.isVerified.append(True)
+         self.advanceVerifiedTop()
+         self.appendToCacheFile([self.pubKeys[-1]])
+
+
+   #############################################################################
+   def extendTo(self, chainIndex, Progress=emptyFunc):
+      """
+      Make sure every key up to and including chainIndex is available.
+      Chunk N is verified by the worker pool while chunk N+1 is derived
+      here; a chunk is only committed once its verification comes back.
+      """
+      if chainIndex <= self.getTopIndex():
+         return
+
+      tstart = RightNow()
+      numNew = chainIndex - self.getTopIndex()
+      pool = None
+      if numNew >= CHAINCACHE_MIN_PARALLEL:
+         pool = openWorkerPool(self.numThreads)
+
+      try:
+         pending = None
+         lastPub = self.pubKeys[-1] if self.pubKeys else self.anchorPub
+         numDone = 0
+         while numDone < numNew:
+            count = min(self.chunkSize, numNew - numDone)
+            pubList,multList = self.deriveChunk(lastPub, count)
+            links = [(prev, self.chaincode, 1, pub) for prev,pub in \
+                                       zip([lastPub] + pubList[:-1], pubList)]
+            getVerified = self.verifyLinksAsync(pool, links)
+
+            if pending and not self.commitChunk(*pending):
+               pending = None
+               break
+
+            pending = [lastPub, pubList, multList, getVerified]
+            lastPub = pubList[-1]
+            numDone += count
+            Progress(numDone, numNew)
+
+         if pending:
+            self.commitChunk(*pending)
+      finally:
+         if pool is not None:
+            pool.close()
+            pool.join()
+
+      if self.getTopIndex() < chainIndex:
+         # Something didn't verify, fall back to the slow, paranoid path
+         self.extendSafely(chainIndex)
+
+      tElapsed = RightNow() - tstart
+      LOGINFO('Derived %d chained public keys in %0.2f sec (%0.1f keys/sec)', \
+               numNew, tElapsed, numNew/max(tElapsed,1e-6))
@@ -57,6 +57,7 @@
 #
 ################################################################################
 ################################################################################
+import bisect
 import math
 import random
 
@@ -404,26 +405,43 @@ def getSelectCoinsScores(utxoSelectList, targetOutVal, minFee):
           indirectly available with the current set of factors here
    """
 
-   # Need to calculate how much the change will be returned to sender on this tx
    totalIn = sum([utxo.getValue() for utxo in utxoSelectList])
-   totalChange = totalIn - (targetOutVal+minFee)
-
-   # Abort if this is an empty list (negative score) or not enough coins
    if len(utxoSelectList)==0 or totalIn<targetOutVal+minFee:
       return -1
 
-
    ##################
    # -- Does this selection include any zero-confirmation tx?
    # -- How many addresses are linked together by this tx?
    addrSet = set()
    noZeroConf = 1
+   prioritySum = 0
    for utxo in utxoSelectList:
       
       addrSet.add(script_to_scrAddr(utxo.getScript()))
       if utxo.getNumConfirm() == 0:
          noZeroConf = 0
-   numAddr = len(addrSet)
+      else:
+         prioritySum += utxo.getValue() * utxo.getNumConfirm()
+
+   return getSelectCoinsScoresFromStats(totalIn, len(utxoSelectList),
+               len(addrSet), noZeroConf, prioritySum, targetOutVal, minFee)
+
+
+################################################################################
+def getSelectCoinsScoresFromStats(totalIn, numInputs, numAddr, noZeroConf,
+                                  prioritySum, targetOutVal, minFee):
+   """
+   The part of getSelectCoinsScores() that doesn't need the UTXO list itself,
+   only a few sums over it.  PyCoinSelector keeps those sums as running
+   totals so that it can score a selection without walking it.
+   """
+   # Need to calculate how much the change will be returned to sender on this tx
+   totalChange = totalIn - (targetOutVal+minFee)
+
+   # Abort if this is an empty list (negative score) or not enough coins
+   if numInputs==0 or totalIn<targetOutVal+minFee:
+      return -1
+
    numAddrFactor = 4.0/(numAddr+1)**2  # values in the range (0, 1]
 
 
@@ -486,7 +504,7 @@ def getSelectCoinsScores(utxoSelectList, targetOutVal, minFee):
    # Tx size:  we don't have signatures yet, but we assume that each txin is
    #           about 180 Bytes, TxOuts are 35, and 10 other bytes in the Tx
    numBytes  =  10
-   numBytes += 180 * len(utxoSelectList)
+   numBytes += 180 * numInputs
    numBytes +=  35 * (1 if totalChange==0 else 2)
    txSizeFactor = 0
    numKb = int(numBytes / 1000)
@@ -500,15 +518,7 @@ def getSelectCoinsScores(utxoSelectList, targetOutVal, minFee):
    #            then we might be allowed a free tx.  But, if its priority
    #            isn't much above this thresh, it might take a couple blocks
    #            to be included
-   dPriority = 0
-   anyZeroConfirm = False
-   for utxo in utxoSelectList:
-      if utxo.getNumConfirm() == 0:
-         anyZeroConfirm = True
-      else:
-         dPriority += utxo.getValue() * utxo.getNumConfirm()
-
-   dPriority = dPriority / numBytes
+   dPriority = prioritySum / numBytes
    priorityThresh = ONE_BTC * 144 / 250
    if dPriority < priorityThresh:
       priorityFactor = 0
@@ -590,6 +600,12 @@ def PyEvalCoinSelect(utxoSelectList, targetOutVal, minFee, weights=WEIGHTS):
    "balanced", etc).
    """
    scores = getSelectCoinsScores(utxoSelectList, targetOutVal, minFee)
+   return PyEvalCoinSelectScores(scores, minFee, weights)
+
+
+################################################################################
+def PyEvalCoinSelectScores(scores, minFee, weights=WEIGHTS):
+   """ Apply the weightings to scores from getSelectCoinsScores() """
    if scores==-1:
       return -1
 
@@ -612,11 +628,30 @@ def PyEvalCoinSelect(utxoSelectList, targetOutVal, minFee, weights=WEIGHTS):
 # https://bitcointalk.org/index.php?topic=92496.msg1126310#msg1126310 contains a
 # description (possibly out-of-date?) of how this function works.
 @TimeThisFunction
-def PySelectCoins(unspentTxOutInfo, targetOutVal, minFee=0, numRand=10, margin=CENT):
+def PySelectCoins(unspentTxOutInfo, targetOutVal, minFee=0, numRand=10,
+                                             margin=CENT, timeLimit=None):
    """
    Intense algorithm for coin selection:  computes about 30 different ways to
    select coins based on the desired target output and the min tx fee.  Then
    ranks the various solutions and picks the best one
+
+   The work is done by PyCoinSelector, which picks the same coins as
+   PySelectCoinsBruteForce but in a fraction of the time on large wallets.
+   If timeLimit (seconds) is given, no new sortings are tried once it has
+   passed, and the best selection found so far is used.
+   """
+   selector = PyCoinSelector(unspentTxOutInfo)
+   return selector.select(targetOutVal, minFee, numRand, margin, timeLimit)
+
+
+################################################################################
+@TimeThisFunction
+def PySelectCoinsBruteForce(unspentTxOutInfo, targetOutVal, minFee=0,
+                                                  numRand=10, margin=CENT):
+   """
+   The original implementation of PySelectCoins:  every sorting re-sorts the
+   UTXO objects, every strategy walks them, and every candidate selection is
+   scored by walking it again.  Kept as the reference for PyCoinSelector.
    """
 
    if sum([u.getValue() for u in unspentTxOutInfo]) < targetOutVal:
@@ -713,6 +748,412 @@ def PySelectCoins(unspentTxOutInfo, targetOutVal, minFee=0, numRand=10, margin=C
             break
    return finalSelection
 
+################################################################################
+class CoinSortPrefixSums(object):
+   """
+   Running totals over one sorting of a PyCoinSelector's arrays:  value,
+   priority, zero-conf count and number of distinct addresses for each prefix
+   of the sorting.  Selections rarely need more than the first few UTXOs of
+   a sorting, so the totals are only extended as far as a search asks for.
+   """
+
+   #############################################################################
+   def __init__(self, selector, order):
+      self.selector = selector
+      self.order    = order
+      self.cumVal   = []
+      self.cumPri   = []
+      self.cumZC    = []
+      self.cumAddr  = []
+      self.seenAddr = set()
+      self.rank     = None
+
+   #############################################################################
+   def __len__(self):
+      return len(self.order)
+
+   #############################################################################
+   def extend(self, length):
+      """ Make sure cumVal covers the first length entries of the sorting """
+      length = min(length, len(self.order))
+      start = len(self.cumVal)
+      if length <= start:
+         return
+
+      values = self.selector.values
+      sumVal = self.cumVal[-1] if start else 0
+      appendVal = self.cumVal.append
+      for i in self.order[start:length]:
+         sumVal += values[i]
+         appendVal(sumVal)
+
+   #############################################################################
+   def extendStats(self, length):
+      """ Same for the totals only needed to score a selection """
+      self.extend(length)
+      length = min(length, len(self.order))
+      start = len(self.cumPri)
+      if length <= start:
+         return
+
+      sel = self.selector
+      priority,isZC,groupIDs = sel.priority, sel.isZeroConf, sel.groupIDs
+      sumPri = self.cumPri[-1] if start else 0
+      numZC  = self.cumZC[-1]  if start else 0
+      seenAddr = self.seenAddr
+      for i in self.order[start:length]:
+         sumPri += priority[i]
+         numZC  += isZC[i]
+         seenAddr.add(groupIDs[i])
+         self.cumPri.append(sumPri)
+         self.cumZC.append(numZC)
+         self.cumAddr.append(len(seenAddr))
+
+   #############################################################################
+   def searchSum(self, target):
+      """ Index of the first prefix summing to >= target, len(self) if none """
+      length = max(len(self.cumVal), 16)
+      while (len(self.cumVal)==0 or self.cumVal[-1] < target) and \
+                                   len(self.cumVal) < len(self.order):
+         self.extend(length)
+         length *= 2
+      return bisect.bisect_left(self.cumVal, target)
+
+   #############################################################################
+   def firstInOrder(self, idxList):
+      """ Which of these UTXO indices the sorting reaches first """
+      if len(idxList) == 1:
+         return idxList[0]
+      if self.rank is None:
+         self.rank = [0]*len(self.order)
+         for pos,i in enumerate(self.order):
+            self.rank[i] = pos
+      return min(idxList, key=self.rank.__getitem__)
+
+
+################################################################################
+class PyCoinSelector(object):
+   """
+   Coin selection over a UTXO list loaded once into parallel arrays.
+
+   PySelectCoinsBruteForce spends nearly all of its time re-sorting UTXO
+   objects with per-element lambdas, walking them for each strategy, and
+   walking every candidate again to score it.  Here each sorting is a
+   permutation of indices into the arrays, and every selection strategy
+   produces either a single UTXO or a prefix of a sorting.  With prefix sums
+   of value, priority, zero-conf count and distinct-address count kept per
+   sorting (CoinSortPrefixSums), the strategies become bisect searches and
+   each candidate is scored from those sums through
+   getSelectCoinsScoresFromStats(), without building it.
+
+   The candidates are generated and compared in the same order as the brute
+   force version, with the same tie-breaking, so both pick the same coins
+   (including the random sortings, which consume the random module the same
+   way).
+   """
+
+   #############################################################################
+   def __init__(self, unspentTxOutInfo):
+      self.utxoList = list(unspentTxOutInfo)
+      self.values   = [u.getValue() for u in self.utxoList]
+      self.confs    = [u.getNumConfirm() for u in self.utxoList]
+      self.scripts  = [u.getScript() for u in self.utxoList]
+      self.totalValue = sum(self.values)
+      self.priority   = [v*c for v,c in zip(self.values, self.confs)]
+      self.isZeroConf = [1 if c==0 else 0 for c in self.confs]
+
+      # Address-group ID of each UTXO, this is what the scoring links on
+      groupMap = {}
+      self.groupIDs = []
+      for script in self.scripts:
+         scrAddr = script_to_scrAddr(script)
+         self.groupIDs.append(groupMap.setdefault(scrAddr, len(groupMap)))
+
+      # All UTXOs by value, for the single-input strategies.  Equal values
+      # end up next to each other, so ties are a contiguous slice
+      n = len(self.utxoList)
+      self.byValue = sorted(range(n), key=self.values.__getitem__)
+      self.sortedValues = [self.values[i] for i in self.byValue]
+
+      self.sortCache = {}
+
+
+   #############################################################################
+   def getSortOrder(self, sortMethod):
+      """
+      Same as PySortCoins(), but returns a list of indices into the arrays.
+      Deterministic sortings are cached, the random ones (8 and 9) are not.
+      """
+      if sortMethod in self.sortCache:
+         return self.sortCache[sortMethod]
+
+      values,confs = self.values,self.confs
+      n = len(values)
+      if sortMethod==0:
+         keys = self.priority
+      elif sortMethod==1:
+         keys = [(values[i] * confs[i])**(1/3.) for i in xrange(n)]
+      elif sortMethod==2:
+         keys = [(math.log(values[i]*confs[i]+1)+4)**4 for i in xrange(n)]
+      elif sortMethod==3:
+         keys = [values[i] if confs[i]>0 else 0 for i in xrange(n)]
+      elif sortMethod==4:
+         keys = None
+         order = self.__groupedSortOrder()
+      elif sortMethod in (5, 6, 7):
+         keys = None
+         order = list(self.getSortOrder(1))
+         if n > 0:
+            rot = (sortMethod-4) % n
+            order = order[rot:] + order[:rot]
+      elif sortMethod==8:
+         order = [i for i in xrange(n) if confs[i]!=0]
+         random.shuffle(order)
+         order.extend([i for i in xrange(n) if confs[i]==0])
+         return order
+      elif sortMethod==9:
+         order = list(self.getSortOrder(1))
+         sz = len([i for i in order if confs[i]!=0])
+         # swap 1/3 of the values at random
+         topsz = int(min(max(round(sz/3), 5), sz))
+         for i in range(topsz):
+            pick1 = int(random.uniform(0,topsz))
+            pick2 = int(random.uniform(0,sz-topsz))
+            order[pick1], order[pick2] = order[pick2], order[pick1]
+         return order
+      else:
+         raise ValueError('Unknown sort method: %s' % sortMethod)
+
+      if keys is not None:
+         order = sorted(range(n), key=keys.__getitem__, reverse=True)
+
+      self.sortCache[sortMethod] = order
+      return order
+
+   #############################################################################
+   def __groupedSortOrder(self):
+      # Built exactly like PySortCoins method 4, dict and all, so that groups
+      # with equal priority come out in the same order
+      addrMap = {}
+      zeroConfirm = []
+      for i,script in enumerate(self.scripts):
+         if self.confs[i] == 0:
+            zeroConfirm.append(i)
+         else:
+            scrType = getTxOutScriptType(script)
+            if scrType in CPP_TXOUT_HAS_ADDRSTR:
+               addr = script_to_addrStr(script)
+            else:
+               addr = script_to_scrAddr(script)
+
+            if not addrMap.has_key(addr):
+               addrMap[addr] = [i]
+            else:
+               addrMap[addr].append(i)
+
+      priority = [self.confs[i]*self.values[i]**0.333 \
+                                    for i in xrange(len(self.values))]
+      for addr,idxList in addrMap.iteritems():
+         idxList.sort(key=priority.__getitem__, reverse=True)
+
+      priorityGrp = lambda a: max([priority[i] for i in a])
+      order = []
+      for idxList in sorted(addrMap.values(), key=priorityGrp, reverse=True):
+         order.extend(idxList)
+
+      order.extend(zeroConfirm)
+      return order
+
+
+   #############################################################################
+   # Each strategy mirrors the PySelectCoins_* function of the same name, but
+   # returns a candidate:  ('single', utxoIdx), ('prefix', prefixSums, length)
+   # or None for an empty selection
+   #############################################################################
+   def singleInputSingleValue(self, prefix, targetOutVal, minFee=0):
+      # Note: the CENT-change retry in the original never takes effect, so
+      # this is simply the smallest UTXO that covers the target
+      target = targetOutVal + minFee
+      lo = bisect.bisect_left(self.sortedValues, target)
+      if lo == len(self.sortedValues):
+         return None
+      hi = bisect.bisect_right(self.sortedValues, self.sortedValues[lo], lo)
+      return ('single', prefix.firstInOrder(self.byValue[lo:hi]))
+
+   #############################################################################
+   def multiInputSingleValue(self, prefix, targetOutVal, minFee=0):
+      k = prefix.searchSum(targetOutVal + minFee)
+      return ('prefix', prefix, min(k+1, len(prefix)))
+
+   #############################################################################
+   def singleInputDoubleValue(self, prefix, targetOutVal, minFee=0):
+      idealTarget    = 2*targetOutVal + minFee
+      minTarget   = long(0.75 * idealTarget)
+      minTarget   = max(minTarget, targetOutVal+minFee)
+      maxTarget   = long(1.25 * idealTarget)
+
+      if self.totalValue < minTarget:
+         return None
+
+      vals = self.sortedValues
+      lo = bisect.bisect_left(vals, minTarget)
+      hi = bisect.bisect_right(vals, maxTarget, lo)
+      if lo >= hi:
+         return None
+
+      # The closest values lie on either side of the ideal target, and the
+      # ones at exactly the best distance are contiguous runs next to it
+      mid = bisect.bisect_left(vals, idealTarget, lo, hi)
+      bestMatch = min([abs(vals[j]-idealTarget) for j in (mid-1, mid) \
+                                                   if lo <= j < hi])
+      left = right = mid
+      while left > lo and abs(vals[left-1]-idealTarget) == bestMatch:
+         left -= 1
+      while right < hi and abs(vals[right]-idealTarget) == bestMatch:
+         right += 1
+      return ('single', prefix.firstInOrder(self.byValue[left:right]))
+
+   #############################################################################
+   def multiInputDoubleValue(self, prefix, targetOutVal, minFee=0):
+      idealTarget = 2.0 * targetOutVal
+      minTarget   = long(0.80 * idealTarget)
+      minTarget   = max(minTarget, targetOutVal+minFee)
+      if self.totalValue < minTarget:
+         return None
+
+      # The original walks the sorting until the sum is past minTarget and
+      # starts moving away from the ideal target.  While the sum is still
+      # below the ideal it can only be getting closer, so start the walk at
+      # whichever of the two is reached last
+      k = max(prefix.searchSum(minTarget), prefix.searchSum(idealTarget))
+      cumVal = prefix.cumVal
+      while k < len(prefix):
+         prefix.extend(k+1)
+         lastDiff = abs(cumVal[k-1] - idealTarget) if k>0 else 2**64-1
+         if abs(cumVal[k] - idealTarget) > lastDiff:
+            return ('prefix', prefix, k)
+         k += 1
+      return ('prefix', prefix, len(prefix))
+
+
+   #############################################################################
+   def scoreCandidate(self, cand, targetOutVal, minFee):
+      if cand is None:
+         return -1
+
+      if cand[0] == 'single':
+         i = cand[1]
+         noZC = 0 if self.confs[i]==0 else 1
+         scores = getSelectCoinsScoresFromStats(self.values[i], 1, 1, noZC,
+                  self.values[i]*self.confs[i], targetOutVal, minFee)
+      else:
+         prefix,k = cand[1], cand[2]-1
+         if k < 0:
+            return -1
+         prefix.extendStats(k+1)
+         noZC = 0 if prefix.cumZC[k]>0 else 1
+         scores = getSelectCoinsScoresFromStats(prefix.cumVal[k], k+1,
+                     prefix.cumAddr[k], noZC, prefix.cumPri[k],
+                     targetOutVal, minFee)
+      return PyEvalCoinSelectScores(scores, minFee)
+
+   #############################################################################
+   def candidateToIndices(self, cand):
+      if cand is None:
+         return []
+      elif cand[0] == 'single':
+         return [cand[1]]
+      else:
+         return list(cand[1].order[:cand[2]])
+
+
+   #############################################################################
+   def select(self, targetOutVal, minFee=0, numRand=10, margin=CENT,
+                                                       timeLimit=None):
+      if self.totalValue < targetOutVal:
+         return []
+
+      targExact  = targetOutVal
+      targMargin = targetOutVal+margin
+      deadline = None if timeLimit is None else RightNow() + timeLimit
+
+      best = [None, None]
+      def consider(cand):
+         score = self.scoreCandidate(cand, targetOutVal, minFee)
+         if best[1] is None or score > best[1]:
+            best[0],best[1] = cand,score
+
+      sortMethods = [(m,1) for m in range(8)] + \
+                    [(m,numRand) for m in range(8,10)]
+      timedOut = False
+      for sortMethod,nRepeat in sortMethods:
+         for i in range(nRepeat):
+            if deadline is not None and best[1] is not None and \
+                                        RightNow() > deadline:
+               timedOut = True
+               break
+
+            prefix = CoinSortPrefixSums(self, self.getSortOrder(sortMethod))
+            if sortMethod < 8:
+               consider(self.singleInputSingleValue(prefix, targExact,  minFee))
+               consider(self.multiInputSingleValue( prefix, targExact,  minFee))
+               consider(self.singleInputSingleValue(prefix, targMargin, minFee))
+               consider(self.multiInputSingleValue( prefix, targMargin, minFee))
+               consider(self.singleInputDoubleValue(prefix, targExact,  minFee))
+               consider(self.multiInputDoubleValue( prefix, targExact,  minFee))
+               consider(self.singleInputDoubleValue(prefix, targMargin, minFee))
+               consider(self.multiInputDoubleValue( prefix, targMargin, minFee))
+            else:
+               consider(self.multiInputSingleValue( prefix, targExact,  minFee))
+               consider(self.multiInputDoubleValue( prefix, targExact,  minFee))
+               consider(self.multiInputSingleValue( prefix, targMargin, minFee))
+               consider(self.multiInputDoubleValue( prefix, targMargin, minFee))
+         if timedOut:
+            LOGWARN('Coin selection hit its %0.2fs time limit', timeLimit)
+            break
+
+      finalIdx = self.candidateToIndices(best[0])
+      if len(finalIdx)==0:
+         return []
+
+      # Same clean-up of tiny same-address outputs as PySelectCoinsBruteForce
+      SCORES = getSelectCoinsScores([self.utxoList[i] for i in finalIdx],
+                                                     targetOutVal, minFee)
+      IDEAL_NUM_INPUTS = 5
+      if len(finalIdx) < IDEAL_NUM_INPUTS and \
+             SCORES[IDX_OUTANONYM] == 0:
+
+         utxos = self.utxoList
+         getUtxoID = lambda a: a.getTxHash() + int_to_binary(a.getTxOutIndex())
+         priority = self.priority
+
+         alreadyUsedAddr = set([utxos[i].getRecipientScrAddr() \
+                                                    for i in finalIdx])
+         finalSelectIDs = set([getUtxoID(utxos[i]) for i in finalIdx])
+         for i in sorted(range(len(utxos)), key=priority.__getitem__):
+            # Skip it if it is already selected
+            if getUtxoID(utxos[i]) in finalSelectIDs:
+               continue
+
+            # We only consider UTXOs that won't link any new addresses together
+            if not utxos[i].getRecipientScrAddr() in alreadyUsedAddr:
+               continue
+
+            # Avoid zero-conf inputs altogether
+            if self.confs[i] == 0:
+               continue
+
+            # Don't consider any inputs that are high priority already
+            if priority[i] > ONE_BTC*144:
+               continue
+
+            finalIdx.append(i)
+            if len(finalIdx)>=IDEAL_NUM_INPUTS:
+               break
+
+      return [self.utxoList[i] for i in finalIdx]
+
+
 ################################################################################
 def calcMinSuggestedFeesHackMS(selectCoinsResult, targetOutVal, preSelectedFee, 
                                                          numRecipients):
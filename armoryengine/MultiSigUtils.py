@@ -57,6 +57,10 @@ PROMIDSIZE = 4
 LBPREFIX, LBSUFFIX = 'Lockbox[Bare:', ']'
 LBP2SHPREFIX = 'Lockbox['
 
+# Version, magic, create date, name, description, M, N
+LOCKBOX_HEADER_SCHEMA = [UINT32, BINARY_CHUNK, UINT64, VAR_STR, VAR_STR,
+                         UINT8, UINT8]
+
 ################################################################################
 def calcLockboxID(script=None, scraddr=None):
    # ScrAddr is "Script/Address" and for multisig it is 0xfe followed by
@@ -101,12 +105,13 @@ def readLockboxEntryStr(addrtext):
 def isBareLockbox(addrtext):
    return addrtext.startswith(LBPREFIX)
 
-def scrAddr_to_displayStr(scrAddr, wltMap, lbMap):
+def scrAddr_to_displayStr(scrAddr, wltMap, lbMap, ownerIndex=None):
    retStr = ''
    if scrAddr[0] in (SCRADDR_P2PKH_BYTE, SCRADDR_P2SH_BYTE):
       retStr = scrAddr_to_addrStr(scrAddr)
    elif scrAddr[0] == SCRADDR_MULTISIG_BYTE:
-      retStr = getDisplayStringForScript(scrAddr[1:], wltMap, lbMap)
+      retStr = getDisplayStringForScript(scrAddr[1:], wltMap, lbMap, \
+                                         ownerIndex=ownerIndex)
    else:
       LOGERROR('scrAddr %s is invalid.' % binary_to_hex(scrAddr))
 
@@ -280,14 +285,14 @@ class MultiSigLockbox(AsciiSerializable):
    #############################################################################
    def serialize(self):
 
-      bp = BinaryPacker()
-      bp.put(UINT32,       self.version)
-      bp.put(BINARY_CHUNK, MAGIC_BYTES)
-      bp.put(UINT64,       self.createDate)
-      bp.put(VAR_STR,      toBytes(self.shortName))
-      bp.put(VAR_STR,      toBytes(self.longDescr))
-      bp.put(UINT8,        self.M)
-      bp.put(UINT8,        self.N)
+      bp = BinaryPacker(512)
+      bp.put_many(LOCKBOX_HEADER_SCHEMA, [self.version,
+                                          MAGIC_BYTES,
+                                          self.createDate,
+                                          toBytes(self.shortName),
+                                          toBytes(self.longDescr),
+                                          self.M,
+                                          self.N])
       for i in range(self.N):
          bp.put(VAR_STR,   self.dPubKeys[i].serialize())
 
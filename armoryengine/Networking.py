@@ -19,8 +19,10 @@
 #
 ################################################################################
 
+from collections import OrderedDict
 import os.path
 import random
+from struct import Struct
 
 from twisted.internet.defer import Deferred
 from twisted.internet.protocol import Protocol, ReconnectingClientFactory
@@ -29,13 +31,21 @@ from armoryengine.ArmoryUtils import LOGINFO, RightNow, getVersionString, \
    BTCARMORY_VERSION, NetworkIDError, LOGERROR, BLOCKCHAINS, CLI_OPTIONS, LOGDEBUG, \
    binary_to_hex, BIGENDIAN, LOGRAWDATA, ARMORY_HOME_DIR, ConnectionError, \
    MAGIC_BYTES, hash256, verifyChecksum, NETWORKENDIAN, int_to_bitset, \
-   bitset_to_int, unixTimeToFormatStr
+   bitset_to_int, unixTimeToFormatStr, LOGWARN
 from armoryengine.BDM import TheBDM
 from armoryengine.BinaryPacker import BinaryPacker, BINARY_CHUNK, UINT32, UINT64, \
    UINT16, VAR_INT, INT32, INT64, VAR_STR, INT8
 from armoryengine.BinaryUnpacker import BinaryUnpacker, UnpackerError
 from armoryengine.Block import PyBlockHeader
-from armoryengine.Transaction import PyTx, indent
+from armoryengine.Transaction import PyTx, LazyPyTx, indent
+
+
+# Received tx and block payloads keep each transaction as raw bytes plus its
+# hash, and only build the PyTxIn/PyTxOut objects if something looks at them
+LAZY_PAYLOAD_DECODING = True
+
+def newPayloadTx():
+   return LazyPyTx() if LAZY_PAYLOAD_DECODING else PyTx()
 
 
 class ArmoryClient(Protocol):
@@ -48,7 +58,7 @@ class ArmoryClient(Protocol):
 
    ############################################################
    def __init__(self):
-      self.recvData = ''
+      self.framer = PyMessageFramer()
       self.gotVerack = False
       self.sentVerack = False
       self.sentHeadersReq = True
@@ -93,40 +103,22 @@ class ArmoryClient(Protocol):
       #print '\n\nData Received:',
       #pprintHex(binary_to_hex(data), withAddr=False)
 
-      # Put the current buffer into an unpacker, process until empty
-      self.recvData += data
-      buf = BinaryUnpacker(self.recvData)
+      # The framer buffers partial messages, and only parses a payload once
+      # all of its bytes have arrived
+      self.framer.feed(data)
 
-      messages = []
       while True:
          try:
-            # recvData is only modified if the unserialize succeeds
-            # Had a serious issue with references, so I had to convert 
-            # messages to strings to guarantee that copies were being 
-            # made!  (yes, hacky...)
-            thisMsg = PyMessage().unserialize(buf)
-            messages.append( thisMsg.serialize() )
-            self.recvData = buf.getRemainingString()
-         except NetworkIDError:
+            msg = self.framer.nextMessage()
+         except NetworkIDError as e:
             LOGERROR('Message for a different network!' )
-            if BLOCKCHAINS.has_key(self.recvData[:4]):
-               LOGERROR( '(for network: %s)', BLOCKCHAINS[self.recvData[:4]])
-            # Before raising the error, we should've finished reading the msg
-            # So pop it off the front of the buffer
-            self.recvData = buf.getRemainingString()
-            return
-         except UnpackerError:
-            # Expect this error when buffer isn't full enough for a whole msg
-            break
-
-      # We might've gotten here without anything to process -- if so, bail
-      if len(messages)==0:
-         return
+            if BLOCKCHAINS.has_key(e.args[-1]):
+               LOGERROR( '(for network: %s)', BLOCKCHAINS[e.args[-1]])
+            continue
 
+         if msg is None:
+            break
 
-      # Finally, we have some message to process, let's do it
-      for msgStr in messages:
-         msg = PyMessage().unserialize(msgStr)
          cmd = msg.cmd
 
          # Log the message if netlog option
@@ -136,6 +128,7 @@ class ArmoryClient(Protocol):
                LOGDEBUG('\t' + binary_to_hex(msg.payload.tx.thisHash))
             elif msg.payload.command == 'block':
                LOGDEBUG('\t' + msg.payload.header.getHashHex())
+               self.framer.logParseStats()
             elif msg.payload.command == 'inv':
                for inv in msg.payload.invList:
                   LOGDEBUG(('\tBLOCK: ' if inv[0]==2 else '\tTX   : ') + \
@@ -182,26 +175,11 @@ class ArmoryClient(Protocol):
       #        application.  For now, it's pretty static.
       #msg.payload.pprint(nIndent=2)
       if msg.cmd=='inv':
-         invobj = msg.payload
-         getdataMsg = PyMessage('getdata')
-         for inv in invobj.invList:
-            if inv[0]==MSG_INV_BLOCK:
-               if self.factory.bdm and (self.factory.bdm.getBDMState()=='Scanning' or \
-                  self.factory.bdm.hasHeaderWithHash(inv[1])):
-                  continue
-               getdataMsg.payload.invList.append(inv)
-            if inv[0]==MSG_INV_TX:
-               if self.factory.bdm and (self.factory.bdm.getBDMState()=='Scanning' or \
-                  self.factory.bdm.hasTxWithHash(inv[1])):
-                  continue
-               getdataMsg.payload.invList.append(inv)
-
-         # Now send the full request
-         if self.factory.bdm and not self.factory.bdm.getBDMState()=='Scanning':
-            self.sendMessage(getdataMsg)
+         self.requestUnknownInv(msg.payload.invList)
 
       if msg.cmd=='tx':
          pytx = msg.payload.tx
+         self.factory.seenInv.add(pytx.getHash())
          self.factory.func_newTx(pytx)
       elif msg.cmd=='inv':
          invList = msg.payload.invList
@@ -209,11 +187,57 @@ class ArmoryClient(Protocol):
       elif msg.cmd=='block':
          pyHeader = msg.payload.header
          pyTxList = msg.payload.txList
+         self.factory.seenInv.add(pyHeader.getHash())
+         self.factory.seenInv.addMany([tx.getHash() for tx in pyTxList])
          LOGINFO('Received new block.  %s', binary_to_hex(pyHeader.getHash(), BIGENDIAN))
          self.factory.func_newBlock(pyHeader, pyTxList)
 
                   
 
+   ############################################################
+   def requestUnknownInv(self, invList):
+      """
+      Send a getdata for every block and tx in invList that we haven't seen.
+      Anything in the factory's seen-inventory cache is dropped right away,
+      and whatever is left goes to the BDM in a single batched request,
+      instead of one blocking BDM call per inv entry.
+      """
+      bdm = self.factory.bdm
+      if not bdm or bdm.getBDMState()=='Scanning':
+         return
+
+      seenInv = self.factory.seenInv
+      blkInv,txInv = [],[]
+      for inv in invList:
+         if seenInv.contains(inv[1]):
+            continue
+         if inv[0]==MSG_INV_BLOCK:
+            blkInv.append(inv)
+         elif inv[0]==MSG_INV_TX:
+            txInv.append(inv)
+
+      if len(blkInv)+len(txInv) == 0:
+         return
+
+      unknown = bdm.getUnknownHashes([inv[1] for inv in blkInv],
+                                     [inv[1] for inv in txInv])
+      if unknown is None:
+         # BDM didn't answer in time, just ask for all of it
+         unknownSet = None
+      else:
+         unknownSet = set(unknown[0]) | set(unknown[1])
+
+      getdataMsg = PyMessage('getdata')
+      for inv in blkInv + txInv:
+         if unknownSet is None or inv[1] in unknownSet:
+            getdataMsg.payload.invList.append(inv)
+         else:
+            seenInv.add(inv[1])
+
+      if len(getdataMsg.payload.invList) > 0:
+         self.sendMessage(getdataMsg)
+
+
    ############################################################
    def startHeaderDL(self):
       numList = self.createBlockLocatorNumList(self.topBlk)
@@ -279,9 +303,12 @@ class ArmoryClient(Protocol):
       if   isinstance(txObj, PyMessage):
          self.sendMessage( txObj )
       elif isinstance(txObj, PyTx):
+         self.factory.seenInv.add(txObj.getHash())
          self.sendMessage( PayloadTx(txObj))
       elif isinstance(txObj, str):
-         self.sendMessage( PayloadTx(PyTx().unserialize(txObj)) )
+         pytx = PyTx().unserialize(txObj)
+         self.factory.seenInv.add(pytx.getHash())
+         self.sendMessage( PayloadTx(pytx) )
          
 
 
@@ -334,6 +361,9 @@ class ArmoryClientFactory(ReconnectingClientFactory):
       self.func_inv         = func_inv
       self.proto = None
 
+      # Shared by all connections, so it survives reconnects
+      self.seenInv = PySeenInvCache()
+
    
 
    #############################################################################
@@ -484,6 +514,195 @@ class PyMessage(object):
       self.payload.pprint(nIndent+1)
 
 
+################################################################################
+# magic(4) | command(12) | payload length(4) | payload checksum(4)
+MESSAGE_HEADER = Struct('<4s12sI4s')
+
+class PyMessageFramer(object):
+   """
+   Incremental framer for the raw byte stream coming off the socket.  Data
+   from the reactor is appended to a single bytearray, and nothing is parsed
+   until a header AND the full payload it announces are present.  At that
+   point the checksum is verified once, and the payload parser is handed a
+   zero-copy memoryview of the buffer.  Consumed bytes are dropped from the
+   front of the buffer lazily, so a large block arriving in many small
+   pieces costs O(N) in total instead of O(N^2).
+
+   Parse counts, bytes and seconds are accumulated per command in
+   self.parseStats, so we can see where the time goes during block relay.
+   """
+   def __init__(self, magic=MAGIC_BYTES):
+      self.magic = magic
+      self.buf = bytearray()
+      self.readPos = 0
+      self.parseStats = {}  # cmd -> [nMsgs, nBytes, parseSeconds]
+
+   #############################################################################
+   def feed(self, data):
+      try:
+         if self.readPos > 0 and self.readPos*2 >= len(self.buf):
+            del self.buf[:self.readPos]
+            self.readPos = 0
+         self.buf.extend(data)
+      except BufferError:
+         # Something is still holding a view into the old buffer.  Leave it
+         # alone and start a new one with just the unread bytes
+         self.buf = self.buf[self.readPos:] + bytearray(data)
+         self.readPos = 0
+
+   #############################################################################
+   def getBufferedSize(self):
+      return len(self.buf) - self.readPos
+
+   #############################################################################
+   def getParseStats(self):
+      return dict([(cmd, list(stats)) for cmd,stats in self.parseStats.iteritems()])
+
+   #############################################################################
+   def logParseStats(self):
+      LOGINFO('Network message parse stats:')
+      for cmd,(nMsg,nBytes,tParse) in sorted(self.parseStats.iteritems()):
+         LOGINFO('   %-12s %8d msgs %12d bytes %10.3f sec', cmd, nMsg, nBytes, tParse)
+
+   #############################################################################
+   def nextMessage(self):
+      """
+      Returns the next complete PyMessage, or None if we are still waiting
+      for more data.  A message for another network is consumed and then
+      reported by raising NetworkIDError with its magic bytes as the last
+      argument.  Messages that fail their checksum, or have a command or
+      payload we can't parse, are logged and skipped.
+      """
+      while self.getBufferedSize() >= MESSAGE_HEADER.size:
+         startPos = self.readPos
+         magic,cmd,length,chksum = MESSAGE_HEADER.unpack_from(self.buf, startPos)
+         payloadStart = startPos + MESSAGE_HEADER.size
+         payloadEnd   = payloadStart + length
+         if payloadEnd > len(self.buf):
+            return None
+
+         self.readPos = payloadEnd
+         cmd = cmd.strip('\x00')
+         if magic != self.magic:
+            raise NetworkIDError('Message has wrong network bytes!', magic)
+
+         tStart = RightNow()
+         payload = memoryview(self.buf)[payloadStart:payloadEnd]
+         if not hash256(payload).startswith(chksum):
+            # Same one-byte repair attempt we make on all checksummed data
+            payload = verifyChecksum(payload.tobytes(), chksum)
+            if len(payload)==0 and length>0:
+               LOGERROR('Dropping %s message with bad checksum', cmd)
+               continue
+
+         if not PayloadMap.has_key(cmd):
+            LOGWARN('Skipping unrecognized network message: %s', cmd)
+            continue
+
+         msg = PyMessage()
+         msg.magic = magic
+         msg.cmd = cmd
+         try:
+            msg.payload = PayloadMap[cmd]().unserialize(BinaryUnpacker(payload))
+         except UnpackerError:
+            LOGERROR('Dropping malformed %s message (%d bytes)', cmd, length)
+            continue
+         finally:
+            # Release our view so the buffer can be compacted on next feed()
+            payload = None
+
+         stats = self.parseStats.setdefault(cmd, [0, 0, 0.0])
+         stats[0] += 1
+         stats[1] += length
+         stats[2] += RightNow() - tStart
+         return msg
+
+      return None
+
+
+################################################################################
+BLOOM_PROBES = Struct('<8I')
+
+class PySeenInvCache(object):
+   """
+   Remembers the tx and block hashes this node has already seen (sent,
+   received, or confirmed by the BDM), so that an inv from our peer can be
+   filtered without asking the BDM thread about every single entry.
+
+   The most recent maxEntries hashes are kept exactly, in an LRU.  If
+   bloomBits is non-zero, every hash is also added to a Bloom filter which
+   keeps answering "probably seen" after the hash falls off the end of the
+   LRU.  A false positive there means we don't getdata something we never
+   had, so keep the filter large, or leave it off when that matters.
+   """
+   def __init__(self, maxEntries=50000, bloomBits=0, bloomProbes=4):
+      self.maxEntries  = maxEntries
+      self.lru         = OrderedDict()
+      self.bloomBits   = bloomBits
+      self.bloomProbes = min(bloomProbes, 8)
+      self.bloomCount  = 0
+      self.bloom       = bytearray((bloomBits+7)/8)
+      self.nHits       = 0
+      self.nMisses     = 0
+
+   #############################################################################
+   def __len__(self):
+      return len(self.lru)
+
+   #############################################################################
+   def __bloomIndices(self, hashBin):
+      # Tx and block hashes are already uniformly distributed, so we can
+      # use 4-byte slices of them directly as the probe positions
+      probes = BLOOM_PROBES.unpack_from(hashBin.ljust(32, '\x00'))
+      return [p % self.bloomBits for p in probes[:self.bloomProbes]]
+
+   #############################################################################
+   def add(self, hashBin):
+      if hashBin in self.lru:
+         del self.lru[hashBin]
+      elif len(self.lru) >= self.maxEntries:
+         self.lru.popitem(last=False)
+      self.lru[hashBin] = True
+
+      if self.bloomBits > 0:
+         # Start over once we're past ~10 bits per entry, the LRU still
+         # covers everything recent
+         if self.bloomCount*10 > self.bloomBits:
+            self.bloom = bytearray(len(self.bloom))
+            self.bloomCount = 0
+         for i in self.__bloomIndices(hashBin):
+            self.bloom[i>>3] |= 1 << (i & 7)
+         self.bloomCount += 1
+
+   #############################################################################
+   def addMany(self, hashList):
+      for hashBin in hashList:
+         self.add(hashBin)
+
+   #############################################################################
+   def contains(self, hashBin):
+      if hashBin in self.lru:
+         self.nHits += 1
+         return True
+
+      if self.bloomBits > 0:
+         for i in self.__bloomIndices(hashBin):
+            if not self.bloom[i>>3] & (1 << (i & 7)):
+               break
+         else:
+            self.nHits += 1
+            return True
+
+      self.nMisses += 1
+      return False
+
+   #############################################################################
+   def clear(self):
+      self.lru.clear()
+      self.bloom = bytearray(len(self.bloom))
+      self.bloomCount = 0
+
+
 ################################################################################
 class PyNetAddress(object):
 
@@ -874,8 +1093,9 @@ class PayloadGetBlocks(object):
 class PayloadTx(object):
    command = 'tx'
 
-   def __init__(self, tx=PyTx()):
-      self.tx = tx
+   def __init__(self, tx=None):
+      # Never share a default PyTx between payloads:  unserialize fills it in
+      self.tx = newPayloadTx() if tx is None else tx
 
    def unserialize(self, toUnpack):
       self.tx.unserialize(toUnpack)
@@ -896,9 +1116,9 @@ class PayloadTx(object):
 class PayloadHeaders(object):
    command = 'headers'
 
-   def __init__(self, header=PyBlockHeader(), headerlist=[]):
-      self.header = header
-      self.headerList = headerlist
+   def __init__(self, header=None, headerlist=None):
+      self.header = PyBlockHeader() if header is None else header
+      self.headerList = [] if headerlist is None else headerlist
    
 
    def unserialize(self, toUnpack):
@@ -938,9 +1158,9 @@ class PayloadHeaders(object):
 class PayloadBlock(object):
    command = 'block'
 
-   def __init__(self, header=PyBlockHeader(), txlist=[]):
-      self.header = header
-      self.txList = txlist
+   def __init__(self, header=None, txlist=None):
+      self.header = PyBlockHeader() if header is None else header
+      self.txList = [] if txlist is None else txlist
    
 
    def unserialize(self, toUnpack):
@@ -953,7 +1173,7 @@ class PayloadBlock(object):
       self.header.unserialize(blkData)
       numTx = blkData.get(VAR_INT)
       for i in range(numTx):
-         self.txList.append(PyTx().unserialize(blkData))
+         self.txList.append(newPayloadTx().unserialize(blkData))
       return self
 
    def serialize(self):
@@ -1030,12 +1250,17 @@ class PayloadReject(object):
       self.rejectCode = None
       
    def unserialize(self, toUnpack):
-      bu = BinaryUnpacker(toUnpack)
+      if isinstance(toUnpack, BinaryUnpacker):
+         bu = toUnpack
+      else:
+         bu = BinaryUnpacker( toUnpack )
+
+      startPos = bu.getPosition()
       self.messageType = bu.get(VAR_STR)
       self.rejectCode = bu.get(INT8)
       self.message = bu.get(VAR_STR)
       self.data = bu.get(BINARY_CHUNK, bu.getRemainingSize())
-      self.serializedData = toUnpack
+      self.serializedData = bu.getSlice(startPos, bu.getPosition())
       return self
 
    def serialize(self):
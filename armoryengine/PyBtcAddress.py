@@ -20,6 +20,16 @@ from armoryengine.Timer import TimeThisFunction
 import CppBlockUtils as Cpp
 
 
+# Every field of a serialized address is fixed-width (see the format in
+# PyBtcAddress.serialize), so the whole entry is written with one struct
+PYBTCADDRESS_SCHEMA = [ (BINARY_CHUNK,20), (BINARY_CHUNK, 4), UINT32, UINT64,
+                        (BINARY_CHUNK,32), (BINARY_CHUNK, 4), INT64,  INT64,
+                        (BINARY_CHUNK,16), (BINARY_CHUNK, 4),
+                        (BINARY_CHUNK,32), (BINARY_CHUNK, 4),
+                        (BINARY_CHUNK,65), (BINARY_CHUNK, 4),
+                        UINT64, UINT64, UINT32, UINT32 ]
+PYBTCADDRESS_SERIALIZED_SIZE = 237
+
 #############################################################################
 def calcWalletIDFromRoot(root, chain):
    """ Helper method for computing a wallet ID """
@@ -618,20 +628,25 @@ class PyBtcAddress(object):
       self.isLocked = False
 
       if not skipCheck:
-         if not self.hasPubKey():
-            self.binPublicKey65 = CryptoECDSA().ComputePublicKey(\
-                                                      self.binPrivKey32_Plain)
-         else:
-            # We should usually check that keys match, but may choose to skip
-            # if we have a lot of keys to load
-            # NOTE:  I run into this error if I fill the keypool without first
-            #        unlocking the wallet.  I'm not sure why it doesn't work 
-            #        when locked (it should), but this wallet format has been
-            #        working flawless for almost a year... and will be replaced
-            #        soon, so I won't sweat it.
-            if not CryptoECDSA().CheckPubPrivKeyMatch(self.binPrivKey32_Plain, \
-                                            self.binPublicKey65):
-               raise KeyDataError, "Stored public key does not match priv key!"
+         self.checkUnlockedKey()
+
+
+   #############################################################################
+   def checkUnlockedKey(self):
+      if not self.hasPubKey():
+         self.binPublicKey65 = CryptoECDSA().ComputePublicKey(\
+                                                   self.binPrivKey32_Plain)
+      else:
+         # We should usually check that keys match, but may choose to skip
+         # if we have a lot of keys to load
+         # NOTE:  I run into this error if I fill the keypool without first
+         #        unlocking the wallet.  I'm not sure why it doesn't work 
+         #        when locked (it should), but this wallet format has been
+         #        working flawless for almost a year... and will be replaced
+         #        soon, so I won't sweat it.
+         if not CryptoECDSA().CheckPubPrivKeyMatch(self.binPrivKey32_Plain, \
+                                         self.binPublicKey65):
+            raise KeyDataError, "Stored public key does not match priv key!"
 
 
 
@@ -758,7 +773,8 @@ class PyBtcAddress(object):
 
    #############################################################################
    @TimeThisFunction
-   def extendAddressChain(self, secureKdfOutput=None, newIV=None):
+   def extendAddressChain(self, secureKdfOutput=None, newIV=None,
+                                                     nextPubKey=None):
       """
       We require some fairly complicated logic here, due to the fact that a
       user with a full, private-key-bearing wallet, may try to generate a new
@@ -767,6 +783,9 @@ class PyBtcAddress(object):
       generate a new address, but we can't compute the private key until the
       next time the user unlocks their wallet.  Thus, we have to save off the
       data they will need to create the key, to be applied on next unlock.
+
+      If the chain is extended by public key only, nextPubKey can supply the
+      already-verified chained key (see ChainedKeyCache) to skip the EC math.
       """
       if not self.chaincode.getSize() == 32:
          raise KeyDataError, 'No chaincode has been defined to extend chain'
@@ -829,8 +848,10 @@ class PyBtcAddress(object):
 
          #newAddr.binPublicKey65 = CryptoECDSA().ComputeChainedPublicKey( \
                                     #self.binPublicKey65, self.chaincode)
-         newAddr.binPublicKey65 = self.safeExtendPublicKey( \
+         if nextPubKey is None:
+            nextPubKey = self.safeExtendPublicKey( \
                                     self.binPublicKey65, self.chaincode)
+         newAddr.binPublicKey65 = nextPubKey
 
          newAddr.addrStr20 = newAddr.binPublicKey65.getHash160()
          newAddr.useEncryption = self.useEncryption
@@ -939,44 +960,35 @@ class PyBtcAddress(object):
       # able to determine where each field is, and will never corrupt the
       # whole wallet so badly we have to go hex-diving to figure out what
       # happened.
-      binOut = BinaryPacker()
-      binOut.put(BINARY_CHUNK,   self.addrStr20,                    width=20)
-      binOut.put(BINARY_CHUNK,   chk(self.addrStr20),               width= 4)
-      binOut.put(UINT32,         getVersionInt(PYBTCWALLET_VERSION))
-      binOut.put(UINT64,         bitset_to_int(flags))
-
-      # Write out address-chaining parameters (for deterministic wallets)
-      binOut.put(BINARY_CHUNK,   raw(self.chaincode),               width=32)
-      binOut.put(BINARY_CHUNK,   chk(self.chaincode),               width= 4)
-      binOut.put(INT64,          self.chainIndex)
-      binOut.put(INT64,          self.createPrivKeyNextUnlock_ChainDepth)
 
       # Write out whatever is appropriate for private-key data
       # Binary-unpacker will write all 0x00 bytes if empty values are given
       if serializeWithEncryption:
          if self.createPrivKeyNextUnlock:
-            binOut.put(BINARY_CHUNK,   raw(self.createPrivKeyNextUnlock_IVandKey[0]), width=16)
-            binOut.put(BINARY_CHUNK,   chk(self.createPrivKeyNextUnlock_IVandKey[0]), width= 4)
-            binOut.put(BINARY_CHUNK,   raw(self.createPrivKeyNextUnlock_IVandKey[1]), width=32)
-            binOut.put(BINARY_CHUNK,   chk(self.createPrivKeyNextUnlock_IVandKey[1]), width= 4)
+            initVect = self.createPrivKeyNextUnlock_IVandKey[0]
+            privKey  = self.createPrivKeyNextUnlock_IVandKey[1]
          else:
-            binOut.put(BINARY_CHUNK,   raw(self.binInitVect16),     width=16)
-            binOut.put(BINARY_CHUNK,   chk(self.binInitVect16),     width= 4)
-            binOut.put(BINARY_CHUNK,   raw(self.binPrivKey32_Encr), width=32)
-            binOut.put(BINARY_CHUNK,   chk(self.binPrivKey32_Encr), width= 4)
+            initVect = self.binInitVect16
+            privKey  = self.binPrivKey32_Encr
       else:
-         binOut.put(BINARY_CHUNK,   raw(self.binInitVect16),        width=16)
-         binOut.put(BINARY_CHUNK,   chk(self.binInitVect16),        width= 4)
-         binOut.put(BINARY_CHUNK,   raw(self.binPrivKey32_Plain),   width=32)
-         binOut.put(BINARY_CHUNK,   chk(self.binPrivKey32_Plain),   width= 4)
-
-      binOut.put(BINARY_CHUNK, raw(self.binPublicKey65),            width=65)
-      binOut.put(BINARY_CHUNK, chk(self.binPublicKey65),            width= 4)
-
-      binOut.put(UINT64, self.timeRange[0])
-      binOut.put(UINT64, self.timeRange[1])
-      binOut.put(UINT32, self.blkRange[0])
-      binOut.put(UINT32, self.blkRange[1])
+         initVect = self.binInitVect16
+         privKey  = self.binPrivKey32_Plain
+
+      binOut = BinaryPacker(PYBTCADDRESS_SERIALIZED_SIZE)
+      binOut.put_many(PYBTCADDRESS_SCHEMA, [ \
+                        self.addrStr20,      chk(self.addrStr20),
+                        getVersionInt(PYBTCWALLET_VERSION),
+                        bitset_to_int(flags),
+                        # Address-chaining parameters (deterministic wallets)
+                        raw(self.chaincode), chk(self.chaincode),
+                        self.chainIndex,
+                        self.createPrivKeyNextUnlock_ChainDepth,
+                        # Private-key data
+                        raw(initVect),       chk(initVect),
+                        raw(privKey),        chk(privKey),
+                        raw(self.binPublicKey65), chk(self.binPublicKey65),
+                        self.timeRange[0],   self.timeRange[1],
+                        self.blkRange[0],    self.blkRange[1] ])
 
       return binOut.getBinaryString()
 
@@ -1339,5 +1351,55 @@ class PyBtcAddress(object):
          result = ''.join([result, '\n',   indent + '           ***** :', 'PrivKeys available on next unlock'])
       return result
 
+
+
+################################################################################
+def PyUnlockAddressList(addrList, secureKdfOutput, skipCheck=False):
+   """
+   Same as addr.unlock(secureKdfOutput, skipCheck) for each address, except
+   that every key that just needs decrypting goes through a single
+   DecryptCFBBatch call, which sets up the AES key schedule only once.
+   Addresses that still have to compute their private key from an earlier
+   one (createPrivKeyNextUnlock) take the regular path.
+   """
+   toDecrypt = []
+   for addr in addrList:
+      if not addr.useEncryption or not addr.isLocked:
+         addr.isLocked = False
+      elif addr.createPrivKeyNextUnlock:
+         addr.unlock(secureKdfOutput, skipCheck)
+      else:
+         if not addr.binPrivKey32_Encr.getSize()==32:
+            raise WalletLockError, 'No encrypted private key to decrypt!'
+         if not addr.binInitVect16.getSize()==16:
+            raise WalletLockError, 'Initialization Vect (IV) is missing!'
+         toDecrypt.append(addr)
+
+   if len(toDecrypt)==0:
+      return
+
+   encrData = SecureBinaryData()
+   ivData   = SecureBinaryData()
+   for addr in toDecrypt:
+      encrData.append(addr.binPrivKey32_Encr)
+      ivData.append(addr.binInitVect16)
+
+   plainData = CryptoAES().DecryptCFBBatch(encrData, \
+                                           SecureBinaryData(secureKdfOutput), \
+                                           ivData, 32)
+   if not plainData.getSize()==32*len(toDecrypt):
+      raise WalletLockError, 'Batch decryption of private keys failed'
+
+   try:
+      for i,addr in enumerate(toDecrypt):
+         addr.binPrivKey32_Plain = plainData.getSliceCopy(32*i, 32)
+         addr.isLocked = False
+         if not skipCheck:
+            addr.checkUnlockedKey()
+   finally:
+      plainData.destroy()
+
+
+
 # Put the import at the end to avoid circular reference problem
 from armoryengine.BDM import *
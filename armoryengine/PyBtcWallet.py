@@ -32,6 +32,9 @@ WLT_DATATYPE_TXCOMMENT   = 2
 WLT_DATATYPE_OPEVAL      = 3
 WLT_DATATYPE_DELETED     = 4
 
+# Everything before the first data entry: see packHeader
+WLT_HEADER_SIZE = 2107
+
 DEFAULT_COMPUTE_TIME_TARGET = 0.25
 DEFAULT_MAXMEM_LIMIT        = 32*1024*1024
 
@@ -190,6 +193,27 @@ class PyBtcWallet(object):
       self.doBlockchainSync = BLOCKCHAIN_READONLY
       self.lastSyncBlockNum = 0
 
+      # Python-side UTXO set, rebuilt/verified from C++ on each sync and
+      # updated in place for zero-conf txs.  Serves balance and UTXO queries
+      self.utxoIndex = UtxoIndex(self.hasScrAddr)
+
+      # Verified public-key chain from the root, only built when addresses
+      # are chained without private keys (watching-only or locked wallets)
+      self.chainedKeyCache = None
+
+      # Bumped whenever addresses are added to or removed from addrMap, so
+      # anything built from the address list can tell when to rebuild
+      self.addrMapVersion = 0
+
+      # Side-car entry index, only used by readWalletFile(lazyLoad=True)
+      self.fileIndex = None
+
+      # Write-ahead journal, only written between beginWalletUpdateBatch and
+      # endWalletUpdateBatch (index updates wait for the checkpoint)
+      self.walletJournal = None
+      self.updateBatchDepth = 0
+      self.journalIndexUpdates = []
+
       # Private key encryption details
       self.useEncryption  = False
       self.kdf            = None
@@ -200,6 +224,11 @@ class PyBtcWallet(object):
       self.isLocked       = False
       self.testedComputeTime=None
 
+      # After unlock(onDemand=True):  addr160s of the keys decrypted since,
+      # and the top chain index at the time, so lock() only visits those
+      self.onDemandAddrs    = None
+      self.onDemandTopIndex = -1
+
       # Deterministic wallet, need a root key.  Though we can still import keys.
       # The unique ID contains the network byte (id[-1]) but is not intended to
       # resemble the address of the root key
@@ -289,6 +318,7 @@ class PyBtcWallet(object):
       if not self.doBlockchainSync==BLOCKCHAIN_DONOTUSE:
          if startBlk==None:
             startBlk = self.lastSyncBlockNum + 1
+         isFullScan = (startBlk <= self.lastSyncBlockNum)
 
          # calledFromBDM means that ultimately the BDM itself called this
          # method and is blocking waiting for it.  So we can't use the 
@@ -299,6 +329,8 @@ class PyBtcWallet(object):
          else:
             TheBDM.scanBlockchainForTx(self.cppWallet, startBlk, wait=True)
             self.lastSyncBlockNum = TheBDM.getTopBlockHeight(wait=True)
+
+         self.updateUtxoIndex(isFullScan)
       else:
          LOGERROR('Blockchain-sync requested, but current wallet')
          LOGERROR('is set to BLOCKCHAIN_DONOTUSE')
@@ -321,6 +353,7 @@ class PyBtcWallet(object):
          if startBlk==None:
             if self.lastSyncBlockNum is not None:
                startBlk = self.lastSyncBlockNum + 1
+         isFullScan = (startBlk is None or startBlk <= self.lastSyncBlockNum)
 
          # calledFromBDM means that ultimately the BDM itself called this
          # method and is blocking waiting for it.  So we can't use the 
@@ -346,10 +379,65 @@ class PyBtcWallet(object):
                      self.txAddrMap[txHash].append(addr160)
                except:
                   continue
+
+         self.updateUtxoIndex(isFullScan)
       else:
          LOGERROR('Blockchain-sync requested, but current wallet')
          LOGERROR('is set to BLOCKCHAIN_DONOTUSE')
 
+   #############################################################################
+   def updateUtxoIndex(self, isFullScan=False):
+      """
+      Bring the UTXO index in line with the C++ wallet after a sync.  After
+      new blocks, the wallet txs C++ found in them are applied to the index,
+      inputs and outputs both.  The index is rebuilt instead after a full
+      scan, after a reorg, or while it holds zero-conf TxOuts (a zero-conf
+      tx that never gets mined doesn't show up in any block).  When it is
+      rebuilt after a full scan, the old one is checked against it outpoint
+      by outpoint so that any drift is logged.
+      """
+      if self.cppWallet is None:
+         return
+
+      currBlk = self.lastSyncBlockNum
+      if not isFullScan and not self.utxoIndex.hasZeroConf():
+         if self.calledFromBDM:
+            getTxFunc = TheBDM.getTxByHash_bdm_direct
+         else:
+            getTxFunc = TheBDM.getTxByHash
+
+         if self.utxoIndex.applyCppLedger(self.cppWallet, currBlk, getTxFunc):
+            if self.utxoIndex.matchesCppTotals(self.cppWallet, currBlk,
+                                                               IGNOREZC):
+               return
+            LOGWARN('UTXO index for wallet %s disagreed with the blockchain '
+                    'balance after block %d, rebuilding it',
+                    self.uniqueIDB58, currBlk)
+
+      newIndex = UtxoIndex(self.hasScrAddr)
+      newIndex.buildFromCpp(self.cppWallet, currBlk, IGNOREZC)
+
+      if isFullScan and self.utxoIndex.isBuilt:
+         errors = self.utxoIndex.compareTo(newIndex, currBlk, IGNOREZC)
+         if len(errors) > 0:
+            LOGWARN('UTXO index for wallet %s disagreed with the blockchain '
+                    'on %d outputs after rescan', self.uniqueIDB58, len(errors))
+            for err in errors[:20]:
+               LOGWARN('   ' + err)
+
+      self.utxoIndex = newIndex
+
+   #############################################################################
+   def applyZeroConfTxList(self, rawTxList):
+      """
+      Update the UTXO index with new zero-conf txs, right after the C++ wallet
+      was rescanned for them.  Anything C++ rejected gets corrected on the
+      next sync, which always rebuilds while the index holds zero-conf TxOuts
+      """
+      if self.utxoIndex.isBuilt:
+         self.utxoIndex.applyTxList([PyTx().unserialize(rawTx) \
+                                                 for rawTx in rawTxList])
+
    #############################################################################
    def getCommentForAddrBookEntry(self, abe):
       comment = self.getComment(abe.getAddr160())
@@ -410,6 +498,12 @@ class PyBtcWallet(object):
          return -1
       else:
          currBlk = TheBDM.getTopBlockHeight(calledFromBDM=self.calledFromBDM)
+         if self.utxoIndex.isBuilt and \
+            not balType.lower() in ('unconfirmed','unconf'):
+            # Unconfirmed depends on the sent-to-self status of mined TxOuts,
+            # which only C++ knows, so that one still goes through SWIG
+            return self.utxoIndex.getBalance(balType, currBlk, IGNOREZC)
+
          if balType.lower() in ('spendable','spend'):
             return self.cppWallet.getSpendableBalance(currBlk, IGNOREZC)
          elif balType.lower() in ('unconfirmed','unconf'):
@@ -426,7 +520,12 @@ class PyBtcWallet(object):
                                                                not self.hasAddr(addr160):
          return -1
       else:
-         addr = self.cppWallet.getScrAddrObjByKey(Hash160ToScrAddr(addr160))
+         scrAddr = Hash160ToScrAddr(addr160)
+         if self.utxoIndex.isBuilt and \
+            balType.lower() in ('spendable','spend','ultimate','unspent','full'):
+            return self.utxoIndex.getBalance(balType, currBlk, IGNOREZC, scrAddr)
+
+         addr = self.cppWallet.getScrAddrObjByKey(scrAddr)
          if balType.lower() in ('spendable','spend'):
             return addr.getSpendableBalance(currBlk, IGNOREZC)
          elif balType.lower() in ('unconfirmed','unconf'):
@@ -493,6 +592,9 @@ class PyBtcWallet(object):
          not self.doBlockchainSync==BLOCKCHAIN_DONOTUSE:
 
          currBlk = TheBDM.getTopBlockHeight(calledFromBDM=self.calledFromBDM)
+         if self.utxoIndex.isBuilt:
+            return self.utxoIndex.getTxOutList(txType, currBlk, IGNOREZC)
+
          self.syncWithBlockchain()
          if txType.lower() in ('spend', 'spendable'):
             return self.cppWallet.getSpendableTxOutList(currBlk, IGNOREZC);
@@ -512,8 +614,12 @@ class PyBtcWallet(object):
             not self.doBlockchainSync==BLOCKCHAIN_DONOTUSE:
 
          currBlk = TheBDM.getTopBlockHeight(calledFromBDM=self.calledFromBDM)
-         self.syncWithBlockchain()
          scrAddrStr = Hash160ToScrAddr(addr160)
+         if self.utxoIndex.isBuilt:
+            return self.utxoIndex.getTxOutList(txType, currBlk, IGNOREZC,
+                                                                scrAddrStr)
+
+         self.syncWithBlockchain()
          cppAddr = self.cppWallet.getScrAddrObjByKey(scrAddrStr)
          if txType.lower() in ('spend', 'spendable'):
             return cppAddr.getSpendableTxOutList(currBlk, IGNOREZC);
@@ -564,7 +670,8 @@ class PyBtcWallet(object):
 
    #############################################################################
    def checkWalletLockTimeout(self):
-      if not self.isLocked and self.kdfKey and RightNow()>self.lockWalletAtTime:
+      isUnlocked = not self.isLocked or self.onDemandAddrs is not None
+      if isUnlocked and self.kdfKey and RightNow()>self.lockWalletAtTime:
          self.lock()
          if self.kdfKey:
             self.kdfKey.destroy()
@@ -617,6 +724,10 @@ class PyBtcWallet(object):
 
       walletFileBackup = self.getWalletPath('backup') if backupPath == None \
                                                                else backupPath
+      if not self.checkpointWalletJournal():
+         LOGERROR('Could not apply wallet journal before backup')
+         return False
+
       try:
          shutil.copy(self.walletPath, walletFileBackup)
       except IOError, errReason:
@@ -1056,12 +1167,15 @@ class PyBtcWallet(object):
       if not addr160:
          addr160 = self.lastComputedChainAddr160
 
-      newAddr = self.addrMap[addr160].extendAddressChain(self.kdfKey)
+      parentAddr = self.addrMap[addr160]
+      newAddr = parentAddr.extendAddressChain(self.kdfKey)
+      self.recordOnDemandKeys([parentAddr, newAddr])
       new160 = newAddr.getAddr160()
       newDataLoc = self.walletFileSafeUpdate( \
          [[WLT_UPDATE_ADD, WLT_DATATYPE_KEYDATA, new160, newAddr]])
       self.addrMap[new160] = newAddr
       self.addrMap[new160].walletByteLoc = newDataLoc[0] + 21
+      self.addrMapVersion += 1
 
       if newAddr.chainIndex > self.lastComputedChainIndex:
          self.lastComputedChainAddr160 = new160
@@ -1104,14 +1218,126 @@ class PyBtcWallet(object):
 
       gap = self.lastComputedChainIndex - self.highestUsedChainIndex
       numToCreate = max(numPool - gap, 0)
-      for i in range(numToCreate):
-         Progress(i+1, numToCreate)
-         self.computeNextAddress(isActuallyNew=isActuallyNew, 
-                                 doRegister=doRegister)            
-         #dlgPrg.UpdateHBar(i+1)
+      self.extendAddressPool(numToCreate, isActuallyNew=isActuallyNew,
+                             doRegister=doRegister, Progress=Progress)
             
       return self.lastComputedChainIndex
 
+   #############################################################################
+   def extendAddressPool(self, numAddr, isActuallyNew=True, doRegister=True,
+                                                       Progress=emptyFunc):
+      """
+      Bulk version of computeNextAddress:  computes the next numAddr addresses
+      of the chain in memory, writes all of them to the wallet file in a
+      single walletFileSafeUpdate (one consistency check and one fsync pair
+      instead of one per address), and registers them with the BDM in a
+      single request.  Returns the list of new addr160 values, or an empty
+      list if the wallet file could not be updated.
+      """
+      if numAddr <= 0:
+         return []
+
+      tstart = RightNow()
+      newAddrList = []
+      prevAddr = self.addrMap[self.lastComputedChainAddr160]
+
+      # Same test extendAddressChain uses to pick the public-key-only path.
+      # The wallet's cache is anchored at the root, so it's only used if it
+      # already reaches prevAddr; deriving every key from the root just to
+      # get there costs far more than deriving numAddr keys from prevAddr.
+      nextPubList = [None]*numAddr
+      if not prevAddr.hasPrivKey() or (prevAddr.isLocked and not self.kdfKey):
+         nextPubList = self.getChainedKeyCache().getPubKeyRange( \
+                        prevAddr.chainIndex+1, numAddr, prevAddr.binPublicKey65)
+         if nextPubList is None:
+            keyCache = ChainedKeyCache(prevAddr.binPublicKey65, \
+                                       prevAddr.chaincode, prevAddr.chainIndex)
+            nextPubList = keyCache.getPubKeyRange(prevAddr.chainIndex+1, numAddr)
+
+      parentAddr = prevAddr
+      for i in range(numAddr):
+         Progress(i+1, numAddr)
+         prevAddr = prevAddr.extendAddressChain(self.kdfKey,
+                                                nextPubKey=nextPubList[i])
+         newAddrList.append(prevAddr)
+      self.recordOnDemandKeys([parentAddr] + newAddrList)
+
+      # Nothing goes in memory until it's safely on disk
+      newDataLocs = self.walletFileSafeUpdate( \
+         [[WLT_UPDATE_ADD, WLT_DATATYPE_KEYDATA, newAddr.getAddr160(), newAddr] \
+                                                   for newAddr in newAddrList])
+      if not len(newDataLocs)==len(newAddrList):
+         LOGERROR('Could not write %d new addresses to the wallet file', numAddr)
+         return []
+
+      time0,blk0 = getCurrTimeAndBlock() if isActuallyNew else (0,0)
+      new160List, scrAddrList = [], []
+      for newAddr,dataLoc in zip(newAddrList, newDataLocs):
+         new160 = newAddr.getAddr160()
+         self.addrMap[new160] = newAddr
+         self.addrMap[new160].walletByteLoc = dataLoc + 21
+
+         if newAddr.chainIndex > self.lastComputedChainIndex:
+            self.lastComputedChainAddr160 = new160
+            self.lastComputedChainIndex = newAddr.chainIndex
+
+         self.linearAddr160List.append(new160)
+         self.chainIndexMap[newAddr.chainIndex] = new160
+
+         scrAddr = Hash160ToScrAddr(new160)
+         self.cppWallet.addScrAddress_5_(scrAddr, time0,blk0,time0,blk0)
+         new160List.append(new160)
+         scrAddrList.append(scrAddr)
+      self.addrMapVersion += 1
+
+      # Same as computeNextAddress, but one trip for the whole list
+      if doRegister:
+         if self.calledFromBDM:
+            TheBDM.registerScrAddrList_bdm_direct(scrAddrList, isActuallyNew)
+         else:
+            TheBDM.registerScrAddrList(scrAddrList, isFresh=isActuallyNew)
+
+      tElapsed = RightNow() - tstart
+      LOGINFO('Added %d addresses to wallet %s in %0.2f sec (%0.1f addr/sec)',
+               numAddr, self.uniqueIDB58, tElapsed, numAddr/max(tElapsed,1e-6))
+      return new160List
+
+   #############################################################################
+   def getChainedKeyCache(self):
+      """
+      Public-key chain of this wallet, cached on disk next to the wallet file
+      so restores and repeated gap scans don't derive the same keys twice.
+      """
+      if self.chainedKeyCache is None:
+         root = self.addrMap['ROOT']
+         self.chainedKeyCache = ChainedKeyCache(root.binPublicKey65, \
+                                                root.chaincode, \
+                                                root.chainIndex, \
+                                                self.getChainedKeyCacheDir())
+      return self.chainedKeyCache
+
+   #############################################################################
+   def getChainedKeyCacheDir(self):
+      if not self.walletPath:
+         return None
+      return os.path.join(os.path.dirname(self.walletPath), 'chaincache')
+
+   #############################################################################
+   def deleteChainedKeyCache(self):
+      """ Call this when deleting the wallet files, the cache is no use then """
+      self.chainedKeyCache = None
+      cacheDir = self.getChainedKeyCacheDir()
+      if cacheDir is None:
+         return
+
+      root = self.addrMap['ROOT']
+      cachePath = getChainCachePath(cacheDir, root.binPublicKey65, root.chaincode)
+      try:
+         if os.path.exists(cachePath):
+            os.remove(cachePath)
+      except OSError:
+         LOGEXCEPT('Could not delete key-chain cache %s', cachePath)
+
    #############################################################################
    def setAddrPoolSize(self, newSize):
       if newSize<5:
@@ -1216,13 +1442,22 @@ class PyBtcWallet(object):
       # out [stepsize] addresses beyond topUsed, and the topUsed will not
       # change, thus escaping the while loop
       nWhile = 0
-      while topCompute - topUsed < 0.9*stepSize:
-         topCompute = self.fillAddressPool(stepSize, isActuallyNew=False)
-         topUsed = self.detectHighestUsedIndex(True)
-         nWhile += 1
-         if nWhile>10000:
-            raise WalletAddressError('Escaping inf loop in freshImport...')
-            
+      self.beginWalletUpdateBatch()
+      try:
+         while topCompute - topUsed < 0.9*stepSize:
+            topCompute = self.fillAddressPool(stepSize, isActuallyNew=False)
+            topUsed = self.detectHighestUsedIndex(True)
+            nWhile += 1
+            if nWhile>10000:
+               raise WalletAddressError('Escaping inf loop in freshImport...')
+      finally:
+         isCheckpointed = self.endWalletUpdateBatch()
+
+      if not isCheckpointed:
+         # The journal is kept, and applied again before the next write
+         LOGERROR('Could not write the restored addresses to wallet %s, ' \
+                  'they are only in its journal for now', self.uniqueIDB58)
+
 
       self.addrPoolSize = oldPoolSize
       return topUsed
@@ -2136,11 +2371,25 @@ class PyBtcWallet(object):
 
    #############################################################################
    @TimeThisFunction
-   def readWalletFile(self, wltpath, verifyIntegrity=True, doScanNow=False):
+   def readWalletFile(self, wltpath, verifyIntegrity=True, doScanNow=False,
+                                                            lazyLoad=False):
+      """
+      With lazyLoad, address entries are not read here at all: their
+      locations come from a side-car index (see WalletFileIndex), and each
+      PyBtcAddress is only unserialized, and checked for byte errors, the
+      first time it is accessed through addrMap.
+      """
       if not os.path.exists(wltpath):
          raise FileExistsError("No wallet file:"+wltpath)
 
+      # Re-reading our own file in the middle of a batch
+      if self.updateBatchDepth > 0:
+         self.checkpointWalletJournal()
+
+      # A re-read replaces addrMap, and must not reuse an earlier version
+      addrMapVersion = self.addrMapVersion
       self.__init__()
+      self.addrMapVersion = addrMapVersion + 1
       self.walletPath = wltpath
 
       if verifyIntegrity:
@@ -2152,7 +2401,12 @@ class PyBtcWallet(object):
 
 
       wltfile = open(wltpath, 'rb')
-      wltdata = BinaryUnpacker(wltfile.read())
+      if lazyLoad:
+         # Just the header, the index tells us where everything else is
+         wltdata = BinaryUnpacker(wltfile.read(WLT_HEADER_SIZE))
+         self.addrMap = LazyAddrMap(self.loadLazyAddress)
+      else:
+         wltdata = BinaryUnpacker(wltfile.read())
       wltfile.close()
 
       self.cppWallet = Cpp.BtcWallet()
@@ -2160,6 +2414,9 @@ class PyBtcWallet(object):
 
       self.lastComputedChainIndex = -UINT32_MAX
       self.lastComputedChainAddr160  = None
+      if lazyLoad:
+         self.readWalletEntriesLazy(wltdata.getPosition())
+
       while wltdata.getRemainingSize()>0:
          byteLocation = wltdata.getPosition()
          dtype, hashVal, rawData = self.unpackNextEntry(wltdata)
@@ -2220,6 +2477,173 @@ class PyBtcWallet(object):
 
 
 
+   #############################################################################
+   def readWalletEntriesLazy(self, dataStart):
+      """
+      The lazyLoad part of readWalletFile:  fill addrMap with placeholders
+      from the side-car index (building the index first if it is missing or
+      out of date), read the comments, and register everything with the C++
+      wallet in one pass.
+      """
+      tstart = RightNow()
+      self.fileIndex = WalletFileIndex(self.walletPath)
+      isWarm = self.fileIndex.readIndex()
+      if not isWarm:
+         self.fileIndex = self.buildFileIndex(dataStart)
+
+      for entry in self.fileIndex.keyEntries:
+         addr160 = entry.addr160
+         self.addrMap[addr160] = entry
+         if entry.chainIndex > self.lastComputedChainIndex:
+            self.lastComputedChainIndex   = entry.chainIndex
+            self.lastComputedChainAddr160 = addr160
+
+         chainIndex = entry.chainIndex
+         if chainIndex < -2:
+            chainIndex = -2
+            self.hasNegativeImports = True
+
+         self.linearAddr160List.append(addr160)
+         self.chainIndexMap[chainIndex] = addr160
+
+      # Comment entries are few and small, read them straight from the file
+      if len(self.fileIndex.otherOffsets) > 0:
+         with open(self.walletPath, 'rb') as wltfile:
+            for offset in self.fileIndex.otherOffsets:
+               wltfile.seek(offset)
+               dtype = binary_to_int(wltfile.read(1))
+               hashVal = wltfile.read(20 if dtype==WLT_DATATYPE_ADDRCOMMENT \
+                                          else 32)
+               commentLen = binary_to_int(wltfile.read(2))
+               self.commentsMap[hashVal] = wltfile.read(commentLen)
+               self.commentLocs[hashVal] = offset
+
+      addScrAddr = self.cppWallet.addScrAddress_5_
+      for entry in self.fileIndex.keyEntries:
+         addScrAddr(Hash160ToScrAddr(entry.addr160), \
+                    entry.timeRange[0], entry.blkRange[0], \
+                    entry.timeRange[1], entry.blkRange[1])
+
+      LOGINFO('Opened wallet %s with %s index: %d addresses in %0.2f sec', \
+               self.uniqueIDB58, 'existing' if isWarm else 'new', \
+               len(self.fileIndex.keyEntries), RightNow() - tstart)
+
+
+   #############################################################################
+   def buildFileIndex(self, dataStart):
+      """
+      Scan the wallet file once and write its side-car index.  Only the
+      addr160 checksum is verified here; entries that fail it get the full
+      unserialize and byte-error fix that readWalletFile does for every entry.
+      """
+      fileIndex = WalletFileIndex(self.walletPath)
+
+      wltfile = open(self.walletPath, 'rb')
+      wltdata = BinaryUnpacker(wltfile.read())
+      wltfile.close()
+      wltdata.advance(dataStart)
+
+      while wltdata.getRemainingSize()>0:
+         byteLocation = wltdata.getPosition()
+         dtype, hashVal, rawData = self.unpackNextEntry(wltdata)
+         if dtype==WLT_DATATYPE_KEYDATA:
+            entry = parseAddrEntryFields(byteLocation, rawData)
+            if entry is None or not entry.addr160==hashVal:
+               newAddr = PyBtcAddress()
+               newAddr.unserialize(rawData)
+               fixedAddrData = newAddr.serialize()
+               if not rawData==fixedAddrData:
+                  self.walletFileSafeUpdate([ \
+                     [WLT_UPDATE_MODIFY, byteLocation + 21, fixedAddrData]])
+               entry = parseAddrEntryFields(byteLocation, fixedAddrData)
+            fileIndex.keyEntries.append(entry)
+         elif dtype in (WLT_DATATYPE_ADDRCOMMENT, WLT_DATATYPE_TXCOMMENT):
+            fileIndex.otherOffsets.append(byteLocation)
+
+      fileIndex.writeIndex()
+      return fileIndex
+
+
+   #############################################################################
+   def loadLazyAddress(self, addr160, entry):
+      """ Called by LazyAddrMap the first time an entry is accessed """
+      if self.updateBatchDepth > 0:
+         # The entry may have journaled modifications
+         self.checkpointWalletJournal()
+
+      wltfile = open(self.walletPath, 'rb')
+      wltfile.seek(entry.offset)
+      entryData = wltfile.read(21 + self.pybtcaddrSize)
+      wltfile.close()
+
+      entryHead = int_to_binary(WLT_DATATYPE_KEYDATA, widthBytes=1) + addr160
+      if not entryData[:21]==entryHead:
+         # Should never happen, but don't trust this index again
+         self.fileIndex.removeIndex()
+         raise WalletAddressError('Wallet index does not match wallet file')
+
+      rawData = entryData[21:]
+      newAddr = PyBtcAddress()
+      newAddr.unserialize(rawData)
+      newAddr.walletByteLoc = entry.offset + 21
+
+      # Fix byte errors in the address data
+      fixedAddrData = newAddr.serialize()
+      if not rawData==fixedAddrData:
+         self.walletFileSafeUpdate([ \
+            [WLT_UPDATE_MODIFY, newAddr.walletByteLoc, fixedAddrData]])
+
+      if newAddr.useEncryption:
+         newAddr.isLocked = True
+         if not self.isLocked and self.kdfKey:
+            newAddr.unlock(self.kdfKey)
+
+      if newAddr.chainIndex < -2:
+         newAddr.chainIndex = -2
+      return newAddr
+
+
+   #############################################################################
+   def updateFileIndex(self, updateList, updateLocations, oldWalletSize, \
+                                            binaryToAppend, dataToChange):
+      """
+      Mirror a successful walletFileSafeUpdate in the side-car index, so
+      that a lazily-loaded wallet stays warm across its own writes.  The
+      last three arguments are what serializeWalletUpdate produced for it,
+      and keep the index fingerprint current without reading the wallet.
+      """
+      self.fileIndex.recordWalletWrite(oldWalletSize, binaryToAppend, \
+                                                      dataToChange)
+      newKeyEntries, newOtherOffsets = [], []
+      modifiedEntries, deletedOffsets = [], []
+      for entry,loc in zip(updateList, updateLocations):
+         if entry[0]==WLT_UPDATE_ADD:
+            if entry[1]==WLT_DATATYPE_KEYDATA:
+               addr = entry[3]
+               newKeyEntries.append(LazyAddrEntry(loc, entry[2], \
+                                                  addr.chainIndex, \
+                                                  list(addr.timeRange), \
+                                                  list(addr.blkRange)))
+            else:
+               newOtherOffsets.append(loc)
+            continue
+
+         # A whole address entry rewritten in place, e.g. touched with new
+         # first/last seen times.  The addr160 checksum tells it apart from
+         # any other overwrite.
+         modified = None
+         if len(entry[2])==self.pybtcaddrSize:
+            modified = parseAddrEntryFields(loc - 21, entry[2])
+
+         if modified is not None:
+            modifiedEntries.append(modified)
+         elif entry[2][:1]==int_to_binary(WLT_DATATYPE_DELETED, widthBytes=1):
+            deletedOffsets.append(loc)
+
+      self.fileIndex.updateEntries(newKeyEntries, newOtherOffsets, \
+                                   modifiedEntries, deletedOffsets)
+
+
    #############################################################################
    def walletFileSafeUpdate(self, updateList):
             
@@ -2282,18 +2706,49 @@ class PyBtcWallet(object):
       if len(updateList)==0:
          return []
 
-      # Make sure that the primary and backup files are synced before update
-      self.doWalletFileConsistencyCheck()
+      serialized = self.serializeWalletUpdate(updateList)
+      if serialized is None:
+         return []
+      binaryToAppend, dataToChange, relLocations = serialized
+
+      if self.updateBatchDepth > 0:
+         # Committed once it's in the journal, the wallet and backup files
+         # catch up at the next checkpoint
+         oldWalletSize = self.getWalletJournal().commit(binaryToAppend, \
+                                                        dataToChange)
+         if oldWalletSize is None:
+            return []
+      else:
+         # Make sure that the primary and backup files are synced before update
+         self.doWalletFileConsistencyCheck()
+         oldWalletSize = os.path.getsize(self.walletPath)
+         if not self.applyWalletUpdate(binaryToAppend, dataToChange):
+            return []
 
-      walletFileBackup = self.getWalletPath('backup')
-      mainUpdateFlag   = self.getWalletPath('update_unsuccessful')
-      backupUpdateFlag = self.getWalletPath('backup_unsuccessful')
+      # Will be passing back info about all data successfully added
+      updateLocations = [loc + oldWalletSize if isAdd else loc \
+                                          for isAdd,loc in relLocations]
+
+      if self.fileIndex is not None:
+         indexUpdate = [updateList, updateLocations, oldWalletSize, \
+                                         binaryToAppend, dataToChange]
+         if self.updateBatchDepth > 0:
+            self.journalIndexUpdates.append(indexUpdate)
+         else:
+            self.updateFileIndex(*indexUpdate)
 
+      return updateLocations
 
-      # Will be passing back info about all data successfully added
-      oldWalletSize = os.path.getsize(self.walletPath)
-      updateLocations = []
-      dataToChange    = []
+
+   #############################################################################
+   def serializeWalletUpdate(self, updateList):
+      """
+      Returns the data to append, the [loc, data] pairs to overwrite, and
+      an [isAdd, loc] pair for each entry of updateList, where loc is relative
+      to the current end of the file for additions.  None on bad input.
+      """
+      relLocations = []
+      dataToChange = []
       toAppend = BinaryPacker()
 
       try:
@@ -2303,7 +2758,7 @@ class PyBtcWallet(object):
 
             if(modType==WLT_UPDATE_ADD):
                dtype = updateInfo[0]
-               updateLocations.append(toAppend.getSize()+oldWalletSize)
+               relLocations.append([True, toAppend.getSize()])
                if dtype==WLT_DATATYPE_KEYDATA:
                   if len(updateInfo[1])!=20 or not isinstance(updateInfo[2], PyBtcAddress):
                      raise Exception('Data type does not match update type')
@@ -2323,16 +2778,27 @@ class PyBtcWallet(object):
                   raise Exception('OP_EVAL not support in wallet yet')
 
             elif(modType==WLT_UPDATE_MODIFY):
-               updateLocations.append(updateInfo[0])
+               relLocations.append([False, updateInfo[0]])
                dataToChange.append( updateInfo )
             else:
                LOGERROR('Unknown wallet-update type!')
                raise Exception('Unknown wallet-update type!')
       except Exception:
          LOGEXCEPT('Bad input to walletFileSafeUpdate')
-         return []
+         return None
+
+      return toAppend.getBinaryString(), dataToChange, relLocations
 
-      binaryToAppend = toAppend.getBinaryString()
+
+   #############################################################################
+   def applyWalletUpdate(self, binaryToAppend, dataToChange):
+      """
+      The flagged two-file write described in walletFileSafeUpdate, used for
+      single updates and for journal checkpoints.  Returns False on failure.
+      """
+      walletFileBackup = self.getWalletPath('backup')
+      mainUpdateFlag   = self.getWalletPath('update_unsuccessful')
+      backupUpdateFlag = self.getWalletPath('backup_unsuccessful')
 
       # We need to safely modify both the main wallet file and backup
       # Start with main wallet
@@ -2360,7 +2826,7 @@ class PyBtcWallet(object):
          LOGEXCEPT('Could not write data to wallet.  Permissions?')
          shutil.copy(walletFileBackup, self.walletPath)
          os.remove(mainUpdateFlag)
-         return []
+         return False
 
       # Write backup flag before removing main-update flag.  If we see
       # both flags, we know file IO was interrupted RIGHT HERE
@@ -2394,12 +2860,94 @@ class PyBtcWallet(object):
          LOGEXCEPT('Could not write backup wallet.  Permissions?')
          shutil.copy(self.walletPath, walletFileBackup)
          os.remove(mainUpdateFlag)
-         return []
+         return False
 
       os.remove(backupUpdateFlag)
+      return True
 
-      return updateLocations
 
+   #############################################################################
+   def getWalletJournal(self):
+      if self.walletJournal is None or \
+         not self.walletJournal.walletPath==self.walletPath:
+         self.walletJournal = WalletJournal(self.walletPath)
+      return self.walletJournal
+
+
+   #############################################################################
+   def beginWalletUpdateBatch(self):
+      """
+      Until the matching endWalletUpdateBatch, walletFileSafeUpdate commits
+      each update to the write-ahead journal (one fsync, shared with any
+      other thread committing at the same time) instead of running the
+      two-file protocol.  Batches nest.  Always end them in a finally block.
+      """
+      if self.updateBatchDepth==0 and os.path.exists(self.walletPath):
+         self.doWalletFileConsistencyCheck()
+      self.updateBatchDepth += 1
+
+
+   #############################################################################
+   def endWalletUpdateBatch(self):
+      # readWalletFile resets the depth (and checkpoints) mid-batch
+      self.updateBatchDepth = max(self.updateBatchDepth - 1, 0)
+      if self.updateBatchDepth > 0:
+         return True
+      return self.checkpointWalletJournal()
+
+
+   #############################################################################
+   def checkpointWalletJournal(self):
+      """
+      Bring the wallet and backup files up to date with the journal, in a
+      single run of the two-file protocol.  Returns False if the journal
+      could not be applied, in which case it is kept for the next attempt.
+      """
+      if not os.path.exists(self.walletPath):
+         return True
+
+      journal = self.getWalletJournal()
+      if not journal.hasRecords():
+         return True
+
+      tstart = RightNow()
+      nRecords = [0]
+      def applyRecords(records):
+         nRecords[0] = len(records)
+         baseSize = records[0][0]
+         binaryToAppend = ''.join([r[1] for r in records])
+         dataToChange = [mod for r in records for mod in r[2]]
+
+         expectSize = baseSize
+         for recBase,appendData,modList in records:
+            if not recBase==expectSize:
+               LOGERROR('Wallet journal records are not contiguous!')
+               return False
+            expectSize += len(appendData)
+
+         wltSize = os.path.getsize(self.walletPath)
+         if wltSize==expectSize and len(binaryToAppend) > 0:
+            # Appended by a checkpoint that was interrupted after writing
+            # both files, only the (repeatable) modifications are left
+            binaryToAppend = ''
+         elif not wltSize==baseSize:
+            LOGERROR('Wallet journal does not match wallet file size ' \
+                     '(%d, expected %d)', wltSize, baseSize)
+            return False
+
+         return self.applyWalletUpdate(binaryToAppend, dataToChange)
+
+      if not journal.checkpoint(applyRecords):
+         return False
+
+      if self.fileIndex is not None:
+         for indexUpdate in self.journalIndexUpdates:
+            self.updateFileIndex(*indexUpdate)
+      self.journalIndexUpdates = []
+
+      LOGINFO('Checkpointed %d wallet journal records in %0.3f sec', \
+                                       nRecords[0], RightNow() - tstart)
+      return True
 
 
    #############################################################################
@@ -2460,6 +3008,9 @@ class PyBtcWallet(object):
          shutil.copy(self.walletPath, walletFileBackup)
          os.remove(backupUpdateFlag)
 
+      # Both files are now the same, replay whatever the journal committed
+      self.checkpointWalletJournal()
+
       if onlySyncBackup:
          return 0
 
@@ -2504,7 +3055,8 @@ class PyBtcWallet(object):
       #             if we just "forget" the current wallet state and re-read
       #             the wallet from file
       wltPath = self.walletPath
-      self.readWalletFile(wltPath, doScanNow=True)
+      self.readWalletFile(wltPath, doScanNow=True, \
+                          lazyLoad=(self.fileIndex is not None))
 
 
    #############################################################################
@@ -2624,6 +3176,7 @@ class PyBtcWallet(object):
          [[WLT_UPDATE_ADD, WLT_DATATYPE_KEYDATA, newAddr160, newAddr]])
       self.addrMap[newAddr160] = newAddr.copy()
       self.addrMap[newAddr160].walletByteLoc = newDataLoc[0] + 21
+      self.addrMapVersion += 1
       self.linearAddr160List.append(newAddr160)
       if self.useEncryption and self.kdfKey:
          self.addrMap[newAddr160].lock(self.kdfKey)
@@ -2802,30 +3355,38 @@ class PyBtcWallet(object):
       LOGDEBUG('Number of inputs that you can sign for: %d', numMyAddr)
 
 
-      # Unlock the wallet if necessary, sign inputs 
+      # Decrypt the keys we sign with (only those), all at once
+      lockedAddrs = dict([(addrObj.getAddr160(), addrObj) \
+                           for addrObj,idx,sigIdx in wltAddr if addrObj.isLocked])
+      if len(lockedAddrs) > 0:
+         if not self.kdfKey:
+            self.lock()
+            raise WalletLockError('Cannot sign tx without unlocking wallet')
+         self.unlockAddrList(lockedAddrs.values())
+
+      # Sign inputs, all in one batch.  One signature per (input, address)
+      # is enough, since it gets inserted in every slot for that pubkey
       maxChainIndex = -1
+      keyList = []
+      signedPairs = set()
       for addrObj,idx,sigIdx in wltAddr:
          maxChainIndex = max(maxChainIndex, addrObj.chainIndex)
-         if addrObj.isLocked:
-            if self.kdfKey:
-               if addrObj.createPrivKeyNextUnlock:
-                  self.unlock(self.kdfKey)
-               else:
-                  addrObj.unlock(self.kdfKey)
-            else:
-               self.lock()
-               raise WalletLockError('Cannot sign tx without unlocking wallet')
 
          if not addrObj.hasPubKey():
             # Make sure the public key is available for this address
             addrObj.binPublicKey65 = \
                CryptoECDSA().ComputePublicKey(addrObj.binPrivKey32_Plain)
 
+         if (idx, addrObj.getAddr160()) in signedPairs:
+            continue
+         signedPairs.add((idx, addrObj.getAddr160()))
+         keyList.append((idx, addrObj.binPrivKey32_Plain))
+
 
-         ##### MAGIC #####
-         ustx.createAndInsertSignatureForInput(idx, addrObj.binPrivKey32_Plain)
-         ##### MAGIC #####
-                                               
+      ##### MAGIC #####
+      ustx.createAndInsertSignaturesBatch(keyList, verifySigs=False)
+      ##### MAGIC #####
+      del keyList
 
       if self.useEncryption:
          self.lock()
@@ -2841,13 +3402,17 @@ class PyBtcWallet(object):
    #############################################################################
    def unlock(self, secureKdfOutput=None, \
                     securePassphrase=None, \
-                    tempKeyLifetime=0, Progress=emptyFunc):
+                    tempKeyLifetime=0, Progress=emptyFunc, onDemand=False):
       """
       We must assume that the kdfResultKey is a SecureBinaryData object
       containing the result of the KDF-passphrase.  The wallet unlocked-
       lifetime will be set to X seconds from time.time() [now] and next
       time the checkWalletLockTimeout function is called it will be re-
       locked.
+
+      With onDemand=True no private key is decrypted here:  the wallet keeps
+      the encryption key, still reports itself as locked, and signUnsignedTx
+      (see unlockAddrList) decrypts just the keys it signs with.
       """
       
       LOGDEBUG('Attempting to unlock wallet: %s', self.uniqueIDB58)
@@ -2873,6 +3438,32 @@ class PyBtcWallet(object):
       else:
          self.lockWalletAtTime = RightNow() + tempKeyLifetime
 
+      if onDemand:
+         if self.isLocked:
+            self.onDemandAddrs = set()
+            self.onDemandTopIndex = self.lastComputedChainIndex
+         LOGDEBUG('Unlocked on demand: %s', self.uniqueIDB58)
+         return
+
+      self.unlockAddrList(self.addrMap.values(), Progress)
+
+      self.isLocked = False
+      self.onDemandAddrs = None
+      LOGDEBUG('Unlock succeeded: %s', self.uniqueIDB58)
+
+
+   #############################################################################
+   def unlockAddrList(self, addrList, Progress=emptyFunc):
+      """
+      Decrypt the private keys of addrList with the key from the last
+      unlock().  Plain decryptions all go through one PyUnlockAddressList
+      call.  Keys computed for the first time (addresses created while the
+      wallet was locked) are written back to the wallet file in a single
+      walletFileSafeUpdate.
+      """
+      if not self.kdfKey:
+         raise WalletLockError('Cannot decrypt keys without unlocking wallet')
+
       #Fix to n2 unlock issue: newly chained addresses on a locked wallet 
       #cannot have their private key computed until the next unlock.
       #When that unlock takes place, certain address entries lack context
@@ -2881,18 +3472,18 @@ class PyBtcWallet(object):
       #to be able to feed the closest computed address entry to the upcoming, 
       #possibly uncomputed entries.
 
-      naddress = 1
-      addrCount = len(self.addrMap)
-         
-      addrObjPrev = None
       import operator
-      for addrObj in (sorted(self.addrMap.values(), 
-                             key=operator.attrgetter('chainIndex'))):
-         Progress(naddress, addrCount)
-         naddress = naddress +1
-         
-         needToSaveAddrAfterUnlock = addrObj.createPrivKeyNextUnlock
-         if needToSaveAddrAfterUnlock and addrObjPrev is not None:
+      sortedAddrs = sorted(addrList, key=operator.attrgetter('chainIndex'))
+      addrCount = len(sortedAddrs)
+
+      addrObjPrev = None
+      toDecrypt = []
+      updList = []
+      for naddress,addrObj in enumerate(sortedAddrs):
+         Progress(naddress+1, addrCount)
+
+         if addrObj.createPrivKeyNextUnlock:
+            if addrObjPrev is not None:
                ChainDepth = addrObj.chainIndex - addrObjPrev.chainIndex
 
                if ChainDepth > 0 and addrObjPrev.chainIndex > -1:
@@ -2903,17 +3494,33 @@ class PyBtcWallet(object):
 
                   addrObj.createPrivKeyNextUnlock_ChainDepth  = ChainDepth
 
-         addrObj.unlock(self.kdfKey)
+            addrObj.unlock(self.kdfKey)
+            updList.append([WLT_UPDATE_MODIFY, addrObj.walletByteLoc, \
+                                               addrObj.serialize()])
+         else:
+            toDecrypt.append(addrObj)
+
          if addrObj.chainIndex > -1: addrObjPrev = addrObj
 
-         if needToSaveAddrAfterUnlock:
-            updateLoc = addrObj.walletByteLoc 
-            self.walletFileSafeUpdate( [[WLT_UPDATE_MODIFY, 
-                                         addrObj.walletByteLoc,
-                                         addrObj.serialize()]])
+      PyUnlockAddressList(toDecrypt, self.kdfKey)
 
-      self.isLocked = False
-      LOGDEBUG('Unlock succeeded: %s', self.uniqueIDB58)
+      self.recordOnDemandKeys(sortedAddrs)
+
+      if len(updList) > 0 and not self.walletFileSafeUpdate(updList):
+         # The keys are still computed again on the next unlock
+         LOGERROR('Could not write %d newly computed private keys to ' \
+                  'wallet %s', len(updList), self.uniqueIDB58)
+
+   ############################################################################
+   def recordOnDemandKeys(self, addrList):
+      """
+      After unlock(onDemand=True), remember every address whose private key
+      may have been decrypted, so that lock() knows to lock it again.
+      extendAddressChain decrypts the parent it extends from and leaves it
+      that way, and the new addresses may be left decrypted too.
+      """
+      if self.onDemandAddrs is not None:
+         self.onDemandAddrs.update([a.getAddr160() for a in addrList])
 
    ############################################################################
    def lock(self, Progress=emptyFunc):
@@ -2950,10 +3557,20 @@ class PyBtcWallet(object):
       #       kdfKey because we saved the encrypted versions before unlocking
       if self.useEncryption:
          LOGDEBUG('Attempting to lock wallet: %s', self.uniqueIDB58)
+         if self.isLocked and self.onDemandAddrs is not None:
+            # Only the keys decrypted on demand, the chain tip at unlock time,
+            # and addresses computed since then can be holding plaintext
+            lockList = list(self.onDemandAddrs)
+            for i in range(self.onDemandTopIndex, self.lastComputedChainIndex+1):
+               if i in self.chainIndexMap:
+                  lockList.append(self.chainIndexMap[i])
+         else:
+            lockList = self.addrMap.keys()
+
          i=1
-         nAddr = len(self.addrMap)
+         nAddr = len(lockList)
          try:
-            for addr160,addrObj in self.addrMap.iteritems():
+            for addr160 in lockList:
                Progress(i, nAddr)
                i = i +1
                
@@ -2963,6 +3580,7 @@ class PyBtcWallet(object):
                self.kdfKey.destroy()
                self.kdfKey = None
             self.isLocked = True
+            self.onDemandAddrs = None
          except WalletLockError:
             LOGERROR('Locking wallet requires encryption key.  This error')
             LOGERROR('Usually occurs on newly-encrypted wallets that have')
@@ -3165,6 +3783,11 @@ def getSuffixedPath(walletPath, nameSuffix):
 
 # Putting this at the end because of the circular dependency
 from armoryengine.BDM import TheBDM, getCurrTimeAndBlock
-from armoryengine.PyBtcAddress import PyBtcAddress
+from armoryengine.PyBtcAddress import PyBtcAddress, PyUnlockAddressList
 from armoryengine.Transaction import *
 from armoryengine.Script import scriptPushData
+from armoryengine.UtxoIndex import UtxoIndex
+from armoryengine.ChainedKeyCache import ChainedKeyCache, getChainCachePath
+from armoryengine.WalletJournal import WalletJournal
+from armoryengine.WalletFileIndex import WalletFileIndex, LazyAddrMap, \
+   LazyAddrEntry, parseAddrEntryFields
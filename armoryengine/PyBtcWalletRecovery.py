@@ -5,6 +5,7 @@ from armoryengine.ArmoryUtils import UINT32_MAX, KeyDataError, \
 from armoryengine.BinaryPacker import UINT16, UINT32, UINT64, INT64, \
                                       BINARY_CHUNK
 from armoryengine.PyBtcAddress import PyBtcAddress
+from armoryengine.ChainedKeyCache import PyVerifyChainLinks
 from armoryengine.PyBtcWallet import (PyBtcWallet, WLT_DATATYPE_KEYDATA, \
                                       WLT_DATATYPE_ADDRCOMMENT, \
                                       WLT_DATATYPE_TXCOMMENT, \
@@ -719,6 +720,36 @@ class PyBtcWalletRecovery(object):
 
 
 
+      #check all public key links up front: each link only depends on the two
+      #entries it connects, so they can be verified on all cores at once
+      pubLinks = []
+      pubLinkIDs = []
+      pubLinkFailed = []
+      for i in addrDict:
+         newAddr = addrDict[i][0]
+         if newAddr.chainIndex <= 0 or not newAddr.hasPubKey():
+            continue
+         seq = newAddr.chainIndex -1
+         while seq > -1:
+            if seq in addrDict: break
+            seq = seq -1
+         if seq not in addrDict:
+            continue
+
+         prevAddr = addrDict[seq][0]
+         if not CryptoECDSA().VerifyPublicKeyValid(prevAddr.binPublicKey65):
+            #can't chain from a point that isn't on the curve, don't hand it
+            #to the workers
+            pubLinkFailed.append(i)
+            continue
+         pubLinks.append([prevAddr.binPublicKey65.toBinStr(), \
+                          prevAddr.chaincode.toBinStr(), \
+                          newAddr.chainIndex - seq, \
+                          newAddr.binPublicKey65.toBinStr()])
+         pubLinkIDs.append(i)
+      pubLinkValid = dict(zip(pubLinkIDs, PyVerifyChainLinks(pubLinks)))
+      pubLinkValid.update([(i, False) for i in pubLinkFailed])
+
       #chained key pairs. for rmode is 4, no need to skip this part, 
       #naddress will be 0
       n=0
@@ -787,14 +818,7 @@ class PyBtcWalletRecovery(object):
 
             #check public address chain
             if newAddr.hasPubKey():
-               cid = 0
-               extended = prevAddr.binPublicKey65
-               while cid < gap:
-                  extended = CryptoECDSA().ComputeChainedPublicKey( \
-                                                extended, prevAddr.chaincode)
-                  cid = cid +1
-
-               if extended.toHexStr() != newAddr.binPublicKey65.toHexStr():
+               if not pubLinkValid.get(i, True):
                   self.forkedPublicKeyChain.append([newAddr.chainIndex, \
                                                     byteLocation])
                   isPubForked = True
@@ -12,64 +12,183 @@
 ################################################################################
 from armoryengine.ArmoryUtils import *
 from armoryengine.BinaryPacker import UINT8, BINARY_CHUNK, UINT16, UINT32
-from armoryengine.BinaryUnpacker import BinaryUnpacker
+from armoryengine.BinaryUnpacker import BinaryUnpacker, UnpackerError
 from armoryengine.Timer import TimeThisFunction
 from armoryengine.Transaction import *
 
 
-def convertScriptToOpStrings(binScript):
-   opList = []
+################################################################################
+# Scripts are split into ops once and kept in compiledScriptCache, keyed by
+# the script itself.  Each op is (opcode, pushData, endPos):  pushData is the
+# pushed string for OP_PUSHDATA* and the direct push opcodes (None for all
+# other opcodes), and endPos is the offset just past the op.  A push that
+# runs off the end of the script is the last op, with endPos None and
+# whatever data was left as pushData.
+SCRIPT_CACHE_SIZE = 20000
+compiledScriptCache = LRUCache(SCRIPT_CACHE_SIZE)
+
+SCRIPT_TEMPLATE = enum('NONSTANDARD', 'P2PKH', 'P2SH', 'P2PK', 'MULTISIG')
+
+# Length-prefix width of OP_PUSHDATA1/2/4
+PUSHDATA_LEN_BYTES = {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}
 
-   i = 0;
+
+################################################################################
+def tokenizeScript(binScript):
+   ops = []
+   i  = 0
    sz = len(binScript)
-   error = False;
    while i < sz:
-      nextOp = ord(binScript[i]);
-      if nextOp == 0:
-         opList.append("0")
-         i+=1
-      elif nextOp < 76:
-         opList.append('PUSHDATA(%s)' % str(nextOp))
-         binObj = binScript[i+1:i+1+nextOp]
-         opList.append('['+binary_to_hex(binObj)+']')
-         i += nextOp+1
-      elif nextOp == 76:
-         nb = binary_to_int(binScript[i+1:i+2])
-         if i+1+1+nb > sz:
-            error = True;
-            break
-         binObj = binScript[i+2:i+2+nb]
-         opList.append('OP_PUSHDATA1(%s)' % str(nb))
-         opList.append('['+binary_to_hex(binObj)+']')
-         i += nb+2
-      elif nextOp == 77:
-         nb = binary_to_int(binScript[i+1:i+3]);
-         if i+1+2+nb > sz:
-            error = True;
-            break
-         nbprint = min(nb,256)
-         binObj = binScript[i+3:i+3+nbprint]
-         opList.append('OP_PUSHDATA2(%s)' % str(nb))
-         opList.append('['+binary_to_hex(binObj)[:512] + '...]')
-         i += nb+3
-      elif nextOp == 78:
-         nb = binScript[i+1:i+5];
-         if i+1+4+nb > sz:
-            error = True;
+      opcode = ord(binScript[i])
+      i += 1
+      if 0 < opcode < 76:
+         nBytes = opcode
+      elif opcode in PUSHDATA_LEN_BYTES:
+         nLen = PUSHDATA_LEN_BYTES[opcode]
+         if i+nLen > sz:
+            ops.append((opcode, binScript[i:], None))
             break
-         nbprint = min(nb,256)
-         binObj = binScript[i+5,i+5+nbprint]
-         opList.append('[OP_PUSHDATA4(%s)]' % str(nb))
-         opList.append('['+binary_to_hex(binObj)[:512] + '...]')
-         i += nb+5
+         nBytes = binary_to_int(binScript[i:i+nLen])
+         i += nLen
       else:
-         opList.append(opnames[nextOp]);
-         i += 1
+         ops.append((opcode, None, i))
+         continue
+
+      if i+nBytes > sz:
+         ops.append((opcode, binScript[i:], None))
+         break
+      ops.append((opcode, binScript[i:i+nBytes], i+nBytes))
+      i += nBytes
+
+   return ops
 
-   if error:
-      opList.append("ERROR PROCESSING SCRIPT");
 
-   return opList;
+################################################################################
+def isPushOp(op):
+   return op[1] is not None and op[2] is not None
+
+
+################################################################################
+def matchScriptTemplate(ops):
+   """
+   Returns (SCRIPT_TEMPLATE.*, templateData).  templateData is the hash160
+   for P2PKH and P2SH, the public key for P2PK and (M, [pubKeys]) for
+   bare multisig.
+   """
+   opcodes = [op[0] for op in ops]
+   if len(ops)==5 and isPushOp(ops[2]) and len(ops[2][1])==20 and \
+      opcodes[:2]==[OP_DUP, OP_HASH160] and \
+      opcodes[3:]==[OP_EQUALVERIFY, OP_CHECKSIG]:
+      return SCRIPT_TEMPLATE.P2PKH, ops[2][1]
+
+   if len(ops)==3 and isPushOp(ops[1]) and len(ops[1][1])==20 and \
+      opcodes[0]==OP_HASH160 and opcodes[2]==OP_EQUAL:
+      return SCRIPT_TEMPLATE.P2SH, ops[1][1]
+
+   if len(ops)==2 and isPushOp(ops[0]) and len(ops[0][1]) in [33,65] and \
+      opcodes[1]==OP_CHECKSIG:
+      return SCRIPT_TEMPLATE.P2PK, ops[0][1]
+
+   if len(ops)>=4 and opcodes[-1]==OP_CHECKMULTISIG and \
+      OP_1 <= opcodes[0] <= OP_16 and OP_1 <= opcodes[-2] <= OP_16:
+      M = opcodes[0]  - OP_1 + 1
+      N = opcodes[-2] - OP_1 + 1
+      keyOps = ops[1:-2]
+      if M<=N and len(keyOps)==N and \
+         all([isPushOp(op) and len(op[1]) in [33,65] for op in keyOps]):
+         return SCRIPT_TEMPLATE.MULTISIG, (M, [op[1] for op in keyOps])
+
+   return SCRIPT_TEMPLATE.NONSTANDARD, None
+
+
+################################################################################
+class CompiledScript(object):
+   """
+   A script split into ops, the standard template it matches (if any), and
+   for push-only scripts, the stack they leave behind.  Get these through
+   compileScript(), which caches them.
+   """
+   def __init__(self, binScript):
+      self.binScript = binScript
+      self.ops = tokenizeScript(binScript)
+      self.isTruncated = len(self.ops)>0 and self.ops[-1][2] is None
+      self.template, self.templateData = matchScriptTemplate(self.ops)
+
+      # What PyScriptProcessor would push for each op, if they're all pushes
+      self.stackValues = None
+      if not self.isTruncated:
+         stackValues = []
+         for opcode,pushData,endPos in self.ops:
+            if pushData is not None:
+               stackValues.append(pushData)
+            elif opcode == OP_FALSE:
+               stackValues.append(0)
+            elif opcode == OP_1NEGATE:
+               stackValues.append(-1)
+            elif OP_1 <= opcode <= OP_16:
+               stackValues.append(opcode - OP_1 + 1)
+            else:
+               break
+         else:
+            self.stackValues = stackValues
+
+
+################################################################################
+def compileScript(binScript):
+   compiled = compiledScriptCache.get(binScript)
+   if compiled is None:
+      compiled = CompiledScript(binScript)
+      compiledScriptCache.put(binScript, compiled)
+   return compiled
+
+
+################################################################################
+def getScriptTemplate(binScript):
+   compiled = compileScript(binScript)
+   return compiled.template, compiled.templateData
+
+
+################################################################################
+def convertScriptToOpStrings(binScript):
+   opList = []
+   for opcode,pushData,endPos in compileScript(binScript).ops:
+      if endPos is None and not 0 < opcode < 76:
+         opList.append("ERROR PROCESSING SCRIPT")
+      elif opcode == 0:
+         opList.append("0")
+      elif opcode < 76:
+         opList.append('PUSHDATA(%s)' % str(opcode))
+         opList.append('['+binary_to_hex(pushData)+']')
+      elif opcode == OP_PUSHDATA1:
+         opList.append('OP_PUSHDATA1(%s)' % str(len(pushData)))
+         opList.append('['+binary_to_hex(pushData)+']')
+      elif opcode == OP_PUSHDATA2:
+         opList.append('OP_PUSHDATA2(%s)' % str(len(pushData)))
+         opList.append('['+binary_to_hex(pushData[:256]) + '...]')
+      elif opcode == OP_PUSHDATA4:
+         opList.append('[OP_PUSHDATA4(%s)]' % str(len(pushData)))
+         opList.append('['+binary_to_hex(pushData[:256]) + '...]')
+      else:
+         opList.append(opnames[opcode])
+
+   return opList
+
+
+################################################################################
+# Public keys that PyScriptProcessor.checkSig has already found on the curve
+validPubKeyCache = LRUCache(SCRIPT_CACHE_SIZE)
+
+def checkScriptPubKey(binPubKey):
+   """
+   The checks PyBtcAddress.createFromPublicKey does on a key from a script,
+   raising KeyDataError the same way, without building the address object
+   """
+   if not (isinstance(binPubKey, str) and len(binPubKey)==65):
+      raise KeyDataError, 'Unknown public key format!'
+   if validPubKeyCache.get(binPubKey) is None:
+      if not CryptoECDSA().VerifyPublicKeyValid(SecureBinaryData(binPubKey)):
+         raise KeyDataError, 'Supplied public key is not on secp256k1 curve'
+      validPubKeyCache.put(binPubKey, True)
 
 
 def pprintScript(binScript, nIndent=0):
@@ -147,6 +266,7 @@ class PyScriptProcessor(object):
       self.txNew   = None
       self.script1 = None
       self.script2 = None
+      self.sigHashCtx = None
       if txOldData and txNew and not txInIndex==None:
          self.setTxObjects(txOldData, txNew, txInIndex)
 
@@ -161,7 +281,7 @@ class PyScriptProcessor(object):
       It is acceptable to pass in the full TxOut or the tx of the
       TxOut instead of just the script itself.
       """
-      self.txNew = PyTx().unserialize(txNew.serialize())
+      self.txNew = txNew.copy()
       self.script1 = str(txNew.inputs[txInIndex].binScript) # copy
       self.txInIndex  = txInIndex
       self.txOutIndex = txNew.inputs[txInIndex].outpoint.txOutIndex
@@ -188,6 +308,11 @@ class PyScriptProcessor(object):
       if self.script1==None or self.txNew==None:
          raise VerifyScriptError, 'Cannot verify transactions, without setTxObjects call first!'
 
+      # Standard scripts have dedicated paths, anything else is executed
+      isValid = self.verifyStandardScripts(self.script1, self.script2)
+      if isValid is not None:
+         return isValid
+
       # Execute TxIn script first
       self.stack = []
       exitCode1 = self.executeScript(self.script1, self.stack)
@@ -203,14 +328,90 @@ class PyScriptProcessor(object):
       return self.stack[-1]==1
 
 
+   def verifyStandardScripts(self, txInScript, txOutScript):
+      """
+      Gives the same result as executing txInScript then txOutScript, for a
+      TxOut script matching one of the standard templates spent by a
+      push-only TxIn script of the expected shape.  Returns None if the
+      pair doesn't fit, and has to be executed op by op instead.
+
+      As with executing it, a P2SH redeem script is only hashed and compared,
+      not evaluated.  Bare multisig goes through the keys and signatures
+      from the top of the stack down, the same as OP_CHECKMULTISIG.
+      """
+      outScript = compileScript(txOutScript)
+      if outScript.template == SCRIPT_TEMPLATE.NONSTANDARD:
+         return None
+
+      pushes = compileScript(txInScript).stackValues
+      if not pushes:
+         return None
+
+      template,tmplData = outScript.template, outScript.templateData
+      checkSig = lambda sig,pub: self.checkSig(sig, pub, txOutScript,
+                                               self.txNew, self.txInIndex)
+      if template == SCRIPT_TEMPLATE.P2PKH:
+         if not len(pushes)==2 or not all([isinstance(p,str) for p in pushes]):
+            return None
+         binSig, binPubKey = pushes
+         if not hash160(binPubKey) == tmplData:
+            # This is where OP_EQUALVERIFY fails
+            raise VerifyScriptError, ('Second script failed!  Exit Code: ' + \
+                                                             str(TX_INVALID))
+         return checkSig(binSig, binPubKey)
+
+      elif template == SCRIPT_TEMPLATE.P2PK:
+         if not len(pushes)==1 or not isinstance(pushes[0], str):
+            return None
+         return checkSig(pushes[0], tmplData)
+
+      elif template == SCRIPT_TEMPLATE.P2SH:
+         redeemScript = pushes[-1] if isinstance(pushes[-1], str) else ''
+         return hash160(redeemScript) == tmplData
+
+      elif template == SCRIPT_TEMPLATE.MULTISIG:
+         M, pubKeys = tmplData
+         sigList = pushes[1:]
+         if not pushes[0]==0 or not len(sigList)==M or \
+            not all([isinstance(sig,str) for sig in sigList]):
+            return None
+
+         iSig, iKey = M-1, len(pubKeys)-1
+         while iSig >= 0:
+            if self.checkMultiSigKey(sigList[iSig], pubKeys[iKey], txOutScript):
+               iSig -= 1
+            iKey -= 1
+            if iSig > iKey:
+               return False
+         return True
+
+      return None
+
+
+   def getSigHashContext(self, pytx):
+      if self.sigHashCtx is None or not self.sigHashCtx.isCurrent(pytx):
+         self.sigHashCtx = SigHashContext(pytx)
+      return self.sigHashCtx
+
+
    def executeScript(self, binaryScript, stack=[]):
       self.stack = stack
       self.stackAlt  = []
-      scriptData = BinaryUnpacker(binaryScript)
+      scriptData = None
       self.lastOpCodeSepPos = None
 
-      while scriptData.getRemainingSize() > 0:
-         opcode = scriptData.get(UINT8)
+      for opcode,pushData,endPos in compileScript(binaryScript).ops:
+         if endPos is None:
+            # Same as reading past the end of the script
+            raise UnpackerError
+         if pushData is not None:
+            self.stack.append(pushData)
+            continue
+
+         # The remaining opcodes may need the script and the position in it
+         if scriptData is None:
+            scriptData = BinaryUnpacker(binaryScript)
+         scriptData.resetPosition(endPos)
          exitCode = self.executeOpCode(opcode, scriptData, self.stack, self.stackAlt)
          if not exitCode == SCRIPT_NO_ERROR:
             if exitCode==OP_NOT_IMPLEMENTED:
@@ -241,6 +442,19 @@ class PyScriptProcessor(object):
       return False
 
 
+   def checkMultiSigKey(self, binSig, binPubKey, txOutScript, lastOpCodeSep=None):
+      """
+      checkSig for one sig-key pair of OP_CHECKMULTISIG.  A key that isn't a
+      valid public key doesn't match any signature, as in the reference
+      client, instead of failing the whole script.
+      """
+      try:
+         return self.checkSig(binSig, binPubKey, txOutScript, self.txNew,
+                              self.txInIndex, lastOpCodeSep)
+      except KeyDataError:
+         return False
+
+
    def checkSig(self,binSig, binPubKey, txOutScript, txInTx, txInIndex, lastOpCodeSep=None):
       """
       Generic method for checking Bitcoin tx signatures.  This needs to be used for both
@@ -267,30 +481,25 @@ class PyScriptProcessor(object):
          LOGERROR('Non-unity hashtypes not implemented yet! (hashtype = %d)', hashtype)
          assert(False)
 
-      # 5. Make a copy of the transaction -- we will be hashing a modified version
-      txCopy = PyTx().unserialize( txInTx.serialize() )
-
       # 6. Remove all OP_CODESEPARATORs
       subscript.replace( int_to_binary(OP_CODESEPARATOR), '')
 
-      # 7. All the TxIn scripts in the copy are blanked (set to empty string)
-      for txin in txCopy.inputs:
-         txin.binScript = ''
-
-      # 8. Script for the current input in the copy is set to subscript
-      txCopy.inputs[txInIndex].binScript = subscript
+      # 5,7,8. The tx with all TxIn scripts blanked and the subscript in the
+      #        current input:  the blanked tx is only serialized once per tx
+      #        and the subscript spliced into it
+      sigHashCtx = self.getSigHashContext(txInTx)
 
       # 9. Prepare the signature and public key
-      senderAddr = PyBtcAddress().createFromPublicKey(binPubKey)
-      binHashCode = int_to_binary(hashtype, widthBytes=4)
-      toHash = txCopy.serialize() + binHashCode
+      checkScriptPubKey(binPubKey)
+      toHash = sigHashCtx.getPreHashMsg(txInIndex, subscript, hashtype)[0]
 
       # Hashes are computed as part of CppBlockUtils::CryptoECDSA methods
       ##hashToVerify = hash256(toHash)
       ##hashToVerify = binary_switchEndian(hashToVerify)
 
-      # 10. Apply ECDSA signature verification
-      if senderAddr.verifyDERSignature(toHash, justSig):
+      # 10. Apply ECDSA signature verification (justSig is binSig without
+      #     the hashcode byte, which getRSFromDERSig ignores anyway)
+      if verifyPreHashSignature(toHash, binSig, binPubKey):
          return True
       else:
          return False
@@ -642,26 +851,22 @@ class PyScriptProcessor(object):
          if nSigs < 0 or nSigs > nKeys:
             return TX_INVALID
 
-         iSig = i
          i += 1
+         iSig = i
          i += nSigs
          if len(stack) < i:
             return TX_INVALID
 
-         stack.pop()
-
          # Apply the ECDSA verification to each of the supplied Sig-Key-pairs
          enoughSigsMatch = True
          while enoughSigsMatch and nSigs > 0:
             binSig = stack[-iSig]
             binKey = stack[-iKey]
 
-            if( self.checkSig(binSig, \
-                              binKey, \
-                              scriptUnpacker.getBinaryString(), \
-                              self.txNew, \
-                              self.txInIndex, \
-                              self.lastOpCodeSepPos) ):
+            if( self.checkMultiSigKey(binSig, \
+                                      binKey, \
+                                      scriptUnpacker.getBinaryString(), \
+                                      self.lastOpCodeSepPos) ):
                iSig  += 1
                nSigs -= 1
 
@@ -672,7 +877,8 @@ class PyScriptProcessor(object):
                enoughSigsMatch = False
 
          # Now pop the things off the stack, we only accessed in-place before
-         while i > 1:
+         # (that includes the extra item the reference client also pops)
+         while i > 0:
             i -= 1
             stack.pop()
 
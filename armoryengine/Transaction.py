@@ -6,7 +6,9 @@
 #                                                                              #
 ################################################################################
 import logging
+import multiprocessing
 import os
+from multiprocessing.pool import ThreadPool
 
 import CppBlockUtils as Cpp
 from armoryengine.ArmoryUtils import *
@@ -17,6 +19,21 @@ from armoryengine.AsciiSerialize import AsciiSerializable
 
 UNSIGNED_TX_VERSION = 1
 
+# Below this many signatures to create or check, starting worker threads
+# costs more than it saves
+USTX_MIN_PARALLEL = 8
+
+# ECDSA verification results, keyed by (hash256(preHashMsg), pubKey, sigStr).
+# One cache for the whole process, so every UnsignedTransaction, USTXI and
+# promissory note checking the same signature shares the result.
+SIG_VERIFY_CACHE_SIZE = 20000
+sigVerifyCache = LRUCache(SIG_VERIFY_CACHE_SIZE)
+
+# put_many() schemas for the hot serialization paths
+OUTPOINT_SCHEMA = [(BINARY_CHUNK,32), UINT32]
+TXIN_SCHEMA     = [(BINARY_CHUNK,32), UINT32, VAR_STR, UINT32]
+TXOUT_SCHEMA    = [UINT64, VAR_STR]
+
 ################################################################################
 # Identify all the codes/strings that are needed for dealing with scripts
 ################################################################################
@@ -454,6 +471,15 @@ def TxInExtractPreImageIfAvail(txinObj):
 
 #####
 class BlockComponent(object):
+   """
+   Components that implement getRawSnapshot() can remember the raw bytes
+   they were unserialized from (or last serialized to), together with a
+   snapshot of the fields those bytes encode.  As long as the fields still
+   match the snapshot, the raw bytes are the serialization and don't need
+   to be packed again.
+   """
+   rawData     = None
+   rawSnapshot = None
 
    def copy(self):
       return self.__class__().unserialize(self.serialize())
@@ -464,6 +490,19 @@ class BlockComponent(object):
    def unserialize(self):
       raise NotImplementedError
 
+   def getRawSnapshot(self):
+      raise NotImplementedError
+
+   def setRawData(self, rawData):
+      self.rawData     = rawData
+      self.rawSnapshot = self.getRawSnapshot()
+
+   def getRawData(self):
+      """ The remembered serialization, or None if anything changed since """
+      if self.rawData is None or not self.getRawSnapshot()==self.rawSnapshot:
+         return None
+      return self.rawData
+
 ################################################################################
 class PyOutPoint(BlockComponent):
    def __init__(self, txHash=None, txOutIndex=None):
@@ -487,11 +526,13 @@ class PyOutPoint(BlockComponent):
       return self
 
    def serialize(self):
-      binOut = BinaryPacker()
-      binOut.put(BINARY_CHUNK, self.txHash)
-      binOut.put(UINT32, self.txOutIndex)
+      binOut = BinaryPacker(36)
+      self.serializeInto(binOut)
       return binOut.getBinaryString()
 
+   def serializeInto(self, binOut):
+      binOut.put_many(OUTPOINT_SCHEMA, [self.txHash, self.txOutIndex])
+
    def pprint(self, nIndent=0, endian=BIGENDIAN):
       indstr = indent*nIndent
       print indstr + 'OutPoint:'
@@ -514,24 +555,50 @@ class PyTxIn(BlockComponent):
       else:
          txInData = BinaryUnpacker( toUnpack )
 
+      startPos = txInData.getPosition()
       self.outpoint  = PyOutPoint().unserialize(txInData.get(BINARY_CHUNK, 36) )
 
       scriptSize     = txInData.get(VAR_INT)
       if txInData.getRemainingSize() < scriptSize+4: raise UnserializeError
       self.binScript = txInData.get(BINARY_CHUNK, scriptSize)
       self.intSeq    = txInData.get(UINT32)
+      self.setRawData(txInData.getSlice(startPos, txInData.getPosition()))
       return self
 
+   def getRawSnapshot(self):
+      return (self.outpoint.txHash, self.outpoint.txOutIndex,
+              self.binScript, self.intSeq)
+
    def getScript(self):
       return self.binScript
 
    def serialize(self):
-      binOut = BinaryPacker()
-      binOut.put(BINARY_CHUNK, self.outpoint.serialize() )
-      binOut.put(VAR_INT, len(self.binScript))
-      binOut.put(BINARY_CHUNK, self.binScript)
-      binOut.put(UINT32, self.intSeq)
-      return binOut.getBinaryString()
+      rawData = self.getRawData()
+      if rawData is None:
+         binOut = BinaryPacker(len(self.binScript) + 50)
+         binOut.put_many(TXIN_SCHEMA, [self.outpoint.txHash,
+                                       self.outpoint.txOutIndex,
+                                       self.binScript,
+                                       self.intSeq])
+         rawData = binOut.getBinaryString()
+         self.setRawData(rawData)
+      return rawData
+
+   def serializeInto(self, binOut):
+      binOut.put(BINARY_CHUNK, self.serialize())
+
+   def copy(self):
+      # All the fields are immutable, so the clone shares them (and the raw
+      # bytes) until one of the two is assigned something new
+      newTxIn = PyTxIn()
+      newTxIn.outpoint  = PyOutPoint(self.outpoint.txHash,
+                                     self.outpoint.txOutIndex)
+      newTxIn.binScript = self.binScript
+      newTxIn.intSeq    = self.intSeq
+      rawData = self.getRawData()
+      if rawData is not None:
+         newTxIn.setRawData(rawData)
+      return newTxIn
 
    def pprint(self, nIndent=0, endian=BIGENDIAN):
       indstr = indent*nIndent
@@ -595,12 +662,17 @@ class PyTxOut(BlockComponent):
       else:
          txOutData = BinaryUnpacker( toUnpack )
 
+      startPos = txOutData.getPosition()
       self.value       = txOutData.get(UINT64)
       scriptSize       = txOutData.get(VAR_INT)
       if txOutData.getRemainingSize() < scriptSize: raise UnserializeError
       self.binScript = txOutData.get(BINARY_CHUNK, scriptSize)
+      self.setRawData(txOutData.getSlice(startPos, txOutData.getPosition()))
       return self
 
+   def getRawSnapshot(self):
+      return (self.value, self.binScript)
+
    def getValue(self):
       return self.value
 
@@ -608,11 +680,25 @@ class PyTxOut(BlockComponent):
       return self.binScript
 
    def serialize(self):
-      binOut = BinaryPacker()
-      binOut.put(UINT64, self.value)
-      binOut.put(VAR_INT, len(self.binScript))
-      binOut.put(BINARY_CHUNK, self.binScript)
-      return binOut.getBinaryString()
+      rawData = self.getRawData()
+      if rawData is None:
+         binOut = BinaryPacker(len(self.binScript) + 17)
+         binOut.put_many(TXOUT_SCHEMA, [self.value, self.binScript])
+         rawData = binOut.getBinaryString()
+         self.setRawData(rawData)
+      return rawData
+
+   def serializeInto(self, binOut):
+      binOut.put(BINARY_CHUNK, self.serialize())
+
+   def copy(self):
+      newTxOut = PyTxOut()
+      newTxOut.value     = self.value
+      newTxOut.binScript = self.binScript
+      rawData = self.getRawData()
+      if rawData is not None:
+         newTxOut.setRawData(rawData)
+      return newTxOut
 
    def pprint(self, nIndent=0, endian=BIGENDIAN):
       """
@@ -668,18 +754,50 @@ class PyTx(BlockComponent):
       self.outputs    = UNINITIALIZED
       self.lockTime   = 0
       self.thisHash   = UNINITIALIZED
+      self.nBytes     = None
+      self.rawData    = None
+      self.rawHash    = None
+
+   def getRawSnapshot(self):
+      # The inputs and outputs are compared by identity here, and each one
+      # checks its own fields in getRawData
+      return (self.version, self.lockTime,
+              tuple(self.inputs), tuple(self.outputs))
+
+   def setRawData(self, rawData, rawHash=None):
+      BlockComponent.setRawData(self, rawData)
+      self.rawHash = rawHash
+
+   def getRawData(self):
+      rawData = BlockComponent.getRawData(self)
+      if rawData is None:
+         return None
+      for comp in self.inputs:
+         if comp.getRawData() is None:
+            return None
+      for comp in self.outputs:
+         if comp.getRawData() is None:
+            return None
+      return rawData
 
    def serialize(self):
-      binOut = BinaryPacker()
+      rawData = self.getRawData()
+      if rawData is not None:
+         return rawData
+
+      # Inputs and outputs that haven't changed just copy in their raw bytes
+      binOut = BinaryPacker(self.nBytes or 256)
       binOut.put(UINT32, self.version)
       binOut.put(VAR_INT, len(self.inputs))
       for txin in self.inputs:
-         binOut.put(BINARY_CHUNK, txin.serialize())
+         txin.serializeInto(binOut)
       binOut.put(VAR_INT, len(self.outputs))
       for txout in self.outputs:
-         binOut.put(BINARY_CHUNK, txout.serialize())
+         txout.serializeInto(binOut)
       binOut.put(UINT32, self.lockTime)
-      return binOut.getBinaryString()
+      rawData = binOut.getBinaryString()
+      self.setRawData(rawData)
+      return rawData
 
    def unserialize(self, toUnpack):
       if isinstance(toUnpack, BinaryUnpacker):
@@ -700,7 +818,11 @@ class PyTx(BlockComponent):
       self.lockTime   = txData.get(UINT32)
       endPos = txData.getPosition()
       self.nBytes = endPos - startPos
-      self.thisHash = hash256(self.serialize())
+
+      # Hash the bytes we just read, rather than serializing them again
+      rawData = txData.getSlice(startPos, endPos)
+      self.thisHash = hash256(rawData)
+      self.setRawData(rawData, self.thisHash)
       return self
 
    # Before broadcasting a transaction make sure that the script is canonical
@@ -722,13 +844,31 @@ class PyTx(BlockComponent):
       return paddingRemoved, newTx.copy()
 
    def getHash(self):
-      return hash256(self.serialize())
+      rawData = self.serialize()
+      if self.rawHash is None:
+         self.rawHash = hash256(rawData)
+      return self.rawHash
 
    def getHashHex(self, endianness=LITTLEENDIAN):
       return binary_to_hex(self.getHash(), endOut=endianness)
 
    def copy(self):
-      return PyTx().unserialize(self.serialize())
+      """
+      Clones the object structure without going through serialize and
+      unserialize.  Scripts and hashes are immutable strings, so the clone
+      shares them (and the raw bytes) until either side changes a field.
+      """
+      newTx = PyTx()
+      newTx.version  = self.version
+      newTx.inputs   = [txin.copy()  for txin  in self.inputs]
+      newTx.outputs  = [txout.copy() for txout in self.outputs]
+      newTx.lockTime = self.lockTime
+      rawData = self.getRawData()
+      if rawData is not None:
+         newTx.setRawData(rawData, self.rawHash)
+      newTx.thisHash = newTx.getHash()
+      newTx.nBytes   = len(newTx.serialize())
+      return newTx
 
 
    def makeRecipientsList(self):
@@ -816,6 +956,103 @@ class PyTx(BlockComponent):
 
 
 
+################################################################################
+def readRawTx(txData):
+   """
+   Advance the unpacker past exactly one serialized transaction and return
+   its raw bytes.  Only the length fields are read, no PyTxIn/PyTxOut
+   objects are built.
+   """
+   startPos = txData.getPosition()
+   txData.advance(4)
+   for i in xrange(txData.get(VAR_INT)):
+      txData.advance(36)
+      txData.advance(txData.get(VAR_INT) + 4)
+   for i in xrange(txData.get(VAR_INT)):
+      txData.advance(8)
+      txData.advance(txData.get(VAR_INT))
+   txData.advance(4)
+   if txData.getPosition() > txData.getSize():
+      raise UnpackerError, 'Transaction runs past the end of the data'
+   return txData.getSlice(startPos, txData.getPosition())
+
+
+################################################################################
+def lazyTxField(name):
+   attr = '_' + name
+   def getField(self):
+      if self.rawTx is not None:
+         self.materialize()
+      return getattr(self, attr)
+   def setField(self, value):
+      if self.rawTx is not None:
+         self.materialize()
+      setattr(self, attr, value)
+   return property(getField, setField)
+
+
+#####
+class LazyPyTx(PyTx):
+   """
+   A PyTx that only keeps its raw bytes and hash until somebody actually
+   looks at the version, inputs, outputs or lockTime.  Serializing or
+   hashing it never builds the PyTxIn/PyTxOut objects, which is all most
+   network consumers do with a tx (or block) they just received.
+
+   The first access to any of those fields parses the raw bytes, and from
+   then on this behaves exactly like a regular PyTx:  the raw bytes are
+   dropped, since the caller may now modify the inputs and outputs.
+   """
+   version  = lazyTxField('version')
+   inputs   = lazyTxField('inputs')
+   outputs  = lazyTxField('outputs')
+   lockTime = lazyTxField('lockTime')
+
+   def __init__(self):
+      self.rawTx = None
+      super(LazyPyTx, self).__init__()
+
+   def unserialize(self, toUnpack):
+      if isinstance(toUnpack, BinaryUnpacker):
+         txData = toUnpack
+      else:
+         txData = BinaryUnpacker( toUnpack )
+
+      # Make sure nothing from a previous unserialize sticks around
+      self.rawTx = None
+      PyTx.__init__(self)
+
+      rawTx = readRawTx(txData)
+      self.rawTx    = rawTx
+      self.nBytes   = len(rawTx)
+      self.thisHash = hash256(rawTx)
+      return self
+
+   def materialize(self):
+      rawTx, self.rawTx = self.rawTx, None
+      if rawTx is not None:
+         PyTx.unserialize(self, rawTx)
+
+   def isMaterialized(self):
+      return self.rawTx is None
+
+   def serialize(self):
+      if self.rawTx is not None:
+         return self.rawTx
+      return PyTx.serialize(self)
+
+   def getHash(self):
+      if self.rawTx is not None:
+         return self.thisHash
+      return PyTx.getHash(self)
+
+   def copy(self):
+      if self.rawTx is not None:
+         return PyTx().unserialize(self.rawTx)
+      return PyTx.copy(self)
+
+
+
 # Use to identify status of individual sigs on an UnsignedTxINPUT
 TXIN_SIGSTAT = enum('ALREADY_SIGNED',
                     'WLT_ALREADY_SIGNED',
@@ -841,6 +1078,9 @@ class InputSigningStatus(object):
       self.wltCanSign     = False
       self.wltIsRelevant  = False
       self.wltCanComplete = False
+      # Only set by UnsignedTransaction.verifySigsAllInputsBatch
+      self.validN         = None
+      self.sigsValid      = None
 
 
    def pprint(self, indent=3, lutFunc=None):
@@ -876,6 +1116,8 @@ class TxSigningStatus(object):
       self.wltIsRelevant    = False
       self.wltAlreadySigned = False
       self.wltCanComplete   = False
+      # Only set by UnsignedTransaction.verifySigsAllInputsBatch
+      self.sigsValid        = None
 
 
    def pprint(self, indent=3, lutFunc=None):
@@ -893,24 +1135,191 @@ def generatePreHashTxMsgToSign(pytx, txInIndex, prevTxOutScript, hashcode=1):
    (blank all scripts except this one, insert prev script, append hashcode)
 
    Right now only supports SIGHASH_ALL
+
+   If you need the messages for more than one input of the same tx, build
+   a SigHashContext once and call getPreHashMsg on it for each input.
    """
-   if not hashcode==1:
-      LOGERROR('Only hashcode=1 is supported at this time!')
-      LOGERROR('Requested hashcode=%d' % hashcode)
-      return None
+   return SigHashContext(pytx).getPreHashMsg(txInIndex, prevTxOutScript,
+                                             hashcode)
+
+
+################################################################################
+class SigHashContext(object):
+   """
+   The parts of the SIGHASH_ALL message that are the same for every input:
+   the tx serialized with all input scripts blanked out, and where each
+   input's (empty) script sits in it.  The message for one input is that
+   skeleton with the previous TxOut script spliced in, so signing or
+   verifying all N inputs doesn't copy and re-serialize the tx N times.
+
+   The context is tied to the PyTx it was built from, and isCurrent(pytx)
+   tells whether that tx has changed since.
+   """
+   def __init__(self, pytx):
+      self.pytx = pytx
+
+      binOut = BinaryPacker()
+      binOut.put(UINT32, pytx.version)
+      binOut.put(VAR_INT, len(pytx.inputs))
+
+      # Each entry is the offset of the one-byte (zero) script length
+      self.scriptOffsets = []
+      self.outpointIndex = {}
+      for i,txin in enumerate(pytx.inputs):
+         opStr = txin.outpoint.serialize()
+         self.outpointIndex.setdefault(opStr, i)
+         binOut.put(BINARY_CHUNK, opStr)
+         self.scriptOffsets.append(binOut.getSize())
+         binOut.put(VAR_INT, 0)
+         binOut.put(UINT32, txin.intSeq)
+
+      binOut.put(VAR_INT, len(pytx.outputs))
+      for txout in pytx.outputs:
+         txout.serializeInto(binOut)
+      binOut.put(UINT32, pytx.lockTime)
+      self.skeleton = binOut.getBinaryString()
+
+      # Remember the serialization this was built from, to detect changes
+      self.rawTx = pytx.serialize()
+
+   #############################################################################
+   def isCurrent(self, pytx):
+      return pytx is self.pytx and pytx.getRawData() is self.rawTx
+
+   #############################################################################
+   def getInputIndex(self, outpoint):
+      """ Index of the first TxIn spending this outpoint, -1 if none does """
+      return self.outpointIndex.get(outpoint.serialize(), -1)
+
+   #############################################################################
+   def getPreHashMsg(self, txInIndex, prevTxOutScript, hashcode=1):
+      if not hashcode==1:
+         LOGERROR('Only hashcode=1 is supported at this time!')
+         LOGERROR('Requested hashcode=%d' % hashcode)
+         return None
+
+      offset = self.scriptOffsets[txInIndex]
+      hashCode1  = int_to_binary(hashcode, widthBytes=1)
+      hashCode4  = int_to_binary(hashcode, widthBytes=4, endOut=LITTLEENDIAN)
+      preHashMsg = ''.join([self.skeleton[:offset],
+                            packVarInt(len(prevTxOutScript))[0],
+                            prevTxOutScript,
+                            self.skeleton[offset+1:],
+                            hashCode4])
+      return preHashMsg, hashCode1
+
 
-   # Create a copy of the tx with all scripts blanked out
-   txCopy = pytx.copy()
-   for i in range(len(txCopy.inputs)):
-      txCopy.inputs[i].binScript = ''
 
-   # Set the script of the TxIn being signed, to the previous TxOut script
-   txCopy.inputs[txInIndex].binScript = prevTxOutScript
+################################################################################
+def getDefaultSigThreads():
+   try:
+      return multiprocessing.cpu_count()
+   except NotImplementedError:
+      return 1
+
+
+################################################################################
+def mapSigJobs(jobFunc, jobList, numThreads=None):
+   """
+   map() over a thread pool.  The CryptoECDSA calls release the GIL (the
+   SWIG wrapper is built with -threads), so signing and verifying run on
+   all cores without copying anything, private keys included, out of this
+   process.  Falls back to a plain map() for short lists or if a pool
+   can't be started.
+   """
+   if numThreads is None:
+      numThreads = getDefaultSigThreads()
+
+   pool = None
+   if numThreads > 1 and len(jobList) >= USTX_MIN_PARALLEL:
+      try:
+         pool = ThreadPool(min(numThreads, len(jobList)))
+      except:
+         LOGEXCEPT('Could not start signing threads')
+
+   if pool is None:
+      return map(jobFunc, jobList)
+
+   try:
+      return pool.map(jobFunc, jobList)
+   finally:
+      pool.close()
+      pool.join()
+
+
+################################################################################
+def signTxInput(sigHashCtx, txInIndex, prevTxOutScript, hashcode, sbdPrivKey):
+   """
+   Sign TxIn txInIndex of the tx behind sigHashCtx, spending an output with
+   prevTxOutScript.  Returns the DER signature with the hashcode byte.
+   """
+   msg,hc = sigHashCtx.getPreHashMsg(txInIndex, prevTxOutScript, hashcode)
+   sbdSig = CryptoECDSA().SignData(SecureBinaryData(msg), sbdPrivKey)
+   binSig = sbdSig.toBinStr()
+   return createDERSigFromRS(binSig[:32], binSig[32:]) + hc
+
+
+################################################################################
+def verifyTxInputSignature(sigHashCtx, txInIndex, prevTxOutScript, sigStr,
+                                                                   pubKey):
+   """
+   Check a signature made by signTxInput.  Don't forget "sigStr" has the
+   1-byte hashcode at the end.  Raises if sigStr isn't a DER signature.
+   """
+   preHash = sigHashCtx.getPreHashMsg(txInIndex, prevTxOutScript,
+                                      binary_to_int(sigStr[-1]))
+   if preHash is None:
+      return False
+   return verifyPreHashSignature(preHash[0], sigStr, pubKey)
+
 
-   hashCode1  = int_to_binary(hashcode, widthBytes=1)
-   hashCode4  = int_to_binary(hashcode, widthBytes=4, endOut=LITTLEENDIAN)
-   preHashMsg = txCopy.serialize() + hashCode4
-   return preHashMsg, hashCode1
+################################################################################
+def signInputJob(sigHashCtx, job):
+   """
+   job = (txInIndex, prevTxOutScript, hashcode, sbdPrivKey).  Returns the
+   public key of sbdPrivKey and the DER signature with the hashcode byte
+   """
+   txInIndex, prevTxOutScript, hashcode, sbdPrivKey = job
+   computedPub = CryptoECDSA().ComputePublicKey(sbdPrivKey).toBinStr()
+   return computedPub, signTxInput(sigHashCtx, txInIndex, prevTxOutScript,
+                                   hashcode, sbdPrivKey)
+
+
+################################################################################
+def verifyPreHashSignature(preHashMsg, sigStr, pubKey):
+   """
+   Check the DER signature sigStr (with its hashcode byte) of preHashMsg
+   against pubKey.  Results are remembered in sigVerifyCache, so checking
+   the same signature again doesn't do any ECDSA work.
+   """
+   cacheKey = (hash256(preHashMsg), pubKey, sigStr)
+   isValid = sigVerifyCache.get(cacheKey)
+   if isValid is None:
+      rBin, sBin = getRSFromDERSig(sigStr)
+      sbdMsg = SecureBinaryData(preHashMsg)
+      sbdSig = SecureBinaryData(rBin + sBin)
+      sbdPub = SecureBinaryData(pubKey)
+      isValid = bool(CryptoECDSA().VerifyData(sbdMsg, sbdSig, sbdPub))
+      sigVerifyCache.put(cacheKey, isValid)
+   return isValid
+
+
+################################################################################
+def getSigVerifyCacheStats():
+   """ Returns (nHits, nMisses, nEntries) for sigVerifyCache """
+   return sigVerifyCache.nHits, sigVerifyCache.nMisses, len(sigVerifyCache)
+
+
+################################################################################
+def verifyInputJob(sigHashCtx, job):
+   """ job = (txInIndex, prevTxOutScript, sigStr, pubKey).  Returns a bool """
+   txInIndex, prevTxOutScript, sigStr, pubKey = job
+   try:
+      return verifyTxInputSignature(sigHashCtx, txInIndex, prevTxOutScript,
+                                    sigStr, pubKey)
+   except:
+      LOGERROR('Signature in USTXI is not a valid DER signature')
+      return False
 
 
 
@@ -1202,7 +1611,15 @@ class UnsignedTxInput(AsciiSerializable):
 
 
    #############################################################################
-   def createTxSignature(self, pytx, sbdPrivKey, hashcode=1):
+   def getSigHashContext(self, pytx, sigHashCtx=None):
+      """ Reuse sigHashCtx if it was built from pytx as it is now """
+      if sigHashCtx is None or not sigHashCtx.isCurrent(pytx):
+         sigHashCtx = SigHashContext(pytx)
+      return sigHashCtx
+
+
+   #############################################################################
+   def createTxSignature(self, pytx, sbdPrivKey, hashcode=1, sigHashCtx=None):
       """
       This might be a little confusing ... remember this is an input for a
       transaction which may not have been fully defined at the time this
@@ -1210,6 +1627,9 @@ class UnsignedTxInput(AsciiSerializable):
       and assume that this input is one of them.  Then we produce the signature
       using the CryptoECDSA module and the supplied privKey.
 
+      When signing several inputs of the same pytx, pass the same sigHashCtx
+      (SigHashContext) to each call.
+
       This returns a DER-encoded signature string with the 1-byte hashcode
       appended to the end
       """
@@ -1219,19 +1639,13 @@ class UnsignedTxInput(AsciiSerializable):
       if not computedPub in self.pubKeys:
          raise SignatureError('No PubKey that matches this privKey')
 
-      txiIdx = -1
-      for i,txin in enumerate(pytx.inputs):
-         if self.outpoint.serialize()==txin.outpoint.serialize():
-            txiIdx = i
-            break
-      else:
+      sigHashCtx = self.getSigHashContext(pytx, sigHashCtx)
+      txiIdx = sigHashCtx.getInputIndex(self.outpoint)
+      if txiIdx < 0:
          raise SignatureError('No TxIn in tx that matches this USTXI')
 
-      msg,hc = generatePreHashTxMsgToSign(pytx, txiIdx, 
-                                    self.getTxoScriptToSign(), hashcode)
-      sbdSig = CryptoECDSA().SignData(SecureBinaryData(msg), sbdPrivKey)
-      binSig = sbdSig.toBinStr()
-      return createDERSigFromRS(binSig[:32], binSig[32:]) + hc
+      return signTxInput(sigHashCtx, txiIdx, self.getTxoScriptToSign(),
+                         hashcode, sbdPrivKey)
 
 
    #############################################################################
@@ -1256,20 +1670,23 @@ class UnsignedTxInput(AsciiSerializable):
 
 
    #############################################################################
-   def createAndInsertSignature(self, pytx, sbdPrivKey, hashcode=1):
+   def createAndInsertSignature(self, pytx, sbdPrivKey, hashcode=1,
+                                                        sigHashCtx=None):
 
-      derSig = self.createTxSignature(pytx, sbdPrivKey, hashcode)
+      derSig = self.createTxSignature(pytx, sbdPrivKey, hashcode, sigHashCtx)
       computedPub = CryptoECDSA().ComputePublicKey(sbdPrivKey).toBinStr()
 
       msIdx = self.insertSignature(derSig, computedPub)
       return derSig, msIdx
 
    #############################################################################
-   def verifyTxSignature(self, pytx, sigStr, pubKey=None):
-      return (self.getValidIndexForSignature(pytx, sigStr, pubKey) >= 0)
+   def verifyTxSignature(self, pytx, sigStr, pubKey=None, sigHashCtx=None):
+      return (self.getValidIndexForSignature(pytx, sigStr, pubKey,
+                                             sigHashCtx) >= 0)
 
    #############################################################################
-   def getValidIndexForSignature(self, pytx, sigStr, pubKey=None):
+   def getValidIndexForSignature(self, pytx, sigStr, pubKey=None,
+                                                     sigHashCtx=None):
       """
       IMPORTANT:  This returns the index in the self.pubKeys list, for which
                   the signature is valid!  -1 is returned if the signature is
@@ -1277,12 +1694,9 @@ class UnsignedTxInput(AsciiSerializable):
 
                      isValid = (verifyTxSignature(...) >= 0)
       """
-      txiIdx = -1
-      for i,txin in enumerate(pytx.inputs):
-         if self.outpoint.serialize()==txin.outpoint.serialize():
-            txiIdx = i
-            break
-      else:
+      sigHashCtx = self.getSigHashContext(pytx, sigHashCtx)
+      txiIdx = sigHashCtx.getInputIndex(self.outpoint)
+      if txiIdx < 0:
          raise SignatureError('No TxIn that matches this USTXI')
 
 
@@ -1293,7 +1707,7 @@ class UnsignedTxInput(AsciiSerializable):
       # USTXI class
       if pubKey is None:
          for i,pubk in enumerate(self.pubKeys):
-            if self.verifyTxSignature(pytx, sigStr, pubk):
+            if self.verifyTxSignature(pytx, sigStr, pubk, sigHashCtx):
                return i
          return -1
 
@@ -1305,16 +1719,10 @@ class UnsignedTxInput(AsciiSerializable):
          raise KeyDataError('Supplied pubkey does not match any USTXI keys')
 
 
-      rBin, sBin = getRSFromDERSig(sigStr)
-      hashcode  = binary_to_int(sigStr[-1])
-
-      # Don't forget "sigStr" has the 1-byte hashcode at the end
-      msg = generatePreHashTxMsgToSign(pytx, txiIdx,
-            self.getTxoScriptToSign(), hashcode)[0]
-      sbdMsg = SecureBinaryData(msg)
-      sbdSig = SecureBinaryData(rBin + sBin)
-      sbdPub = SecureBinaryData(pubKey)
-      return msIndex if CryptoECDSA().VerifyData(sbdMsg, sbdSig, sbdPub) else -1
+      isValid = verifyTxInputSignature(sigHashCtx, txiIdx,
+                                       self.getTxoScriptToSign(),
+                                       sigStr, pubKey)
+      return msIndex if isValid else -1
 
    #############################################################################
    # make sure to sign the p2shScript if it is there, other wise sign the txoScript
@@ -1324,7 +1732,7 @@ class UnsignedTxInput(AsciiSerializable):
       return self.p2shScript if self.p2shScript else self.txoScript
       
    #############################################################################
-   def verifyAllSignatures(self, pytx):
+   def verifyAllSignatures(self, pytx, sigHashCtx=None):
       M = self.sigsNeeded
       N = self.keysListed
       signStat = self.evaluateSigningStatus()
@@ -1335,12 +1743,13 @@ class UnsignedTxInput(AsciiSerializable):
 
       # Now check that all the raw signatures are actually value
       numValid = 0  # we'll double check sufficient sigs
+      sigHashCtx = self.getSigHashContext(pytx, sigHashCtx)
       for i in range(signStat.N):
          if signStat.statusN[i] in [TXIN_SIGSTAT.ALREADY_SIGNED, \
                                     TXIN_SIGSTAT.WLT_ALREADY_SIGNED]:
             pub = self.pubKeys[i]
             sig = self.signatures[i]
-            if self.verifyTxSignature(pytx, sig, pub):
+            if self.verifyTxSignature(pytx, sig, pub, sigHashCtx):
                numValid +=1
             else:
                LOGERROR('Signature in USTXI is not valid')
@@ -1977,6 +2386,7 @@ class UnsignedTransaction(AsciiSerializable):
       self.lockTime        = 0
       self.ustxInputs  = []
       self.decorTxOuts = []
+      self.sigHashCtx  = None
 
       txMap   = {} if txMap   is None else txMap
       p2shMap = {} if p2shMap is None else p2shMap
@@ -2206,10 +2616,9 @@ class UnsignedTransaction(AsciiSerializable):
          LOGERROR('Cannot serialize an uninitialized tx')
          return None
 
-      bp = BinaryPacker()
-      bp.put(UINT32,       self.version)
-      bp.put(BINARY_CHUNK, MAGIC_BYTES, 4)
-      bp.put(UINT32,       self.lockTime)
+      bp = BinaryPacker(1024)
+      bp.put_many([UINT32, (BINARY_CHUNK,4), UINT32],
+                  [self.version, MAGIC_BYTES, self.lockTime])
 
       bp.put(VAR_INT,  len(self.ustxInputs))
       for ustxi in self.ustxInputs:
@@ -2390,12 +2799,109 @@ class UnsignedTransaction(AsciiSerializable):
 
 
    #############################################################################
-   def verifySigsAllInputs(self):
-      for ustxi in self.ustxInputs:
-         if not ustxi.verifyAllSignatures(self.pytxObj):
-            return False
+   def getSigHashContext(self):
+      """
+      The SigHashContext for self.pytxObj, shared by every input that is
+      signed or verified, and rebuilt only if the pytxObj has changed
+      """
+      if self.sigHashCtx is None or not self.sigHashCtx.isCurrent(self.pytxObj):
+         self.sigHashCtx = SigHashContext(self.pytxObj)
+      return self.sigHashCtx
 
-      return True
+   #############################################################################
+   def verifySigsAllInputs(self, numThreads=None):
+      return self.verifySigsAllInputsBatch(numThreads=numThreads).sigsValid
+
+   #############################################################################
+   def verifySigsAllInputsBatch(self, cppWlt=None, numThreads=None):
+      """
+      Same checks as verifySigsAllInputs, but every signature of every input
+      is verified in one batch spread over numThreads threads.  Returns the
+      evaluateSigningStatus() result with the verification filled in:
+      validN and sigsValid on each input's status, and sigsValid overall.
+      """
+      txSigStat = self.evaluateSigningStatus(cppWlt)
+      sigHashCtx = self.getSigHashContext()
+
+      # Each signature slot goes with the pubkey in the same position, so
+      # there is no need to try every pubkey for every signature
+      jobList, jobSlots = [], []
+      for ustxi,inputStat in zip(self.ustxInputs, txSigStat.statusList):
+         inputStat.validN = [False]*inputStat.N
+         if not inputStat.allSigned:
+            continue
+
+         txiIdx = sigHashCtx.getInputIndex(ustxi.outpoint)
+         if txiIdx < 0:
+            raise SignatureError('No TxIn that matches this USTXI')
+
+         for i in range(inputStat.N):
+            if inputStat.statusN[i] in [TXIN_SIGSTAT.ALREADY_SIGNED, \
+                                        TXIN_SIGSTAT.WLT_ALREADY_SIGNED]:
+               jobList.append((txiIdx, ustxi.getTxoScriptToSign(),
+                               ustxi.signatures[i], ustxi.pubKeys[i]))
+               jobSlots.append((inputStat, i))
+
+      results = mapSigJobs(lambda job: verifyInputJob(sigHashCtx, job),
+                           jobList, numThreads)
+
+      for (inputStat,i),isValid in zip(jobSlots, results):
+         inputStat.validN[i] = isValid
+         if not isValid:
+            LOGERROR('Signature in USTXI is not valid')
+
+      txSigStat.sigsValid = True
+      for inputStat in txSigStat.statusList:
+         inputStat.sigsValid = inputStat.allSigned and \
+                               sum(inputStat.validN) >= inputStat.M
+         if not inputStat.sigsValid:
+            txSigStat.sigsValid = False
+
+      return txSigStat
+
+   #############################################################################
+   def createAndInsertSignaturesBatch(self, keyList, hashcode=1, cppWlt=None,
+                                      verifySigs=True, numThreads=None):
+      """
+      keyList is [(txInIndex, sbdPrivKey), ...].  All the signatures are
+      created in one batch spread over numThreads threads, then inserted
+      just like createAndInsertSignatureForInput would.
+
+      The private keys only ever live in the local job list: they are not
+      stored on this object and never leave the process.
+
+      Returns the signing status of the tx after inserting the signatures,
+      with the signatures verified (see verifySigsAllInputsBatch) unless
+      verifySigs is False.
+      """
+      sigHashCtx = self.getSigHashContext()
+
+      jobList = []
+      for txInIndex,sbdPrivKey in keyList:
+         if txInIndex >= len(self.ustxInputs):
+            raise SignatureError('TxIn index is out of range for this USTX')
+
+         ustxi = self.ustxInputs[txInIndex]
+         txiIdx = sigHashCtx.getInputIndex(ustxi.outpoint)
+         if txiIdx < 0:
+            raise SignatureError('No TxIn in tx that matches this USTXI')
+         jobList.append((txiIdx, ustxi.getTxoScriptToSign(), hashcode,
+                         sbdPrivKey))
+
+      results = mapSigJobs(lambda job: signInputJob(sigHashCtx, job),
+                           jobList, numThreads)
+
+      # Check every key before inserting anything
+      for (txInIndex,sbdPrivKey),(computedPub,derSig) in zip(keyList, results):
+         if not computedPub in self.ustxInputs[txInIndex].pubKeys:
+            raise SignatureError('No PubKey that matches this privKey')
+
+      for (txInIndex,sbdPrivKey),(computedPub,derSig) in zip(keyList, results):
+         self.ustxInputs[txInIndex].insertSignature(derSig, computedPub)
+
+      if verifySigs:
+         return self.verifySigsAllInputsBatch(cppWlt, numThreads)
+      return self.evaluateSigningStatus(cppWlt)
 
    #############################################################################
    def verifyInputsMatchPyTxObj(self):
@@ -2468,7 +2974,8 @@ class UnsignedTransaction(AsciiSerializable):
          raise SignatureError('TxIn index is out of range for this USTX')
 
       ustxi = self.ustxInputs[txInIndex]
-      return ustxi.verifyTxSignature(self.pytxObj, sigStr, pubKey)
+      return ustxi.verifyTxSignature(self.pytxObj, sigStr, pubKey,
+                                     self.getSigHashContext())
 
 
    #############################################################################
@@ -2477,13 +2984,15 @@ class UnsignedTransaction(AsciiSerializable):
          raise SignatureError('TxIn index is out of range for this USTX')
 
       ustxi = self.ustxInputs[txInIndex]
-      ustxi.createAndInsertSignature(self.pytxObj, sbdPrivKey, hashcode)
+      ustxi.createAndInsertSignature(self.pytxObj, sbdPrivKey, hashcode,
+                                     self.getSigHashContext())
 
 
    #############################################################################
    def insertSignatureForInput(self, txInIndex, sigStr, pubKey=None):
       ustxi = self.ustxInputs[txInIndex]
-      sigIndex = ustxi.getValidIndexForSignature(self.pytxObj, sigStr, pubKey)
+      sigIndex = ustxi.getValidIndexForSignature(self.pytxObj, sigStr, pubKey,
+                                                 self.getSigHashContext())
       if sigIndex >= 0:
          ustxi.setSignature(sigIndex, sigStr)
          return sigIndex
@@ -2623,15 +3132,16 @@ class UnsignedTransaction(AsciiSerializable):
 def PyCreateAndSignTx(ustxiList, dtxoList, sbdPrivKeyMap):
    ustx = UnsignedTransaction().createFromUnsignedTxIO(ustxiList, dtxoList)
 
+   keyList = []
    for ustxiIndex in range(len(ustx.ustxInputs)):
       for scrAddr in ustx.ustxInputs[ustxiIndex].scrAddrs:
          sbdPriv = sbdPrivKeyMap.get(scrAddr)
          if sbdPriv is None:
             raise SignatureError('Supplied key map cannot sign all inputs')
-         ustx.createAndInsertSignatureForInput(ustxiIndex, sbdPriv)
+         keyList.append((ustxiIndex, sbdPriv))
 
    # Make sure everythign was good
-   if not ustx.verifySigsAllInputs():
+   if not ustx.createAndInsertSignaturesBatch(keyList).sigsValid:
       raise SignatureError('Not all signatures are present or valid')
 
    return ustx.getSignedPyTx(doVerifySigs=False) # already checked them
@@ -10,6 +10,131 @@ from armoryengine.MultiSigUtils import readLockboxEntryStr, calcLockboxID, \
                                        isBareLockbox, isP2SHLockbox
 from armoryengine.Transaction import getTxOutScriptType, getMultisigScriptInfo
 
+################################################################################
+class ScrAddrOwnerIndex(object):
+   """
+   Maps scrAddrs to the wallet or lockbox they belong to, so that ledgers and
+   RPC output can label every TxIn/TxOut with a dict lookup, instead of
+   asking every wallet and lockbox in turn.
+
+   Whoever owns the wallet map and lockbox list (ArmoryQt, armoryd) calls
+   syncWallets/syncLockboxes after adding or removing any, and
+   invalidateWallet after importing or deleting addresses.  Address pools
+   grow without telling anyone, so before a lookup is declared a miss, any
+   wallet whose addrMapVersion changed since it was indexed is re-indexed.
+   """
+
+   #############################################################################
+   def __init__(self):
+      self.lock         = threading.RLock()
+      self.wallets      = {}   # wltID --> wallet
+      self.wltVersions  = {}   # wltID --> addrMapVersion when last indexed
+      self.wltEntries   = {}   # wltID --> set of its scrAddrs
+      self.wltScrAddrs  = {}   # scrAddr --> wltID
+      self.lboxScrAddrs = {}   # p2shScrAddr --> lockbox
+
+
+   #############################################################################
+   def indexWallet(self, wlt):
+      with self.lock:
+         wltID = wlt.uniqueIDB58
+         newSet = set([SCRADDR_P2PKH_BYTE + a160 \
+                       for a160 in wlt.addrMap.iterkeys() if not a160=='ROOT'])
+         oldSet = self.wltEntries.get(wltID, set())
+         for scrAddr in oldSet - newSet:
+            if self.wltScrAddrs.get(scrAddr)==wltID:
+               del self.wltScrAddrs[scrAddr]
+         for scrAddr in newSet - oldSet:
+            # Like the old linear search, the first wallet to claim it wins
+            self.wltScrAddrs.setdefault(scrAddr, wltID)
+
+         self.wallets[wltID]     = wlt
+         self.wltVersions[wltID] = wlt.addrMapVersion
+         self.wltEntries[wltID]  = newSet
+
+
+   #############################################################################
+   def removeWallet(self, wltID):
+      with self.lock:
+         for scrAddr in self.wltEntries.pop(wltID, set()):
+            if self.wltScrAddrs.get(scrAddr)==wltID:
+               del self.wltScrAddrs[scrAddr]
+         self.wallets.pop(wltID, None)
+         self.wltVersions.pop(wltID, None)
+
+
+   #############################################################################
+   def invalidateWallet(self, wltID):
+      """ Addresses were imported into or deleted from this wallet """
+      with self.lock:
+         if wltID in self.wallets:
+            self.indexWallet(self.wallets[wltID])
+
+
+   #############################################################################
+   def syncWallets(self, wltMap):
+      """ Bring the index in line with wltMap {wltID --> PyBtcWallet} """
+      with self.lock:
+         for wltID in self.wallets.keys():
+            if not wltMap.get(wltID) is self.wallets[wltID]:
+               self.removeWallet(wltID)
+
+         for wltID,wlt in wltMap.iteritems():
+            if not wltID in self.wallets or \
+               not self.wltVersions[wltID]==wlt.addrMapVersion:
+               self.indexWallet(wlt)
+
+
+   #############################################################################
+   def syncLockboxes(self, lboxList):
+      lboxScrAddrs = {}
+      for lbox in lboxList:
+         lboxScrAddrs.setdefault(lbox.p2shScrAddr, lbox)
+      self.lboxScrAddrs = lboxScrAddrs
+
+
+   #############################################################################
+   def reindexChangedWallets(self):
+      """ Returns True if any wallet had to be re-indexed """
+      with self.lock:
+         changed = [wlt for wltID,wlt in self.wallets.iteritems() \
+                       if not self.wltVersions[wltID]==wlt.addrMapVersion]
+         for wlt in changed:
+            self.indexWallet(wlt)
+         return len(changed) > 0
+
+
+   #############################################################################
+   def getWalletForScrAddr(self, scrAddr):
+      with self.lock:
+         wltID = self.wltScrAddrs.get(scrAddr)
+         if wltID is None:
+            if not self.reindexChangedWallets():
+               return None
+            wltID = self.wltScrAddrs.get(scrAddr)
+            if wltID is None:
+               return None
+
+         wlt = self.wallets[wltID]
+         if not wlt.hasScrAddr(scrAddr):
+            # An imported address was deleted from the wallet
+            self.indexWallet(wlt)
+            wltID = self.wltScrAddrs.get(scrAddr)
+            wlt = None if wltID is None else self.wallets[wltID]
+         return wlt
+
+
+   #############################################################################
+   def getWalletIDForScrAddr(self, scrAddr):
+      wlt = self.getWalletForScrAddr(scrAddr)
+      return None if wlt is None else wlt.uniqueIDB58
+
+
+   #############################################################################
+   def getLockboxForScrAddr(self, p2shScrAddr):
+      return self.lboxScrAddrs.get(p2shScrAddr)
+
+
 #############################################################################
 def getScriptForUserString(userStr, wltMap, lboxList):
    """
@@ -114,7 +239,7 @@ def getScriptForUserString(userStr, wltMap, lboxList):
 ################################################################################
 def getDisplayStringForScript(binScript, wltMap, lboxList, maxChars=256, 
                               doBold=0, prefIDOverAddr=False, 
-                              lblTrunc=12, lastTrunc=12):
+                              lblTrunc=12, lastTrunc=12, ownerIndex=None):
    """
    NOTE: This was originally in ArmoryQt.py, but we really needed this to be
    more widely accessible.  And it's easier to test when this is in ArmoryUtils.  
@@ -156,6 +281,10 @@ def getDisplayStringForScript(binScript, wltMap, lboxList, maxChars=256,
    The doBold arg indicates that we want to add html bold tags around the 
    first N parts of the return.  This is applied after the length calculations
    are performed, as bolding will have a very small impact on width
+
+   If ownerIndex (a ScrAddrOwnerIndex kept in sync with wltMap and lboxList)
+   is supplied, the wallet and lockbox are found with it instead of by
+   searching wltMap and lboxList.
    """
 
    if maxChars<32:
@@ -166,10 +295,13 @@ def getDisplayStringForScript(binScript, wltMap, lboxList, maxChars=256,
    scrAddr = script_to_scrAddr(binScript)
 
    wlt = None
-   for iterID,iterWlt in wltMap.iteritems():
-      if iterWlt.hasScrAddr(scrAddr):
-         wlt = iterWlt
-         break
+   if ownerIndex is not None:
+      wlt = ownerIndex.getWalletForScrAddr(scrAddr)
+   else:
+      for iterID,iterWlt in wltMap.iteritems():
+         if iterWlt.hasScrAddr(scrAddr):
+            wlt = iterWlt
+            break
 
    lbox = None
    if wlt is None:
@@ -177,10 +309,13 @@ def getDisplayStringForScript(binScript, wltMap, lboxList, maxChars=256,
       if scriptType==CPP_TXOUT_MULTISIG:
          searchScrAddr = script_to_scrAddr(script_to_p2sh_script(binScript))
          
-      for iterLbox in lboxList:
-         if searchScrAddr == iterLbox.p2shScrAddr:
-            lbox = iterLbox
-            break
+      if ownerIndex is not None:
+         lbox = ownerIndex.getLockboxForScrAddr(searchScrAddr)
+      else:
+         for iterLbox in lboxList:
+            if searchScrAddr == iterLbox.p2shScrAddr:
+               lbox = iterLbox
+               break
 
    # Return these with the display string
    wltID  = wlt.uniqueIDB58  if wlt  else None
@@ -0,0 +1,419 @@
+################################################################################
+#                                                                              #
+# Copyright (C) 2011-2014, Armory Technologies, Inc.                           #
+# Distributed under the GNU Affero General Public License (AGPL v3)            #
+# See LICENSE or http://www.gnu.org/licenses/agpl.html                         #
+#                                                                              #
+################################################################################
+################################################################################
+#
+# UtxoIndex
+#
+#   Python-side mirror of a wallet's unspent TxOuts, keyed by outpoint.  Every
+#   balance or UTXO query used to go through SWIG and walk the whole C++ txio
+#   map, and getTxOutList() even forced a blockchain sync first.  The index
+#   keeps running totals per address and per confirmation bucket, so balance
+#   queries are O(1) and UTXO lists only touch the entries they return.
+#
+#   Confirmations are not stored, only the height each TxOut was mined at, so
+#   a new block that doesn't touch the wallet costs nothing but a new top
+#   height.  The buckets are:
+#
+#      CONFIRMED   - mined, non-coinbase: always spendable
+#      COINBASE    - mined coinbase: spendable after COINBASE_MATURITY blocks
+#      ZC_SELF     - zero-conf change (the tx spends our coins): spendable
+#                    unless IGNOREZC
+#      ZC_OTHER    - zero-conf from someone else: never spendable
+#
+#   The rules mirror TxIOPair::isSpendable() in C++.  The index is built from
+#   the C++ wallet after a full scan, and updated in place after that:  by
+#   applyTx() for new zero-conf transactions, and by applyCppLedger() for the
+#   wallet's transactions in each new block.  The balance totals are checked
+#   against the C++ wallet after every update, so that any drift they reveal
+#   is logged and corrected rather than silently served.
+#
+################################################################################
+import CppBlockUtils as Cpp
+from armoryengine.ArmoryUtils import UINT32_MAX, binary_to_hex, \
+   script_to_scrAddr
+from armoryengine.Transaction import PyTx
+
+
+# Mirrors BtcUtils.h, the C++ code is the final word on spendability
+COINBASE_MATURITY = 120
+
+UTXO_CONFIRMED = 0
+UTXO_COINBASE  = 1
+UTXO_ZC_SELF   = 2
+UTXO_ZC_OTHER  = 3
+
+# Entry fields, entries are plain lists to keep thousands of them cheap
+UTXO_SCRADDR = 0
+UTXO_VALUE   = 1
+UTXO_HEIGHT  = 2
+UTXO_SCRIPT  = 3
+UTXO_BUCKET  = 4
+
+COINBASE_OUTPOINT_HASH = '\x00'*32
+
+
+################################################################################
+def isCoinbaseTx(pytx):
+   return len(pytx.inputs)==1 and \
+          pytx.inputs[0].outpoint.txHash==COINBASE_OUTPOINT_HASH
+
+
+################################################################################
+class UtxoIndex(object):
+   """
+   Outpoint-keyed index of one wallet's unspent TxOuts.  isMineFunc takes a
+   scrAddr and says whether a new TxOut paying it belongs in the index.
+   """
+
+   #############################################################################
+   def __init__(self, isMineFunc=None):
+      self.isMineFunc = isMineFunc
+      self.clear()
+
+   #############################################################################
+   def clear(self):
+      self.utxoMap     = {}   # (txHash, txOutIndex) -> entry
+      self.addrOutPts  = {}   # scrAddr -> set of outpoints
+      self.addrTotals  = {}   # scrAddr -> [total per bucket]
+      self.totals      = [0, 0, 0, 0]
+      self.coinbaseOutPts = set()
+      self.topBlock    = 0
+      self.isBuilt     = False
+      self.nInvalidLedger = 0
+
+   #############################################################################
+   def __len__(self):
+      return len(self.utxoMap)
+
+   #############################################################################
+   def __contains__(self, outPt):
+      return outPt in self.utxoMap
+
+   #############################################################################
+   def addTxOut(self, txHash, txOutIdx, scrAddr, value, height, script,
+                                                                bucket):
+      outPt = (txHash, txOutIdx)
+      if outPt in self.utxoMap:
+         self.removeTxOut(txHash, txOutIdx)
+
+      self.utxoMap[outPt] = [scrAddr, value, height, script, bucket]
+      self.addrOutPts.setdefault(scrAddr, set()).add(outPt)
+      self.addrTotals.setdefault(scrAddr, [0, 0, 0, 0])[bucket] += value
+      self.totals[bucket] += value
+      if bucket == UTXO_COINBASE:
+         self.coinbaseOutPts.add(outPt)
+
+   #############################################################################
+   def removeTxOut(self, txHash, txOutIdx):
+      """ Returns the removed entry, or None if we didn't have it """
+      outPt = (txHash, txOutIdx)
+      entry = self.utxoMap.pop(outPt, None)
+      if entry is None:
+         return None
+
+      scrAddr,value,bucket = entry[UTXO_SCRADDR], entry[UTXO_VALUE], \
+                                                  entry[UTXO_BUCKET]
+      self.addrOutPts[scrAddr].discard(outPt)
+      self.addrTotals[scrAddr][bucket] -= value
+      self.totals[bucket] -= value
+      self.coinbaseOutPts.discard(outPt)
+      return entry
+
+
+   #############################################################################
+   def buildFromCpp(self, cppWallet, currBlk, ignoreZC=False):
+      """
+      Rebuild from scratch out of the C++ wallet's full and spendable TxOut
+      lists.  C++ doesn't expose the coinbase and sent-to-self flags, but
+      they can be inferred:  a mined TxOut that isn't spendable is an
+      immature coinbase output, and a zero-conf TxOut that is spendable is
+      our own change.  Mature coinbase outputs are indistinguishable from
+      regular ones, and they don't need to be.
+      """
+      spendSet = set()
+      for utxo in cppWallet.getSpendableTxOutList(currBlk, ignoreZC):
+         spendSet.add((utxo.getTxHash(), utxo.getTxOutIndex()))
+
+      self.clear()
+      for utxo in cppWallet.getFullTxOutList(currBlk):
+         txHash = utxo.getTxHash()
+         txoIdx = utxo.getTxOutIndex()
+         height = utxo.getTxHeight()
+         isSpendable = (txHash, txoIdx) in spendSet
+         if height == UINT32_MAX:
+            bucket = UTXO_ZC_SELF if isSpendable else UTXO_ZC_OTHER
+         else:
+            bucket = UTXO_CONFIRMED if isSpendable else UTXO_COINBASE
+
+         self.addTxOut(txHash, txoIdx, utxo.getRecipientScrAddr(),
+                       utxo.getValue(), height, utxo.getScript(), bucket)
+
+      self.nInvalidLedger = len([le for le in cppWallet.getTxLedger() \
+                                                   if not le.isValid()])
+      self.topBlock = currBlk
+      self.isBuilt  = True
+
+   #############################################################################
+   def applyCppLedger(self, cppWallet, currBlk, getTxFunc):
+      """
+      Bring the index up to currBlk by applying every tx the C++ wallet's
+      ledger lists in the blocks mined since the last update, one block at a
+      time:  the outputs each tx spends are removed and the outputs paying
+      us are added.  getTxFunc takes a tx hash and returns the C++ Tx.
+
+      Returns False if the index can't be updated this way and has to be
+      rebuilt:  after a reorg (C++ marks the ledger entries of orphaned
+      blocks invalid), or if a tx can't be found.  The index may be half
+      updated by then, which doesn't matter since it is thrown away.
+      """
+      if not self.isBuilt or currBlk < self.topBlock:
+         return False
+
+      nInvalid = 0
+      blkTxHashes = {}
+      for le in cppWallet.getTxLedger():
+         if not le.isValid():
+            nInvalid += 1
+         elif self.topBlock < le.getBlockNum() <= currBlk:
+            blkTxHashes.setdefault(le.getBlockNum(), set()).add(le.getTxHash())
+
+      if nInvalid != self.nInvalidLedger:
+         return False
+
+      for height in sorted(blkTxHashes.keys()):
+         pytxList = []
+         for txHash in blkTxHashes[height]:
+            cppTx = getTxFunc(txHash)
+            if cppTx is None or not cppTx.isInitialized():
+               return False
+            pytxList.append(PyTx().unserialize(cppTx.serialize()))
+         self.applyTxList(pytxList, height)
+
+      self.topBlock = currBlk
+      return True
+
+
+   #############################################################################
+   def __addTxOutputs(self, pytx, height, isFromSelf):
+      if height == UINT32_MAX:
+         bucket = UTXO_ZC_SELF if isFromSelf else UTXO_ZC_OTHER
+      elif isCoinbaseTx(pytx):
+         bucket = UTXO_COINBASE
+      else:
+         bucket = UTXO_CONFIRMED
+
+      txHash = pytx.getHash()
+      isRelevant = False
+      for i,txout in enumerate(pytx.outputs):
+         scrAddr = script_to_scrAddr(txout.binScript)
+         if self.isMineFunc is None or not self.isMineFunc(scrAddr):
+            continue
+
+         # Seeing the same zero-conf tx twice must not lose its change status,
+         # its inputs were already removed the first time around
+         thisBucket = bucket
+         prev = self.utxoMap.get((txHash, i))
+         if prev is not None and prev[UTXO_BUCKET]==UTXO_ZC_SELF and \
+                                           bucket==UTXO_ZC_OTHER:
+            thisBucket = UTXO_ZC_SELF
+
+         self.addTxOut(txHash, i, scrAddr, txout.value, height,
+                                          txout.binScript, thisBucket)
+         isRelevant = True
+
+      return isRelevant
+
+   #############################################################################
+   def applyTx(self, pytx, height=UINT32_MAX):
+      """
+      Update the index with a transaction we just heard about.  Outputs it
+      spends are removed, outputs paying us are added.  With the default
+      height this is a zero-conf tx, otherwise it was mined at that height
+      (a zero-conf TxOut we already have just moves to its mined bucket).
+      Returns True if the tx touched the wallet at all.
+      """
+      isFromSelf = False
+      if not isCoinbaseTx(pytx):
+         for txin in pytx.inputs:
+            op = txin.outpoint
+            if self.removeTxOut(op.txHash, op.txOutIndex) is not None:
+               isFromSelf = True
+
+      isRelevant = self.__addTxOutputs(pytx, height, isFromSelf)
+      if height != UINT32_MAX:
+         self.topBlock = max(self.topBlock, height)
+
+      return isRelevant or isFromSelf
+
+   #############################################################################
+   def applyTxList(self, pytxList, height=UINT32_MAX):
+      """
+      Zero-conf txs can arrive in any order, and a child that spends our
+      change may be applied before its parent.  Add every output first and
+      then remove the spent ones, so the result doesn't depend on order.
+      """
+      pytxList = list(pytxList)
+      ourOutPts = set(self.utxoMap.keys())
+      for pytx in pytxList:
+         txHash = pytx.getHash()
+         for i,txout in enumerate(pytx.outputs):
+            if self.isMineFunc is not None and \
+               self.isMineFunc(script_to_scrAddr(txout.binScript)):
+               ourOutPts.add((txHash, i))
+
+      isRelevant = False
+      spentOutPts = []
+      for pytx in pytxList:
+         if isCoinbaseTx(pytx):
+            isFromSelf = False
+         else:
+            txinOutPts = [(txin.outpoint.txHash, txin.outpoint.txOutIndex)
+                                                  for txin in pytx.inputs]
+            isFromSelf = any([op in ourOutPts for op in txinOutPts])
+            spentOutPts.extend(txinOutPts)
+
+         if self.__addTxOutputs(pytx, height, isFromSelf):
+            isRelevant = True
+
+      for txHash,txoIdx in spentOutPts:
+         if self.removeTxOut(txHash, txoIdx) is not None:
+            isRelevant = True
+
+      if height != UINT32_MAX:
+         self.topBlock = max(self.topBlock, height)
+
+      return isRelevant
+
+   #############################################################################
+   def setTopBlock(self, currBlk):
+      self.topBlock = currBlk
+
+
+   #############################################################################
+   def __isSpendable(self, entry, currBlk, ignoreZC):
+      bucket = entry[UTXO_BUCKET]
+      if bucket == UTXO_CONFIRMED:
+         return True
+      elif bucket == UTXO_COINBASE:
+         return currBlk - entry[UTXO_HEIGHT] + 1 > COINBASE_MATURITY
+      elif bucket == UTXO_ZC_SELF:
+         return not ignoreZC
+      return False
+
+   #############################################################################
+   def __maturedCoinbase(self, outPts, currBlk):
+      # Immature coinbase outputs are rare outside of mining wallets, so this
+      # only walks the (usually empty) coinbase set, never the whole index
+      total = 0
+      for outPt in outPts:
+         entry = self.utxoMap[outPt]
+         if currBlk - entry[UTXO_HEIGHT] + 1 > COINBASE_MATURITY:
+            total += entry[UTXO_VALUE]
+      return total
+
+   #############################################################################
+   def getBalance(self, balType='Spendable', currBlk=None, ignoreZC=False,
+                                                              scrAddr=None):
+      """ Only 'Spendable' and 'Full' are tracked, see the module comments """
+      if currBlk is None:
+         currBlk = self.topBlock
+
+      if scrAddr is None:
+         totals = self.totals
+         cbOutPts = self.coinbaseOutPts
+      else:
+         totals = self.addrTotals.get(scrAddr, [0, 0, 0, 0])
+         cbOutPts = [op for op in self.coinbaseOutPts
+                     if self.utxoMap[op][UTXO_SCRADDR]==scrAddr] \
+                     if totals[UTXO_COINBASE] else []
+
+      if balType.lower() in ('spendable','spend'):
+         bal = totals[UTXO_CONFIRMED]
+         if totals[UTXO_COINBASE]:
+            bal += self.__maturedCoinbase(cbOutPts, currBlk)
+         if not ignoreZC:
+            bal += totals[UTXO_ZC_SELF]
+         return bal
+      elif balType.lower() in ('total','ultimate','unspent','full'):
+         return sum(totals)
+      else:
+         raise TypeError('Unknown balance type! "' + balType + '"')
+
+   #############################################################################
+   def getTxOutList(self, txType='Spendable', currBlk=None, ignoreZC=False,
+                                                              scrAddr=None):
+      """ Returns UnspentTxOut/C++ objects, sorted by outpoint """
+      if currBlk is None:
+         currBlk = self.topBlock
+
+      if txType.lower() in ('spend', 'spendable'):
+         onlySpendable = True
+      elif txType.lower() in ('full', 'all', 'unspent', 'ultimate'):
+         onlySpendable = False
+      else:
+         raise TypeError('Unknown TxOut type! ' + txType)
+
+      if scrAddr is None:
+         outPts = self.utxoMap.keys()
+      else:
+         outPts = list(self.addrOutPts.get(scrAddr, []))
+
+      utxoList = []
+      for outPt in sorted(outPts):
+         entry = self.utxoMap[outPt]
+         if onlySpendable and not self.__isSpendable(entry, currBlk, ignoreZC):
+            continue
+
+         utxo = Cpp.UnspentTxOut(outPt[0], outPt[1], entry[UTXO_HEIGHT],
+                                 entry[UTXO_VALUE], entry[UTXO_SCRIPT])
+         utxo.updateNumConfirm(currBlk)
+         utxoList.append(utxo)
+      return utxoList
+
+
+   #############################################################################
+   def matchesCppTotals(self, cppWallet, currBlk, ignoreZC=False):
+      """
+      Cheap check, two balance calls and no UTXO lists cross SWIG.  A
+      mismatch means the index has drifted and must be rebuilt.  A match
+      doesn't prove the two agree outpoint by outpoint (a block that spends
+      S of our coins and pays S back leaves both totals alone), so this is
+      only a safety net after applyCppLedger(), not a substitute for it.
+      """
+      return self.isBuilt and \
+         cppWallet.getFullBalance() == self.getBalance('Full', currBlk) and \
+         cppWallet.getSpendableBalance(currBlk, ignoreZC) == \
+                           self.getBalance('Spendable', currBlk, ignoreZC)
+
+   #############################################################################
+   def hasZeroConf(self):
+      return self.totals[UTXO_ZC_SELF] + self.totals[UTXO_ZC_OTHER] > 0
+
+   #############################################################################
+   def compareTo(self, other, currBlk, ignoreZC=False):
+      """
+      Compare this index entry by entry with another one, normally a fresh
+      build from C++ after a rescan.  Returns a list of discrepancy strings,
+      empty if the two agree on every outpoint, value, height and spendable
+      status.
+      """
+      errors = []
+      for outPt in set(self.utxoMap.keys()) | set(other.utxoMap.keys()):
+         opStr = '%s:%d' % (binary_to_hex(outPt[0][::-1]), outPt[1])
+         ours,theirs = self.utxoMap.get(outPt), other.utxoMap.get(outPt)
+         if theirs is None:
+            errors.append('Extra UTXO in index: ' + opStr)
+         elif ours is None:
+            errors.append('Missing UTXO in index: ' + opStr)
+         elif ours[UTXO_VALUE]!=theirs[UTXO_VALUE] or \
+              ours[UTXO_HEIGHT]!=theirs[UTXO_HEIGHT] or \
+              self.__isSpendable(ours, currBlk, ignoreZC) != \
+              other.__isSpendable(theirs, currBlk, ignoreZC):
+            errors.append('UTXO mismatch: ' + opStr)
+
+      return errors
@@ -0,0 +1,412 @@
+################################################################################
+#                                                                              #
+# Copyright (C) 2011-2014, Armory Technologies, Inc.                           #
+# Distributed under the GNU Affero General Public License (AGPL v3)            #
+# See LICENSE or http://www.gnu.org/licenses/agpl.html                         #
+#                                                                              #
+################################################################################
+################################################################################
+#
+# WalletFileIndex
+#
+#   Side-car index for lazily-loaded wallet files.  Opening a wallet normally
+#   unserializes (and reserializes, to catch byte errors) every address entry
+#   in the file.  With half a million addresses that takes minutes and keeps
+#   every PyBtcAddress in RAM, even though most of them are never touched.
+#
+#   The index records, for every key entry, just what the wallet needs to
+#   know without looking at the key data: where the entry is, its addr160,
+#   chain index and time/block range (to register it with the C++ wallet).
+#   It also records where the comment entries are.  PyBtcWallet then fills
+#   addrMap with LazyAddrEntry placeholders, which LazyAddrMap swaps for the
+#   real PyBtcAddress on first access.
+#
+#   The index is tied to the wallet file size and mtime, its own number of
+#   records, and a hash of the first and last few KB of the wallet (the
+#   header, and the entries written most recently).  Hashing the whole file
+#   would cost as much as the full read lazy loading avoids.  Every
+#   successful walletFileSafeUpdate updates the index, and the fingerprint
+#   is brought up to date from the data that was just written, without
+#   reading the wallet again.  If anything else touches the wallet, the
+#   fingerprint won't match and the index is rebuilt from the wallet file on
+#   the next open.  The hash catches changes that keep the size and land
+#   within the mtime resolution of the filesystem, as long as they are in
+#   the header or near the end.
+#
+#   File format:
+#
+#      Header:        Magic8 | Version4 | WalletSize8 | WalletMTime8 (double) |
+#                     NumRecords4 | HeadTailHash32
+#      Key entry:     0x00 | Offset8 | Addr160 | ChainIndex8 | FirstTime8 |
+#                     LastTime8 | FirstBlk4 | LastBlk4
+#      Other entry:   0x01 | Offset8
+#
+################################################################################
+import hashlib
+import os
+from struct import Struct
+
+from armoryengine.ArmoryUtils import LOGWARN, LOGEXCEPT, computeChecksum
+
+
+WLTINDEX_MAGIC   = '\xbaWLTIDX\x00'
+WLTINDEX_VERSION = 3
+
+WLTINDEX_KEYREC   = 0
+WLTINDEX_OTHERREC = 1
+
+INDEX_HEADER  = Struct('<8sIQdI32s')
+INDEX_KEYREC  = Struct('<BQ20sqQQII')
+INDEX_OTHREC  = Struct('<BQ')
+
+# Fixed positions of the fields we need inside a serialized PyBtcAddress,
+# see PYBTCADDRESS_SCHEMA
+ADDRDATA_HEAD  = Struct('<20s4s')
+ADDRDATA_INDEX = Struct('<q')
+ADDRDATA_TIMES = Struct('<QQII')
+ADDRDATA_INDEX_POS = 72
+ADDRDATA_TIMES_POS = 213
+
+# How much of the start and the end of the wallet file is hashed
+WLTINDEX_HEAD_SIZE = 4*1024
+WLTINDEX_TAIL_SIZE = 64*1024
+
+
+################################################################################
+def getWalletIndexPath(walletPath):
+   # Not a .wallet file, so it's never mistaken for a wallet or its backup
+   return os.path.splitext(walletPath)[0] + '.walletindex'
+
+
+################################################################################
+def getWalletFileStat(walletPath):
+   return (os.path.getsize(walletPath), os.path.getmtime(walletPath))
+
+
+################################################################################
+def readWalletWindows(walletPath):
+   """ (size, first WLTINDEX_HEAD_SIZE bytes, last WLTINDEX_TAIL_SIZE bytes) """
+   with open(walletPath, 'rb') as f:
+      head = f.read(WLTINDEX_HEAD_SIZE)
+      f.seek(0, os.SEEK_END)
+      size = f.tell()
+      f.seek(max(size - WLTINDEX_TAIL_SIZE, 0))
+      tail = f.read()
+   return size, head, tail
+
+
+################################################################################
+def patchWindow(window, windowStart, loc, data):
+   """
+   window holds the file bytes from windowStart on.  Returns it with the part
+   overlapped by data, written to the file at loc, replaced.
+   """
+   start = max(loc, windowStart)
+   end   = min(loc + len(data), windowStart + len(window))
+   if start >= end:
+      return window
+   return window[:start-windowStart] + data[start-loc:end-loc] + \
+          window[end-windowStart:]
+
+
+################################################################################
+class LazyAddrEntry(object):
+   """
+   Placeholder for an address entry that hasn't been unserialized yet.
+   offset is the position of the entry's datatype byte in the wallet file.
+   """
+   __slots__ = ('offset', 'addr160', 'chainIndex', 'timeRange', 'blkRange')
+
+   def __init__(self, offset, addr160, chainIndex, timeRange, blkRange):
+      self.offset     = offset
+      self.addr160    = addr160
+      self.chainIndex = chainIndex
+      self.timeRange  = timeRange
+      self.blkRange   = blkRange
+
+
+################################################################################
+def parseAddrEntryFields(offset, rawData):
+   """
+   Pull the indexed fields out of a serialized PyBtcAddress without
+   unserializing it.  Returns None if the addr160 checksum doesn't match, so
+   the caller can fall back to a full unserialize (which fixes byte errors).
+   """
+   addr160,chk = ADDRDATA_HEAD.unpack_from(rawData, 0)
+   if not computeChecksum(addr160)==chk:
+      return None
+   chainIndex = ADDRDATA_INDEX.unpack_from(rawData, ADDRDATA_INDEX_POS)[0]
+   t0,t1,b0,b1 = ADDRDATA_TIMES.unpack_from(rawData, ADDRDATA_TIMES_POS)
+   return LazyAddrEntry(offset, addr160, chainIndex, [t0,t1], [b0,b1])
+
+
+################################################################################
+class LazyAddrMap(dict):
+   """
+   The addrMap of a lazily-loaded wallet.  Values may be LazyAddrEntry
+   placeholders, which are replaced by the PyBtcAddress returned from
+   loadFunc(addr160, entry) the first time they are accessed.  Anything that
+   goes through the normal dict accessors only ever sees PyBtcAddress objects.
+   """
+
+   #############################################################################
+   def __init__(self, loadFunc):
+      super(LazyAddrMap, self).__init__()
+      self.loadFunc = loadFunc
+
+   #############################################################################
+   def __getitem__(self, key):
+      val = dict.__getitem__(self, key)
+      if isinstance(val, LazyAddrEntry):
+         val = self.loadFunc(key, val)
+         dict.__setitem__(self, key, val)
+      return val
+
+   #############################################################################
+   def isLoaded(self, key):
+      return not isinstance(dict.__getitem__(self, key), LazyAddrEntry)
+
+   #############################################################################
+   def getNumLoaded(self):
+      return sum([1 for v in dict.itervalues(self) \
+                              if not isinstance(v, LazyAddrEntry)])
+
+   #############################################################################
+   def get(self, key, default=None):
+      return self[key] if key in self else default
+
+   #############################################################################
+   def pop(self, key, *default):
+      if key in self:
+         val = self[key]
+         dict.__delitem__(self, key)
+         return val
+      return dict.pop(self, key, *default)
+
+   #############################################################################
+   def itervalues(self):
+      for key in self.keys():
+         yield self[key]
+
+   #############################################################################
+   def values(self):
+      return list(self.itervalues())
+
+   #############################################################################
+   def iteritems(self):
+      for key in self.keys():
+         yield (key, self[key])
+
+   #############################################################################
+   def items(self):
+      return list(self.iteritems())
+
+
+
+################################################################################
+class WalletFileIndex(object):
+
+   #############################################################################
+   def __init__(self, walletPath):
+      self.walletPath   = walletPath
+      self.indexPath    = getWalletIndexPath(walletPath)
+      self.keyEntries   = []
+      self.otherOffsets = []
+
+      # The parts of the wallet file the fingerprint hashes, as of wltSize
+      self.wltSize  = None
+      self.headData = ''
+      self.tailData = ''
+
+
+   #############################################################################
+   def loadWalletWindows(self):
+      self.wltSize,self.headData,self.tailData = \
+                                       readWalletWindows(self.walletPath)
+
+
+   #############################################################################
+   def getWindowHash(self):
+      return hashlib.sha256(self.headData + self.tailData).digest()
+
+
+   #############################################################################
+   def recordWalletWrite(self, oldWalletSize, binaryToAppend, dataToChange):
+      """
+      The wallet just appended binaryToAppend to its file, which was
+      oldWalletSize bytes, and then overwrote the [loc, data] pairs in
+      dataToChange.  Apply the same to the head and tail we hash, instead of
+      reading them from the file again.
+      """
+      if not self.wltSize==oldWalletSize:
+         self.loadWalletWindows()
+         return
+
+      newSize = oldWalletSize + len(binaryToAppend)
+      if len(self.headData) < WLTINDEX_HEAD_SIZE:
+         # The head is still the whole file
+         self.headData = (self.headData + binaryToAppend)[:WLTINDEX_HEAD_SIZE]
+      tail = (self.tailData + binaryToAppend)[-WLTINDEX_TAIL_SIZE:]
+      tailStart = newSize - len(tail)
+
+      for loc,data in dataToChange:
+         self.headData = patchWindow(self.headData, 0, loc, data)
+         tail = patchWindow(tail, tailStart, loc, data)
+
+      self.tailData = tail
+      self.wltSize  = newSize
+
+
+   #############################################################################
+   def readIndex(self):
+      """
+      Returns True if there is an index and it matches the wallet file as it
+      is on disk right now.
+      """
+      if not os.path.exists(self.indexPath):
+         return False
+
+      try:
+         with open(self.indexPath, 'rb') as f:
+            data = f.read()
+
+         magic,version = INDEX_HEADER.unpack_from(data, 0)[:2]
+         if not magic==WLTINDEX_MAGIC or not version==WLTINDEX_VERSION:
+            LOGWARN('Unrecognized wallet index %s, rebuilding', self.indexPath)
+            return False
+
+         # Only hash the wallet if the cheap part of the fingerprint matches
+         wltSize,wltMTime,nRecords,wltHash = \
+                                    INDEX_HEADER.unpack_from(data, 0)[2:]
+         if not (wltSize,wltMTime)==getWalletFileStat(self.walletPath):
+            return False
+         self.loadWalletWindows()
+         if not self.wltSize==wltSize or not self.getWindowHash()==wltHash:
+            LOGWARN('Wallet %s changed since it was indexed, rebuilding', \
+                                                            self.walletPath)
+            return False
+
+         keyEntries, otherOffsets = [], []
+         pos = INDEX_HEADER.size
+         while pos < len(data):
+            if ord(data[pos])==WLTINDEX_KEYREC:
+               rec = INDEX_KEYREC.unpack_from(data, pos)
+               keyEntries.append(LazyAddrEntry(rec[1], rec[2], rec[3], \
+                                               [rec[4], rec[5]], \
+                                               [rec[6], rec[7]]))
+               pos += INDEX_KEYREC.size
+            else:
+               otherOffsets.append(INDEX_OTHREC.unpack_from(data, pos)[1])
+               pos += INDEX_OTHREC.size
+
+         if not len(keyEntries) + len(otherOffsets)==nRecords:
+            LOGWARN('Wallet index %s is incomplete, rebuilding', self.indexPath)
+            return False
+      except Exception:
+         LOGEXCEPT('Could not read wallet index %s, rebuilding', self.indexPath)
+         return False
+
+      self.keyEntries   = keyEntries
+      self.otherOffsets = otherOffsets
+      return True
+
+
+   #############################################################################
+   def packKeyEntry(self, entry):
+      return INDEX_KEYREC.pack(WLTINDEX_KEYREC, entry.offset, entry.addr160, \
+                               entry.chainIndex, \
+                               entry.timeRange[0], entry.timeRange[1], \
+                               entry.blkRange[0],  entry.blkRange[1])
+
+
+   #############################################################################
+   def packHeader(self):
+      wltSize,wltMTime = getWalletFileStat(self.walletPath)
+      if not wltSize==self.wltSize:
+         # First write of a new index, or the wallet was written to without
+         # telling recordWalletWrite.  Either way, it's only a few KB.
+         self.loadWalletWindows()
+      nRecords = len(self.keyEntries) + len(self.otherOffsets)
+      return INDEX_HEADER.pack(WLTINDEX_MAGIC, WLTINDEX_VERSION, \
+                               self.wltSize, wltMTime, nRecords, \
+                               self.getWindowHash())
+
+
+   #############################################################################
+   def writeIndex(self):
+      """
+      Rewrite the whole index.  Records are written in file order so that
+      comment entries are replayed in the same order as a full read would.
+      """
+      records = [(e.offset, self.packKeyEntry(e)) for e in self.keyEntries]
+      records.extend([(off, INDEX_OTHREC.pack(WLTINDEX_OTHERREC, off)) \
+                                             for off in self.otherOffsets])
+      records.sort()
+      try:
+         with open(self.indexPath, 'wb') as f:
+            f.write(self.packHeader())
+            f.write(''.join([rec for off,rec in records]))
+      except (IOError, OSError):
+         LOGEXCEPT('Could not write wallet index %s', self.indexPath)
+         self.removeIndex()
+
+
+   #############################################################################
+   def appendEntries(self, keyEntries, otherOffsets):
+      """
+      Called after data was appended to the wallet: the new records go at the
+      end of the index, and only then is the header (fingerprint) updated.
+      If we die in between, the fingerprint doesn't match and the index is
+      simply rebuilt next time.
+      """
+      self.keyEntries.extend(keyEntries)
+      self.otherOffsets.extend(otherOffsets)
+      if not os.path.exists(self.indexPath):
+         self.writeIndex()
+         return
+
+      records = [(e.offset, self.packKeyEntry(e)) for e in keyEntries]
+      records.extend([(off, INDEX_OTHREC.pack(WLTINDEX_OTHERREC, off)) \
+                                                  for off in otherOffsets])
+      records.sort()
+      try:
+         with open(self.indexPath, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            f.write(''.join([rec for off,rec in records]))
+            f.seek(0)
+            f.write(self.packHeader())
+      except (IOError, OSError):
+         LOGEXCEPT('Could not update wallet index %s', self.indexPath)
+         self.removeIndex()
+
+
+   #############################################################################
+   def updateEntries(self, keyEntries, otherOffsets, modifiedEntries, \
+                                                           deletedOffsets):
+      """
+      Mirror one wallet update.  keyEntries and otherOffsets were appended
+      to the wallet.  modifiedEntries replace the entries at the same offsets
+      (an address rewritten in place, e.g. with a new time/block range), and
+      the entries at deletedOffsets are dropped.  Only appends can go at the
+      end of the index, anything else rewrites it.
+      """
+      if len(modifiedEntries)==0 and len(deletedOffsets)==0:
+         self.appendEntries(keyEntries, otherOffsets)
+         return
+
+      modifiedMap = dict([(e.offset, e) for e in modifiedEntries])
+      deletedSet  = set(deletedOffsets)
+      self.keyEntries = [modifiedMap.get(e.offset, e) for e in self.keyEntries \
+                                             if not e.offset in deletedSet]
+      self.keyEntries.extend(keyEntries)
+      self.otherOffsets.extend(otherOffsets)
+      self.writeIndex()
+
+
+   #############################################################################
+   def removeIndex(self):
+      try:
+         if os.path.exists(self.indexPath):
+            os.remove(self.indexPath)
+      except OSError:
+         LOGEXCEPT('Could not remove wallet index %s', self.indexPath)
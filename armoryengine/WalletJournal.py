@@ -0,0 +1,250 @@
+################################################################################
+#                                                                              #
+# Copyright (C) 2011-2014, Armory Technologies, Inc.                           #
+# Distributed under the GNU Affero General Public License (AGPL v3)            #
+# See LICENSE or http://www.gnu.org/licenses/agpl.html                         #
+#                                                                              #
+################################################################################
+################################################################################
+#
+# WalletJournal
+#
+#   Write-ahead journal for wallet file updates.  walletFileSafeUpdate makes
+#   every update durable by writing it to BOTH the wallet and its backup,
+#   with flag files around each step: four fsyncs, a consistency check and
+#   four flag-file operations per call.  Inside an update batch (see
+#   PyBtcWallet.beginWalletUpdateBatch) updates are instead appended to this
+#   journal, and the wallet and backup files are brought up to date from it
+#   in one checkpoint when the batch ends.
+#
+#   An update is committed once its journal record is fsync'd.  Threads that
+#   commit at the same time share that fsync: whoever gets to the file first
+#   writes every record queued so far (group commit).
+#
+#   Recovery is roll-forward: doWalletFileConsistencyCheck first restores the
+#   wallet/backup pair from the flag files as it always has, then replays any
+#   complete records left in the journal.  A torn record at the end of the
+#   journal was never committed (its caller never got a result) and is
+#   dropped.  Replay is idempotent, since each record carries the wallet size
+#   its appended data starts at.
+#
+#   Record format:
+#
+#      Magic4 | BaseSize8 | AppendLen4 | NumMods4 | AppendData |
+#      (Offset8 | Len4 | Data) * NumMods | Checksum4 (hash256)
+#
+################################################################################
+import os
+import threading
+from struct import Struct
+
+from armoryengine.ArmoryUtils import LOGWARN, LOGEXCEPT, computeChecksum
+
+
+JOURNAL_MAGIC = 'WJR1'
+JOURNAL_HEAD  = Struct('<4sQII')
+JOURNAL_MOD   = Struct('<QI')
+
+
+################################################################################
+def getWalletJournalPath(walletPath):
+   # Not a .wallet file, so it's never mistaken for a wallet or its backup
+   return os.path.splitext(walletPath)[0] + '.walletjournal'
+
+
+################################################################################
+def packJournalRecord(baseSize, appendData, modList):
+   pieces = [JOURNAL_HEAD.pack(JOURNAL_MAGIC, baseSize, len(appendData), \
+                                                         len(modList)), \
+             appendData]
+   for loc,data in modList:
+      pieces.append(JOURNAL_MOD.pack(loc, len(data)))
+      pieces.append(data)
+   record = ''.join(pieces)
+   return record + computeChecksum(record)
+
+
+################################################################################
+def unpackJournalRecords(data):
+   """
+   Returns the list of complete records as [baseSize, appendData, modList],
+   and the number of bytes they take up.  Parsing stops at the first record
+   that is truncated or fails its checksum.
+   """
+   records = []
+   pos = 0
+   while pos + JOURNAL_HEAD.size <= len(data):
+      try:
+         magic,baseSize,appendLen,numMods = JOURNAL_HEAD.unpack_from(data, pos)
+         if not magic==JOURNAL_MAGIC:
+            break
+         end = pos + JOURNAL_HEAD.size
+         appendData = data[end:end+appendLen]
+         end += appendLen
+         modList = []
+         for i in range(numMods):
+            loc,modLen = JOURNAL_MOD.unpack_from(data, end)
+            end += JOURNAL_MOD.size
+            modList.append([loc, data[end:end+modLen]])
+            end += modLen
+      except Exception:
+         break
+
+      if end + 4 > len(data) or \
+         not computeChecksum(data[pos:end])==data[end:end+4]:
+         break
+
+      records.append([baseSize, appendData, modList])
+      pos = end + 4
+
+   return records, pos
+
+
+
+################################################################################
+class WalletJournal(object):
+
+   #############################################################################
+   def __init__(self, walletPath):
+      self.walletPath  = walletPath
+      self.journalPath = getWalletJournalPath(walletPath)
+
+      # lock protects the queue and the size bookkeeping, writeLock is held
+      # by the thread currently writing a group of records to the file
+      self.lock      = threading.Lock()
+      self.writeLock = threading.Lock()
+      self.queue     = []
+      self.nQueued   = 0
+      self.nDone     = 0
+      self.failedIDs = []
+
+      # Journal size we expect on disk, and how many bytes the records in it
+      # (plus queued ones) will append to the wallet file
+      self.fileSize      = None
+      self.pendingAppend = 0
+
+
+   #############################################################################
+   def readRecords(self):
+      if not os.path.exists(self.journalPath):
+         return [], 0
+      with open(self.journalPath, 'rb') as f:
+         data = f.read()
+      records, validSize = unpackJournalRecords(data)
+      if validSize < len(data):
+         LOGWARN('Dropping %d bytes of uncommitted wallet journal data', \
+                                                   len(data) - validSize)
+      return records, validSize
+
+
+   #############################################################################
+   def hasRecords(self):
+      return os.path.exists(self.journalPath) and \
+             os.path.getsize(self.journalPath) > 0
+
+
+   #############################################################################
+   def __refreshSizes(self):
+      """
+      The journal may have been checkpointed (and truncated) by someone else
+      since we last looked, e.g. another PyBtcWallet object reading the file
+      """
+      currSize = 0
+      if os.path.exists(self.journalPath):
+         currSize = os.path.getsize(self.journalPath)
+      if currSize==self.fileSize:
+         return
+
+      records, validSize = self.readRecords()
+      if validSize < currSize:
+         with open(self.journalPath, 'r+b') as f:
+            f.truncate(validSize)
+      self.fileSize = validSize
+      self.pendingAppend = sum([len(r[1]) for r in records])
+
+
+   #############################################################################
+   def commit(self, appendData, modList):
+      """
+      Durably record one wallet update.  Returns the wallet-file offset at
+      which appendData will land, or None if the journal could not be
+      written (nothing was committed in that case).
+      """
+      with self.lock:
+         # Only look at the file when nobody is in the middle of writing it
+         if self.nDone==self.nQueued:
+            self.__refreshSizes()
+         baseSize = os.path.getsize(self.walletPath) + self.pendingAppend
+         self.pendingAppend += len(appendData)
+         record = packJournalRecord(baseSize, appendData, modList)
+         self.queue.append([record, len(appendData)])
+         self.nQueued += 1
+         myID = self.nQueued
+
+      with self.writeLock:
+         # Someone may have written our record while we waited for the lock
+         if myID <= self.nDone:
+            for firstID,lastID in self.failedIDs:
+               if firstID <= myID <= lastID:
+                  return None
+            return baseSize
+
+         with self.lock:
+            toWrite = ''.join([rec for rec,appendLen in self.queue])
+            self.queue = []
+            firstID,lastID = self.nDone+1, self.nQueued
+
+         startSize = 0
+         if os.path.exists(self.journalPath):
+            startSize = os.path.getsize(self.journalPath)
+
+         try:
+            with open(self.journalPath, 'ab') as f:
+               f.write(toWrite)
+               f.flush()
+               os.fsync(f.fileno())
+         except (IOError, OSError):
+            LOGEXCEPT('Could not write to wallet journal %s', self.journalPath)
+            # Records of this group that did make it must not be replayed,
+            # their callers are told the update failed
+            try:
+               with open(self.journalPath, 'r+b') as f:
+                  f.truncate(startSize)
+            except (IOError, OSError):
+               LOGEXCEPT('Could not roll back wallet journal')
+            with self.lock:
+               self.failedIDs.append([firstID, lastID])
+               self.nDone = lastID
+               self.fileSize = None
+            return None
+
+         with self.lock:
+            self.nDone = lastID
+            if self.fileSize is not None:
+               self.fileSize += len(toWrite)
+
+      return baseSize
+
+
+   #############################################################################
+   def checkpoint(self, applyFunc):
+      """
+      Hand every committed record to applyFunc(records), which must make the
+      wallet file reflect them.  If it returns True the journal is emptied.
+      New commits wait until we're done, records that are queued but not yet
+      written stay queued: they already account for the records before them.
+      """
+      with self.writeLock:
+         with self.lock:
+            records, validSize = self.readRecords()
+            if len(records) > 0 and not applyFunc(records):
+               return False
+
+            if os.path.exists(self.journalPath):
+               with open(self.journalPath, 'r+b') as f:
+                  f.truncate(0)
+                  f.flush()
+                  os.fsync(f.fileno())
+            self.fileSize = 0
+            self.pendingAppend = sum([appendLen for rec,appendLen in self.queue])
+            return True
@@ -363,6 +363,42 @@ SecureBinaryData CryptoAES::DecryptCFB(SecureBinaryData & data,
 
 
 
+/////////////////////////////////////////////////////////////////////////////
+SecureBinaryData CryptoAES::DecryptCFBBatch(SecureBinaryData & data, 
+                                            SecureBinaryData & key,
+                                            SecureBinaryData & ivs,
+                                            uint32_t blockSize)
+{
+   if(data.getSize() == 0 || blockSize == 0)
+      return SecureBinaryData(0);
+
+   uint32_t nItems = data.getSize() / blockSize;
+   if(data.getSize() != nItems * blockSize ||
+      ivs.getSize()  != nItems * BTC_AES::BLOCKSIZE)
+   {
+      LOGERR << "DecryptCFBBatch: data/IV sizes do not match";
+      return SecureBinaryData(0);
+   }
+
+   SecureBinaryData unencrData(data.getSize());
+
+   BTC_CFB_MODE<BTC_AES>::Decryption aes_dec( (byte*)key.getPtr(), 
+                                                     key.getSize(), 
+                                              (byte*)ivs.getPtr());
+
+   for(uint32_t i=0; i<nItems; i++)
+   {
+      aes_dec.Resynchronize((byte*)ivs.getPtr() + i*BTC_AES::BLOCKSIZE);
+      aes_dec.ProcessData( (byte*)unencrData.getPtr() + i*blockSize, 
+                           (byte*)data.getPtr() + i*blockSize, 
+                                  blockSize);
+   }
+
+   return unencrData;
+}
+
+
+
 /////////////////////////////////////////////////////////////////////////////
 // Same as above, but only changing the AES mode of operation (CBC, not CFB)
 SecureBinaryData CryptoAES::EncryptCBC(SecureBinaryData & data, 
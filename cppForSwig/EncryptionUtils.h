@@ -172,6 +172,10 @@ public:
    BinaryData    getRawCopy(void) const { return BinaryData(getPtr(), getSize()); }
    BinaryDataRef getRawRef(void)  { return BinaryDataRef(getPtr(), getSize()); }
 
+   // Slices of secure data stay secure (the BinaryData version would not be)
+   SecureBinaryData getSliceCopy(int32_t start_pos, uint32_t nChar) const
+                { return SecureBinaryData(BinaryData::getSliceRef(start_pos, nChar)); }
+
    SecureBinaryData copySwapEndian(size_t pos1=0, size_t pos2=0) const;
 
    SecureBinaryData & append(SecureBinaryData & sbd2) ;
@@ -288,6 +292,16 @@ public:
                                SecureBinaryData & key,
                                SecureBinaryData   iv);
 
+   /////////////////////////////////////////////////////////////////////////////
+   // Decrypt many blockSize-byte items under the same key, each with its own
+   // IV.  data and ivs are the items (and their IVs) concatenated.  The key
+   // schedule is only set up once for the whole batch.  Returns an empty
+   // object if the sizes don't line up.
+   SecureBinaryData DecryptCFBBatch(SecureBinaryData & data, 
+                                    SecureBinaryData & key,
+                                    SecureBinaryData & ivs,
+                                    uint32_t blockSize);
+
    /////////////////////////////////////////////////////////////////////////////
    SecureBinaryData EncryptCBC(SecureBinaryData & data, 
                                SecureBinaryData & key,
@@ -59,6 +59,7 @@
 #include <ctime>
 #include <string>
 #include <fstream>
+#include <vector>
 #include <iostream>
 #include <stdio.h>
 #include "OS_TranslatePath.h"
@@ -159,18 +160,21 @@ public:
          ifstream is(OS_TranslatePath(logfile.c_str()), ios::in|ios::binary);
          is.seekg(fsize - maxSizeInBytes);
 
-         // Allocate buffer to hold the rest of the file (about maxSizeInBytes)
-         unsigned long long int bytesToCopy = fsize - is.tellg();
-         char* lastBytes = new char[(unsigned int)bytesToCopy];
-         is.read(lastBytes, bytesToCopy);
-         is.close();
-         
-         // Create temporary file and dump the bytes there
+         // Copy the rest of the file to a temporary file, a chunk at a time
          string tempfile = logfile + string("temp");
          ofstream os(OS_TranslatePath(tempfile.c_str()), ios::out|ios::binary);
-         os.write(lastBytes, bytesToCopy);
+         const size_t chunkSize = 64*1024;
+         vector<char> chunk(chunkSize);
+         while(is)
+         {
+            is.read(&chunk[0], chunkSize);
+            streamsize nRead = is.gcount();
+            if(nRead <= 0)
+               break;
+            os.write(&chunk[0], nRead);
+         }
+         is.close();
          os.close();
-         delete[] lastBytes;
 
          // Remove the original and rename the temp file to original
 			#ifndef _MSC_VER
@@ -0,0 +1,52 @@
+################################################################################
+# Benchmark for address pool generation.  Creates a throw-away wallet in a
+# temp directory and reports addresses/sec for the old one-at-a-time path
+# (computeNextAddress, one walletFileSafeUpdate per address) against
+# extendAddressPool (one walletFileSafeUpdate for the whole batch).
+#
+#    $ cd extras && python bench_addrpool.py [numAddr]
+################################################################################
+import shutil
+import sys
+import tempfile
+sys.path.append('..')
+sys.argv.append('--nologging')
+from armoryengine.ArmoryUtils import RightNow, SecureBinaryData
+from armoryengine.PyBtcWallet import PyBtcWallet
+
+
+def makeWallet(homeDir):
+   return PyBtcWallet().createNewWallet( \
+                           plainRootKey=SecureBinaryData('\xaa'*32),
+                           chaincode=SecureBinaryData('\xbb'*32),
+                           withEncrypt=False, shortLabel='bench',
+                           isActuallyNew=False, doRegisterWithBDM=False,
+                           armoryHomeDir=homeDir)
+
+
+if __name__ == '__main__':
+   numAddr = int(sys.argv[1]) if len(sys.argv)>1 and \
+                                 sys.argv[1].isdigit() else 500
+
+   homeDir = tempfile.mkdtemp()
+   try:
+      wlt = makeWallet(homeDir)
+      start = RightNow()
+      for i in range(numAddr):
+         wlt.computeNextAddress(isActuallyNew=False, doRegister=False)
+      tSingle = RightNow() - start
+      shutil.rmtree(homeDir)
+
+      homeDir = tempfile.mkdtemp()
+      wlt = makeWallet(homeDir)
+      start = RightNow()
+      wlt.extendAddressPool(numAddr, isActuallyNew=False, doRegister=False)
+      tBatch = RightNow() - start
+   finally:
+      shutil.rmtree(homeDir, ignore_errors=True)
+
+   print '%-20s  %10s  %12s' % ('Method', 'Time (s)', 'addr/sec')
+   print '%-20s  %10.2f  %12.1f' % ('computeNextAddress', tSingle,
+                                                       numAddr/tSingle)
+   print '%-20s  %10.2f  %12.1f' % ('extendAddressPool', tBatch,
+                                                       numAddr/tBatch)
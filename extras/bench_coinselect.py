@@ -0,0 +1,63 @@
+################################################################################
+# Benchmark for coin selection.  Builds random UTXO sets of increasing size
+# and times PySelectCoins (PyCoinSelector) against PySelectCoinsBruteForce,
+# the implementation it replaced, checking that both pick the same coins.
+#
+#    $ cd extras && python bench_coinselect.py [maxBruteForceSize]
+#
+# The brute force version is skipped above maxBruteForceSize UTXOs (default
+# 5000), it takes far too long on exchange-sized wallets.
+################################################################################
+import random
+import sys
+sys.path.append('..')
+sys.argv.append('--nologging')
+from armoryengine.ArmoryUtils import RightNow, hash160_to_p2pkhash_script, \
+                                     script_to_scrAddr, ONE_BTC, CENT
+from armoryengine.CoinSelection import PyUnspentTxOut, PySelectCoins, \
+                                       PySelectCoinsBruteForce
+
+
+def makeUtxoList(nUtxo, seed=0):
+   rng = random.Random(seed)
+   scripts = [hash160_to_p2pkhash_script(''.join([chr(rng.randint(0,255)) \
+                  for j in range(20)])) for i in range(max(nUtxo/4, 1))]
+   utxoList = []
+   for i in range(nUtxo):
+      script = rng.choice(scripts)
+      value  = rng.choice([rng.randint(10000, 50*ONE_BTC), CENT, ONE_BTC])
+      nConf  = rng.choice([0, 1, 6, rng.randint(1, 50000)])
+      txHash = ''.join([chr(rng.randint(0,255)) for j in range(32)])
+      utxoList.append(PyUnspentTxOut(script_to_scrAddr(script), txHash,
+                                     rng.randint(0,3), value, nConf, script))
+   return utxoList
+
+
+def timeSelect(selectFunc, utxoList, target, fee, seed):
+   random.seed(seed)
+   start = RightNow()
+   result = selectFunc(utxoList, target, fee)
+   return RightNow() - start, result
+
+
+if __name__ == '__main__':
+   maxBrute = int(sys.argv[1]) if len(sys.argv)>1 and \
+                                  sys.argv[1].isdigit() else 5000
+
+   print '%8s  %14s  %14s  %8s  %s' % \
+            ('nUtxo', 'Selector (ms)', 'BruteForce (ms)', 'Speedup', 'Same')
+   for nUtxo in [10, 100, 1000, 5000, 20000, 50000]:
+      utxoList = makeUtxoList(nUtxo)
+      target = sum([u.getValue() for u in utxoList]) / 10
+      fee = 10000
+
+      tSel,selected = timeSelect(PySelectCoins, utxoList, target, fee, nUtxo)
+      if nUtxo > maxBrute:
+         print '%8d  %14.1f  %14s  %8s  %s' % (nUtxo, tSel*1000, '-', '-', '-')
+         continue
+
+      tBrute,bruteSel = timeSelect(PySelectCoinsBruteForce, utxoList, target,
+                                                                 fee, nUtxo)
+      isSame = [id(u) for u in selected] == [id(u) for u in bruteSel]
+      print '%8d  %14.1f  %14.1f  %7.1fx  %s' % \
+            (nUtxo, tSel*1000, tBrute*1000, tBrute/tSel, isSame)
@@ -0,0 +1,83 @@
+################################################################################
+# Micro-benchmark for compiled scripts in PyScriptProcessor.  Collects every
+# TxIn and TxOut script from the same ~1 MB block as bench_unpacker.py and
+# times splitting them into ops without the cache and with it warm, plus
+# convertScriptToOpStrings.  Then signs a P2PKH transaction the same way as
+# bench_sigbatch.py and times verifyTransactionValid on each input through
+# the standard-script path and through the generic script engine, with the
+# caches cold and warm.
+#
+#    $ cd extras && python bench_script.py [targetBytes] [nInputs]
+#
+################################################################################
+import sys
+sys.path.append('..')
+sys.argv.append('--nologging')
+from armoryengine.Block import PyBlock
+from armoryengine.Script import PyScriptProcessor, CompiledScript, \
+   compileScript, convertScriptToOpStrings, compiledScriptCache, \
+   validPubKeyCache, SCRIPT_NO_ERROR
+from armoryengine.Transaction import PyTx, sigVerifyCache
+from bench_unpacker import buildLargeBlock, timeIt
+from bench_sigbatch import buildUnsignedTx, timeOnce
+
+
+def clearScriptCaches():
+   compiledScriptCache.clear()
+   validPubKeyCache.clear()
+   sigVerifyCache.clear()
+
+
+if __name__ == '__main__':
+   targetBytes = int(sys.argv[1]) if len(sys.argv)>1 and \
+                                     sys.argv[1].isdigit() else 1024*1024
+   nInputs = int(sys.argv[2]) if len(sys.argv)>2 and \
+                                 sys.argv[2].isdigit() else 100
+
+   rawBlock, nTx = buildLargeBlock(targetBytes)
+   txList = PyBlock().unserialize(rawBlock).blockData.txList
+   scripts = []
+   for tx in txList:
+      scripts.extend([txin.binScript for txin in tx.inputs])
+      scripts.extend([txout.binScript for txout in tx.outputs])
+   print 'Block size: %d bytes, %d transactions, %d scripts (%d unique)' % \
+                  (len(rawBlock), nTx, len(scripts), len(set(scripts)))
+
+   def report(label, t):
+      print '%-34s: %8.2f ms' % (label, t*1000)
+
+   # The block repeats a few transactions, so time the uncached path directly
+   report('CompiledScript (no cache)',
+          timeIt(lambda: [CompiledScript(scr) for scr in scripts], 10))
+   report('compileScript (warm cache)',
+          timeIt(lambda: [compileScript(scr) for scr in scripts], 10))
+   report('convertScriptToOpStrings',
+          timeIt(lambda: [convertScriptToOpStrings(scr) for scr in scripts], 10))
+
+   # Verify every input of one signed tx, script pair by script pair
+   ustx, keyList = buildUnsignedTx(nInputs)
+   ustx.createAndInsertSignaturesBatch(keyList, verifySigs=False)
+   signedTx = ustx.getSignedPyTx(doVerifySigs=False)
+   supportTx = PyTx().unserialize(ustx.ustxInputs[0].supportTx)
+   print 'Verifying %d P2PKH inputs' % nInputs
+
+   def verifyStandard():
+      for i in range(nInputs):
+         psp = PyScriptProcessor(supportTx, signedTx, i)
+         assert psp.verifyTransactionValid()
+
+   def verifyGeneric():
+      for i in range(nInputs):
+         psp = PyScriptProcessor(supportTx, signedTx, i)
+         stack = []
+         assert psp.executeScript(psp.script1, stack) == SCRIPT_NO_ERROR
+         assert psp.executeScript(psp.script2, stack) == SCRIPT_NO_ERROR
+         assert stack[-1]==1
+
+   for label,func in [('standard path', verifyStandard),
+                      ('generic engine', verifyGeneric)]:
+      clearScriptCaches()
+      tCold,_ = timeOnce(func)
+      tWarm,_ = timeOnce(func)
+      report('verify, %s (cold caches)' % label, tCold)
+      report('verify, %s (warm caches)' % label, tWarm)
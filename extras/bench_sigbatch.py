@@ -0,0 +1,100 @@
+################################################################################
+# Benchmark for batch signing and verification of UnsignedTransactions.
+# Builds P2PKH transactions with 1, 10, 100 and 1000 inputs (each input with
+# its own key) and times, for each size:
+#
+#    - signing input-by-input with createAndInsertSignatureForInput
+#    - createAndInsertSignaturesBatch on one thread, and on all cores
+#    - verifySigsAllInputsBatch on one thread, and on all cores
+#
+#    $ cd extras && python bench_sigbatch.py [maxInputs] [numThreads]
+#
+################################################################################
+import sys
+sys.path.append('..')
+sys.argv.append('--nologging')
+from armoryengine.ArmoryUtils import RightNow, hash256, hash160, \
+   hash160_to_p2pkhash_script, ONE_BTC
+from armoryengine.Transaction import PyTx, PyTxIn, PyTxOut, PyOutPoint, \
+   UnsignedTxInput, DecoratedTxOut, UnsignedTransaction, getDefaultSigThreads
+from CppBlockUtils import SecureBinaryData, CryptoECDSA
+
+
+def buildUnsignedTx(nInputs):
+   privKeys = [SecureBinaryData(hash256('bench_sigbatch %d' % i)) \
+                                                for i in range(nInputs)]
+   pubKeys  = [CryptoECDSA().ComputePublicKey(k).toBinStr() for k in privKeys]
+
+   # One supporting tx that pays every key once
+   supportTx = PyTx()
+   supportTx.version  = 1
+   supportTx.lockTime = 0
+   txin = PyTxIn()
+   txin.outpoint  = PyOutPoint('\x00'*32, 0)
+   txin.binScript = '\x00'
+   txin.intSeq    = 2**32-1
+   supportTx.inputs  = [txin]
+   supportTx.outputs = []
+   for pub in pubKeys:
+      txout = PyTxOut()
+      txout.value     = ONE_BTC
+      txout.binScript = hash160_to_p2pkhash_script(hash160(pub))
+      supportTx.outputs.append(txout)
+   rawSupport = supportTx.serialize()
+
+   ustxiList = [UnsignedTxInput(rawSupport, i, None, pub) \
+                                       for i,pub in enumerate(pubKeys)]
+   dtxo = DecoratedTxOut(hash160_to_p2pkhash_script('\x11'*20),
+                         nInputs*ONE_BTC - 10000)
+   ustx = UnsignedTransaction().createFromUnsignedTxIO(ustxiList, [dtxo])
+   return ustx, list(enumerate(privKeys))
+
+
+def timeOnce(func):
+   start = RightNow()
+   result = func()
+   return RightNow() - start, result
+
+
+if __name__ == '__main__':
+   maxInputs = int(sys.argv[1]) if len(sys.argv)>1 and \
+                                   sys.argv[1].isdigit() else 1000
+   numThreads = int(sys.argv[2]) if len(sys.argv)>2 and \
+                                    sys.argv[2].isdigit() else \
+                                    getDefaultSigThreads()
+
+   print 'Using %d threads' % numThreads
+   print '%6s  %12s %12s %12s %12s %12s' % ('Inputs', 'SignEach',
+         'SignBatch/1', 'SignBatch/N', 'Verify/1', 'Verify/N')
+
+   for nInputs in [1, 10, 100, 1000]:
+      if nInputs > maxInputs:
+         break
+
+      ustx, keyList = buildUnsignedTx(nInputs)
+      ser = ustx.serialize()
+
+      def signEach():
+         for txInIndex,sbdPrivKey in keyList:
+            ustx1.createAndInsertSignatureForInput(txInIndex, sbdPrivKey)
+
+      ustx1 = UnsignedTransaction().unserialize(ser)
+      tEach,_ = timeOnce(signEach)
+
+      ustx1 = UnsignedTransaction().unserialize(ser)
+      tSign1,stat = timeOnce(lambda: ustx1.createAndInsertSignaturesBatch(
+                           keyList, verifySigs=False, numThreads=1))
+
+      ustxN = UnsignedTransaction().unserialize(ser)
+      tSignN,stat = timeOnce(lambda: ustxN.createAndInsertSignaturesBatch(
+                           keyList, verifySigs=False, numThreads=numThreads))
+      assert stat.canBroadcast
+
+      tVer1,stat1 = timeOnce(lambda: ustxN.verifySigsAllInputsBatch(
+                                                      numThreads=1))
+      tVerN,statN = timeOnce(lambda: ustxN.verifySigsAllInputsBatch(
+                                                      numThreads=numThreads))
+      assert stat1.sigsValid and statN.sigsValid
+
+      print '%6d  %10.1fms %10.1fms %10.1fms %10.1fms %10.1fms' % (nInputs,
+            tEach*1000, tSign1*1000, tSignN*1000, tVer1*1000, tVerN*1000)
@@ -0,0 +1,51 @@
+################################################################################
+# Micro-benchmark for PyTx raw-data reuse.  Builds a ~1 MB block the same way
+# as bench_unpacker.py, then times parsing it, hashing every transaction,
+# building the merkle root, and copying and re-serializing every transaction.
+#
+#    $ cd extras && python bench_txhash.py [targetBytes] [nIter]
+#
+################################################################################
+import sys
+sys.path.append('..')
+sys.argv.append('--nologging')
+from armoryengine.BinaryUnpacker import BinaryUnpacker
+from armoryengine.Block import PyBlock
+from bench_unpacker import buildLargeBlock, timeIt
+
+
+if __name__ == '__main__':
+   targetBytes = int(sys.argv[1]) if len(sys.argv)>1 and \
+                                     sys.argv[1].isdigit() else 1024*1024
+   nIter = int(sys.argv[2]) if len(sys.argv)>2 and \
+                               sys.argv[2].isdigit() else 10
+
+   rawBlock, nTx = buildLargeBlock(targetBytes)
+   print 'Block size: %d bytes, %d transactions' % (len(rawBlock), nTx)
+
+   def report(label, func):
+      t = timeIt(func, nIter)
+      print '%-26s: %8.2f ms  (%6.2f MB/s)' % \
+                           (label, t*1000, len(rawBlock)/t/(1024*1024))
+
+   report('PyBlock.unserialize',
+          lambda: PyBlock().unserialize(BinaryUnpacker(rawBlock)))
+
+   txList = PyBlock().unserialize(rawBlock).blockData.txList
+   blkData = PyBlock().unserialize(rawBlock).blockData
+   report('PyTx.getHash (all tx)', lambda: [tx.getHash() for tx in txList])
+   def merkleRoot():
+      blkData.merkleTree = []
+      blkData.getMerkleRoot()
+   report('PyBlockData.getMerkleRoot', merkleRoot)
+   report('PyTx.serialize (all tx)', lambda: [tx.serialize() for tx in txList])
+   report('PyTx.copy (all tx)', lambda: [tx.copy() for tx in txList])
+
+   # Changing one field has to re-serialize that tx, but the unchanged
+   # inputs and outputs still contribute their raw bytes
+   def copyAndModify():
+      for tx in txList:
+         txCopy = tx.copy()
+         txCopy.lockTime += 1
+         txCopy.getHash()
+   report('copy + modify + getHash', copyAndModify)
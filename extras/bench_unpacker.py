@@ -0,0 +1,81 @@
+################################################################################
+# Micro-benchmark for BinaryUnpacker.  Builds a ~1 MB block by repeating the
+# non-coinbase transactions of extras/blk135687.hex, then times how long it
+# takes to parse it with PyBlock().unserialize(), plus a raw field-by-field
+# loop that isolates the cost of BinaryUnpacker.get() itself.
+#
+#    $ cd extras && python bench_unpacker.py [targetBytes] [nIter]
+#
+################################################################################
+import os
+import sys
+sys.path.append('..')
+sys.argv.append('--nologging')
+from armoryengine.ArmoryUtils import hex_to_binary, RightNow, packVarInt
+from armoryengine.BinaryUnpacker import BinaryUnpacker
+from armoryengine.BinaryPacker import UINT32, UINT64, VAR_INT, VAR_STR, \
+                                      BINARY_CHUNK
+from armoryengine.Block import PyBlock
+
+
+def buildLargeBlock(targetBytes):
+   here = os.path.dirname(os.path.abspath(__file__))
+   hexStr = open(os.path.join(here, 'blk135687.hex')).read()
+   rawBlk = hex_to_binary(hexStr.replace(' ','').strip())
+   blk = PyBlock().unserialize(rawBlk)
+
+   rawHeader = blk.blockHeader.serialize()
+   rawCoinbase = blk.blockData.txList[0].serialize()
+   rawOthers = [tx.serialize() for tx in blk.blockData.txList[1:]]
+
+   txList = [rawCoinbase]
+   nBytes = 80 + len(rawCoinbase)
+   while nBytes < targetBytes:
+      for rawTx in rawOthers:
+         txList.append(rawTx)
+         nBytes += len(rawTx)
+
+   return rawHeader + packVarInt(len(txList))[0] + ''.join(txList), len(txList)
+
+
+def timeIt(func, nIter):
+   start = RightNow()
+   for i in xrange(nIter):
+      func()
+   return (RightNow() - start) / nIter
+
+
+if __name__ == '__main__':
+   targetBytes = int(sys.argv[1]) if len(sys.argv)>1 and \
+                                     sys.argv[1].isdigit() else 1024*1024
+   nIter = int(sys.argv[2]) if len(sys.argv)>2 and \
+                               sys.argv[2].isdigit() else 10
+
+   rawBlock, nTx = buildLargeBlock(targetBytes)
+   print 'Block size: %d bytes, %d transactions' % (len(rawBlock), nTx)
+
+   for label,data in [('str',        rawBlock),
+                      ('memoryview', memoryview(rawBlock))]:
+      t = timeIt(lambda: PyBlock().unserialize(BinaryUnpacker(data)), nIter)
+      print 'PyBlock.unserialize (%-10s): %8.2f ms  (%6.2f MB/s)' % \
+                           (label, t*1000, len(rawBlock)/t/(1024*1024))
+
+   # Raw get() throughput, independent of the PyTx object construction
+   def walkFields():
+      bu = BinaryUnpacker(rawBlock)
+      bu.advance(80)
+      for i in xrange(bu.get(VAR_INT)):
+         bu.get(UINT32)
+         for j in xrange(bu.get(VAR_INT)):
+            bu.get(BINARY_CHUNK, 32)
+            bu.get(UINT32)
+            bu.get(VAR_STR)
+            bu.get(UINT32)
+         for j in xrange(bu.get(VAR_INT)):
+            bu.get(UINT64)
+            bu.get(VAR_STR)
+         bu.get(UINT32)
+
+   t = timeIt(walkFields, nIter)
+   print 'Field walk only           : %8.2f ms  (%6.2f MB/s)' % \
+                           (t*1000, len(rawBlock)/t/(1024*1024))
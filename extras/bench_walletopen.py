@@ -0,0 +1,62 @@
+################################################################################
+# Benchmark for opening large wallets.  Builds a throw-away wallet with
+# numAddr addresses in a temp directory, then times:
+#
+#    eager      - readWalletFile() as it has always worked
+#    lazy cold  - readWalletFile(lazyLoad=True) with no side-car index yet
+#    lazy warm  - readWalletFile(lazyLoad=True) with the index in place
+#
+#    $ cd extras && python bench_walletopen.py [numAddr]
+################################################################################
+import os
+import shutil
+import sys
+import tempfile
+sys.path.append('..')
+sys.argv.append('--nologging')
+from armoryengine.ArmoryUtils import RightNow, SecureBinaryData
+from armoryengine.PyBtcWallet import PyBtcWallet
+from armoryengine.WalletFileIndex import getWalletIndexPath
+
+
+def timeOpen(wltPath, lazyLoad):
+   start = RightNow()
+   wlt = PyBtcWallet().readWalletFile(wltPath, lazyLoad=lazyLoad)
+   return RightNow() - start, wlt
+
+
+if __name__ == '__main__':
+   numAddr = int(sys.argv[1]) if len(sys.argv)>1 and \
+                                 sys.argv[1].isdigit() else 20000
+
+   homeDir = tempfile.mkdtemp()
+   try:
+      wlt = PyBtcWallet().createNewWallet( \
+                              plainRootKey=SecureBinaryData('\xaa'*32),
+                              chaincode=SecureBinaryData('\xbb'*32),
+                              withEncrypt=False, shortLabel='bench',
+                              isActuallyNew=False, doRegisterWithBDM=False,
+                              armoryHomeDir=homeDir)
+      print 'Creating wallet with %d addresses...' % numAddr
+      wlt.extendAddressPool(numAddr, isActuallyNew=False, doRegister=False)
+      wltPath = wlt.walletPath
+      indexPath = getWalletIndexPath(wltPath)
+
+      tEager,wlt  = timeOpen(wltPath, False)
+      if os.path.exists(indexPath):
+         os.remove(indexPath)
+      tCold,wlt = timeOpen(wltPath, True)
+      tWarm,wlt = timeOpen(wltPath, True)
+
+      start = RightNow()
+      for a160 in wlt.linearAddr160List[:1000]:
+         wlt.addrMap[a160]
+      tAccess = (RightNow() - start) / min(1000, numAddr)
+   finally:
+      shutil.rmtree(homeDir, ignore_errors=True)
+
+   print '%-12s  %10s' % ('Open mode', 'Time (s)')
+   print '%-12s  %10.2f' % ('eager', tEager)
+   print '%-12s  %10.2f' % ('lazy cold', tCold)
+   print '%-12s  %10.2f' % ('lazy warm', tWarm)
+   print 'First access of a lazy entry: %0.3f ms' % (tAccess*1000)
@@ -16,7 +16,7 @@ import time
 
 import CppBlockUtils
 from armoryengine.ArmoryUtils import getVersionString, BTCARMORY_VERSION, \
-   ChecksumError
+   ChecksumError, binary_to_base58, base58_to_binary, hash160_to_addrStr
 
 
 FTVerbose=False
@@ -52,10 +52,7 @@ def randomk():  #better make it stronger
 # Common constants/functions for Bitcoin
 
 def hash_160_to_bc_address(h160, addrtype=0):
-   vh160 = chr(addrtype) + h160
-   h = Hash(vh160)
-   addr = vh160 + h[0:4]
-   return b58encode(addr)
+   return hash160_to_addrStr(h160, chr(addrtype))
 
 def bc_address_to_hash_160(addr):
    hash160 = b58decode(addr, 25)
@@ -70,46 +67,16 @@ def sha256(data):
 def sha1(data):
    return hashlib.sha1(data).digest()
 
-__b58chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
-__b58base = len(__b58chars)
-
+# Same codec as the rest of Armory
 def b58encode(v):
-   long_value = 0L
-   for (i, c) in enumerate(v[::-1]):
-      long_value += (256**i) * ord(c)
-
-   result = ''
-   while long_value >= __b58base:
-      div, mod = divmod(long_value, __b58base)
-      result = __b58chars[mod] + result
-      long_value = div
-   result = __b58chars[long_value] + result
-
-   nPad = 0
-   for c in v:
-      if c == '\0': nPad += 1
-      else: break
-
-   return (__b58chars[0]*nPad) + result
+   return binary_to_base58(v)
 
 def b58decode(v, length):
-   long_value = 0L
-   for (i, c) in enumerate(v[::-1]):
-      long_value += __b58chars.find(c) * (__b58base**i)
-
-   result = ''
-   while long_value >= 256:
-      div, mod = divmod(long_value, 256)
-      result = chr(mod) + result
-      long_value = div
-   result = chr(long_value) + result
-
-   nPad = 0
-   for c in v:
-      if c == __b58chars[0]: nPad += 1
-      else: break
-
-   result = chr(0)*nPad + result
+   try:
+      result = base58_to_binary(v)
+   except ValueError:
+      return None
+
    if length is not None and len(result) != length:
       return None
 
@@ -124,6 +91,8 @@ def ASecretToSecret(key):
      
 def DecodeBase58Check(psz):
    vchRet = b58decode(psz, None)
+   if vchRet is None:
+      return None
    key = vchRet[0:-4]
    csum = vchRet[-4:]
    hashValue = Hash(key)
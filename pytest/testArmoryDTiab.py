@@ -8,7 +8,8 @@ sys.path.append('..')
 from pytest.Tiab import TiabTest, TOP_TIAB_BLOCK, FIRST_WLT_BALANCE,\
    FIRST_WLT_NAME, SECOND_WLT_NAME, THIRD_WLT_NAME, TIAB_SATOSHI_PORT
 from armoryengine.ArmoryUtils import *
-from armoryd import AmountToJSON, Armory_Json_Rpc_Server, JSONtoAmount
+from armoryd import AmountToJSON, Armory_Json_Rpc_Server, JSONtoAmount, \
+   ArmoryLedgerCache
 from armoryengine.BDM import TheBDM
 from armoryengine.PyBtcWallet import PyBtcWallet
 from armoryengine.Transaction import UnsignedTransaction, PyTx
@@ -358,6 +359,33 @@ class ArmoryDTiabTest(TiabTest):
       self.assertEqual(amountList[:5], expectedAmountList)
 
 
+   def testGetledgerCached(self):
+      ledger = self.jsonServer.jsonrpc_getledger(FIRST_WLT_NAME)
+      simple = self.jsonServer.jsonrpc_getledgersimple(FIRST_WLT_NAME)
+      self.assertEqual(self.jsonServer.jsonrpc_getledger(FIRST_WLT_NAME), ledger)
+      self.assertTrue('recipme' in ledger[0])
+      self.assertFalse('recipme' in simple[0])
+      self.assertEqual(simple[0]['confirmations'], ledger[0]['confirmations'])
+
+      # Pages are slices of the same rows
+      page = self.jsonServer.jsonrpc_getledger(FIRST_WLT_NAME, 2, 1)
+      self.assertEqual(page, ledger[1:3])
+
+      # Rows say whose address is whose, so they all go when any wallet's
+      # addresses change
+      self.assertTrue(len(self.jsonServer.ledgerCache.rows) > 0)
+      self.wltB.addrMapVersion += 1
+      self.jsonServer.ledgerCache.checkWallets(self.jsonServer.serverWltMap, \
+                                               self.jsonServer.serverLBMap)
+      self.assertEqual(len(self.jsonServer.ledgerCache.rows), 0)
+      self.assertEqual(self.jsonServer.jsonrpc_getledger(FIRST_WLT_NAME), ledger)
+
+      # A page bigger than the cache still comes back whole
+      self.jsonServer.ledgerCache = ArmoryLedgerCache(maxRows=3)
+      self.assertEqual(self.jsonServer.jsonrpc_getledger(FIRST_WLT_NAME), ledger)
+      self.assertEqual(len(self.jsonServer.ledgerCache.rows), 3)
+
+
    def testGetledger(self):
       ledger = self.jsonServer.jsonrpc_getledger(FIRST_WLT_NAME)
       self.assertTrue(len(ledger)>6)
@@ -7,6 +7,9 @@ import sys
 sys.path.append('..')
 import hashlib
 import locale
+import os
+import shutil
+import tempfile
 from random import shuffle
 import time
 import unittest
@@ -297,6 +300,58 @@ class ArmoryEngineTest(unittest.TestCase):
       self.assertEqual(thr.getErrorMsg(), 'This is a forced error')
       self.assertRaises(ValueError, thr.raiseLastError)
 
+   #############################################################################
+   def testAsyncLogHandler(self):
+      stream = stringAggregator()
+      target = logging.StreamHandler(stream)
+      target.setFormatter(logging.Formatter('%(message)s'))
+      handler = AsyncLogHandler(target)
+      handler.setLevel(logging.INFO)
+
+      def logFromHere():
+         return getCallerLine()
+      callerStr = logFromHere()
+      self.assertTrue(callerStr.startswith('testArmoryEngineUtils.py:'))
+
+      testLogger = logging.getLogger('AsyncLogTest')
+      testLogger.propagate = False
+      testLogger.addHandler(handler)
+      try:
+         testLogger.debug('Not written')
+         testLogger.info('Written %d', 1)
+         handler.flush()
+         self.assertEqual(stream.getStr(), 'Written 1\n')
+      finally:
+         testLogger.removeHandler(handler)
+         handler.close()
+      self.assertFalse(handler.thread.is_alive())
+
+   #############################################################################
+   def testChopLogFile(self):
+      logDir = tempfile.mkdtemp('armory_logtest')
+      logPath = os.path.join(logDir, 'test.log')
+      try:
+         lines = ['Log line number %06d\n' % i for i in range(20000)]
+         with open(logPath, 'wb') as f:
+            f.write(''.join(lines))
+
+         # Small enough already, left alone
+         chopLogFile(logPath, 1024*1024)
+         self.assertEqual(os.path.getsize(logPath), 23*20000)
+
+         # Cut at a line boundary, so a little less than asked for
+         chopLogFile(logPath, 1000)
+         with open(logPath, 'rb') as f:
+            self.assertEqual(f.read(), ''.join(lines[-43:]))
+         self.assertFalse(os.path.exists(logPath + '.tmp'))
+
+         fout = stringAggregator()
+         self.assertEqual(copyLastBytesOfFile(logPath, fout, 30), 30)
+         self.assertEqual(fout.getStr(), lines[-2][-7:] + lines[-1])
+         self.assertEqual(copyLastBytesOfFile(logPath + 'x', fout, 30), 0)
+      finally:
+         shutil.rmtree(logDir)
+
    #############################################################################
    def test_read_address(self):
       hashVal = hex_to_binary('c3a9eb6753c449c88ac193e9ddf7ab3a0be8c5ad')
@@ -319,6 +374,40 @@ class ArmoryEngineTest(unittest.TestCase):
       self.assertRaises(ChecksumError, addrStr_to_hash160, addrStrBad)
       self.assertRaises(P2SHNotSupportedError, addrStr_to_hash160, addrStr05, False)
 
+   #############################################################################
+   def test_base58_batch(self):
+      # Leading zero bytes, and a value that is a whole number of chunks
+      for binStr in ['', '\x00', '\x00\x00\x01', '\xff'*25, '\x00'*2 + '\x01'*30]:
+         self.assertEqual(base58_to_binary(binary_to_base58(binStr)), binStr)
+      self.assertEqual(binary_to_base58('\x00\x00\x01'), '112')
+      self.assertEqual(binary_to_base58(hex_to_binary('0239')), 'Ap')
+      self.assertRaises(ValueError, base58_to_binary, '1OIl0')
+
+      a160List = [hash160(chr(i)) for i in range(50)]
+      addrList = hash160List_to_addrStrList(a160List)
+      self.assertEqual(addrList, [hash160_to_addrStr(a) for a in a160List])
+      self.assertEqual(addrStrList_to_hash160List(addrList), \
+                       [(ADDRBYTE, a) for a in a160List])
+
+      # Repeat conversions come from the cache
+      nHits = addrStrEncodeCache.nHits
+      hash160List_to_addrStrList(a160List)
+      self.assertEqual(addrStrEncodeCache.nHits, nHits + 50)
+
+   #############################################################################
+   def testLRUCache(self):
+      cache = LRUCache(2)
+      cache.put('a', 1)
+      cache.put('b', 2)
+      self.assertEqual(cache.get('a'), 1)
+      cache.put('c', 3)
+      self.assertEqual(len(cache), 2)
+      self.assertFalse('b' in cache)
+      self.assertEqual(cache.get('b', 'none'), 'none')
+      self.assertEqual(cache.get('a'), 1)
+      self.assertEqual(cache.get('c'), 3)
+      self.assertEqual((cache.nHits, cache.nMisses), (3, 1))
+
 
    #############################################################################
    def test_p2pkhash_script(self):
@@ -463,6 +552,30 @@ class BinaryPackerUnpackerTest(unittest.TestCase):
       bu.append(ts)
       self.assertEqual(bu.getBinaryString(), ts + ts)
 
+   #############################################################################
+   def testBinaryUnpackerBuffers(self):
+      ts = hex_to_binary('fd0201' '03616263' 'ffffffff' '0102')
+      for data in [ts, buffer(ts), bytearray(ts), memoryview(ts)]:
+         bu = BinaryUnpacker(data)
+         self.assertEqual(bu.get(VAR_INT), 0x0102)
+         self.assertEqual(bu.get(VAR_STR), 'abc')
+         self.assertEqual(bu.get(INT32), -1)
+         self.assertEqual(bu.getRemainingString(), '\x01\x02')
+         self.assertEqual(str(bytearray(bu.getRemainingBuffer())), '\x01\x02')
+         self.assertEqual(bu.get(UINT16, endianness=BIGENDIAN), 0x0102)
+         self.assertRaises(UnpackerError, bu.get, UINT8)
+         self.assertEqual(bu.getBinaryString(), ts)
+
+   #############################################################################
+   def testTruncatedVarInt(self):
+      # The prefix byte is there but the 2/4/8 bytes it announces are not
+      for hexStr in ['fd01', 'fe010203', 'ff01020304050607']:
+         bu = BinaryUnpacker(hex_to_binary(hexStr))
+         self.assertRaises(UnpackerError, bu.get, VAR_INT)
+         self.assertEqual(bu.getPosition(), 0)
+         self.assertRaises(UnpackerError, BinaryUnpacker(
+                                hex_to_binary(hexStr)).get, VAR_STR)
+
    #############################################################################
    def testBinaryPacker(self):
       UNKNOWN_TYPE = 100
@@ -510,6 +623,20 @@ class BinaryPackerUnpackerTest(unittest.TestCase):
       self.assertRaises(UnpackerError, bu.get, UNKNOWN_TYPE)
       self.assertRaises(UnpackerError, bu.get, BINARY_CHUNK, 1)
 
+      # put_many must produce exactly the same bytes as the put() calls
+      bp = BinaryPacker(1)
+      bp.put_many([UINT8, UINT16, UINT32, UINT64, INT8, INT16, INT32, INT64,
+                   VAR_INT, VAR_STR, FLOAT, BINARY_CHUNK, (BINARY_CHUNK,4)],
+                  [TEST_UINT, TEST_UINT, TEST_UINT, TEST_UINT,
+                   TEST_INT, TEST_INT, TEST_INT, TEST_INT,
+                   TEST_VARINT, TEST_STR, TEST_FLOAT,
+                   FS_FOR_3_BYTES, FS_FOR_3_BYTES])
+      self.assertEqual(bp.getSize(), len(TEST_BINARY_PACKER_STR))
+      self.assertEqual(bp.getBinaryString(), TEST_BINARY_PACKER_STR)
+      self.assertRaises(PackerError, bp.put_many, [(BINARY_CHUNK,2)],
+                                                  [FS_FOR_3_BYTES])
+      self.assertRaises(PackerError, bp.put_many, [UINT8, UINT8], [1])
+
 # Running tests with "python <module name>" will NOT work for any Armory tests
 # You must run tests with "python -m unittest <module name>" or run all tests with "python -m unittest discover"
 # if __name__ == "__main__":
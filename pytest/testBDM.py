@@ -0,0 +1,289 @@
+'''
+Tests for the BDM request queue, run against a fake C++ BlockDataManager
+'''
+import sys
+sys.path.append('..')
+import Queue
+import threading
+import time
+import unittest
+
+sys.argv.append('--nologging')
+
+import armoryengine.BDM as BDM
+from armoryengine.BDM import BDMRequest, BDMINPUTTYPE, BDM_REQUEST_ERROR, \
+   isBDMRequestError, BDMReadSnapshot
+
+
+class BorrowedHeader(object):
+   """ Looks like a SWIG pointer into memory owned by the C++ BDM """
+   thisown = False
+
+
+class FakeCppBDM(object):
+   """
+   Stands in for the C++ BlockDataManager.  slowCall() blocks the thread
+   running it until release() is called.
+   """
+   def __init__(self):
+      self.txMap = {'tx1': 'rawTx1', 'tx2': 'rawTx2'}
+      self.slowStarted = threading.Event()
+      self.slowRelease = threading.Event()
+
+      # How many threads were inside getTxByHash at once
+      self.callLock  = threading.Lock()
+      self.nInside   = 0
+      self.maxInside = 0
+
+   def isInitialized(self):
+      return True
+
+   def getTopBlockHeight(self):
+      return 300000
+
+   def getTxByHash(self, txHash):
+      with self.callLock:
+         self.nInside += 1
+         self.maxInside = max(self.maxInside, self.nInside)
+      try:
+         time.sleep(0.01)
+         # Unknown hashes raise, which gives us an error slot in a batch
+         return self.txMap[txHash]
+      finally:
+         with self.callLock:
+            self.nInside -= 1
+
+   def getTopBlockHeader(self):
+      return BorrowedHeader()
+
+   def slowCall(self):
+      self.slowStarted.set()
+      self.slowRelease.wait()
+      return 'slowDone'
+
+   # What a rescan calls
+   def isDirty(self):
+      return True
+
+   def numBlocksToRescan(self, cppWlt):
+      return 1000
+
+   def doSyncIfNeeded(self):
+      self.slowCall()
+
+   def scanBlockchainForTx(self, cppWlt):
+      pass
+
+   def saveScrAddrHistories(self):
+      pass
+
+   def release(self):
+      self.slowRelease.set()
+
+
+################################################################################
+class BDMTestBase(unittest.TestCase):
+   """
+   Swaps in a fresh TheBDM with a FakeCppBDM behind it for each test, and
+   puts the real one back afterwards
+   """
+   nReaders = 0
+
+   def setUp(self):
+      self.savedBDM = BDM.TheBDM
+      BDM.newTheBDM(isOffline=True)
+      self.bdm = BDM.TheBDM
+      self.fakeBDM = FakeCppBDM()
+      self.bdm.bdm = self.fakeBDM
+      self.bdm.setBlocking(False, newTimeout=5)
+      self.bdm.setConcurrentReaders(self.nReaders)
+      self.bdm.setDaemon(True)
+      self.bdm.start()
+
+   def tearDown(self):
+      self.fakeBDM.release()
+      self.bdm.doShutdown = True
+      self.bdm.queueRequest(BDMINPUTTYPE.GoOfflineRequested, False)
+      self.bdm.join(5)
+      for reader in self.bdm.readerThreads:
+         self.bdm.readQueue.put(None)
+      BDM.TheBDM = self.savedBDM
+
+   def startSlowCall(self):
+      """ Keeps the BDM thread busy until self.fakeBDM.release() """
+      request = self.bdm.batch([('slowCall',)], wait=False)
+      self.assertTrue(self.fakeBDM.slowStarted.wait(5))
+      return request
+
+
+################################################################################
+class BDMRequestTest(unittest.TestCase):
+
+   #############################################################################
+   def testRequestOutput(self):
+      request = BDMRequest(7)
+      self.assertEqual(request.rndID, 7)
+      self.assertFalse(request.isFinished())
+      self.assertRaises(Queue.Empty, request.getOutput, 0.01)
+
+      request.setOutput('abc')
+      self.assertTrue(request.isFinished())
+      self.assertEqual(request.getOutput(0), 'abc')
+
+   #############################################################################
+   def testRequestError(self):
+      self.assertTrue(isBDMRequestError(BDM_REQUEST_ERROR))
+      self.assertFalse(isBDMRequestError('rawTx1'))
+      self.assertFalse(isBDMRequestError(None))
+
+
+################################################################################
+class BDMBatchTest(BDMTestBase):
+
+   #############################################################################
+   def testBatchOrdering(self):
+      self.assertEqual(self.bdm.batch([('getTxByHash', 'tx2'), \
+                                       'getTopBlockHeight', \
+                                       ('getTxByHash', 'tx1')]), \
+                       ['rawTx2', 300000, 'rawTx1'])
+
+      # Several batches in flight at once each get their own output
+      slowRequest = self.startSlowCall()
+      txHashes = ['tx1', 'tx2', 'tx2', 'tx1']
+      requests = [self.bdm.batch([('getTxByHash', txHash)]*n, wait=False) \
+                                    for n,txHash in enumerate(txHashes, 1)]
+      self.fakeBDM.release()
+      self.assertEqual(slowRequest.getOutput(5), ['slowDone'])
+      for n,(txHash,request) in enumerate(zip(txHashes, requests), 1):
+         self.assertEqual(request.getOutput(5), [self.fakeBDM.txMap[txHash]]*n)
+      self.assertEqual(self.bdm.pendingRequests, {})
+
+   #############################################################################
+   def testBatchErrorSlots(self):
+      output = self.bdm.batch([('getTxByHash', 'tx1'), \
+                               ('getTxByHash', 'noSuchTx'), \
+                               ('getTopBlockHeight',)])
+      self.assertEqual(output, ['rawTx1', BDM_REQUEST_ERROR, 300000])
+
+      # The failed call is retried on its own, and fails again
+      output = self.bdm.batchWithFallback([('getTxByHash', 'tx1'), \
+                                           ('getTxByHash', 'noSuchTx')])
+      self.assertEqual(output, ['rawTx1', None])
+
+      self.assertRaises(AttributeError, self.bdm.batch, [('noSuchMethod',)])
+
+   #############################################################################
+   def testBatchTimeout(self):
+      self.bdm.setBlocking(False, newTimeout=0.2)
+      slowRequest = self.startSlowCall()
+
+      self.assertEqual(self.bdm.batch([('getTopBlockHeight',)]), None)
+      self.assertEqual(self.bdm.batchWithFallback([('getTxByHash', 'tx1'), \
+                                                   ('getTopBlockHeight',)]), \
+                       [None, None])
+
+      # Nobody is waiting for those any more, so their output is dropped
+      self.assertEqual(self.bdm.pendingRequests.keys(), [slowRequest.rndID])
+      self.fakeBDM.release()
+      self.assertEqual(slowRequest.getOutput(5), ['slowDone'])
+      self.bdm.setBlocking(False, newTimeout=5)
+      self.assertEqual(self.bdm.batch(['getTopBlockHeight']), [300000])
+      self.assertEqual(self.bdm.pendingRequests, {})
+      self.assertEqual(self.bdm.queuedTimes, {})
+
+
+################################################################################
+class BDMReadSnapshotTest(unittest.TestCase):
+
+   #############################################################################
+   def testSnapshot(self):
+      snapshot = BDMReadSnapshot()
+      passthru = BDMINPUTTYPE.Passthrough
+      batch = BDMINPUTTYPE.BatchRequested
+      snapshot.record(passthru, ('getTopBlockHeight',), 300000)
+      snapshot.record(batch, ([('getTxByHash', ('tx1',)), \
+                               ('getTxByHash', ('noSuchTx',)), \
+                               ('getTopBlockHeader', ())],), \
+                      ['rawTx1', BDM_REQUEST_ERROR, BorrowedHeader()])
+
+      # Only used while the BDM thread is busy with a long-running request
+      self.assertEqual(snapshot.lookup(passthru, ('getTopBlockHeight',)), \
+                       (False, None))
+      self.assertFalse(snapshot.contains(passthru, ('getTopBlockHeight',)))
+
+      snapshot.serving = True
+      self.assertEqual(snapshot.lookup(passthru, ('getTopBlockHeight',)), \
+                       (True, 300000))
+      self.assertEqual(snapshot.lookup(batch, ([('getTopBlockHeight', ()), \
+                                                ('getTxByHash', ('tx1',))],)), \
+                       (True, [300000, 'rawTx1']))
+
+      # Errors, borrowed pointers and non-value arguments aren't kept
+      self.assertFalse(snapshot.contains(passthru, ('getTxByHash', 'noSuchTx')))
+      self.assertFalse(snapshot.contains(passthru, ('getTopBlockHeader',)))
+      snapshot.record(passthru, ('getHeaderPtrForTx', object()), 'header')
+      self.assertEqual(len(snapshot.results), 2)
+
+      snapshot.clear()
+      self.assertFalse(snapshot.contains(passthru, ('getTopBlockHeight',)))
+
+
+################################################################################
+class BDMConcurrentReaderTest(BDMTestBase):
+   nReaders = 2
+
+   #############################################################################
+   def testReadDuringScan(self):
+      # Reads made before the scan go into the snapshot
+      self.assertEqual(self.bdm.getTopBlockHeight(), 300000)
+      self.assertEqual(self.bdm.batch([('getTxByHash', 'tx1')]), ['rawTx1'])
+
+      self.bdm.rescanBlockchain('AsNeeded', wait=False)
+      self.assertTrue(self.fakeBDM.slowStarted.wait(5))
+      self.fakeBDM.txMap['tx1'] = 'rescannedTx1'
+
+      # The scan is still running, and these are answered without waiting
+      self.assertEqual(self.bdm.getTopBlockHeight(), 300000)
+      self.assertEqual(self.bdm.batch([('getTxByHash', 'tx1')]), ['rawTx1'])
+      self.assertFalse(self.fakeBDM.slowRelease.isSet())
+
+      # Anything not in the snapshot waits for the scan to finish
+      request = self.bdm.batch([('getTxByHash', 'tx2')], wait=False)
+      self.assertRaises(Queue.Empty, request.getOutput, 0.2)
+      self.fakeBDM.release()
+      self.assertEqual(request.getOutput(5), ['rawTx2'])
+
+      # The scan changed the BDM, so reads see the new state again
+      self.assertEqual(self.bdm.batch([('getTxByHash', 'tx1')]), \
+                       ['rescannedTx1'])
+      self.assertEqual(self.bdm.queuedTimes, {})
+      self.assertEqual(self.bdm.getRequestStats()['RescanRequested'][0], 1)
+
+   #############################################################################
+   def testReadDuringShortWrite(self):
+      # A passthrough that isn't read-only is a write, and the snapshot isn't
+      # used for it
+      self.assertEqual(self.bdm.batch([('getTxByHash', 'tx1')]), ['rawTx1'])
+      slowRequest = self.startSlowCall()
+      request = self.bdm.batch([('getTxByHash', 'tx1')], wait=False)
+      self.assertRaises(Queue.Empty, request.getOutput, 0.2)
+      self.fakeBDM.release()
+      self.assertEqual(request.getOutput(5), ['rawTx1'])
+      self.assertEqual(slowRequest.getOutput(5), ['slowDone'])
+
+   #############################################################################
+   def testReadersTakeTurns(self):
+      # The readers never call into the C++ BDM at the same time
+      requests = []
+      for i in range(8):
+         txHash = 'tx%d' % (i%2+1)
+         requests.append(self.bdm.batch([('getTxByHash', txHash)], wait=False))
+      for i,request in enumerate(requests):
+         self.assertEqual(request.getOutput(5), ['rawTx%d' % (i%2+1)])
+      self.assertEqual(self.fakeBDM.maxInside, 1)
+
+
+# Running tests with "python <module name>" will NOT work for any Armory tests
+# You must run tests with "python -m unittest <module name>" or run all tests with "python -m unittest discover"
+# if __name__ == "__main__":
+#    unittest.main()
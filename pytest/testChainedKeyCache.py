@@ -0,0 +1,102 @@
+import sys
+sys.path.append('..')
+from pytest.Tiab import TiabTest
+import os
+import shutil
+import tempfile
+import unittest
+
+from armoryengine.ArmoryUtils import computeChecksum
+from armoryengine.ChainedKeyCache import ChainedKeyCache, PyVerifyChainLinks
+from armoryengine.PyBtcAddress import PyBtcAddress
+from CppBlockUtils import SecureBinaryData, CryptoECDSA
+
+
+class ChainedKeyCacheTest(TiabTest):
+
+   def setUp(self):
+      self.cacheDir = tempfile.mkdtemp()
+      self.chaincode = SecureBinaryData('\xee'*32)
+      privKey = SecureBinaryData('\xaa'*32)
+      self.rootPub = CryptoECDSA().ComputePublicKey(privKey)
+
+      # Reference chain, one key at a time the way wallets used to do it
+      self.refChain = []
+      pub = self.rootPub
+      for i in range(100):
+         pub = PyBtcAddress().safeExtendPublicKey(pub, self.chaincode)
+         self.refChain.append(pub.toBinStr())
+
+   def tearDown(self):
+      shutil.rmtree(self.cacheDir, ignore_errors=True)
+
+   def testSameAsSerialChain(self):
+      cache = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+      cache.chunkSize = 30
+      self.assertEqual(cache.getPubKey(-1), self.rootPub)
+      self.assertEqual([p.toBinStr() for p in cache.getPubKeyRange(0, 100)],
+                       self.refChain)
+
+   def testReadFromDisk(self):
+      cache = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+      cache.extendTo(49)
+
+      cache2 = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+      self.assertEqual(cache2.getTopIndex(), 49)
+      self.assertEqual(cache2.pubKeys, self.refChain[:50])
+
+      # A damaged record truncates the cache there, it gets re-derived
+      with open(cache.cachePath, 'r+b') as f:
+         f.seek(69*10 + 5)
+         f.write('\x00')
+      cache3 = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+      self.assertEqual(cache3.getTopIndex(), 9)
+      self.assertEqual(cache3.getPubKey(99).toBinStr(), self.refChain[99])
+
+   def testTamperedCacheFile(self):
+      cache = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+      cache.extendTo(49)
+
+      # A well-formed record with the wrong key passes the checksum, but is
+      # caught when its link is recomputed
+      with open(cache.cachePath, 'r+b') as f:
+         f.seek(69*20)
+         f.write(self.refChain[60] + computeChecksum(self.refChain[60]))
+      cache2 = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+      self.assertEqual(cache2.getTopIndex(), 49)
+      self.assertFalse(any(cache2.isVerified))
+      self.assertEqual(cache2.getPubKey(49).toBinStr(), self.refChain[49])
+      self.assertTrue(all(cache2.isVerified))
+      self.assertEqual(cache2.verifiedTop, 49)
+
+      cache3 = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+      self.assertEqual(cache3.pubKeys, self.refChain[:50])
+
+   def testRangeFromPrevPub(self):
+      cache = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+      cache.extendTo(49)
+      cache2 = ChainedKeyCache(self.rootPub, self.chaincode, -1, self.cacheDir)
+
+      # Only the links after the key we passed in are recomputed
+      self.assertEqual([p.toBinStr() for p in \
+                        cache2.getPubKeyRange(40, 20, self.refChain[39])],
+                       self.refChain[40:60])
+      self.assertFalse(any(cache2.isVerified[:40]))
+      self.assertTrue(all(cache2.isVerified[40:]))
+      self.assertEqual(cache2.verifiedTop, -1)
+
+      # Never derives up to the key we passed in, nor trusts a different one
+      self.assertEqual(cache2.getPubKeyRange(80, 5, self.refChain[79]), None)
+      self.assertEqual(cache2.getTopIndex(), 59)
+      self.assertEqual(cache2.getPubKeyRange(40, 5, self.refChain[40]), None)
+
+      # Filling the gap makes the whole chain trusted from the anchor
+      self.assertEqual(cache2.getPubKey(59).toBinStr(), self.refChain[59])
+      self.assertEqual(cache2.verifiedTop, 59)
+
+   def testVerifyLinks(self):
+      cc = self.chaincode.toBinStr()
+      links = [(self.refChain[i], cc, 3, self.refChain[i+3]) for i in range(90)]
+      links[7] = (self.refChain[7], cc, 2, self.refChain[10])
+      result = PyVerifyChainLinks(links)
+      self.assertEqual(result, [i!=7 for i in range(90)])
@@ -0,0 +1,51 @@
+import sys
+sys.path.append('..')
+from pytest.Tiab import TiabTest
+import random
+import unittest
+
+from armoryengine.ArmoryUtils import hash160_to_p2pkhash_script, \
+   script_to_scrAddr, ONE_BTC, CENT
+from armoryengine.CoinSelection import PyUnspentTxOut, PySelectCoins, \
+   PySelectCoinsBruteForce, PyCoinSelector
+
+
+def makeUtxoList(nUtxo, rng):
+   scripts = [hash160_to_p2pkhash_script(chr(i)*20) for i in range(1,8)]
+   utxoList = []
+   for i in range(nUtxo):
+      script = rng.choice(scripts)
+      value  = rng.choice([rng.randint(10000, 5*ONE_BTC), CENT, ONE_BTC])
+      nConf  = rng.choice([0, 1, 6, rng.randint(1, 5000)])
+      utxoList.append(PyUnspentTxOut(script_to_scrAddr(script),
+                      chr(i%256)*32, i/256, value, nConf, script))
+   return utxoList
+
+
+class CoinSelectionTest(TiabTest):
+
+   def testSameAsBruteForce(self):
+      rng = random.Random(42)
+      for trial in range(50):
+         utxoList = makeUtxoList(rng.choice([1, 3, 10, 40, 150]), rng)
+         total = sum([u.getValue() for u in utxoList])
+         target = rng.choice([1, CENT, total/3, total])
+         fee = rng.choice([0, 10000])
+
+         random.seed(trial)
+         expected = PySelectCoinsBruteForce(utxoList, target, fee)
+         random.seed(trial)
+         actual = PySelectCoins(utxoList, target, fee)
+         self.assertEqual([id(u) for u in actual], [id(u) for u in expected])
+
+   def testNotEnoughCoins(self):
+      utxoList = makeUtxoList(5, random.Random(1))
+      total = sum([u.getValue() for u in utxoList])
+      self.assertEqual(PySelectCoins(utxoList, total+1), [])
+
+   def testTimeLimit(self):
+      utxoList = makeUtxoList(200, random.Random(2))
+      total = sum([u.getValue() for u in utxoList])
+      # Even with no time at all, the first sorting is always tried
+      selected = PyCoinSelector(utxoList).select(total/2, timeLimit=0)
+      self.assertTrue(sum([u.getValue() for u in selected]) >= total/2)
@@ -10,7 +10,7 @@ sys.path.append('..')
 import unittest
 from armoryengine.ArmoryUtils import *
 from armoryengine.Transaction import PyTx, UnsignedTxInput, DecoratedTxOut,\
-   UnsignedTransaction, TXIN_SIGSTAT, NullAuthData
+   UnsignedTransaction, TXIN_SIGSTAT, NullAuthData, getSigVerifyCacheStats
 from armoryengine.Script import convertScriptToOpStrings
 from armoryengine.MultiSigUtils import calcLockboxID, computePromissoryID, \
    MultiSigLockbox, MultiSigPromissoryNote, DecoratedPublicKey
@@ -388,6 +388,39 @@ class MSUtilsTest(unittest.TestCase):
                self.assertEqual(sstat.canBroadcast, (i+j+k)>1)
                #self.assertEqual(sstat.statusM[0], NOSIG if i+j+k==0 else SIG)
                #self.assertEqual(sstat.statusM[1], NOSIG if i+j+k<2  else SIG)
+
+      # Same results through the batch API
+      for numThreads in [2, 1]:
+         ustxCopy = UnsignedTransaction().unserialize(ustx.serialize())
+         sstat = ustxCopy.createAndInsertSignaturesBatch([(0, privKeys[0])],
+                                                   numThreads=numThreads)
+         self.assertFalse(sstat.canBroadcast)
+         self.assertFalse(sstat.sigsValid)
+         sstat = ustxCopy.createAndInsertSignaturesBatch([(0, privKeys[2])],
+                                                   numThreads=numThreads)
+         self.assertTrue(sstat.canBroadcast)
+         self.assertTrue(sstat.sigsValid)
+         self.assertEqual(sum(sstat.statusList[0].validN), 2)
+         self.assertTrue(ustxCopy.verifySigsAllInputs())
+
+         # Checking the same signatures again is all cache hits
+         nHits,nMisses,nEntries = getSigVerifyCacheStats()
+         self.assertTrue(ustxCopy.verifySigsAllInputs())
+         iValid = sstat.statusList[0].validN.index(True)
+         ustxi0 = ustxCopy.ustxInputs[0]
+         self.assertTrue(ustxCopy.isSigValidForInput(0,
+                  ustxi0.signatures[iValid], ustxi0.pubKeys[iValid]))
+         self.assertEqual(getSigVerifyCacheStats()[1], nMisses)
+         self.assertTrue(getSigVerifyCacheStats()[0] > nHits)
+
+         # A signature moved to the wrong slot doesn't verify
+         iSig = [i for i in range(3) if ustxi0.signatures[i]]
+         iNoSig = [i for i in range(3) if not ustxi0.signatures[i]][0]
+         ustxi0.signatures[iNoSig] = ustxi0.signatures[iSig[0]]
+         ustxi0.signatures[iSig[0]] = ''
+         sstat = ustxCopy.verifySigsAllInputsBatch(numThreads=numThreads)
+         self.assertTrue(sstat.canBroadcast)
+         self.assertFalse(sstat.sigsValid)
       
       # Now actually sign it and dump out a raw signed tx!
       ustx.createAndInsertSignatureForInput(0, privKeys[0])
@@ -0,0 +1,214 @@
+'''
+Tests for the P2P message framing and inventory handling in Networking.py
+'''
+import sys
+sys.path.append('..')
+import unittest
+
+sys.argv.append('--nologging')
+
+from armoryengine.ArmoryUtils import MAGIC_BYTES, NetworkIDError, hash256
+from armoryengine.Networking import PyMessage, PyMessageFramer, \
+   MESSAGE_HEADER, MSG_INV_TX, MSG_INV_BLOCK, PySeenInvCache, ArmoryClient
+
+
+def makeInvMessage(nInv, hashByte='\x11'):
+   msg = PyMessage('inv')
+   msg.payload.invList = [[MSG_INV_TX, chr(i) + hashByte*31] \
+                                                   for i in range(nInv)]
+   return msg.serialize()
+
+
+def makeRawMessage(cmd, payload, magic=MAGIC_BYTES, chksum=None):
+   if chksum is None:
+      chksum = hash256(payload)[:4]
+   return MESSAGE_HEADER.pack(magic, cmd, len(payload), chksum) + payload
+
+
+################################################################################
+class PyMessageFramerTest(unittest.TestCase):
+
+   #############################################################################
+   def testSplitAcrossFeeds(self):
+      raw = makeInvMessage(50)
+      framer = PyMessageFramer()
+      for i in range(0, len(raw)-1, 7):
+         framer.feed(raw[i:min(i+7, len(raw)-1)])
+         self.assertEqual(framer.nextMessage(), None)
+
+      framer.feed(raw[-1])
+      msg = framer.nextMessage()
+      self.assertEqual(msg.cmd, 'inv')
+      self.assertEqual(len(msg.payload.invList), 50)
+      self.assertEqual(msg.serialize(), raw)
+      self.assertEqual(framer.nextMessage(), None)
+      self.assertEqual(framer.getBufferedSize(), 0)
+      self.assertEqual(framer.getParseStats()['inv'][:2], [1, len(raw)-24])
+
+   #############################################################################
+   def testSeveralMessagesInOneFeed(self):
+      raws = [makeInvMessage(n) for n in [1, 2, 3]]
+      raws.append(PyMessage('verack').serialize())
+      framer = PyMessageFramer()
+      framer.feed(''.join(raws) + raws[0][:10])
+
+      msgs = [framer.nextMessage() for i in range(4)]
+      self.assertEqual([m.cmd for m in msgs], ['inv']*3 + ['verack'])
+      self.assertEqual([m.serialize() for m in msgs], raws)
+      self.assertEqual(framer.nextMessage(), None)
+      self.assertEqual(framer.getBufferedSize(), 10)
+
+      framer.feed(raws[0][10:])
+      self.assertEqual(framer.nextMessage().serialize(), raws[0])
+
+   #############################################################################
+   def testBadChecksum(self):
+      good = makeInvMessage(2)
+      payload = good[MESSAGE_HEADER.size:]
+      framer = PyMessageFramer()
+      framer.feed(makeRawMessage('inv', payload, chksum='\x00'*4) + good)
+
+      # The bad message is dropped and the one behind it still comes through
+      msg = framer.nextMessage()
+      self.assertEqual(msg.serialize(), good)
+      self.assertEqual(framer.nextMessage(), None)
+      self.assertEqual(framer.getParseStats()['inv'][0], 1)
+
+   #############################################################################
+   def testWrongMagic(self):
+      good = makeInvMessage(2)
+      payload = good[MESSAGE_HEADER.size:]
+      framer = PyMessageFramer()
+      framer.feed(makeRawMessage('inv', payload, magic='\xab'*4) + good)
+
+      try:
+         framer.nextMessage()
+         self.fail('Expected NetworkIDError')
+      except NetworkIDError as e:
+         self.assertEqual(e.args[-1], '\xab'*4)
+
+      # The foreign message was consumed, so we can carry on after it
+      self.assertEqual(framer.nextMessage().serialize(), good)
+
+   #############################################################################
+   def testUnknownCommand(self):
+      good = makeInvMessage(1)
+      framer = PyMessageFramer()
+      framer.feed(makeRawMessage('bogus', 'abcdef') + good)
+      self.assertEqual(framer.nextMessage().serialize(), good)
+      self.assertFalse('bogus' in framer.getParseStats())
+      self.assertEqual(framer.getBufferedSize(), 0)
+
+
+################################################################################
+class FakeInvBDM(object):
+   """ Knows a fixed set of hashes, and records what it was asked """
+   def __init__(self, knownHashes, state='BlockchainReady'):
+      self.knownHashes = set(knownHashes)
+      self.state = state
+      self.requests = []
+
+   def getBDMState(self):
+      return self.state
+
+   def getUnknownHashes(self, headHashList, txHashList):
+      self.requests.append((list(headHashList), list(txHashList)))
+      return ([h for h in headHashList if h not in self.knownHashes],
+              [h for h in txHashList   if h not in self.knownHashes])
+
+
+class FakeInvFactory(object):
+   def __init__(self, bdm):
+      self.bdm = bdm
+      self.seenInv = PySeenInvCache()
+
+
+def makeInvClient(bdm):
+   client = ArmoryClient()
+   client.factory = FakeInvFactory(bdm)
+   client.sentMsgs = []
+   client.sendMessage = client.sentMsgs.append
+   return client
+
+
+################################################################################
+class PySeenInvCacheTest(unittest.TestCase):
+
+   #############################################################################
+   def testDedup(self):
+      cache = PySeenInvCache(maxEntries=10)
+      cache.addMany(['a'*32, 'b'*32, 'a'*32])
+      cache.add('b'*32)
+      self.assertEqual(len(cache), 2)
+      self.assertTrue(cache.contains('a'*32))
+      self.assertFalse(cache.contains('c'*32))
+      self.assertEqual((cache.nHits, cache.nMisses), (1, 1))
+
+   #############################################################################
+   def testEvictionAtCapacity(self):
+      cache = PySeenInvCache(maxEntries=3)
+      cache.addMany(['1'*32, '2'*32, '3'*32])
+
+      # Re-adding '1' makes it the most recent, so '2' is the one to go
+      cache.add('1'*32)
+      cache.add('4'*32)
+      self.assertEqual(len(cache), 3)
+      self.assertFalse(cache.contains('2'*32))
+      for h in ['1'*32, '3'*32, '4'*32]:
+         self.assertTrue(cache.contains(h))
+
+      # With a Bloom filter, evicted hashes are still reported as seen
+      cache = PySeenInvCache(maxEntries=2, bloomBits=8192)
+      cache.addMany(['1'*32, '2'*32, '3'*32])
+      self.assertEqual(len(cache), 2)
+      self.assertTrue(cache.contains('1'*32))
+      self.assertFalse(cache.contains('9'*32))
+
+      cache.clear()
+      self.assertEqual(len(cache), 0)
+      self.assertFalse(cache.contains('1'*32))
+
+   #############################################################################
+   def testRequestOnlyUnknownInv(self):
+      txSeen, txKnown, txNew = '\x01'*32, '\x02'*32, '\x03'*32
+      blkKnown, blkNew = '\x04'*32, '\x05'*32
+      bdm = FakeInvBDM([txKnown, blkKnown])
+      client = makeInvClient(bdm)
+      client.factory.seenInv.add(txSeen)
+
+      invList = [[MSG_INV_TX, txSeen], [MSG_INV_TX, txKnown],
+                 [MSG_INV_TX, txNew], [MSG_INV_BLOCK, blkKnown],
+                 [MSG_INV_BLOCK, blkNew]]
+      client.requestUnknownInv(invList)
+
+      # One BDM call, without the hash that was already in the cache
+      self.assertEqual(bdm.requests, [([blkKnown, blkNew], [txKnown, txNew])])
+      self.assertEqual(len(client.sentMsgs), 1)
+      self.assertEqual(client.sentMsgs[0].cmd, 'getdata')
+      self.assertEqual(client.sentMsgs[0].payload.invList,
+                       [[MSG_INV_BLOCK, blkNew], [MSG_INV_TX, txNew]])
+
+      # What the BDM already had goes into the cache, so the same inv
+      # again only asks about the hashes still unknown
+      self.assertTrue(client.factory.seenInv.contains(txKnown))
+      self.assertTrue(client.factory.seenInv.contains(blkKnown))
+      client.requestUnknownInv(invList)
+      self.assertEqual(bdm.requests[-1], ([blkNew], [txNew]))
+
+      # Nothing is sent when everything is already known
+      client.sentMsgs[:] = []
+      client.requestUnknownInv([[MSG_INV_TX, txSeen], [MSG_INV_TX, txKnown]])
+      self.assertEqual(len(bdm.requests), 2)
+      self.assertEqual(client.sentMsgs, [])
+
+      # Or while the BDM is scanning
+      bdm.state = 'Scanning'
+      client.requestUnknownInv(invList)
+      self.assertEqual(len(bdm.requests), 2)
+      self.assertEqual(client.sentMsgs, [])
+
+
+# Running tests with "python <module name>" will NOT work for any Armory tests
+# You must run tests with "python -m unittest <module name>" or run all tests with "python -m unittest discover"
+# if __name__ == "__main__":
+#    unittest.main()
@@ -15,6 +15,9 @@ from armoryengine.ArmoryUtils import convertKeyDataToAddress, \
    hash256, binary_to_hex, hex_to_binary, CLI_OPTIONS, \
    WalletLockError, InterruptTestError, MULTISIG_FILE_NAME
 from armoryengine.PyBtcWallet import PyBtcWallet
+from armoryengine.WalletFileIndex import WalletFileIndex, getWalletIndexPath, \
+   WLTINDEX_TAIL_SIZE
+from armoryengine.WalletJournal import getWalletJournalPath
 from armoryengine.BDM import TheBDM
 
 
@@ -88,6 +91,180 @@ class PyBtcWalletTest(TiabTest):
       lboxWltB = PyBtcWallet().readWalletFile(lboxWltBFile, doScanNow=True)
       self.assertTrue(lboxWltB.isWltSigningAnyLockbox(lockboxList))
       
+   def testExtendAddressPool(self):
+      lastIndex = self.wlt.lastComputedChainIndex
+      new160List = self.wlt.extendAddressPool(25, doRegister=False)
+      self.assertEqual(len(new160List), 25)
+      self.assertEqual(self.wlt.lastComputedChainIndex, lastIndex+25)
+      self.assertEqual(self.wlt.lastComputedChainAddr160, new160List[-1])
+      for i,a160 in enumerate(new160List):
+         self.assertEqual(self.wlt.chainIndexMap[lastIndex+1+i], a160)
+
+      # Every address made it to the file, at the offset we recorded
+      wltCopy = PyBtcWallet().readWalletFile(self.fileA, doScanNow=False)
+      for a160 in new160List:
+         self.assertTrue(wltCopy.hasAddr(a160))
+         self.assertEqual(wltCopy.addrMap[a160].walletByteLoc,
+                          self.wlt.addrMap[a160].walletByteLoc)
+
+   def testLazyLoad(self):
+      indexPath = getWalletIndexPath(self.fileA)
+      self.removeFileList([indexPath])
+      self.addCleanup(self.removeFileList, [indexPath])
+
+      # Cold open builds the index, no entry is unserialized until accessed
+      lazyWlt = PyBtcWallet().readWalletFile(self.fileA, lazyLoad=True)
+      self.assertTrue(os.path.exists(indexPath))
+      self.assertEqual(lazyWlt.addrMap.getNumLoaded(), 1) # ROOT
+      self.assertEqual(lazyWlt.linearAddr160List, self.wlt.linearAddr160List)
+      a160 = self.wlt.chainIndexMap[3]
+      self.assertEqual(lazyWlt.addrMap[a160].serialize(),
+                       self.wlt.addrMap[a160].serialize())
+      self.assertEqual(lazyWlt.addrMap.getNumLoaded(), 2)
+
+      # Writes through the lazy wallet keep the index warm
+      new160List = lazyWlt.extendAddressPool(10, doRegister=False)
+      lazyWlt.setComment(new160List[0], 'Lazy comment')
+      self.assertTrue(WalletFileIndex(self.fileA).readIndex())
+
+      warmWlt = PyBtcWallet().readWalletFile(self.fileA, lazyLoad=True)
+      eagerWlt = PyBtcWallet().readWalletFile(self.fileA)
+      self.assertEqual(warmWlt.getComment(new160List[0]), 'Lazy comment')
+      self.assertEqual(warmWlt.lastComputedChainAddr160, new160List[-1])
+      self.assertTrue(eagerWlt.isEqualTo(warmWlt))
+
+      # Rewriting an address in place updates its time range in the index
+      touched = warmWlt.getNextUnusedAddress()
+      fileIndex = WalletFileIndex(self.fileA)
+      self.assertTrue(fileIndex.readIndex())
+      touchedEntry = [e for e in fileIndex.keyEntries \
+                                    if e.addr160==touched.getAddr160()][0]
+      self.assertEqual(touchedEntry.timeRange, list(touched.getTimeRange()))
+      self.assertNotEqual(touchedEntry.timeRange[0], 0)
+
+      # Same size and mtime, but different contents near the end
+      mtime = os.path.getmtime(self.fileA)
+      with open(self.fileA, 'r+b') as f:
+         f.seek(-100, os.SEEK_END)
+         oldByte = f.read(1)
+         f.seek(-1, os.SEEK_CUR)
+         f.write(chr(ord(oldByte) ^ 0xff))
+      os.utime(self.fileA, (mtime, mtime))
+      self.assertFalse(WalletFileIndex(self.fileA).readIndex())
+
+   def testWalletIndexFingerprint(self):
+      indexPath = getWalletIndexPath(self.fileA)
+      self.addCleanup(self.removeFileList, [indexPath])
+      fileIndex = WalletFileIndex(self.fileA)
+      fileIndex.writeIndex()
+
+      # The head and tail kept up to date from the writes themselves are
+      # the same as reading them again
+      oldSize = os.path.getsize(self.fileA)
+      toAppend = '\x5a'*(WLTINDEX_TAIL_SIZE + 10)
+      dataToChange = [[10, 'abc'], [oldSize - 2, 'defg'], \
+                      [oldSize + len(toAppend) - 5, 'hi']]
+      with open(self.fileA, 'r+b') as f:
+         f.seek(0, os.SEEK_END)
+         f.write(toAppend)
+         for loc,data in dataToChange:
+            f.seek(loc)
+            f.write(data)
+      fileIndex.recordWalletWrite(oldSize, toAppend, dataToChange)
+      fileIndex.writeIndex()
+
+      self.assertTrue(WalletFileIndex(self.fileA).readIndex())
+      fromFile = WalletFileIndex(self.fileA)
+      fromFile.loadWalletWindows()
+      self.assertEqual(fileIndex.headData, fromFile.headData)
+      self.assertEqual(fileIndex.tailData, fromFile.tailData)
+
+   def testWalletJournal(self):
+      journalPath = getWalletJournalPath(self.fileA)
+      self.addCleanup(self.removeFileList, [journalPath])
+
+      # Inside a batch only the journal is written
+      mainSize = os.path.getsize(self.fileA)
+      self.wlt.beginWalletUpdateBatch()
+      new160List = self.wlt.extendAddressPool(5, doRegister=False)
+      self.wlt.setComment(new160List[0], 'Journaled')
+      self.assertEqual(os.path.getsize(self.fileA), mainSize)
+      self.assertTrue(os.path.getsize(journalPath) > 0)
+      self.assertTrue(self.wlt.endWalletUpdateBatch())
+      self.assertEqual(os.path.getsize(journalPath), 0)
+
+      wlt2 = PyBtcWallet().readWalletFile(self.fileA)
+      self.assertTrue(self.wlt.isEqualTo(wlt2))
+      self.assertEqual(wlt2.getComment(new160List[0]), 'Journaled')
+      self.assertEqual(wlt2.addrMap[new160List[-1]].walletByteLoc,
+                       self.wlt.addrMap[new160List[-1]].walletByteLoc)
+
+      # Checkpoint interrupted: the consistency check rolls back the main
+      # file, then replays the journal
+      self.wlt.beginWalletUpdateBatch()
+      self.wlt.setComment(new160List[1], 'Replayed')
+      try:
+         self.wlt.interruptTest1 = True
+         self.wlt.endWalletUpdateBatch()
+      except InterruptTestError:
+         pass
+      self.wlt.interruptTest1 = False
+      self.assertTrue(os.path.exists(self.fileBupd))
+
+      wlt3 = PyBtcWallet().readWalletFile(self.fileA)
+      self.assertEqual(wlt3.getComment(new160List[1]), 'Replayed')
+      self.assertEqual(os.path.getsize(journalPath), 0)
+      self.assertFalse(os.path.exists(self.fileBupd))
+      self.assertEqual(hash256(open(self.fileA,'rb').read()),
+                       hash256(open(self.fileB,'rb').read()))
+
+   def testOnDemandUnlock(self):
+      kdfParams = self.wlt.computeSystemSpecificKdfParams(0.1)
+      self.wlt.changeKdfParams(*kdfParams)
+      self.wlt.changeWalletEncryption(securePassphrase=self.passphrase)
+      self.wlt.lock()
+
+      # Computed while locked, the private keys come with the next unlock
+      new160List = self.wlt.extendAddressPool(3, doRegister=False)
+      newAddr = self.wlt.addrMap[new160List[1]]
+      self.assertTrue(newAddr.createPrivKeyNextUnlock)
+
+      self.wlt.unlock(securePassphrase=self.passphrase, onDemand=True)
+      self.assertTrue(self.wlt.isLocked)
+      self.wlt.unlockAddrList([newAddr])
+      self.assertFalse(newAddr.isLocked)
+      self.assertTrue(self.wlt.addrMap[new160List[0]].isLocked)
+      onDemandKey = newAddr.binPrivKey32_Plain.toHexStr()
+
+      # The computed key was written back
+      wlt2 = PyBtcWallet().readWalletFile(self.fileA)
+      self.assertFalse(wlt2.addrMap[new160List[1]].createPrivKeyNextUnlock)
+
+      self.wlt.lock()
+      self.assertTrue(newAddr.isLocked)
+      self.assertEqual(newAddr.binPrivKey32_Plain.toHexStr(), '')
+
+      # Same key as a full unlock
+      wlt2.unlock(securePassphrase=self.passphrase)
+      self.assertEqual(wlt2.addrMap[new160List[1]].binPrivKey32_Plain.toHexStr(),
+                       onDemandKey)
+
+   def testOnDemandExtendThenLock(self):
+      kdfParams = self.wlt.computeSystemSpecificKdfParams(0.1)
+      self.wlt.changeKdfParams(*kdfParams)
+      self.wlt.changeWalletEncryption(securePassphrase=self.passphrase)
+      self.wlt.lock()
+
+      # Extending the chain while unlocked on demand decrypts the old tip
+      self.wlt.unlock(securePassphrase=self.passphrase, onDemand=True)
+      self.wlt.computeNextAddress(doRegister=False)
+      self.wlt.extendAddressPool(2, doRegister=False)
+      self.wlt.lock()
+
+      for addr in self.wlt.addrMap.values():
+         self.assertTrue(addr.isLocked)
+         self.assertEqual(addr.binPrivKey32_Plain.toHexStr(), '')
+
    # Remove wallet files, need fresh dir for this test
    def testPyBtcWallet(self):
 
@@ -7,14 +7,16 @@ import sys
 sys.path.append('..')
 import unittest
 from armoryengine.ArmoryUtils import hex_to_binary, binary_to_hex, hex_to_int, \
-   ONE_BTC
-from armoryengine.BinaryUnpacker import BinaryUnpacker
+   ONE_BTC, hash256, hash160, SecureBinaryData, CryptoECDSA, VerifyScriptError
+from armoryengine.BinaryUnpacker import BinaryUnpacker, UnpackerError
 from armoryengine.Block import PyBlock
 from armoryengine.PyBtcAddress import PyBtcAddress
-from armoryengine.Script import PyScriptProcessor
+from armoryengine.Script import PyScriptProcessor, compileScript, \
+   tokenizeScript, convertScriptToOpStrings, SCRIPT_TEMPLATE, scriptPushData, \
+   SCRIPT_NO_ERROR, TX_INVALID
 from armoryengine.Transaction import PyTx, PyTxIn, PyOutPoint, PyTxOut, \
    PyCreateAndSignTx, getMultisigScriptInfo, BlockComponent,\
-   PyCreateAndSignTx_old
+   PyCreateAndSignTx_old, LazyPyTx, SigHashContext, signInputJob
 from pytest.Tiab import TiabTest
 
 
@@ -112,6 +114,39 @@ tx2Fake = PyTx().unserialize(hex_to_binary( (
 
 ALL_ZERO_OUTPOINT = hex_to_binary('00' * 36)
 
+def makeSpendingPair(txOutScript):
+   """
+   A tx paying 1 BTC to txOutScript, and a tx spending that output with an
+   empty TxIn script for the caller to fill in
+   """
+   txOld = PyTx()
+   txOld.version  = 1
+   txOld.inputs   = [PyTxIn()]
+   txOld.inputs[0].outpoint  = PyOutPoint().unserialize(ALL_ZERO_OUTPOINT)
+   txOld.inputs[0].binScript = hex_to_binary('99'*4)
+   txOld.inputs[0].intSeq    = hex_to_int('ff'*4)
+   txOld.outputs  = [PyTxOut()]
+   txOld.outputs[0].value     = ONE_BTC
+   txOld.outputs[0].binScript = txOutScript
+   txOld.lockTime = 0
+
+   txNew = PyTx()
+   txNew.version  = 1
+   txNew.inputs   = [PyTxIn()]
+   txNew.inputs[0].outpoint  = PyOutPoint(txOld.getHash(), 0)
+   txNew.inputs[0].binScript = ''
+   txNew.inputs[0].intSeq    = hex_to_int('ff'*4)
+   txNew.outputs  = [PyTxOut()]
+   txNew.outputs[0].value     = ONE_BTC
+   txNew.outputs[0].binScript = '\x76\xa9\x14' + '\x22'*20 + '\x88\xac'
+   txNew.lockTime = 0
+   return txOld, txNew
+
+def signSpendingTx(txNew, txOutScript, privKeyByte):
+   """ Signature of input 0 of txNew, with the private key privKeyByte*32 """
+   job = (0, txOutScript, 1, SecureBinaryData(privKeyByte*32))
+   return signInputJob(SigHashContext(txNew), job)[1]
+
 class PyTXTest(TiabTest):
    
    def testMinimizeDERSignaturePadding(self):
@@ -159,6 +194,71 @@ class PyTXTest(TiabTest):
       binRoot = blk.blockData.getMerkleRoot()
       self.assertEqual(blk.blockHeader.merkleRoot, blk.blockData.merkleRoot)
    
+   def testLazyPyTx(self):
+      tx2 = PyTx().unserialize(tx2raw)
+      lazyTx = LazyPyTx().unserialize(BinaryUnpacker(tx2raw))
+      self.assertFalse(lazyTx.isMaterialized())
+      self.assertEqual(lazyTx.thisHash, tx2.thisHash)
+      self.assertEqual(lazyTx.serialize(), tx2raw)
+      self.assertFalse(lazyTx.isMaterialized())
+      # Touching the inputs builds the full object graph
+      self.assertEqual(lazyTx.inputs[0].binScript, tx2.inputs[0].binScript)
+      self.assertTrue(lazyTx.isMaterialized())
+      lazyTx.lockTime = 1
+      self.assertNotEqual(lazyTx.serialize(), tx2raw)
+      self.assertRaises(UnpackerError, LazyPyTx().unserialize, tx2raw[:-5])
+
+   def testRawDataReuse(self):
+      tx1 = PyTx().unserialize(tx1raw)
+      # The bytes read in are reused, not packed again
+      self.assertTrue(tx1.serialize() is tx1.getRawData())
+      self.assertEqual(tx1.serialize(), tx1raw)
+      self.assertEqual(tx1.getHash(), hash256(tx1raw))
+
+      # Copies share the raw bytes until one of them changes
+      txCopy = tx1.copy()
+      self.assertEqual(txCopy.getHash(), tx1.getHash())
+      txCopy.inputs[0].binScript = '\x51'
+      self.assertEqual(txCopy.inputs[0].getRawData(), None)
+      self.assertEqual(txCopy.getRawData(), None)
+      self.assertEqual(tx1.serialize(), tx1raw)
+      self.assertEqual(txCopy.getHash(), hash256(txCopy.serialize()))
+      self.assertNotEqual(txCopy.getHash(), tx1.getHash())
+      self.assertEqual(PyTx().unserialize(txCopy.serialize()).getHash(),
+                       txCopy.getHash())
+
+      for mutate in [lambda tx: setattr(tx, 'lockTime', 1),
+                     lambda tx: tx.outputs.pop(),
+                     lambda tx: setattr(tx.outputs[0], 'value', 1),
+                     lambda tx: setattr(tx.inputs[0].outpoint, 'txOutIndex', 5)]:
+         txCopy = tx1.copy()
+         mutate(txCopy)
+         self.assertNotEqual(txCopy.getHash(), tx1.getHash())
+         self.assertEqual(txCopy.getHash(), hash256(txCopy.serialize()))
+      self.assertEqual(LazyPyTx().unserialize(tx1raw).copy().getHash(),
+                       tx1.getHash())
+
+   def testSigHashContext(self):
+      tx = PyTx().unserialize(multiTx1raw)
+      ctx = SigHashContext(tx)
+      prevScript = hex_to_binary('76a914' + '11'*20 + '88ac')
+      for i,txin in enumerate(tx.inputs):
+         self.assertEqual(ctx.getInputIndex(txin.outpoint), i)
+
+         # Same message as blanking all the scripts by hand
+         txCopy = tx.copy()
+         for txinCopy in txCopy.inputs:
+            txinCopy.binScript = ''
+         txCopy.inputs[i].binScript = prevScript
+         msg,hc = ctx.getPreHashMsg(i, prevScript)
+         self.assertEqual(msg, txCopy.serialize() + '\x01\x00\x00\x00')
+         self.assertEqual(hc, '\x01')
+
+      self.assertEqual(ctx.getInputIndex(PyOutPoint('\x00'*32, 0)), -1)
+      self.assertTrue(ctx.isCurrent(tx))
+      tx.lockTime += 1
+      self.assertFalse(ctx.isCurrent(tx))
+
    def testCreateTx(self):
       addrA = PyBtcAddress().createFromPrivateKey(hex_to_int('aa' * 32))
       addrB = PyBtcAddress().createFromPrivateKey(hex_to_int('bb' * 32)) 
@@ -237,6 +337,119 @@ class PyTXTest(TiabTest):
       psp = PyScriptProcessor()
       psp.setTxObjects(tx1, tx2, 0)
       self.assertTrue(psp.verifyTransactionValid())
+
+   def testCompiledScript(self):
+      tx = PyTx().unserialize(tx1raw)
+      p2pkh = tx.outputs[0].binScript
+      compiled = compileScript(p2pkh)
+      self.assertEqual(compiled.template, SCRIPT_TEMPLATE.P2PKH)
+      self.assertEqual(compiled.templateData, p2pkh[3:23])
+      self.assertEqual(compiled.stackValues, None)
+      self.assertTrue(compileScript(p2pkh) is compiled)
+
+      # The input script is two pushes:  signature and public key
+      txInScr = compileScript(tx.inputs[0].binScript)
+      self.assertEqual(txInScr.template, SCRIPT_TEMPLATE.NONSTANDARD)
+      self.assertEqual([len(v) for v in txInScr.stackValues], [72, 65])
+
+      p2sh = hex_to_binary('a914' + '11'*20 + '87')
+      self.assertEqual(compileScript(p2sh).template, SCRIPT_TEMPLATE.P2SH)
+      multisig = hex_to_binary('5121' + '02'*33 + '21' + '03'*33 + '52ae')
+      template, data = compileScript(multisig).template, \
+                       compileScript(multisig).templateData
+      self.assertEqual(template, SCRIPT_TEMPLATE.MULTISIG)
+      self.assertEqual(data, (1, ['\x02'*33, '\x03'*33]))
+
+      # A push running past the end of the script is the last op
+      truncated = hex_to_binary('00514c05aabb')
+      self.assertEqual(tokenizeScript(truncated),
+                       [(0, None, 1), (0x51, None, 2), (0x4c, '\xaa\xbb', None)])
+      self.assertTrue(compileScript(truncated).isTruncated)
+      self.assertEqual(convertScriptToOpStrings(truncated),
+                       ['0', 'OP_1', 'ERROR PROCESSING SCRIPT'])
+      self.assertEqual(convertScriptToOpStrings(p2sh),
+                       ['OP_HASH160', 'PUSHDATA(20)', '['+'11'*20+']', 'OP_EQUAL'])
+
+   def verifyBothWays(self, txOld, txNew):
+      """
+      The result of the standard-script path, and of executing the TxIn and
+      TxOut scripts op by op with the generic engine
+      """
+      psp = PyScriptProcessor(txOld, txNew, 0)
+      standardResult = psp.verifyStandardScripts(psp.script1, psp.script2)
+      self.assertNotEqual(standardResult, None)
+
+      psp = PyScriptProcessor(txOld, txNew, 0)
+      stack = []
+      self.assertEqual(psp.executeScript(psp.script1, stack), SCRIPT_NO_ERROR)
+      self.assertEqual(psp.executeScript(psp.script2, stack), SCRIPT_NO_ERROR)
+      return standardResult, stack[-1]==1
+
+   def testStandardScriptsMatchEngine(self):
+      pubs = dict([(b, CryptoECDSA().ComputePublicKey( \
+                                 SecureBinaryData(b*32)).toBinStr()) \
+                                             for b in ['\xaa', '\xbb', '\xcc']])
+
+      # P2PKH, with a good signature and with another key's signature
+      p2pkh = '\x76\xa9\x14' + hash160(pubs['\xaa']) + '\x88\xac'
+      for signKey,expect in [('\xaa', True), ('\xbb', False)]:
+         txOld, txNew = makeSpendingPair(p2pkh)
+         sig = signSpendingTx(txNew, p2pkh, signKey)
+         txNew.inputs[0].binScript = scriptPushData(sig) + \
+                                     scriptPushData(pubs['\xaa'])
+         self.assertEqual(self.verifyBothWays(txOld, txNew), (expect, expect))
+
+      # A public key that doesn't hash to the address fails OP_EQUALVERIFY
+      txOld, txNew = makeSpendingPair(p2pkh)
+      sig = signSpendingTx(txNew, p2pkh, '\xbb')
+      txNew.inputs[0].binScript = scriptPushData(sig) + \
+                                  scriptPushData(pubs['\xbb'])
+      psp = PyScriptProcessor(txOld, txNew, 0)
+      self.assertRaises(VerifyScriptError, psp.verifyTransactionValid)
+      stack = []
+      self.assertEqual(psp.executeScript(psp.script1, stack), SCRIPT_NO_ERROR)
+      self.assertEqual(psp.executeScript(psp.script2, stack), TX_INVALID)
+
+      # P2PK
+      p2pk = scriptPushData(pubs['\xbb']) + '\xac'
+      for signKey,expect in [('\xbb', True), ('\xaa', False)]:
+         txOld, txNew = makeSpendingPair(p2pk)
+         txNew.inputs[0].binScript = \
+                  scriptPushData(signSpendingTx(txNew, p2pk, signKey))
+         self.assertEqual(self.verifyBothWays(txOld, txNew), (expect, expect))
+
+      # P2SH only compares the hash of the redeem script
+      redeemScript = '\x51'
+      p2sh = '\xa9\x14' + hash160(redeemScript) + '\x87'
+      for pushed,expect in [(redeemScript, True), ('\x52', False)]:
+         txOld, txNew = makeSpendingPair(p2sh)
+         txNew.inputs[0].binScript = '\x00' + scriptPushData(pushed)
+         self.assertEqual(self.verifyBothWays(txOld, txNew), (expect, expect))
+
+      # Bare multisig, including the last key in the script, signatures out
+      # of order and a key that isn't on the curve
+      keyOrder = ['\xaa', '\xbb', '\xcc']
+      badKey = '\x04' + '\x00'*64
+      for M,keyBytes,signKeys,expect in [
+                           (1, keyOrder, ['\xcc'], True),
+                           (1, keyOrder, ['\xaa'], True),
+                           (2, keyOrder, ['\xaa', '\xcc'], True),
+                           (2, keyOrder, ['\xbb', '\xcc'], True),
+                           (2, keyOrder, ['\xcc', '\xaa'], False),
+                           (2, keyOrder, ['\xaa', '\xaa'], False),
+                           (3, keyOrder, ['\xaa', '\xbb', '\xcc'], True),
+                           (1, ['\xaa', None], ['\xaa'], True)]:
+         pubList = [pubs[b] if b else badKey for b in keyBytes]
+         msScript = chr(0x50+M) + \
+                    ''.join([scriptPushData(p) for p in pubList]) + \
+                    chr(0x50+len(pubList)) + '\xae'
+         self.assertEqual(compileScript(msScript).template,
+                          SCRIPT_TEMPLATE.MULTISIG)
+         txOld, txNew = makeSpendingPair(msScript)
+         sigs = [signSpendingTx(txNew, msScript, b) for b in signKeys]
+         txNew.inputs[0].binScript = '\x00' + \
+                                  ''.join([scriptPushData(s) for s in sigs])
+         self.assertEqual(self.verifyBothWays(txOld, txNew), (expect, expect))
       
    '''
    def testMultiSigAddrExtraction(self):
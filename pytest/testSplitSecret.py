@@ -7,11 +7,13 @@ import sys
 sys.path.append('..')
 from pytest.Tiab import TiabTest
 
+import itertools
 from random import shuffle
 import unittest
 
 from armoryengine.ArmoryUtils import FiniteField, FiniteFieldError, SplitSecret, \
-   hex_to_binary, RightNow, binary_to_hex, ReconstructSecret
+   hex_to_binary, RightNow, binary_to_hex, ReconstructSecret, \
+   ReconstructSecretSubsets
 
 
 sys.argv.append('--nologging')
@@ -72,6 +74,25 @@ class SplitSecretTest(TiabTest):
       self.assertRaises(FiniteFieldError, SplitSecret, '9f', 1,1)
 
    
+   def testReconstructSecretSubsets(self):
+      secret = hex_to_binary('9f'*32)
+      out = SplitSecret(secret, 12, 16)
+      self.assertEqual(ReconstructSecret(out[4:], 12, 32), secret)
+
+      # All 16-choose-12 = 1820 subsets in one pass
+      subsets = list(itertools.combinations(range(16), 12))
+      recons = ReconstructSecretSubsets(out, subsets, 32)
+      self.assertEqual(len(recons), 1820)
+      for recon in recons:
+         self.assertEqual(recon, secret)
+
+      # Too few fragments give the wrong secret, repeated x-values give none
+      recons = ReconstructSecretSubsets(out, [range(11), range(5,16)], 32)
+      self.assertNotEqual(recons[0], secret)
+      self.assertNotEqual(recons[1], secret)
+      self.assertRaises(FiniteFieldError, ReconstructSecret, \
+                                          [out[0], out[0]], 2, 32)
+
    def callSplitSecret(self, secretHex, M, N, nbytes=1):
       secret = hex_to_binary(secretHex)
       print '\nSplitting secret into %d-of-%d: secret=%s' % (M,N,secretHex)
@@ -8,7 +8,7 @@ from armoryengine.ArmoryUtils import *
 from armoryengine.MultiSigUtils import calcLockboxID
 from armoryengine.Transaction import getTxOutScriptType
 from armoryengine.UserAddressUtils import getDisplayStringForScript, \
-   getScriptForUserString
+   getScriptForUserString, ScrAddrOwnerIndex
 
 
 ################################################################################
@@ -22,6 +22,18 @@ class MockWallet(object):
       return scraddr==self.scrAddr
       
 
+################################################################################
+class MockAddrMapWallet(object):
+   def __init__(self, wltID, a160List):
+      self.uniqueIDB58 = wltID
+      self.addrMap = dict([(a160, None) for a160 in a160List])
+      self.addrMap['ROOT'] = None
+      self.addrMapVersion = 0
+
+   def hasScrAddr(self, scraddr):
+      return scraddr[0]==SCRADDR_P2PKH_BYTE and scraddr[1:] in self.addrMap
+
+
 ################################################################################
 class MockLockbox(object):
    def __init__(self, lboxID, lboxName, script, M, N):
@@ -459,6 +471,61 @@ class UserAddressToScript(TiabTest):
          self.assertEqual(scrInfo['WltID'], None)
          self.assertEqual(scrInfo['LboxID'], None)
 
+
+################################################################################
+class ScrAddrOwnerIndexTest(TiabTest):
+
+   #############################################################################
+   def testOwnerIndex(self):
+      a160s = [hash160(chr(i)) for i in range(10)]
+      scrAddrs = [SCRADDR_P2PKH_BYTE + a160 for a160 in a160s]
+      wltA = MockAddrMapWallet('AbCd1234z', a160s[:4])
+      wltB = MockAddrMapWallet('BcDe2345y', a160s[4:6])
+      wltMap = {wltA.uniqueIDB58: wltA, wltB.uniqueIDB58: wltB}
+
+      index = ScrAddrOwnerIndex()
+      index.syncWallets(wltMap)
+      self.assertTrue(index.getWalletForScrAddr(scrAddrs[0]) is wltA)
+      self.assertEqual(index.getWalletIDForScrAddr(scrAddrs[5]), 'BcDe2345y')
+      self.assertEqual(index.getWalletForScrAddr(scrAddrs[8]), None)
+      self.assertEqual(index.getWalletForScrAddr(SCRADDR_P2SH_BYTE + a160s[0]), None)
+
+      # Address pool grows, nobody tells the index
+      wltB.addrMap[a160s[8]] = None
+      wltB.addrMapVersion += 1
+      self.assertTrue(index.getWalletForScrAddr(scrAddrs[8]) is wltB)
+
+      # Imported address deleted
+      del wltA.addrMap[a160s[1]]
+      self.assertEqual(index.getWalletForScrAddr(scrAddrs[1]), None)
+
+      # One address imported and another deleted leaves the size unchanged
+      del wltB.addrMap[a160s[4]]
+      wltB.addrMap[a160s[9]] = None
+      wltB.addrMapVersion += 1
+      index.syncWallets(wltMap)
+      self.assertEqual(index.getWalletForScrAddr(scrAddrs[4]), None)
+      self.assertTrue(index.getWalletForScrAddr(scrAddrs[9]) is wltB)
+
+      # The wallet owner can also say so explicitly
+      wltA.addrMap[a160s[7]] = None
+      index.invalidateWallet(wltA.uniqueIDB58)
+      self.assertTrue(index.getWalletForScrAddr(scrAddrs[7]) is wltA)
+
+      del wltMap[wltA.uniqueIDB58]
+      index.syncWallets(wltMap)
+      self.assertEqual(index.getWalletForScrAddr(scrAddrs[0]), None)
+      self.assertTrue(index.getWalletForScrAddr(scrAddrs[5]) is wltB)
+
+      pubKeys = [CryptoECDSA().UncompressPoint(SecureBinaryData( \
+                        '\x02' + b*32)).toBinStr() for b in ['\xbb','\xaa']]
+      msScript = pubkeylist_to_multisig_script(pubKeys, 1)
+      lbox = MockLockbox('ZzCc8899a', 'Lockbox', msScript, 1, 2)
+      index.syncLockboxes([lbox])
+      self.assertTrue(index.getLockboxForScrAddr(lbox.p2shScrAddr) is lbox)
+      index.syncLockboxes([])
+      self.assertEqual(index.getLockboxForScrAddr(lbox.p2shScrAddr), None)
+
 # Running tests with "python <module name>" will NOT work for any Armory tests
 # You must run tests with "python -m unittest <module name>" or run all tests with "python -m unittest discover"
 # if __name__ == "__main__":
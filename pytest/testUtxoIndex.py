@@ -0,0 +1,162 @@
+import sys
+sys.path.append('..')
+from pytest.Tiab import TiabTest
+import unittest
+
+from armoryengine.ArmoryUtils import UINT32_MAX, hash160_to_p2pkhash_script, \
+   script_to_scrAddr
+from armoryengine.Transaction import PyTx, PyTxIn, PyOutPoint, PyTxOut
+from armoryengine.UtxoIndex import UtxoIndex, COINBASE_MATURITY, \
+   UTXO_CONFIRMED, UTXO_COINBASE, UTXO_ZC_SELF
+
+
+MY_SCRIPT    = hash160_to_p2pkhash_script('\x11'*20)
+OTHER_SCRIPT = hash160_to_p2pkhash_script('\x22'*20)
+MY_SCRADDR   = script_to_scrAddr(MY_SCRIPT)
+
+
+def makeTx(outPtList, outList):
+   tx = PyTx()
+   tx.version = 1
+   tx.lockTime = 0
+   tx.inputs = []
+   for txHash,txoIdx in outPtList:
+      txin = PyTxIn()
+      txin.outpoint = PyOutPoint(txHash, txoIdx)
+      txin.binScript = ''
+      txin.intSeq = UINT32_MAX
+      tx.inputs.append(txin)
+
+   tx.outputs = []
+   for value,script in outList:
+      txout = PyTxOut()
+      txout.value = value
+      txout.binScript = script
+      tx.outputs.append(txout)
+   return tx
+
+
+class FakeLedgerEntry(object):
+   def __init__(self, txHash, blockNum, isValid=True):
+      self.txHash = txHash
+      self.blockNum = blockNum
+      self.valid = isValid
+
+   def getTxHash(self):
+      return self.txHash
+
+   def getBlockNum(self):
+      return self.blockNum
+
+   def isValid(self):
+      return self.valid
+
+
+class FakeCppTx(object):
+   def __init__(self, pytx):
+      self.rawTx = pytx.serialize()
+
+   def isInitialized(self):
+      return True
+
+   def serialize(self):
+      return self.rawTx
+
+
+class FakeCppWallet(object):
+   """ Just the ledger, which is all applyCppLedger() looks at """
+   def __init__(self):
+      self.ledger = []
+      self.txMap = {}
+
+   def addTx(self, pytx, blockNum):
+      self.txMap[pytx.getHash()] = FakeCppTx(pytx)
+      self.ledger.append(FakeLedgerEntry(pytx.getHash(), blockNum))
+
+   def getTxLedger(self):
+      return self.ledger
+
+   def getTx(self, txHash):
+      return self.txMap.get(txHash)
+
+
+class UtxoIndexTest(TiabTest):
+
+   def setUp(self):
+      self.index = UtxoIndex(lambda scrAddr: scrAddr==MY_SCRADDR)
+      self.index.addTxOut('\xaa'*32, 0, MY_SCRADDR, 1000, 100, MY_SCRIPT,
+                                                           UTXO_CONFIRMED)
+      self.index.addTxOut('\xbb'*32, 0, MY_SCRADDR, 5000, 200, MY_SCRIPT,
+                                                           UTXO_COINBASE)
+
+   def testCoinbaseMaturity(self):
+      immatureBlk = 200 + COINBASE_MATURITY - 1
+      self.assertEqual(self.index.getBalance('Spendable', immatureBlk), 1000)
+      self.assertEqual(self.index.getBalance('Spendable', immatureBlk+1), 6000)
+      self.assertEqual(self.index.getBalance('Full', immatureBlk), 6000)
+      self.assertEqual(len(self.index.getTxOutList('Spendable', immatureBlk)), 1)
+
+   def testZeroConfChange(self):
+      # Spend our confirmed output, half to someone else and half back to us
+      tx = makeTx([('\xaa'*32, 0)], [(500, OTHER_SCRIPT), (400, MY_SCRIPT)])
+      self.assertTrue(self.index.applyTx(tx))
+      self.assertTrue(self.index.hasZeroConf())
+      self.assertEqual(self.index.getBalance('Full', 300), 5400)
+      self.assertEqual(self.index.getBalance('Spendable', 300), 400)
+      self.assertEqual(self.index.getBalance('Spendable', 300, True), 0)
+      self.assertEqual(self.index.utxoMap[(tx.getHash(), 1)][4], UTXO_ZC_SELF)
+
+      # Mined in the next block
+      self.index.applyTx(tx, 301)
+      self.assertFalse(self.index.hasZeroConf())
+      utxo = self.index.getTxOutList('Spendable', 302, True, MY_SCRADDR)[0]
+      self.assertEqual(utxo.getValue(), 400)
+      self.assertEqual(utxo.getNumConfirm(), 2)
+
+   def testZeroConfOrder(self):
+      parent = makeTx([('\xaa'*32, 0)], [(900, MY_SCRIPT)])
+      child  = makeTx([(parent.getHash(), 0)], [(800, MY_SCRIPT)])
+      self.index.applyTxList([child, parent])
+      self.assertFalse((parent.getHash(), 0) in self.index)
+      self.assertEqual(self.index.getBalance('Spendable', 300), 800)
+
+   def testApplyCppLedger(self):
+      self.index.isBuilt = True
+      self.index.setTopBlock(300)
+      cppWallet = FakeCppWallet()
+
+      # Spend our confirmed output and pay the same amount back to us:  the
+      # totals don't change, but the outpoint does
+      tx = makeTx([('\xaa'*32, 0)], [(1000, MY_SCRIPT)])
+      cppWallet.addTx(tx, 301)
+      # Already applied, and ZC entries aren't in any block
+      cppWallet.addTx(makeTx([('\xcc'*32, 0)], [(7, MY_SCRIPT)]), 300)
+      cppWallet.addTx(makeTx([('\xdd'*32, 0)], [(9, MY_SCRIPT)]), UINT32_MAX)
+
+      self.assertTrue(self.index.applyCppLedger(cppWallet, 302,
+                                                cppWallet.getTx))
+      self.assertEqual(self.index.topBlock, 302)
+      self.assertEqual(self.index.getBalance('Full'), 6000)
+      self.assertFalse(('\xaa'*32, 0) in self.index)
+      self.assertEqual(self.index.utxoMap[(tx.getHash(), 0)][2], 301)
+
+      # A reorg invalidates ledger entries, and then we have to rebuild
+      cppWallet.ledger[0].valid = False
+      self.assertFalse(self.index.applyCppLedger(cppWallet, 303,
+                                                 cppWallet.getTx))
+
+      # So does a tx the BDM can't find
+      self.index.nInvalidLedger = 1
+      cppWallet.addTx(makeTx([], [(5, MY_SCRIPT)]), 303)
+      cppWallet.txMap.clear()
+      self.assertFalse(self.index.applyCppLedger(cppWallet, 303,
+                                                 cppWallet.getTx))
+
+   def testCompareTo(self):
+      other = UtxoIndex(self.index.isMineFunc)
+      self.assertEqual(len(self.index.compareTo(other, 300)), 2)
+      other.addTxOut('\xaa'*32, 0, MY_SCRADDR, 1000, 100, MY_SCRIPT,
+                                                           UTXO_CONFIRMED)
+      other.addTxOut('\xbb'*32, 0, MY_SCRADDR, 5000, 200, MY_SCRIPT,
+                                                           UTXO_COINBASE)
+      self.assertEqual(self.index.compareTo(other, 300), [])
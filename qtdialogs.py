@@ -3312,6 +3312,7 @@ class DlgImportAddress(ArmoryDialog):
 
 
          self.wlt.importExternalAddressData(privKey=SecureBinaryData(binKeyData))
+         self.main.scrAddrOwners.invalidateWallet(self.wlt.uniqueIDB58)
          self.main.statusBar().showMessage('Successful import of address ' \
                                  + addrStr + ' into wallet ' + self.wlt.uniqueIDB58, 10000)
 
@@ -3505,6 +3506,9 @@ class DlgImportAddress(ArmoryDialog):
                LOGERROR('Problem importing: %s: %s', addrStr, msg)
                raise
 
+         if nImport > 0:
+            self.main.scrAddrOwners.invalidateWallet(thisWltID)
+
 
          if nAlready == nTotal:
             MsgBoxCustom(MSGBOX.Warning, 'Nothing Imported!', 'All addresses '
@@ -4854,6 +4858,7 @@ class DlgRemoveWallet(ArmoryDialog):
                LOGINFO('***Completely deleting wallet')
                os.remove(thepath)
                os.remove(thepathBackup)
+               wlt.deleteChainedKeyCache()
                self.main.removeWalletFromApplication(wltID)
                self.main.statusBar().showMessage(\
                      'Wallet ' + wltID + ' was deleted!', 10000)
@@ -4978,6 +4983,7 @@ class DlgRemoveAddress(ArmoryDialog):
 
       if reply == QMessageBox.Yes:
          self.wlt.deleteImportedAddress(self.addr.getAddr160())
+         self.main.scrAddrOwners.invalidateWallet(self.wlt.uniqueIDB58)
          try:
             self.parent.wltAddrModel.reset()
             self.parent.setSummaryBalances()
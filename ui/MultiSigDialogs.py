@@ -2889,6 +2889,7 @@ class DlgMultiSpendReview(ArmoryDialog):
       wltID, a160 = ib.wltSignRightNow[keyIdx]
       wlt = self.main.walletMap[wltID]
       pytx = self.ustx.pytxObj
+      sigHashCtx = self.ustx.getSigHashContext()
       if wlt.useEncryption and wlt.isLocked:
          dlg = DlgUnlockWallet(wlt, self, self.main, 'Sign Lockbox')
          if not dlg.exec_():
@@ -2901,13 +2902,15 @@ class DlgMultiSpendReview(ArmoryDialog):
          # If a lockbox, all USTXIs require the same signing key
          for ustxi in ib.ustxiList:
             addrObj = wlt.getAddrByHash160(a160)
-            ustxi.createAndInsertSignature(pytx, addrObj.binPrivKey32_Plain)
+            ustxi.createAndInsertSignature(pytx, addrObj.binPrivKey32_Plain,
+                                           sigHashCtx=sigHashCtx)
       else:
          # Not lockboxes... may have to access multiple keys in wallet
          for ustxi in ib.ustxiList:
             a160 = CheckHash160(ustxi.scrAddrs[0])
             addrObj = wlt.getAddrByHash160(a160)
-            ustxi.createAndInsertSignature(pytx, addrObj.binPrivKey32_Plain)
+            ustxi.createAndInsertSignature(pytx, addrObj.binPrivKey32_Plain,
+                                           sigHashCtx=sigHashCtx)
 
       self.evalSigStat()
       
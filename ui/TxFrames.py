@@ -775,7 +775,7 @@ class SendBitcoinsFrame(ArmoryFrame):
                         QMessageBox.Ok)
                      return
                   else:
-                     self.wlt.kdfKey = self.wlt.kdf.DeriveKey(Passphrase)
+                     self.wlt.unlock(securePassphrase=Passphrase, onDemand=True)
                      Passphrase.destroy()                                     
                
                self.wlt.mainWnd = self.main
@@ -1691,7 +1691,7 @@ class SignBroadcastOfflineTxFrame(ArmoryFrame):
                QMessageBox.Ok)
             return
          else:
-            self.wlt.kdfKey = self.wlt.kdf.DeriveKey(Passphrase)
+            self.wlt.unlock(securePassphrase=Passphrase, onDemand=True)
             Passphrase.destroy()                                              
 
       newUstx = self.wlt.signUnsignedTx(self.ustxObj)